@@ -1,6 +1,7 @@
 import os
 from pathlib import Path
 from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 import dj_database_url
 
 # --------------------------------------------------------------------
@@ -271,6 +272,23 @@ CACHES = {
     }
 }
 
+# LocMemCache is per process. With several web workers (WEB_CONCURRENCY, see procfile) set REDIS_URL
+# so they share cache namespaces, rate limits, circuit breakers and Gemini model health
+REDIS_URL = config("REDIS_URL", default="")
+WEB_CONCURRENCY = config("WEB_CONCURRENCY", default=1, cast=int)
+if WEB_CONCURRENCY > 1 and not REDIS_URL:
+    raise ImproperlyConfigured(
+        f"WEB_CONCURRENCY={WEB_CONCURRENCY} needs REDIS_URL: per-process caches would split the shared rate limits"
+    )
+if REDIS_URL:
+    CACHES["default"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": REDIS_URL,
+        "TIMEOUT": 300,
+        "KEY_PREFIX": "email_assistant",
+        "VERSION": 1,
+    }
+
 # --------------------------------------------------------------------
 # CUSTOM SETTINGS FOR EMAIL ASSISTANT
 # --------------------------------------------------------------------
@@ -279,6 +297,96 @@ DEFAULT_REFRESH_INTERVAL = 5  # in minutes
 DEFAULT_THEME = "light"
 DEFAULT_AUTO_REPLY_ENABLED = True
 
+# Number of Gmail API calls grouped into one HTTP batch request (Gmail allows up to 100)
+GMAIL_BATCH_SIZE = config("GMAIL_BATCH_SIZE", default=50, cast=int)
+
+# Per-process pool of authorized Gmail service objects (max users, seconds to live)
+GMAIL_SERVICE_POOL_SIZE = config("GMAIL_SERVICE_POOL_SIZE", default=256, cast=int)
+GMAIL_SERVICE_POOL_TTL = config("GMAIL_SERVICE_POOL_TTL", default=1800, cast=int)
+
+# Local mailbox mirror: unread messages kept after a full resync, seconds between history syncs,
+# queue background enrichment for newly seen unread messages
+MAILBOX_FULL_SYNC_LIMIT = config("MAILBOX_FULL_SYNC_LIMIT", default=500, cast=int)
+MAILBOX_SYNC_INTERVAL = config("MAILBOX_SYNC_INTERVAL", default=15, cast=int)
+MAILBOX_AUTO_ENRICH = config("MAILBOX_AUTO_ENRICH", default=True, cast=bool)
+
+# Background job queue (manage.py run_workers): lease visibility timeout and retry base delay in seconds,
+# attempts per job, days finished jobs are kept
+JOB_VISIBILITY_TIMEOUT = config("JOB_VISIBILITY_TIMEOUT", default=300, cast=int)
+JOB_RETRY_DELAY = config("JOB_RETRY_DELAY", default=30, cast=int)
+JOB_MAX_ATTEMPTS = config("JOB_MAX_ATTEMPTS", default=3, cast=int)
+JOB_RETENTION_DAYS = config("JOB_RETENTION_DAYS", default=7, cast=int)
+
+# Due-time scheduler (manage.py run_scheduler): seconds ahead of now loaded into its heap, seconds between
+# checks for new rows, seconds between full reloads of the window, and the most entries kept in memory
+SCHEDULER_HORIZON = config("SCHEDULER_HORIZON", default=3600, cast=int)
+SCHEDULER_REFRESH_INTERVAL = config("SCHEDULER_REFRESH_INTERVAL", default=15, cast=int)
+SCHEDULER_RELOAD_INTERVAL = config("SCHEDULER_RELOAD_INTERVAL", default=900, cast=int)
+SCHEDULER_MAX_LOADED = config("SCHEDULER_MAX_LOADED", default=50000, cast=int)
+
+# Live inbox updates (/api/events/stream/): hours events are kept for Last-Event-ID resumes, seconds between
+# checks for events from other processes, seconds before a stream is closed and the client reconnects
+INBOX_EVENT_RETENTION_HOURS = config("INBOX_EVENT_RETENTION_HOURS", default=24, cast=int)
+INBOX_STREAM_POLL_INTERVAL = config("INBOX_STREAM_POLL_INTERVAL", default=5, cast=int)
+INBOX_STREAM_MAX_DURATION = config("INBOX_STREAM_MAX_DURATION", default=300, cast=int)
+
+# Async HTTP client of the ASGI views: request timeout in seconds, connections per process,
+# concurrent upstream requests per fan-out (e.g. the messages of one list page)
+ASYNC_HTTP_TIMEOUT = config("ASYNC_HTTP_TIMEOUT", default=60, cast=int)
+ASYNC_HTTP_MAX_CONNECTIONS = config("ASYNC_HTTP_MAX_CONNECTIONS", default=100, cast=int)
+ASYNC_FANOUT_CONCURRENCY = config("ASYNC_FANOUT_CONCURRENCY", default=10, cast=int)
+
+# Replies drafted ahead of time: unread emails per user (highest priority first), lowest priority (1-10)
+# worth drafting for, model calls spent drafting per user per day, days drafts are kept
+SPECULATIVE_REPLY_TOP_N = config("SPECULATIVE_REPLY_TOP_N", default=5, cast=int)
+SPECULATIVE_REPLY_MIN_PRIORITY = config("SPECULATIVE_REPLY_MIN_PRIORITY", default=7, cast=int)
+SPECULATIVE_REPLY_DAILY_BUDGET = config("SPECULATIVE_REPLY_DAILY_BUDGET", default=20, cast=int)
+SPECULATIVE_REPLY_RETENTION_DAYS = config("SPECULATIVE_REPLY_RETENTION_DAYS", default=7, cast=int)
+
+# Emails categorized and scored per model call by /api/workflow/classify/batch/
+CLASSIFY_BATCH_SIZE = config("CLASSIFY_BATCH_SIZE", default=20, cast=int)
+
+# Local classifier: lowest confidence (0-1) used instead of the LLM, labeled emails needed to
+# train a model, new labels since the last training that trigger another one
+LOCAL_CLASSIFIER_THRESHOLD = config("LOCAL_CLASSIFIER_THRESHOLD", default=0.8, cast=float)
+LOCAL_CLASSIFIER_MIN_SAMPLES = config("LOCAL_CLASSIFIER_MIN_SAMPLES", default=30, cast=int)
+LOCAL_CLASSIFIER_RETRAIN_EVERY = config("LOCAL_CLASSIFIER_RETRAIN_EVERY", default=25, cast=int)
+
+# Semantic search: index updates on sync, embedder ('gemini', or 'hashing' for offline use), users
+# whose index each process keeps in memory, vectors from which searches scan only the
+# SEMANTIC_IVF_PROBES closest clusters
+SEMANTIC_SEARCH_ENABLED = config("SEMANTIC_SEARCH_ENABLED", default=True, cast=bool)
+SEMANTIC_SEARCH_EMBEDDER = config("SEMANTIC_SEARCH_EMBEDDER", default="gemini" if GEMINI_API_KEY else "hashing")
+SEMANTIC_INDEX_CACHE_SIZE = config("SEMANTIC_INDEX_CACHE_SIZE", default=20, cast=int)
+SEMANTIC_IVF_MIN_VECTORS = config("SEMANTIC_IVF_MIN_VECTORS", default=20000, cast=int)
+SEMANTIC_IVF_PROBES = config("SEMANTIC_IVF_PROBES", default=8, cast=int)
+
+# Thread analysis: messages of one thread sent to the model at once
+THREAD_ANALYSIS_CONCURRENCY = config("THREAD_ANALYSIS_CONCURRENCY", default=4, cast=int)
+
+# Gemini model health: seconds before the shared health state is re-probed
+GEMINI_MODEL_HEALTH_TTL = config("GEMINI_MODEL_HEALTH_TTL", default=1800, cast=int)
+
+# Rate limits for Google APIs: Gmail quota units per second (per user and process, whole project), Gemini calls per minute
+GMAIL_USER_QUOTA_PER_SECOND = config("GMAIL_USER_QUOTA_PER_SECOND", default=250, cast=int)
+GMAIL_GLOBAL_QUOTA_PER_SECOND = config("GMAIL_GLOBAL_QUOTA_PER_SECOND", default=20000, cast=int)
+GEMINI_REQUESTS_PER_MINUTE = config("GEMINI_REQUESTS_PER_MINUTE", default=60, cast=int)
+
+# Google API retries: attempts per call, backoff base and cap in seconds, longest wait for tokens or Retry-After
+API_RETRY_ATTEMPTS = config("API_RETRY_ATTEMPTS", default=4, cast=int)
+API_RETRY_BASE_DELAY = config("API_RETRY_BASE_DELAY", default=0.5, cast=float)
+API_RETRY_MAX_DELAY = config("API_RETRY_MAX_DELAY", default=30, cast=float)
+API_MAX_WAIT = config("API_MAX_WAIT", default=10, cast=float)
+
+# Circuit breaker per upstream API: consecutive failures that open it, seconds it stays open
+CIRCUIT_BREAKER_FAILURES = config("CIRCUIT_BREAKER_FAILURES", default=5, cast=int)
+CIRCUIT_BREAKER_COOLDOWN = config("CIRCUIT_BREAKER_COOLDOWN", default=30, cast=int)
+
+# LLM response cache: seconds to keep responses, entries in the per-process LRU, rows in the database table
+LLM_CACHE_TTL = config("LLM_CACHE_TTL", default=604800, cast=int)
+LLM_CACHE_MEMORY_SIZE = config("LLM_CACHE_MEMORY_SIZE", default=1024, cast=int)
+LLM_CACHE_DB_MAX_ENTRIES = config("LLM_CACHE_DB_MAX_ENTRIES", default=10000, cast=int)
+
 # CSRF settings
 CSRF_COOKIE_SECURE = False  # Set to True in production with HTTPS
 CSRF_COOKIE_HTTPONLY = False
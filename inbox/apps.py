@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+class InboxConfig(AppConfig):
+    name = "inbox"
+
+    def ready(self):
+        # Connect the live event receivers in every process (web, workers, scheduler)
+        from .services import events  # noqa: F401
+        from .services.fulltext import ensure_index
+        post_migrate.connect(ensure_index, sender=self)
@@ -0,0 +1,150 @@
+from django.core.management.base import BaseCommand, CommandError
+from inbox.services.mime import parse_message
+import base64
+import json
+import os
+import time
+
+
+def _b64(text, charset='utf-8'):
+    return base64.urlsafe_b64encode(text.encode(charset)).decode('ascii').rstrip('=')
+
+
+def _part(mime_type, text='', charset='utf-8', filename='', parts=None):
+    part = {
+        'mimeType': mime_type,
+        'filename': filename,
+        'headers': [{'name': 'Content-Type', 'value': f'{mime_type}; charset="{charset}"'}],
+        'body': {'size': len(text)},
+    }
+    if parts is not None:
+        part['parts'] = parts
+    elif filename:
+        part['body']['attachmentId'] = 'ANGjdJ8' + filename
+    elif text:
+        part['body']['data'] = _b64(text, charset)
+    return part
+
+
+def _message(message_id, payload):
+    payload['headers'] = [
+        {'name': 'Delivered-To', 'value': 'me@example.com'},
+        {'name': 'Received', 'value': 'by 2002:a05:6a10 with SMTP id x; Mon, 1 Jan 2024 09:00:00 -0800'},
+        {'name': 'Received', 'value': 'from mail.example.com (mail.example.com. [192.0.2.1])'},
+        {'name': 'DKIM-Signature', 'value': 'v=1; a=rsa-sha256; c=relaxed/relaxed; d=example.com; s=s1; bh=abc='},
+        {'name': 'MIME-Version', 'value': '1.0'},
+        {'name': 'Date', 'value': 'Mon, 1 Jan 2024 09:00:00 -0800'},
+        {'name': 'Message-ID', 'value': f'<{message_id}@mail.example.com>'},
+        {'name': 'Subject', 'value': f'Quarterly report {message_id}'},
+        {'name': 'From', 'value': 'Alice Example <alice@example.com>'},
+        {'name': 'To', 'value': 'me@example.com'},
+        {'name': 'Cc', 'value': 'team@example.com'},
+    ] + payload.get('headers', [])
+    return {'id': message_id, 'threadId': 't' + message_id, 'snippet': 'Hi, please find the report', 'payload': payload}
+
+
+def build_corpus():
+    """Payload shapes Gmail returns for common senders"""
+    text = "Hi,\n\nPlease find the quarterly report attached. " * 20
+    html = f"<html><body><p>{text}</p></body></html>"
+    return [
+        # Plain single-part message
+        _message('plain', _part('text/plain', text)),
+        # Newsletter: HTML only
+        _message('html', _part('text/html', html)),
+        # Typical client: multipart/alternative
+        _message('alternative', _part('multipart/alternative', parts=[
+            _part('text/plain', text), _part('text/html', html)])),
+        # Attachment: multipart/mixed > multipart/alternative + PDF
+        _message('mixed', _part('multipart/mixed', parts=[
+            _part('multipart/alternative', parts=[_part('text/plain', text), _part('text/html', html)]),
+            _part('application/pdf', filename='report.pdf')])),
+        # Inline images: multipart/mixed > multipart/related > multipart/alternative
+        _message('related', _part('multipart/mixed', parts=[
+            _part('multipart/related', parts=[
+                _part('multipart/alternative', parts=[_part('text/plain', text), _part('text/html', html)]),
+                _part('image/png', filename='logo.png')]),
+            _part('application/pdf', filename='report.pdf')])),
+        # Legacy charset
+        _message('latin1', _part('text/plain', "Réunion à 10h, merci. " * 40, charset='iso-8859-1')),
+    ]
+
+
+def legacy_parse(message):
+    """The one-level parser the services used before inbox.services.mime"""
+    headers = message['payload']['headers']
+    result = {
+        'subject': next((h['value'] for h in headers if h['name'] == 'Subject'), '(no subject)'),
+        'from': next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown'),
+        'to': next((h['value'] for h in headers if h['name'] == 'To'), ''),
+        'cc': next((h['value'] for h in headers if h['name'] == 'Cc'), ''),
+        'date': next((h['value'] for h in headers if h['name'] == 'Date'), ''),
+        'body_text': '',
+        'body_html': '',
+    }
+    payload = message['payload']
+    for part in payload.get('parts', [payload]):
+        data = part.get('body', {}).get('data', '')
+        if not data:
+            continue
+        try:
+            decoded = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4)).decode('utf-8')
+        except UnicodeDecodeError:
+            continue
+        if part['mimeType'] == 'text/plain':
+            result['body_text'] = decoded
+        elif part['mimeType'] == 'text/html':
+            result['body_html'] = decoded
+    return result
+
+
+def mime_parse(message):
+    parsed = parse_message(message)
+    return {
+        'subject': parsed.header('Subject', '(no subject)'),
+        'from': parsed.header('From', 'Unknown'),
+        'to': parsed.header('To'),
+        'cc': parsed.header('Cc'),
+        'date': parsed.header('Date'),
+        'body_text': parsed.body_text,
+        'body_html': parsed.body_html,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the MIME parser against the previous one-level parser'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000, help='Parses per message and parser')
+        parser.add_argument('--corpus', help='Directory of Gmail message resources saved as JSON (format=full)')
+
+    def handle(self, *args, **options):
+        corpus = build_corpus()
+        if options['corpus']:
+            try:
+                corpus = []
+                for name in sorted(os.listdir(options['corpus'])):
+                    if name.endswith('.json'):
+                        with open(os.path.join(options['corpus'], name)) as f:
+                            corpus.append(json.load(f))
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Could not load corpus: {str(e)}')
+        if not corpus:
+            raise CommandError('Corpus is empty')
+
+        iterations = options['iterations']
+        for name, parse in (('legacy', legacy_parse), ('mime', mime_parse)):
+            results = [parse(message) for message in corpus]
+            empty_bodies = sum(1 for result in results if not (result['body_text'] or result['body_html']))
+            start = time.perf_counter()
+            for _ in range(iterations):
+                for message in corpus:
+                    parse(message)
+            elapsed = time.perf_counter() - start
+            per_message = elapsed / (iterations * len(corpus)) * 1e6
+            self.stdout.write(
+                f'{name:>7}: {per_message:8.2f} us/message, '
+                f'{empty_bodies}/{len(corpus)} messages with an empty body'
+            )
+
+        self.stdout.write(self.style.SUCCESS(f'Parsed {len(corpus)} messages x {iterations} iterations'))
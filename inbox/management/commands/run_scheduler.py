@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+from inbox.services.scheduler import DueScheduler, DUE_SOURCES
+import logging
+import signal
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Longest sleep between heap checks, in seconds
+MAX_SLEEP = 5.0
+
+
+class Command(BaseCommand):
+    help = 'Queue scheduled emails and reminders as they come due (the jobs are run by run_workers)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sources', nargs='*', choices=sorted(DUE_SOURCES), help='Only schedule these sources')
+        parser.add_argument('--once', action='store_true', help='Queue what is due now and exit')
+
+    def handle(self, *args, **options):
+        refresh_interval = getattr(settings, 'SCHEDULER_REFRESH_INTERVAL', 15)
+        reload_interval = getattr(settings, 'SCHEDULER_RELOAD_INTERVAL', 900)
+        stopping = threading.Event()
+
+        def stop(signum, frame):
+            self.stdout.write('Stopping scheduler...')
+            stopping.set()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        scheduler = DueScheduler(sources=options['sources'])
+        loaded = scheduler.advance()
+        self.stdout.write(self.style.SUCCESS(f'Scheduler started with {loaded} upcoming items'))
+        logger.info(f"Scheduler started with {loaded} upcoming items")
+
+        dispatched = 0
+        last_refresh = last_reload = time.monotonic()
+        while not stopping.is_set():
+            try:
+                if time.monotonic() - last_reload > reload_interval:
+                    # Safety net for edited due times and rows whose jobs were lost
+                    scheduler.reload()
+                    scheduler.advance()
+                    last_reload = last_refresh = time.monotonic()
+                elif time.monotonic() - last_refresh > refresh_interval:
+                    scheduler.load_new()
+                    scheduler.advance()
+                    last_refresh = time.monotonic()
+
+                due = scheduler.pop_due()
+                if due:
+                    scheduler.dispatch(due)
+                    dispatched += len(due)
+
+                if options['once']:
+                    break
+
+                next_due = scheduler.next_due()
+                sleep = min(MAX_SLEEP, max(0.0, refresh_interval - (time.monotonic() - last_refresh)))
+                if next_due:
+                    sleep = min(sleep, max(0.0, (next_due - timezone.now()).total_seconds()))
+                stopping.wait(sleep)
+            except Exception as e:
+                logger.error(f"Error in scheduler loop: {str(e)}", exc_info=True)
+                close_old_connections()
+                stopping.wait(MAX_SLEEP)
+
+        self.stdout.write(self.style.SUCCESS(f'Scheduler stopped: {dispatched} items queued'))
+        logger.info(f"Scheduler stopped: {dispatched} items queued")
@@ -0,0 +1,98 @@
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from inbox.services.jobs import JobQueue, JOB_HANDLERS
+from inbox.services.events import InboxEventService
+from inbox.services.speculative import SpeculativeReplyService
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds between purges of old finished jobs, inbox events and drafted replies
+PURGE_INTERVAL = 3600
+
+
+def _run_job(job):
+    try:
+        return JobQueue.run(job)
+    finally:
+        # Worker threads keep their own connections; don't let them go stale
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Process background jobs (e.g. email enrichment) from the database job queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help='Jobs processed in parallel (SQLite serializes writes, so 1 is enough there)')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--kinds', nargs='*', choices=sorted(JOB_HANDLERS), help='Only process these job kinds')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        threads = max(1, options['threads'])
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        stopping = threading.Event()
+
+        def stop(signum, frame):
+            self.stdout.write('Stopping after the running jobs finish...')
+            stopping.set()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        self.stdout.write(self.style.SUCCESS(f'Worker {worker_id} started with {threads} threads'))
+        logger.info(f"Job worker {worker_id} started with {threads} threads")
+
+        processed = failed = 0
+        running = set()
+        last_purge = 0.0
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='job-worker') as pool:
+            while not stopping.is_set():
+                try:
+                    if time.monotonic() - last_purge > PURGE_INTERVAL:
+                        purged = JobQueue.purge()
+                        if purged:
+                            logger.info(f"Purged {purged} finished jobs")
+                        purged = InboxEventService.purge()
+                        if purged:
+                            logger.info(f"Purged {purged} old inbox events")
+                        purged = SpeculativeReplyService.purge()
+                        if purged:
+                            logger.info(f"Purged {purged} old drafted replies")
+                        last_purge = time.monotonic()
+
+                    for future in [f for f in running if f.done()]:
+                        running.discard(future)
+                        if future.result():
+                            processed += 1
+                        else:
+                            failed += 1
+
+                    free = threads - len(running)
+                    jobs = JobQueue.lease(worker_id, limit=free, kinds=options['kinds']) if free else []
+                    for job in jobs:
+                        running.add(pool.submit(_run_job, job))
+
+                    if not jobs:
+                        if options['once'] and not running:
+                            break
+                        stopping.wait(options['poll_interval'] if free else 0.2)
+                except Exception as e:
+                    logger.error(f"Error in job worker loop: {str(e)}", exc_info=True)
+                    close_old_connections()
+                    stopping.wait(options['poll_interval'])
+
+            for future in running:
+                if future.result():
+                    processed += 1
+                else:
+                    failed += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Worker {worker_id} stopped: {processed} jobs done, {failed} failed'))
+        logger.info(f"Job worker {worker_id} stopped: {processed} jobs done, {failed} failed")
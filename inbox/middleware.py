@@ -1,3 +1,4 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.contrib.sessions.models import Session
 from django.utils import timezone
 from django.contrib.sessions.exceptions import SessionInterrupted
@@ -8,8 +9,14 @@ import logging
 logger = logging.getLogger(__name__)
 
 class SessionCleanupMiddleware:
+    # Pass-through in both modes, so async views don't get pushed onto a thread
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
         response = self.get_response(request)
@@ -35,8 +42,13 @@ class CustomSessionMiddleware:
     """
     Custom session middleware to handle SessionInterrupted exceptions
     """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
         return self.get_response(request)
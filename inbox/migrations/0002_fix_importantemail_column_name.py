@@ -8,6 +8,10 @@ class Migration(migrations.Migration):
 
     def rename_column(apps, schema_editor):
         with schema_editor.connection.cursor() as cursor:
+            # Databases created from 0001 already have email_id (e.g. the test database)
+            columns = [column.name for column in schema_editor.connection.introspection.get_table_description(cursor, 'inbox_importantemail')]
+            if 'message_id' not in columns:
+                return
             cursor.execute("""
                 ALTER TABLE inbox_importantemail 
                 RENAME COLUMN message_id TO email_id
@@ -15,6 +19,9 @@ class Migration(migrations.Migration):
 
     def reverse_rename_column(apps, schema_editor):
         with schema_editor.connection.cursor() as cursor:
+            columns = [column.name for column in schema_editor.connection.introspection.get_table_description(cursor, 'inbox_importantemail')]
+            if 'email_id' not in columns:
+                return
             cursor.execute("""
                 ALTER TABLE inbox_importantemail 
                 RENAME COLUMN email_id TO message_id
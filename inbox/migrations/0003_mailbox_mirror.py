@@ -0,0 +1,60 @@
+# Generated by Django 5.2.5 on 2026-10-17 00:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inbox', '0002_fix_importantemail_column_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailboxSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('history_id', models.CharField(blank=True, max_length=50)),
+                ('last_full_sync', models.DateTimeField(blank=True, null=True)),
+                ('last_synced_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='mailbox_sync_state', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Mailbox Sync State',
+                'verbose_name_plural': 'Mailbox Sync States',
+            },
+        ),
+        migrations.CreateModel(
+            name='MailboxMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_id', models.CharField(max_length=255)),
+                ('thread_id', models.CharField(blank=True, max_length=255)),
+                ('label_ids', models.JSONField(default=list)),
+                ('is_unread', models.BooleanField(default=False)),
+                ('is_trashed', models.BooleanField(default=False)),
+                ('subject', models.TextField(blank=True)),
+                ('sender', models.TextField(blank=True)),
+                ('recipients', models.TextField(blank=True)),
+                ('cc', models.TextField(blank=True)),
+                ('date', models.CharField(blank=True, max_length=255)),
+                ('internal_date', models.DateTimeField(blank=True, null=True)),
+                ('snippet', models.TextField(blank=True)),
+                ('size_estimate', models.IntegerField(default=0)),
+                ('body_fetched', models.BooleanField(default=False)),
+                ('body_text', models.TextField(blank=True)),
+                ('body_html', models.TextField(blank=True)),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Mailbox Message',
+                'verbose_name_plural': 'Mailbox Messages',
+                'indexes': [models.Index(fields=['user', 'is_unread', 'is_trashed', '-internal_date'], name='inbox_mbox_unread_idx'), models.Index(fields=['user', 'thread_id'], name='inbox_mbox_thread_idx')],
+                'unique_together': {('user', 'message_id')},
+            },
+        ),
+    ]
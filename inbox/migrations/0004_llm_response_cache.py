@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-17 00:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inbox', '0003_mailbox_mirror'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMResponseCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cache_key', models.CharField(max_length=64, unique=True)),
+                ('model_name', models.CharField(max_length=100)),
+                ('function', models.CharField(max_length=100)),
+                ('prompt_version', models.PositiveIntegerField(default=1)),
+                ('response', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('hit_count', models.PositiveIntegerField(default=0)),
+                ('last_hit_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'LLM Response Cache Entry',
+                'verbose_name_plural': 'LLM Response Cache Entries',
+                'indexes': [models.Index(fields=['function', 'model_name'], name='inbox_llmcache_fn_idx')],
+            },
+        ),
+    ]
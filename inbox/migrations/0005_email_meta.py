@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-17 00:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inbox', '0004_llm_response_cache'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailMeta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email_id', models.CharField(max_length=255)),
+                ('is_important', models.BooleanField(default=False)),
+                ('priority', models.IntegerField(default=0)),
+                ('sentiment', models.CharField(blank=True, max_length=20)),
+                ('urgency', models.CharField(blank=True, max_length=10)),
+                ('intent', models.CharField(blank=True, max_length=50)),
+                ('has_reminder', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='inbox.emailcategory')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Email Meta',
+                'verbose_name_plural': 'Email Meta',
+                'indexes': [models.Index(fields=['user', '-priority'], name='inbox_meta_priority_idx'), models.Index(fields=['user', 'category', '-priority'], name='inbox_meta_category_idx'), models.Index(fields=['user', 'is_important'], name='inbox_meta_important_idx'), models.Index(fields=['user', 'has_reminder'], name='inbox_meta_reminder_idx')],
+                'unique_together': {('user', 'email_id')},
+            },
+        ),
+    ]
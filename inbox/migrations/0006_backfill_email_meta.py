@@ -0,0 +1,46 @@
+# Generated by Django 5.2.5 on 2026-10-17 00:45
+
+from django.db import migrations
+
+
+def backfill_email_meta(apps, schema_editor):
+    """Build one EmailMeta row per (user, email_id) from the per-feature tables"""
+    EmailMeta = apps.get_model('inbox', 'EmailMeta')
+    ImportantEmail = apps.get_model('inbox', 'ImportantEmail')
+    EmailCategorization = apps.get_model('inbox', 'EmailCategorization')
+    EmailPriority = apps.get_model('inbox', 'EmailPriority')
+    SentimentAnalysis = apps.get_model('inbox', 'SentimentAnalysis')
+    Reminder = apps.get_model('inbox', 'Reminder')
+
+    rows = {}
+
+    def row(user_id, email_id):
+        return rows.setdefault((user_id, email_id), {})
+
+    for user_id, email_id in ImportantEmail.objects.values_list('user_id', 'email_id'):
+        row(user_id, email_id)['is_important'] = True
+    for user_id, email_id, category_id in EmailCategorization.objects.values_list('user_id', 'email_id', 'category_id'):
+        row(user_id, email_id)['category_id'] = category_id
+    for user_id, email_id, priority in EmailPriority.objects.values_list('user_id', 'email_id', 'priority'):
+        row(user_id, email_id)['priority'] = priority
+    for user_id, email_id, sentiment, urgency in SentimentAnalysis.objects.values_list('user_id', 'email_id', 'sentiment', 'urgency'):
+        row(user_id, email_id).update(sentiment=sentiment, urgency=urgency)
+    for user_id, email_id in Reminder.objects.filter(completed=False).values_list('user_id', 'email_id'):
+        row(user_id, email_id)['has_reminder'] = True
+
+    EmailMeta.objects.bulk_create(
+        [EmailMeta(user_id=user_id, email_id=email_id, **fields) for (user_id, email_id), fields in rows.items()],
+        batch_size=500,
+        ignore_conflicts=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inbox', '0005_email_meta'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_email_meta, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 00:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inbox', '0006_backfill_email_meta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailboxsyncstate',
+            name='unread_page_token',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.5 on 2026-10-17 00:57
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inbox', '0008_background_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reminder',
+            name='notified_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='scheduledemail',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='scheduledemail',
+            name='failed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='scheduledemail',
+            name='last_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='scheduledemail',
+            name='sent_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='scheduledemail',
+            name='sent_message_id',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='reminder',
+            index=models.Index(fields=['completed', 'reminder_time'], name='inbox_reminder_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scheduledemail',
+            index=models.Index(fields=['sent', 'scheduled_time'], name='inbox_scheduled_due_idx'),
+        ),
+    ]
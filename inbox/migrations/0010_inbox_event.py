@@ -0,0 +1,31 @@
+# Generated by Django 5.2.5 on 2026-10-17 00:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inbox', '0009_scheduler_fields'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('message_added', 'Message added'), ('message_removed', 'Message removed'), ('labels_changed', 'Labels changed'), ('reminder_due', 'Reminder due'), ('scheduled_email_sent', 'Scheduled email sent'), ('resync', 'Resync')], max_length=30)),
+                ('payload', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Inbox Event',
+                'verbose_name_plural': 'Inbox Events',
+                'indexes': [models.Index(fields=['user', 'id'], name='inbox_event_user_idx'), models.Index(fields=['created_at'], name='inbox_event_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:12
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inbox', '0010_inbox_event'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpeculativeReply',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email_id', models.CharField(max_length=255)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('tone', models.CharField(max_length=20)),
+                ('summary', models.TextField(blank=True)),
+                ('reply_text', models.TextField()),
+                ('enrichment', models.JSONField(default=dict)),
+                ('generated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('used_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Speculative Reply',
+                'verbose_name_plural': 'Speculative Replies',
+                'indexes': [models.Index(fields=['user', 'generated_at'], name='inbox_specreply_user_idx')],
+                'unique_together': {('user', 'email_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:16
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inbox', '0011_speculative_reply'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailcategorization',
+            name='source',
+            field=models.CharField(choices=[('manual', 'Manual'), ('llm', 'LLM'), ('local', 'Local classifier')], default='llm', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='emailpriority',
+            name='source',
+            field=models.CharField(choices=[('manual', 'Manual'), ('llm', 'LLM'), ('local', 'Local classifier')], default='llm', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='LocalClassifier',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('categories', models.JSONField(default=list)),
+                ('weights', models.BinaryField()),
+                ('category_samples', models.IntegerField(default=0)),
+                ('priority_samples', models.IntegerField(default=0)),
+                ('trained_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='local_classifier', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Local Classifier',
+                'verbose_name_plural': 'Local Classifiers',
+            },
+        ),
+    ]
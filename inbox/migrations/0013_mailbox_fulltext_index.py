@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:40
+
+from django.db import migrations
+
+
+def create_index(apps, schema_editor):
+    """FTS5 table and triggers on SQLite, generated tsvector column and GIN index on Postgres"""
+    from inbox.services.fulltext import install_index
+    install_index(schema_editor.connection)
+
+
+def remove_index(apps, schema_editor):
+    from inbox.services.fulltext import drop_index
+    drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inbox', '0012_local_classifier'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, remove_index),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inbox', '0014_speculative_reply_usage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageEmbedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('embedder', models.CharField(max_length=20)),
+                ('message_id', models.CharField(max_length=255)),
+                ('has_body', models.BooleanField(default=False)),
+                ('removed', models.BooleanField(default=False)),
+                ('vector', models.BinaryField(blank=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Message Embedding',
+                'verbose_name_plural': 'Message Embeddings',
+                'indexes': [models.Index(fields=['user', 'embedder', 'id'], name='inbox_embedding_user_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.5 on 2026-10-17 01:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def backfill_event_seq(apps, schema_editor):
+    """Number stored events by their ID, so Last-Event-IDs clients already hold still resume"""
+    InboxEvent = apps.get_model('inbox', 'InboxEvent')
+    InboxEventSequence = apps.get_model('inbox', 'InboxEventSequence')
+
+    InboxEvent.objects.update(seq=F('id'))
+    InboxEventSequence.objects.bulk_create(
+        [
+            InboxEventSequence(user_id=row['user_id'], last_seq=row['last_seq'])
+            for row in InboxEvent.objects.values('user_id').annotate(last_seq=Max('id'))
+        ],
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inbox', '0015_message_embedding'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboxEventSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_seq', models.PositiveBigIntegerField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_event_sequence', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Inbox Event Sequence',
+                'verbose_name_plural': 'Inbox Event Sequences',
+            },
+        ),
+        migrations.AddField(
+            model_name='inboxevent',
+            name='seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_event_seq, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='inboxevent',
+            constraint=models.UniqueConstraint(fields=('user', 'seq'), name='inbox_event_user_seq'),
+        ),
+        migrations.RemoveIndex(
+            model_name='inboxevent',
+            name='inbox_event_user_idx',
+        ),
+    ]
@@ -207,10 +207,17 @@ class EmailCategory(models.Model):
 
 class EmailCategorization(models.Model):
     """Link emails to categories"""
+    SOURCE_CHOICES = [
+        ('manual', 'Manual'),
+        ('llm', 'LLM'),
+        ('local', 'Local classifier'),
+    ]
+    
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     email_id = models.CharField(max_length=255)
     category = models.ForeignKey(EmailCategory, on_delete=models.CASCADE)
     confidence = models.DecimalField(max_digits=5, decimal_places=2, default=0.00)
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES, default='llm')  # Local predictions are not trained on
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -231,8 +238,13 @@ class Reminder(models.Model):
     message = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     completed = models.BooleanField(default=False)
+    notified_at = models.DateTimeField(null=True, blank=True)  # Set by the scheduler once the reminder fired
     
     class Meta:
+        indexes = [
+            # Due-time range scans by `manage.py run_scheduler`
+            models.Index(fields=['completed', 'reminder_time'], name='inbox_reminder_due_idx'),
+        ]
         verbose_name = "Reminder"
         verbose_name_plural = "Reminders"
     
@@ -247,12 +259,21 @@ class Reminder(models.Model):
 class ScheduledEmail(models.Model):
     """Email scheduling capability"""
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    email_id = models.CharField(max_length=255)  # Gmail message ID
+    email_id = models.CharField(max_length=255)  # Gmail draft ID, sent at scheduled_time
     scheduled_time = models.DateTimeField()
     created_at = models.DateTimeField(auto_now_add=True)
     sent = models.BooleanField(default=False)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    sent_message_id = models.CharField(max_length=255, blank=True)  # Gmail message ID of the sent email
+    failed = models.BooleanField(default=False)  # Gave up; the draft is left as it is
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
     
     class Meta:
+        indexes = [
+            # Due-time range scans by `manage.py run_scheduler`
+            models.Index(fields=['sent', 'scheduled_time'], name='inbox_scheduled_due_idx'),
+        ]
         verbose_name = "Scheduled Email"
         verbose_name_plural = "Scheduled Emails"
     
@@ -276,6 +297,7 @@ class EmailPriority(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     email_id = models.CharField(max_length=255)  # Gmail message ID
     priority = models.IntegerField(choices=PRIORITY_CHOICES)
+    source = models.CharField(max_length=10, choices=EmailCategorization.SOURCE_CHOICES, default='llm')
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -289,4 +311,314 @@ class EmailPriority(models.Model):
     @property
     def priority_label(self):
         """Get the human-readable priority label"""
-        return dict(self.PRIORITY_CHOICES).get(self.priority, 'Unknown')
\ No newline at end of file
+        return dict(self.PRIORITY_CHOICES).get(self.priority, 'Unknown')
+# LOCAL MAILBOX MIRROR
+
+class MailboxSyncState(models.Model):
+    """Gmail history sync position for a user's local mailbox mirror"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='mailbox_sync_state')
+    history_id = models.CharField(max_length=50, blank=True)
+    last_full_sync = models.DateTimeField(null=True, blank=True)
+    last_synced_at = models.DateTimeField(null=True, blank=True)
+    # Gmail list page token for the unread messages beyond MAILBOX_FULL_SYNC_LIMIT ('' if all are mirrored)
+    unread_page_token = models.CharField(max_length=255, blank=True)
+    
+    class Meta:
+        verbose_name = "Mailbox Sync State"
+        verbose_name_plural = "Mailbox Sync States"
+    
+    def __str__(self):
+        return f"Mailbox sync for {self.user.username} at history {self.history_id or '-'}"
+
+class MailboxMessage(models.Model):
+    """Locally mirrored Gmail message metadata"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    message_id = models.CharField(max_length=255)  # Gmail message ID
+    thread_id = models.CharField(max_length=255, blank=True)
+    label_ids = models.JSONField(default=list)
+    is_unread = models.BooleanField(default=False)
+    is_trashed = models.BooleanField(default=False)  # In TRASH or SPAM
+    subject = models.TextField(blank=True)
+    sender = models.TextField(blank=True)  # Raw From header
+    recipients = models.TextField(blank=True)  # Raw To header
+    cc = models.TextField(blank=True)
+    date = models.CharField(max_length=255, blank=True)  # Raw Date header
+    internal_date = models.DateTimeField(null=True, blank=True)
+    snippet = models.TextField(blank=True)
+    size_estimate = models.IntegerField(default=0)
+    # Bodies are only downloaded when the email is opened
+    body_fetched = models.BooleanField(default=False)
+    body_text = models.TextField(blank=True)
+    body_html = models.TextField(blank=True)
+    synced_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['user', 'message_id']
+        indexes = [
+            models.Index(fields=['user', 'is_unread', 'is_trashed', '-internal_date'], name='inbox_mbox_unread_idx'),
+            models.Index(fields=['user', 'thread_id'], name='inbox_mbox_thread_idx'),
+        ]
+        verbose_name = "Mailbox Message"
+        verbose_name_plural = "Mailbox Messages"
+    
+    def __str__(self):
+        return f"Mirrored message {self.message_id} for {self.user.username}"
+    
+    def to_email_dict(self):
+        """Return the message in the same shape as services.gmail.fetch_unread"""
+        return {
+            'id': self.message_id,
+            'threadId': self.thread_id,
+            'subject': self.subject or '(no subject)',
+            'from': self.sender or 'Unknown',
+            'to': self.recipients,
+            'date': self.date,
+            'snippet': self.snippet,
+            'body_text': self.body_text,
+        }
+    
+    def to_details_dict(self):
+        """Return the message in the same shape as services.gmail.get_email_details"""
+        return {
+            'id': self.message_id,
+            'subject': self.subject or '(no subject)',
+            'from': self.sender or 'Unknown',
+            'to': self.recipients,
+            'cc': self.cc,
+            'date': self.date,
+            'body_text': self.body_text,
+            'body_html': self.body_html,
+            'snippet': self.snippet,
+        }
+
+# LLM RESPONSE CACHE
+
+class LLMResponseCacheEntry(models.Model):
+    """Stored Gemini response, keyed by model, function, prompt version and input hash"""
+    cache_key = models.CharField(max_length=64, unique=True)  # sha256 hex digest
+    model_name = models.CharField(max_length=100)
+    function = models.CharField(max_length=100)
+    prompt_version = models.PositiveIntegerField(default=1)
+    response = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    hit_count = models.PositiveIntegerField(default=0)
+    last_hit_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['function', 'model_name'], name='inbox_llmcache_fn_idx'),
+        ]
+        verbose_name = "LLM Response Cache Entry"
+        verbose_name_plural = "LLM Response Cache Entries"
+    
+    def __str__(self):
+        return f"{self.function} v{self.prompt_version} on {self.model_name} ({self.cache_key[:12]})"
+
+# PER-EMAIL METADATA
+
+class EmailMeta(models.Model):
+    """
+    Denormalized per-email state (one row per user and message), kept in sync with
+    ImportantEmail, EmailCategorization, EmailPriority, SentimentAnalysis and Reminder
+    so lists can be annotated, filtered and sorted with a single indexed query
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    email_id = models.CharField(max_length=255)  # Gmail message ID
+    is_important = models.BooleanField(default=False)
+    category = models.ForeignKey(EmailCategory, on_delete=models.SET_NULL, null=True, blank=True)
+    priority = models.IntegerField(default=0)  # 0 = not scored
+    sentiment = models.CharField(max_length=20, blank=True)
+    urgency = models.CharField(max_length=10, blank=True)
+    intent = models.CharField(max_length=50, blank=True)
+    has_reminder = models.BooleanField(default=False)  # Any open reminder
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['user', 'email_id']
+        indexes = [
+            models.Index(fields=['user', '-priority'], name='inbox_meta_priority_idx'),
+            models.Index(fields=['user', 'category', '-priority'], name='inbox_meta_category_idx'),
+            models.Index(fields=['user', 'is_important'], name='inbox_meta_important_idx'),
+            models.Index(fields=['user', 'has_reminder'], name='inbox_meta_reminder_idx'),
+        ]
+        verbose_name = "Email Meta"
+        verbose_name_plural = "Email Meta"
+    
+    def __str__(self):
+        return f"Meta for {self.email_id} ({self.user.username})"
+
+# BACKGROUND JOBS
+
+class BackgroundJob(models.Model):
+    """Job in the database-backed work queue processed by `manage.py run_workers`"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    kind = models.CharField(max_length=50)  # Key of services.jobs.JOB_HANDLERS
+    payload = models.JSONField(default=dict)
+    # Jobs with the same kind and dedupe key are only queued once while pending or running
+    dedupe_key = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)  # Not leased before this (retry backoff)
+    leased_until = models.DateTimeField(null=True, blank=True)  # Visibility timeout of a running job
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='inbox_job_ready_idx'),
+            models.Index(fields=['status', 'leased_until'], name='inbox_job_lease_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind', 'dedupe_key'],
+                condition=models.Q(status__in=['pending', 'running']) & ~models.Q(dedupe_key=''),
+                name='inbox_job_active_dedupe'
+            ),
+        ]
+        verbose_name = "Background Job"
+        verbose_name_plural = "Background Jobs"
+    
+    def __str__(self):
+        return f"{self.kind} job {self.pk} ({self.status})"
+
+# LIVE EVENTS
+
+class InboxEvent(models.Model):
+    """Change to a user's inbox, streamed to open tabs over Server-Sent Events (seq is the SSE event ID)"""
+    KIND_CHOICES = [
+        ('message_added', 'Message added'),
+        ('message_removed', 'Message removed'),
+        ('labels_changed', 'Labels changed'),
+        ('reminder_due', 'Reminder due'),
+        ('scheduled_email_sent', 'Scheduled email sent'),
+        ('resync', 'Resync'),  # Too much changed; clients reload their lists
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Per-user position in the log, assigned under the user's InboxEventSequence row
+    # lock, so events commit in seq order (unlike autoincrement IDs across processes)
+    seq = models.PositiveBigIntegerField(default=0)
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'seq'], name='inbox_event_user_seq'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='inbox_event_created_idx'),
+        ]
+        verbose_name = "Inbox Event"
+        verbose_name_plural = "Inbox Events"
+    
+    def __str__(self):
+        return f"{self.kind} event {self.seq} for {self.user.username}"
+
+
+class InboxEventSequence(models.Model):
+    """Last event seq handed out for a user; its row lock orders the user's event inserts"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='inbox_event_sequence')
+    last_seq = models.PositiveBigIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = "Inbox Event Sequence"
+        verbose_name_plural = "Inbox Event Sequences"
+    
+    def __str__(self):
+        return f"Event sequence of {self.user.username} at {self.last_seq}"
+
+# SPECULATIVE REPLIES
+
+class SpeculativeReply(models.Model):
+    """Reply drafted in the background for a high-priority unread email, served when the user asks for a reply"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    email_id = models.CharField(max_length=255)  # Gmail message ID
+    content_hash = models.CharField(max_length=64)  # Hash of the email text the reply was drafted from
+    tone = models.CharField(max_length=20)
+    summary = models.TextField(blank=True)
+    reply_text = models.TextField()
+    enrichment = models.JSONField(default=dict)
+    generated_at = models.DateTimeField(default=timezone.now)
+    used_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        unique_together = ['user', 'email_id']
+        indexes = [
+            models.Index(fields=['user', 'generated_at'], name='inbox_specreply_user_idx'),
+        ]
+        verbose_name = "Speculative Reply"
+        verbose_name_plural = "Speculative Replies"
+    
+    def __str__(self):
+        return f"Speculative reply to {self.email_id} for {self.user.username}"
+
+class SpeculativeReplyUsage(models.Model):
+    """Model calls spent drafting replies ahead of time, per user and day (regenerations included)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    day = models.DateField()
+    model_calls = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['user', 'day']
+        verbose_name = "Speculative Reply Usage"
+        verbose_name_plural = "Speculative Reply Usage"
+    
+    def __str__(self):
+        return f"{self.model_calls} reply drafting calls on {self.day} for {self.user.username}"
+
+# LOCAL CLASSIFIER
+
+class LocalClassifier(models.Model):
+    """Per-user naive Bayes model that categorizes and scores emails without the LLM"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='local_classifier')
+    categories = models.JSONField(default=list)  # Category names, in the order of the weight rows
+    weights = models.BinaryField()  # numpy .npz archive of the log probabilities
+    category_samples = models.IntegerField(default=0)
+    priority_samples = models.IntegerField(default=0)
+    trained_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name = "Local Classifier"
+        verbose_name_plural = "Local Classifiers"
+    
+    def __str__(self):
+        return f"Local classifier for {self.user.username} ({self.category_samples} samples)"
+
+# SEMANTIC SEARCH
+
+class MessageEmbedding(models.Model):
+    """
+    Append-only log of a user's message vectors for one embedder
+
+    A re-embedded message gets a new row and a removed one a `removed` row, so
+    every process can follow the index by reading the rows after the last ID it
+    loaded. Superseded rows are deleted when the log is compacted.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    embedder = models.CharField(max_length=20)
+    message_id = models.CharField(max_length=255)  # Gmail message ID
+    has_body = models.BooleanField(default=False)  # Embedded with the body, not just subject and snippet
+    removed = models.BooleanField(default=False)
+    vector = models.BinaryField(blank=True)  # float16 values, empty for removed rows
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'embedder', 'id'], name='inbox_embedding_user_idx'),
+        ]
+        verbose_name = "Message Embedding"
+        verbose_name_plural = "Message Embeddings"
+    
+    def __str__(self):
+        return f"{self.embedder} embedding of {self.message_id} for {self.user.username}"
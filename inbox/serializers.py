@@ -18,6 +18,9 @@ class EmailSerializer(serializers.Serializer):
     # New fields for workflow automation
     category = serializers.CharField(allow_blank=True, required=False, default='')
     priority = serializers.IntegerField(required=False, default=0)
+    category_color = serializers.CharField(allow_blank=True, required=False, default='')
+    sentiment = serializers.CharField(allow_blank=True, required=False, default='')
+    urgency = serializers.CharField(allow_blank=True, required=False, default='')
     
     def get_from_field(self, obj):
         """Extract and format sender information from Gmail API object"""
@@ -235,9 +238,10 @@ class ScheduledEmailSerializer(serializers.ModelSerializer):
         model = ScheduledEmail
         fields = [
             'id', 'email_id', 'scheduled_time', 
-            'created_at', 'sent', 'is_ready_to_send'
+            'created_at', 'sent', 'is_ready_to_send',
+            'sent_at', 'failed', 'last_error'
         ]
-        read_only_fields = ['created_at', 'is_ready_to_send']
+        read_only_fields = ['created_at', 'is_ready_to_send', 'sent_at', 'failed', 'last_error']
 
 class EmailPrioritySerializer(serializers.ModelSerializer):
     """Serializer for EmailPriority model"""
@@ -0,0 +1,240 @@
+# inbox/services/aio.py
+
+import asyncio
+import logging
+import weakref
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from . import gmail
+from .cache import UserCache
+from .pool import service_pool
+from .ratelimit import rate_limiter, gmail_quota_units, UpstreamUnavailable
+
+logger = logging.getLogger(__name__)
+
+GMAIL_API_URL = "https://gmail.googleapis.com/gmail/v1/users/me"
+GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta"
+
+# Seconds before an upstream request times out (LLM calls can take a while)
+ASYNC_HTTP_TIMEOUT = getattr(settings, "ASYNC_HTTP_TIMEOUT", 60)
+# Connections per process shared by all requests, across Google hosts
+ASYNC_HTTP_MAX_CONNECTIONS = getattr(settings, "ASYNC_HTTP_MAX_CONNECTIONS", 100)
+# Concurrent upstream requests of one fan-out (e.g. the messages of a list page)
+ASYNC_FANOUT_CONCURRENCY = getattr(settings, "ASYNC_FANOUT_CONCURRENCY", 10)
+
+# One client (and connection pool) per event loop
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    """Shared httpx.AsyncClient of the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=ASYNC_HTTP_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=ASYNC_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=ASYNC_HTTP_MAX_CONNECTIONS // 4,
+            ),
+        )
+        _clients[loop] = client
+    return client
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run sync code that waits on the network (googleapiclient, Gemini SDK) in a worker thread
+
+    Plain sync_to_async would queue it on the single thread shared by all ORM calls.
+    """
+    def run():
+        try:
+            return func(*args, **kwargs)
+        finally:
+            # Worker threads outlive the request, so don't leave a connection open in them
+            close_old_connections()
+    return await sync_to_async(run, thread_sensitive=False)()
+
+
+async def gather_limited(coroutines, limit=ASYNC_FANOUT_CONCURRENCY):
+    """asyncio.gather with at most `limit` coroutines running at once; exceptions are returned"""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(run(coroutine) for coroutine in coroutines), return_exceptions=True)
+
+
+########################################
+# Gmail
+########################################
+
+async def gmail_request(user, method_id, path, params=None, _retry_auth=True):
+    """
+    GET a Gmail API resource under the shared rate limits
+
+    Args:
+        user: User whose credentials and per-user quota are used
+        method_id: Gmail method ID for the quota cost, e.g. 'gmail.users.messages.get'
+        path: Path below users/me, e.g. 'messages/<id>'
+        params: Query parameters (lists repeat the parameter)
+
+    Returns:
+        Decoded JSON response
+
+    Raises:
+        PermissionError: If the user has no Gmail credentials
+        httpx.HTTPStatusError: On error responses that are not retried
+        UpstreamUnavailable: If Gmail is rate limited or its circuit is open
+    """
+    token = await run_blocking(gmail.get_access_token, user)
+    if not token:
+        raise PermissionError("Gmail is not connected")
+
+    async def send():
+        response = await get_client().get(
+            f"{GMAIL_API_URL}/{path}",
+            params={key: value for key, value in (params or {}).items() if value is not None},
+            headers={'Authorization': f'Bearer {token}'},
+        )
+        response.raise_for_status()
+        return response.json()
+
+    try:
+        return await rate_limiter.acall(
+            'gmail', send, key=service_pool.key_for(user), cost=gmail_quota_units(method_id)
+        )
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 401 and _retry_auth:
+            # The access token expired early or was revoked: refresh it once
+            await run_blocking(gmail.refresh_access_token, user)
+            return await gmail_request(user, method_id, path, params, _retry_auth=False)
+        raise
+
+
+async def fetch_unread_page(user, page_size=10, page_token=None, metadata_only=True):
+    """
+    gmail.fetch_unread_page() on the async client, sharing its cache entries
+
+    The message gets run concurrently instead of as one batch HTTP request, so the
+    page is ready after the slowest message rather than the whole batch.
+
+    Returns:
+        Tuple of (list of email dicts, nextPageToken or None, Gmail's estimate of the total)
+    """
+    cache_key = gmail.unread_cache_key(page_size, page_token, metadata_only)
+    cached_emails = await sync_to_async(UserCache.get)(user, cache_key)
+    if cached_emails:
+        next_page_token, estimate = await sync_to_async(UserCache.get)(user, f"{cache_key}:next") or (None, len(cached_emails))
+        return gmail.unread_only(cached_emails), next_page_token, estimate
+
+    response = await gmail_request(user, 'gmail.users.messages.list', 'messages', {
+        'labelIds': 'UNREAD',
+        'maxResults': page_size,
+        'pageToken': page_token,
+        'fields': 'messages/id,nextPageToken,resultSizeEstimate',
+    })
+    messages = response.get('messages', [])
+    next_page_token = response.get('nextPageToken')
+    estimate = response.get('resultSizeEstimate', len(messages))
+
+    params = {'format': 'metadata', 'metadataHeaders': gmail.LIST_METADATA_HEADERS, 'fields': gmail.LIST_MESSAGE_FIELDS}
+    results = await gather_limited(
+        gmail_request(user, 'gmail.users.messages.get', f"messages/{message['id']}",
+                      params if metadata_only else None)
+        for message in messages
+    )
+
+    emails = []
+    for message, result in zip(messages, results):
+        if isinstance(result, UpstreamUnavailable):
+            raise result
+        if isinstance(result, Exception):
+            logger.error(f"Error fetching message {message['id']}: {str(result)}")
+            continue
+        try:
+            emails.append(gmail._list_email_from_message(message['id'], result, metadata_only))
+        except Exception as e:
+            logger.error(f"Error processing message {message['id']}: {str(e)}", exc_info=True)
+
+    # Like the sync version, a page with failed messages is not cached
+    if len(emails) == len(messages):
+        await sync_to_async(UserCache.set_list)(user, gmail.UNREAD_CACHE_GROUP, cache_key, emails, 300)
+        await sync_to_async(UserCache.set)(user, f"{cache_key}:next", (next_page_token, estimate), 300)
+    return emails, next_page_token, estimate
+
+
+async def get_email_details(user, message_id):
+    """
+    Full details of an email (same shape as gmail.get_email_details)
+
+    Returns:
+        Email details dict, or None if the message does not exist
+    """
+    try:
+        message = await gmail_request(user, 'gmail.users.messages.get', f"messages/{message_id}")
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code in (400, 404):
+            return None
+        raise
+    return gmail._email_details_from_message(message_id, message)
+
+
+async def get_thread(user, thread_id):
+    """
+    A thread with all of its messages in full format
+
+    Returns:
+        Gmail thread resource, or None if the thread does not exist
+    """
+    try:
+        return await gmail_request(user, 'gmail.users.threads.get', f"threads/{thread_id}")
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code in (400, 404):
+            return None
+        raise
+
+
+########################################
+# Gemini
+########################################
+
+async def generate_text(model_name, prompt, api_key):
+    """
+    Gemini generateContent on the async client, under the shared Gemini rate limit
+
+    Args:
+        model_name: Model name, with or without the 'models/' prefix
+        prompt: Prompt text
+        api_key: Gemini API key
+
+    Returns:
+        str: Text of the first candidate
+
+    Raises:
+        RuntimeError: If the response has no text (e.g. the prompt was blocked)
+    """
+    if not model_name.startswith('models/'):
+        model_name = f"models/{model_name}"
+
+    async def send():
+        response = await get_client().post(
+            f"{GEMINI_API_URL}/{model_name}:generateContent",
+            headers={'x-goog-api-key': api_key},
+            json={'contents': [{'role': 'user', 'parts': [{'text': prompt}]}]},
+        )
+        response.raise_for_status()
+        return response.json()
+
+    data = await rate_limiter.acall('gemini', send)
+    candidates = data.get('candidates') or []
+    parts = candidates[0].get('content', {}).get('parts', []) if candidates else []
+    text = ''.join(part.get('text', '') for part in parts)
+    if not text:
+        raise RuntimeError(f"Gemini returned no text: {data.get('promptFeedback') or data}")
+    return text
@@ -0,0 +1,173 @@
+# inbox/services/batch.py
+
+import logging
+import time
+from django.conf import settings
+from .ratelimit import rate_limiter, gmail_quota_units, classify_error, backoff_delay, UpstreamUnavailable, API_RETRY_ATTEMPTS, API_MAX_WAIT
+
+logger = logging.getLogger(__name__)
+
+# Gmail accepts up to 100 calls per batch request, but recommends staying at 50 or
+# below because larger batches are more likely to trip rateLimitExceeded.
+MAX_GMAIL_BATCH_SIZE = 100
+GMAIL_BATCH_SIZE = getattr(settings, "GMAIL_BATCH_SIZE", 50)
+
+
+def _chunks(items, size):
+    """Yield successive chunks of at most `size` items"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def execute_batch(service, requests, chunk_size=None):
+    """
+    Execute Gmail API requests through HTTP batch requests
+
+    Args:
+        service: Gmail service object
+        requests: List of (key, HttpRequest) pairs, keys must be unique strings
+        chunk_size: Number of requests per batch (defaults to GMAIL_BATCH_SIZE)
+
+    Returns:
+        Tuple of (results, errors) dicts keyed by request key. A failing item
+        only ends up in errors, the rest of its batch is still returned.
+
+    Each batch spends the quota units of its items from the shared rate limiter.
+    Items that fail with a retryable error (rate limits, 5xx) are retried in a
+    smaller follow-up batch after a backoff.
+
+    Raises:
+        UpstreamUnavailable: If Gmail is rate limited or its circuit is open
+        The error of a failed batch call (auth, bad request) if it is not
+        retryable, or if it still failed after the last retry
+    """
+    chunk_size = max(1, min(chunk_size or GMAIL_BATCH_SIZE, MAX_GMAIL_BATCH_SIZE))
+    requests = list(requests)
+    results = {}
+    errors = {}
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            errors[request_id] = exception
+        else:
+            results[request_id] = response
+
+    batch_errors = []  # Errors of whole batch calls, as opposed to single items
+    pending = requests
+    for attempt in range(API_RETRY_ATTEMPTS):
+        for chunk in _chunks(pending, chunk_size):
+            batch = service.new_batch_http_request(callback=callback)
+            for key, request in chunk:
+                batch.add(request, request_id=key)
+
+            try:
+                rate_limiter.call(
+                    'gmail',
+                    batch.execute,
+                    key=getattr(chunk[0][1], 'quota_key', None),
+                    cost=sum(gmail_quota_units(getattr(request, 'methodId', None)) for _, request in chunk),
+                    attempts=1
+                )
+            except UpstreamUnavailable:
+                raise
+            except Exception as e:
+                # The batch call itself failed, so nothing in this chunk arrived
+                logger.error(f"Gmail batch request of {len(chunk)} items failed: {str(e)}")
+                if not classify_error(e)[0]:
+                    raise
+                batch_errors.append(e)
+                for key, _ in chunk:
+                    if key not in results:
+                        errors.setdefault(key, e)
+
+        retry_after = None
+        retry = []
+        for key, request in pending:
+            if key in errors:
+                retryable, item_retry_after = classify_error(errors[key])
+                if retryable:
+                    retry.append((key, request))
+                    retry_after = max(retry_after or 0, item_retry_after or 0) or None
+        delay = backoff_delay(attempt, retry_after)
+        if not retry or attempt == API_RETRY_ATTEMPTS - 1 or delay > API_MAX_WAIT:
+            break
+
+        logger.warning(f"Retrying {len(retry)} rate-limited Gmail batch items in {delay:.2f}s")
+        time.sleep(delay)
+        for key, _ in retry:
+            errors.pop(key)
+        pending = retry
+
+    for error in errors.values():
+        if any(error is batch_error for batch_error in batch_errors):
+            # Retries ran out with whole batches still failing (network, 5xx)
+            raise error
+
+    logger.info(f"Executed {len(requests)} Gmail requests in batches of {chunk_size}: "
+                f"{len(results)} succeeded, {len(errors)} failed")
+    return results, errors
+
+
+def _unique(ids):
+    """Drop duplicate and empty IDs while keeping order (batch request IDs must be unique)"""
+    return list(dict.fromkeys(i for i in ids if i))
+
+
+def batch_get_messages(service, message_ids, chunk_size=None, **get_kwargs):
+    """
+    Fetch several messages with batched messages().get calls
+
+    Args:
+        service: Gmail service object
+        message_ids: Iterable of Gmail message IDs
+        chunk_size: Number of messages per batch
+        **get_kwargs: Extra arguments for messages().get (e.g. format)
+
+    Returns:
+        Dict of message ID -> message resource. Messages that failed are logged and left out.
+    """
+    message_ids = _unique(message_ids)
+    if not message_ids:
+        return {}
+
+    messages_api = service.users().messages()
+    requests = [
+        (message_id, messages_api.get(userId='me', id=message_id, **get_kwargs))
+        for message_id in message_ids
+    ]
+    results, errors = execute_batch(service, requests, chunk_size=chunk_size)
+
+    for message_id, error in errors.items():
+        logger.error(f"Error fetching message {message_id}: {str(error)}")
+
+    return results
+
+
+def batch_get_drafts(service, draft_ids, chunk_size=None, **get_kwargs):
+    """
+    Fetch several drafts with batched drafts().get calls
+
+    Args:
+        service: Gmail service object
+        draft_ids: Iterable of Gmail draft IDs
+        chunk_size: Number of drafts per batch
+        **get_kwargs: Extra arguments for drafts().get (e.g. format)
+
+    Returns:
+        Dict of draft ID -> draft resource. Drafts that failed are logged and left out.
+    """
+    draft_ids = _unique(draft_ids)
+    if not draft_ids:
+        return {}
+
+    drafts_api = service.users().drafts()
+    requests = [
+        (draft_id, drafts_api.get(userId='me', id=draft_id, **get_kwargs))
+        for draft_id in draft_ids
+    ]
+    results, errors = execute_batch(service, requests, chunk_size=chunk_size)
+
+    for draft_id, error in errors.items():
+        logger.error(f"Error fetching draft {draft_id}: {str(error)}")
+
+    return results
@@ -0,0 +1,124 @@
+# inbox/services/bulk.py
+
+import logging
+from .batch import _chunks, _unique
+
+logger = logging.getLogger(__name__)
+
+# messages.batchModify and messages.batchDelete accept at most 1000 IDs per call
+MAX_BULK_IDS = 1000
+
+# Label changes for each bulk action that maps onto batchModify
+BULK_LABEL_ACTIONS = {
+    'mark-read': {'remove': ['UNREAD']},
+    'mark-unread': {'add': ['UNREAD']},
+    'archive': {'remove': ['INBOX']},
+    'trash': {'add': ['TRASH']},
+}
+# Actions exposed through /api/emails/bulk/
+BULK_ACTIONS = ('mark-read', 'mark-unread', 'archive', 'trash', 'label', 'delete')
+
+
+class BulkEmailService:
+    """Service for applying one change to many messages with as few Gmail calls as possible"""
+
+    @staticmethod
+    def batch_modify(service, message_ids, add_labels=(), remove_labels=()):
+        """
+        Add and remove labels on many messages through messages.batchModify
+
+        Args:
+            service: Gmail service object
+            message_ids: Iterable of Gmail message IDs
+            add_labels: Label IDs to add
+            remove_labels: Label IDs to remove
+
+        Returns:
+            Dict of message ID -> error message, or None if the change was applied.
+            batchModify is all-or-nothing per call, so a failing call marks every ID in its chunk.
+        """
+        outcomes = {}
+        body = {}
+        if add_labels:
+            body['addLabelIds'] = list(add_labels)
+        if remove_labels:
+            body['removeLabelIds'] = list(remove_labels)
+
+        for chunk in _chunks(_unique(message_ids), MAX_BULK_IDS):
+            try:
+                service.users().messages().batchModify(
+                    userId='me',
+                    body={'ids': chunk, **body}
+                ).execute()
+                outcomes.update((message_id, None) for message_id in chunk)
+            except Exception as e:
+                logger.error(f"batchModify of {len(chunk)} messages failed: {str(e)}")
+                outcomes.update((message_id, str(e)) for message_id in chunk)
+
+        return outcomes
+
+    @staticmethod
+    def batch_delete(service, message_ids):
+        """
+        Permanently delete many messages through messages.batchDelete
+
+        Note that batchDelete needs the full https://mail.google.com/ scope;
+        with gmail.modify only, Gmail rejects it and every ID is reported as failed.
+
+        Args:
+            service: Gmail service object
+            message_ids: Iterable of Gmail message IDs
+
+        Returns:
+            Dict of message ID -> error message, or None if the message was deleted
+        """
+        outcomes = {}
+        for chunk in _chunks(_unique(message_ids), MAX_BULK_IDS):
+            try:
+                service.users().messages().batchDelete(
+                    userId='me',
+                    body={'ids': chunk}
+                ).execute()
+                outcomes.update((message_id, None) for message_id in chunk)
+            except Exception as e:
+                logger.error(f"batchDelete of {len(chunk)} messages failed: {str(e)}")
+                outcomes.update((message_id, str(e)) for message_id in chunk)
+
+        return outcomes
+
+    @staticmethod
+    def apply(service, action, message_ids, add_labels=(), remove_labels=()):
+        """
+        Run a bulk action
+
+        Args:
+            service: Gmail service object
+            action: 'mark-read', 'mark-unread', 'archive', 'trash', 'label' or 'delete'
+            message_ids: Iterable of Gmail message IDs
+            add_labels: Label IDs to add (only for 'label')
+            remove_labels: Label IDs to remove (only for 'label')
+
+        Returns:
+            Tuple of (label changes as {'add': [...], 'remove': [...]}, outcomes dict)
+
+        Raises:
+            ValueError: If the action is unknown or 'label' has no labels
+        """
+        if action == 'delete':
+            return {'add': [], 'remove': []}, BulkEmailService.batch_delete(service, message_ids)
+
+        if action == 'label':
+            if not add_labels and not remove_labels:
+                raise ValueError("The label action needs add_labels or remove_labels")
+            changes = {'add': list(add_labels), 'remove': list(remove_labels)}
+        elif action in BULK_LABEL_ACTIONS:
+            changes = {'add': [], 'remove': [], **BULK_LABEL_ACTIONS[action]}
+        else:
+            raise ValueError(f"Unknown bulk action: {action}")
+
+        outcomes = BulkEmailService.batch_modify(
+            service, message_ids, add_labels=changes['add'], remove_labels=changes['remove']
+        )
+        logger.info(f"Bulk {action} on {len(outcomes)} messages: "
+                    f"{sum(1 for error in outcomes.values() if error is None)} succeeded")
+        return changes, outcomes
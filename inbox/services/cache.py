@@ -0,0 +1,235 @@
+# inbox/services/cache.py
+
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Version counters outlive the entries they namespace so a bump is never lost
+NAMESPACE_VERSION_TIMEOUT = None
+DEFAULT_TIMEOUT = 300
+# List registrations per group and namespace before the namespace is replaced,
+# which keeps patch_lists to one get_many of bounded size
+LIST_SLOT_LIMIT = 256
+# Seconds a group's slot counter outlives its last registration
+LIST_SLOT_COUNTER_TIMEOUT = 86400
+# Seconds a list's write lock is held at most (a crashed holder frees it by expiry),
+# and seconds a writer waits for it
+LIST_LOCK_TIMEOUT = 5
+LIST_LOCK_WAIT = 1
+
+
+class UserCache:
+    """
+    Per-user, versioned namespaces on top of the Django cache.
+
+    Every key a user caches is prefixed with that user's namespace version.
+    Invalidating a user bumps the version (a single cache.incr), which orphans
+    all of their entries without touching anyone else's and without having to
+    enumerate keys (LocMemCache cannot). Orphaned entries age out on their TTL.
+
+    Lists are additionally registered per group in the same namespace, so a
+    mutation can patch them in place (e.g. flip is_unread) instead of
+    invalidating the user.
+    """
+
+    @staticmethod
+    def owner_key(user=None):
+        """Namespace owner for a user; all anonymous requests share one namespace"""
+        if user is not None and user.is_authenticated:
+            return f"user:{user.pk}"
+        return "anonymous"
+
+    @staticmethod
+    def _version_key(user):
+        return f"cache_ns_version:{UserCache.owner_key(user)}"
+
+    @staticmethod
+    def _initial_version():
+        # Versions only move forward, even when the counter was culled: a restarted
+        # counter starts at the clock in microseconds, past any version handed out
+        # before (a bump is one cache round trip, far slower than a microsecond)
+        return int(time.time() * 1_000_000)
+
+    @staticmethod
+    def version(user=None):
+        """Current namespace version for a user"""
+        version_key = UserCache._version_key(user)
+        version = cache.get(version_key)
+        if version is None:
+            cache.add(version_key, UserCache._initial_version(), NAMESPACE_VERSION_TIMEOUT)
+            version = cache.get(version_key)
+            if version is None:
+                # Culled again at once; a fresh version keeps old entries dead
+                version = UserCache._initial_version()
+        return version
+
+    @staticmethod
+    def namespace(user=None):
+        """Prefix of every key in the user's current namespace"""
+        return f"{UserCache.owner_key(user)}:v{UserCache.version(user)}"
+
+    @staticmethod
+    def key(user, name):
+        """Full cache key for `name` in the user's current namespace"""
+        return f"{UserCache.namespace(user)}:{name}"
+
+    @staticmethod
+    def get(user, name, default=None):
+        return cache.get(UserCache.key(user, name), default)
+
+    @staticmethod
+    def set(user, name, value, timeout=DEFAULT_TIMEOUT):
+        cache.set(UserCache.key(user, name), value, timeout)
+
+    @staticmethod
+    def delete(user, name):
+        cache.delete(UserCache.key(user, name))
+
+    @staticmethod
+    def invalidate(user=None):
+        """Drop everything cached for one user by moving them to a new namespace"""
+        version_key = UserCache._version_key(user)
+        try:
+            cache.incr(version_key)
+        except ValueError:
+            # No version yet (or it was culled): restart from the clock so old keys stay dead
+            cache.set(version_key, UserCache._initial_version(), NAMESPACE_VERSION_TIMEOUT)
+        logger.info(f"Invalidated cache namespace for {UserCache.owner_key(user)}")
+
+    # ---- lists ---------------------------------------------------------------
+    #
+    # Each group hands out numbered registration slots with an atomic cache.incr,
+    # so concurrent set_list calls never overwrite each other's registration.
+    # A slot holds (name, expiry) and lives as long as its list; all of it sits
+    # in the versioned namespace, so invalidate() retires it with the lists.
+
+    @staticmethod
+    @contextmanager
+    def _list_lock(key):
+        """
+        Short lock on one cached list, taken with the atomic cache.add
+
+        Yields:
+            bool: Whether the lock is held; on False the caller must not write the list
+        """
+        lock_key = f"{key}:__lock__"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + LIST_LOCK_WAIT
+        while not cache.add(lock_key, token, LIST_LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                yield False
+                return
+            time.sleep(0.01)
+        try:
+            yield True
+        finally:
+            # Only release our own lock, not one taken after ours expired
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    @staticmethod
+    def set_list(user, group, name, items, timeout=DEFAULT_TIMEOUT):
+        """
+        Cache a list of dicts and register it under `group` for in-place patching
+
+        Args:
+            user: User object (or None for anonymous)
+            group: Group of related lists (e.g. 'gmail_unread')
+            name: Cache name of this list within the user's namespace
+            items: List of dicts with an 'id' key
+            timeout: Seconds to keep the list
+        """
+        namespace = UserCache.namespace(user)
+        key = f"{namespace}:{name}"
+        with UserCache._list_lock(key) as locked:
+            if not locked:
+                # A patch is stuck on this list; leave it uncached rather than race it
+                cache.delete(key)
+                return
+            cache.set(key, items, timeout)
+
+        # A list that is cached again keeps its slot
+        slot_of_key = f"{namespace}:{group}:__slot_of__:{name}"
+        slot = cache.get(slot_of_key)
+        if slot is None:
+            counter_key = f"{namespace}:{group}:__slots__"
+            cache.add(counter_key, 0, LIST_SLOT_COUNTER_TIMEOUT)
+            slot = cache.incr(counter_key)
+            cache.touch(counter_key, LIST_SLOT_COUNTER_TIMEOUT)
+            if slot > LIST_SLOT_LIMIT:
+                UserCache.invalidate(user)
+                UserCache.set_list(user, group, name, items, timeout)
+                return
+        expires_at = time.time() + timeout if timeout is not None else None
+        cache.set_many({
+            slot_of_key: slot,
+            f"{namespace}:{group}:__slot__:{slot}": (name, expires_at),
+        }, timeout)
+
+    @staticmethod
+    def patch_lists(user, group, patch):
+        """
+        Apply `patch(items) -> items` to every cached list in `group`
+
+        Patched lists keep their remaining time to live. Each list is read and
+        written back under its lock, so concurrent patches and set_list calls
+        never overwrite each other's changes.
+
+        Args:
+            user: User object (or None for anonymous)
+            group: Group of related lists
+            patch: Function taking and returning a list of dicts
+
+        Returns:
+            int: Number of cached lists that were patched
+        """
+        namespace = UserCache.namespace(user)
+        slots = cache.get(f"{namespace}:{group}:__slots__") or 0
+        registered = cache.get_many([f"{namespace}:{group}:__slot__:{slot}" for slot in range(1, slots + 1)])
+
+        expiries = {}
+        for name, expires_at in registered.values():
+            expiries[name] = expires_at
+
+        now = time.time()
+        patched = 0
+        for name, expires_at in expiries.items():
+            timeout = None if expires_at is None else int(expires_at - now)
+            if timeout is not None and timeout < 1:
+                continue
+            key = f"{namespace}:{name}"
+            with UserCache._list_lock(key) as locked:
+                if not locked:
+                    # Dropping the list is always safe; the next read fetches it again
+                    cache.delete(key)
+                    continue
+                items = cache.get(key)
+                if items is None:
+                    continue
+                cache.set(key, patch(items), timeout)
+            patched += 1
+        return patched
+
+    @staticmethod
+    def remove_from_lists(user, group, ids):
+        """Remove the items with the given IDs from every cached list in `group`"""
+        ids = set(ids)
+        if not ids:
+            return 0
+        return UserCache.patch_lists(user, group, lambda items: [item for item in items if item.get('id') not in ids])
+
+    @staticmethod
+    def update_in_lists(user, group, ids, **changes):
+        """Update fields (e.g. is_unread=False) of the given IDs in every cached list in `group`"""
+        ids = set(ids)
+        if not ids:
+            return 0
+
+        def patch(items):
+            return [{**item, **changes} if item.get('id') in ids else item for item in items]
+
+        return UserCache.patch_lists(user, group, patch)
@@ -0,0 +1,359 @@
+# inbox/services/classifier.py
+
+import io
+import logging
+import math
+import re
+import time
+import zlib
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from ..models import LocalClassifier, EmailCategorization, EmailPriority, ImportantEmail, MailboxMessage
+from .gmail import extract_email_address
+from .jobs import JobQueue
+
+logger = logging.getLogger(__name__)
+
+# Lowest posterior probability at which a local prediction is used instead of the LLM
+LOCAL_CLASSIFIER_THRESHOLD = getattr(settings, "LOCAL_CLASSIFIER_THRESHOLD", 0.8)
+# Labeled emails needed before a model is trained
+LOCAL_CLASSIFIER_MIN_SAMPLES = getattr(settings, "LOCAL_CLASSIFIER_MIN_SAMPLES", 30)
+# New labels since the last training that trigger another one
+LOCAL_CLASSIFIER_RETRAIN_EVERY = getattr(settings, "LOCAL_CLASSIFIER_RETRAIN_EVERY", 25)
+
+# Hashed feature space; collisions are rare at the vocabulary of one mailbox
+FEATURE_DIM = 2 ** 14
+# Newest labeled emails a model is trained on
+MAX_TRAINING_SAMPLES = 5000
+# Characters of the body that are tokenized
+MAX_BODY_CHARS = 2000
+# Laplace smoothing of the per-class token counts
+SMOOTHING = 0.1
+# Weight of a training label by source: the user's own labels count more than the LLM's
+SOURCE_WEIGHTS = {'manual': 3.0, 'llm': 1.0}
+# Weight of sender and label tokens relative to words of the text
+HEADER_TOKEN_WEIGHT = 3.0
+# Seconds a loaded model is used before checking for a newer one
+MODEL_RELOAD_SECONDS = 60
+
+# Priority bands predicted by the model: low, medium, high (same ranges as the LLM prompt)
+PRIORITY_BANDS = [(1, 3), (4, 6), (7, 10)]
+# Priority given to emails the user marked important but never scored
+IMPORTANT_PRIORITY = 8
+
+# Gmail's own tabs that match one of our categories, used while no model is trained
+GMAIL_CATEGORY_HINTS = {
+    'CATEGORY_PROMOTIONS': ('Promotions', 2),
+    'CATEGORY_SOCIAL': ('Social', 3),
+}
+# Confidence reported for a prediction taken from a Gmail tab
+GMAIL_HINT_CONFIDENCE = 0.9
+
+TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9'_-]{1,30}")
+
+# User ID -> (monotonic load time, trained_at, _Model or None)
+_models = {}
+
+
+def _hash(token):
+    return zlib.crc32(token.encode('utf-8')) & (FEATURE_DIM - 1)
+
+
+def _band(priority):
+    for index, (low, high) in enumerate(PRIORITY_BANDS):
+        if low <= priority <= high:
+            return index
+    return None
+
+
+def features(email):
+    """
+    Hashed bag-of-words of an email
+
+    Args:
+        email: Dict with any of subject, from, snippet, body_text and label_ids
+
+    Returns:
+        Tuple of (feature indices, weights) as numpy arrays, one entry per distinct feature
+    """
+    counts = {}
+
+    def add(token, weight):
+        index = _hash(token)
+        counts[index] = max(counts.get(index, 0.0), weight)
+
+    sender = extract_email_address(email.get('from') or '').lower()
+    if sender:
+        add(f"from:{sender}", HEADER_TOKEN_WEIGHT)
+        add(f"domain:{sender.rpartition('@')[2]}", HEADER_TOKEN_WEIGHT)
+    for label in email.get('label_ids') or []:
+        add(f"label:{label}", HEADER_TOKEN_WEIGHT)
+    for token in TOKEN_RE.findall((email.get('subject') or '').lower()):
+        add(f"subject:{token}", 1.0)
+    body = email.get('body_text') or email.get('snippet') or ''
+    for token in TOKEN_RE.findall(body[:MAX_BODY_CHARS].lower()):
+        add(token, 1.0)
+
+    indices = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+    weights = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    return indices, weights
+
+
+def _email_from_row(row):
+    return {
+        'subject': row.subject,
+        'from': row.sender,
+        'snippet': row.snippet,
+        'body_text': row.body_text,
+        'label_ids': row.label_ids,
+    }
+
+
+class _NaiveBayes:
+    """Multinomial naive Bayes over hashed features"""
+
+    def __init__(self, log_prior, log_likelihood):
+        self.log_prior = log_prior
+        self.log_likelihood = log_likelihood
+
+    @classmethod
+    def fit(cls, samples, labels, sample_weights, n_classes):
+        counts = np.zeros((n_classes, FEATURE_DIM), dtype=np.float64)
+        class_weights = np.zeros(n_classes, dtype=np.float64)
+        for (indices, weights), label, sample_weight in zip(samples, labels, sample_weights):
+            counts[label, indices] += weights * sample_weight
+            class_weights[label] += sample_weight
+        counts += SMOOTHING
+        log_likelihood = np.log(counts / counts.sum(axis=1, keepdims=True))
+        log_prior = np.log(class_weights / class_weights.sum())
+        return cls(log_prior.astype(np.float32), log_likelihood.astype(np.float32))
+
+    def predict(self, indices, weights):
+        """Tuple of (class index, posterior probability)"""
+        if not len(indices):
+            return None, 0.0
+        # Naive Bayes treats every token as independent evidence, which makes long emails
+        # near-certain; scaling by 1/sqrt(tokens) keeps the posterior usable as a confidence
+        evidence = self.log_likelihood[:, indices] @ weights / math.sqrt(weights.sum())
+        scores = self.log_prior + evidence
+        scores = np.exp(scores - scores.max())
+        posterior = scores / scores.sum()
+        best = int(posterior.argmax())
+        return best, float(posterior[best])
+
+
+class _Model:
+    """A user's trained category and priority models"""
+
+    def __init__(self, categories, category_nb, band_nb, band_priorities):
+        self.categories = categories
+        self.category_nb = category_nb
+        self.band_nb = band_nb
+        self.band_priorities = band_priorities
+
+    def dumps(self):
+        arrays = {
+            'category_prior': self.category_nb.log_prior,
+            'category_likelihood': self.category_nb.log_likelihood,
+        }
+        if self.band_nb is not None:
+            arrays.update(
+                band_prior=self.band_nb.log_prior,
+                band_likelihood=self.band_nb.log_likelihood,
+                band_priorities=self.band_priorities,
+            )
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def loads(cls, categories, data):
+        arrays = np.load(io.BytesIO(bytes(data)))
+        band_nb = band_priorities = None
+        if 'band_prior' in arrays:
+            band_nb = _NaiveBayes(arrays['band_prior'], arrays['band_likelihood'])
+            band_priorities = arrays['band_priorities']
+        return cls(categories, _NaiveBayes(arrays['category_prior'], arrays['category_likelihood']), band_nb, band_priorities)
+
+
+class LocalClassifierService:
+    """
+    In-process categorization and priority scoring, trained per user on their labeled mail
+
+    Categories and priorities stored from the LLM or set by the user, together with
+    the emails the user marked important, train a naive Bayes model over hashed
+    words of the subject and body, the sender and Gmail's labels. Predictions at
+    or above LOCAL_CLASSIFIER_THRESHOLD are stored without calling the LLM (with
+    source 'local', so the model never trains on its own output).
+    """
+
+    @staticmethod
+    def _mirrored(user, email_ids):
+        rows = {}
+        email_ids = list(email_ids)
+        for start in range(0, len(email_ids), 500):
+            for row in MailboxMessage.objects.filter(user=user, message_id__in=email_ids[start:start + 500]).only(
+                'message_id', 'subject', 'sender', 'snippet', 'body_text', 'label_ids'
+            ):
+                rows[row.message_id] = _email_from_row(row)
+        return rows
+
+    @staticmethod
+    def labeled_count(user):
+        """Categorized emails the model can be trained on"""
+        return EmailCategorization.objects.filter(user=user).exclude(source='local').count()
+
+    @staticmethod
+    def train(user):
+        """
+        Train the user's model from their labeled emails in the mailbox mirror
+
+        Returns:
+            LocalClassifier object, or None if there are too few labeled emails
+        """
+        categorized = list(
+            EmailCategorization.objects.filter(user=user).exclude(source='local')
+            .order_by('-created_at').values_list('email_id', 'category__name', 'source')[:MAX_TRAINING_SAMPLES]
+        )
+        scored = {
+            email_id: (priority, source)
+            for email_id, priority, source in EmailPriority.objects.filter(user=user).exclude(source='local')
+            .order_by('-created_at').values_list('email_id', 'priority', 'source')[:MAX_TRAINING_SAMPLES]
+        }
+        for email_id in ImportantEmail.objects.filter(user=user).values_list('email_id', flat=True):
+            scored.setdefault(email_id, (IMPORTANT_PRIORITY, 'manual'))
+
+        mirrored = LocalClassifierService._mirrored(user, {email_id for email_id, _, _ in categorized} | set(scored))
+        vectors = {email_id: features(email) for email_id, email in mirrored.items()}
+
+        category_rows = [(email_id, name, source) for email_id, name, source in categorized if email_id in vectors]
+        categories = sorted({name for _, name, _ in category_rows})
+        if len(category_rows) < LOCAL_CLASSIFIER_MIN_SAMPLES or len(categories) < 2:
+            logger.info(f"Not enough labeled emails to train a classifier for {user.username}: {len(category_rows)}")
+            return None
+        category_nb = _NaiveBayes.fit(
+            [vectors[email_id] for email_id, _, _ in category_rows],
+            [categories.index(name) for _, name, _ in category_rows],
+            [SOURCE_WEIGHTS.get(source, 1.0) for _, _, source in category_rows],
+            len(categories),
+        )
+
+        priority_rows = [
+            (email_id, priority, _band(priority), source)
+            for email_id, (priority, source) in scored.items()
+            if email_id in vectors and _band(priority) is not None
+        ]
+        band_nb = band_priorities = None
+        if len(priority_rows) >= LOCAL_CLASSIFIER_MIN_SAMPLES and len({band for _, _, band, _ in priority_rows}) > 1:
+            band_nb = _NaiveBayes.fit(
+                [vectors[email_id] for email_id, _, _, _ in priority_rows],
+                [band for _, _, band, _ in priority_rows],
+                [SOURCE_WEIGHTS.get(source, 1.0) for _, _, _, source in priority_rows],
+                len(PRIORITY_BANDS),
+            )
+            # Each band predicts the user's typical priority within it
+            band_priorities = np.array([
+                round(np.mean([p for _, p, band, _ in priority_rows if band == index] or [(low + high) / 2]))
+                for index, (low, high) in enumerate(PRIORITY_BANDS)
+            ], dtype=np.int32)
+
+        model = _Model(categories, category_nb, band_nb, band_priorities)
+        classifier, _ = LocalClassifier.objects.update_or_create(
+            user=user,
+            defaults={
+                'categories': categories,
+                'weights': model.dumps(),
+                'category_samples': len(category_rows),
+                'priority_samples': len(priority_rows) if band_nb is not None else 0,
+                'trained_at': timezone.now(),
+            }
+        )
+        _models.pop(user.pk, None)
+        logger.info(f"Trained local classifier for {user.username}: {len(category_rows)} categorized, "
+                    f"{len(priority_rows)} scored emails")
+        return classifier
+
+    @staticmethod
+    def schedule_training(user):
+        """Queue training once enough emails were labeled since the last one"""
+        if user is None or not user.is_authenticated:
+            return
+        trained = LocalClassifier.objects.filter(user=user).values_list('category_samples', flat=True).first()
+        labeled = LocalClassifierService.labeled_count(user)
+        if labeled >= max(LOCAL_CLASSIFIER_MIN_SAMPLES, (trained or 0) + LOCAL_CLASSIFIER_RETRAIN_EVERY):
+            JobQueue.enqueue('train_classifier', user=user, dedupe_key=f"classifier:{user.pk}")
+
+    @staticmethod
+    def get_model(user):
+        """The user's trained model (reloaded at most every MODEL_RELOAD_SECONDS), or None"""
+        cached = _models.get(user.pk)
+        if cached and time.monotonic() - cached[0] < MODEL_RELOAD_SECONDS:
+            return cached[2]
+
+        trained_at = LocalClassifier.objects.filter(user=user).values_list('trained_at', flat=True).first()
+        if cached and cached[1] == trained_at:
+            model = cached[2]
+        elif trained_at is None:
+            model = None
+        else:
+            classifier = LocalClassifier.objects.get(user=user)
+            model = _Model.loads(classifier.categories, classifier.weights)
+        _models[user.pk] = (time.monotonic(), trained_at, model)
+        return model
+
+    @staticmethod
+    def predict(user, email):
+        """
+        Category and priority of an email with their confidence
+
+        Args:
+            user: User object
+            email: Dict with any of subject, from, snippet, body_text and label_ids
+
+        Returns:
+            Dict with 'category' (name, confidence) and 'priority' (1-10, confidence);
+            either is None when there is no model for it
+        """
+        prediction = {'category': None, 'priority': None}
+        model = LocalClassifierService.get_model(user)
+        if model is not None:
+            indices, weights = features(email)
+            index, confidence = model.category_nb.predict(indices, weights)
+            if index is not None:
+                prediction['category'] = (model.categories[index], confidence)
+            if model.band_nb is not None:
+                band, confidence = model.band_nb.predict(indices, weights)
+                if band is not None:
+                    prediction['priority'] = (int(model.band_priorities[band]), confidence)
+
+        for label in email.get('label_ids') or []:
+            if label in GMAIL_CATEGORY_HINTS:
+                category, priority = GMAIL_CATEGORY_HINTS[label]
+                if prediction['category'] is None or prediction['category'][1] < LOCAL_CLASSIFIER_THRESHOLD:
+                    prediction['category'] = (category, GMAIL_HINT_CONFIDENCE)
+                if prediction['priority'] is None or prediction['priority'][1] < LOCAL_CLASSIFIER_THRESHOLD:
+                    prediction['priority'] = (priority, GMAIL_HINT_CONFIDENCE)
+                break
+        return prediction
+
+    @staticmethod
+    def email_for(user, email_id, email_text=''):
+        """Email dict to classify: the mirrored message, or just the given text"""
+        mirrored = LocalClassifierService._mirrored(user, [email_id]).get(email_id) if email_id else None
+        if mirrored is None:
+            return {'body_text': email_text}
+        if email_text:
+            mirrored['body_text'] = email_text
+        return mirrored
+
+    @staticmethod
+    def confident(prediction, field):
+        """(value, confidence) of a prediction field if it clears the threshold, else None"""
+        value = prediction.get(field)
+        return value if value is not None and value[1] >= LOCAL_CLASSIFIER_THRESHOLD else None
+
+
+def run_train_classifier_job(job):
+    """Job handler: train a user's local classifier"""
+    LocalClassifierService.train(job.user)
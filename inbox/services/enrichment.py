@@ -0,0 +1,317 @@
+# inbox/services/enrichment.py
+
+import logging
+from decimal import Decimal
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from ..models import SentimentAnalysis, EmailCategory, EmailCategorization, EmailPriority
+from . import gemini
+from .workflow import CategorizationService, BatchClassificationService
+from .classifier import LocalClassifierService
+from .meta import EmailMetaService
+from .jobs import JobQueue
+
+logger = logging.getLogger(__name__)
+
+SENTIMENTS = {'positive', 'negative', 'neutral'}
+URGENCIES = {'low', 'medium', 'high'}
+TONES = {'professional', 'friendly', 'casual', 'formal', 'apologetic'}
+ENTITY_KEYS = ['people', 'dates', 'locations', 'organizations', 'action_items']
+
+
+def _choice(value, choices, default):
+    value = str(value or '').strip().lower()
+    return value if value in choices else default
+
+
+def _number(value, low, high, default):
+    try:
+        return max(low, min(high, int(float(str(value).strip().rstrip('%')))))
+    except (TypeError, ValueError):
+        return default
+
+
+def _text(value):
+    if isinstance(value, list):
+        return "\n".join(f"- {item}" for item in value)
+    return str(value or '').strip()
+
+
+class EnrichmentService:
+    """Service for enriching emails with one LLM call and loading the stored results in bulk"""
+
+    @staticmethod
+    def normalize(raw):
+        """
+        Coerce a raw enrichment response into known values
+
+        Args:
+            raw: Dict from gemini.enrich_email
+
+        Returns:
+            Dict with every enrichment field present and valid for our models
+        """
+        category = str(raw.get('category') or '').strip().title()
+        intent = str(raw.get('intent') or '').strip().title()
+        entities = raw.get('entities') if isinstance(raw.get('entities'), dict) else {}
+        key_indicators = raw.get('key_indicators')
+
+        return {
+            'summary': _text(raw.get('summary')),
+            'reply': _text(raw.get('reply')),
+            'sentiment': _choice(raw.get('sentiment'), SENTIMENTS, 'neutral'),
+            'confidence': _number(raw.get('confidence'), 0, 100, 50),
+            'urgency': _choice(raw.get('urgency'), URGENCIES, 'medium'),
+            'suggested_tone': _choice(raw.get('suggested_tone'), TONES, 'professional'),
+            'key_indicators': key_indicators if isinstance(key_indicators, list) else [],
+            'category': category if category in CategorizationService.VALID_CATEGORIES else 'Other',
+            'priority': _number(raw.get('priority'), 1, 10, 5),
+            'intent': intent if intent in gemini.ENRICHMENT_INTENTS else 'Other',
+            'entities': {key: list(entities.get(key) or []) for key in ENTITY_KEYS},
+        }
+
+    @staticmethod
+    def enrich_email(user, email_id, email_text, tone='professional', persist=True):
+        """
+        Enrich an email and store the classification
+
+        Args:
+            user: User object (results are only stored for authenticated users)
+            email_id: Gmail message ID (results are only stored if given)
+            email_text: Content of the email
+            tone: Tone for the drafted reply
+            persist: Store sentiment, category and priority
+
+        Returns:
+            Normalized enrichment dict
+
+        Raises:
+            RuntimeError: If the model call failed
+        """
+        raw = gemini.enrich_email(email_text, tone=tone)
+        if raw.get('error'):
+            raise RuntimeError(raw['error'])
+
+        result = EnrichmentService.normalize(raw)
+
+        if persist and email_id and user is not None and user.is_authenticated:
+            EnrichmentService.save(user, email_id, result)
+
+        return result
+
+    @staticmethod
+    async def aenrich_email(user, email_id, email_text, tone='professional', persist=True):
+        """Async enrich_email(): the model call runs on the event loop, the save in the ORM thread"""
+        raw = await gemini.aenrich_email(email_text, tone=tone)
+        if raw.get('error'):
+            raise RuntimeError(raw['error'])
+
+        result = EnrichmentService.normalize(raw)
+
+        if persist and email_id and user is not None and user.is_authenticated:
+            await sync_to_async(EnrichmentService.save)(user, email_id, result)
+
+        return result
+
+    @staticmethod
+    def save(user, email_id, result):
+        """
+        Persist sentiment, category and priority of one email in a single transaction
+
+        Args:
+            user: User object
+            email_id: Gmail message ID
+            result: Normalized enrichment dict
+        """
+        with transaction.atomic():
+            SentimentAnalysis.objects.update_or_create(
+                user=user,
+                email_id=email_id,
+                defaults={
+                    'sentiment': result['sentiment'],
+                    'confidence': Decimal(result['confidence']),
+                    'urgency': result['urgency'],
+                    'suggested_tone': result['suggested_tone'],
+                    'key_indicators': result['key_indicators'],
+                }
+            )
+
+            category, _ = EmailCategory.objects.get_or_create(
+                user=user,
+                name=result['category'],
+                defaults={'color': '#007bff'}
+            )
+            EmailCategorization.objects.update_or_create(
+                user=user,
+                email_id=email_id,
+                defaults={'category': category, 'confidence': Decimal(result['confidence']), 'source': 'llm'}
+            )
+
+            EmailPriority.objects.update_or_create(
+                user=user,
+                email_id=email_id,
+                defaults={'priority': result['priority'], 'source': 'llm'}
+            )
+
+            EmailMetaService.update(
+                user, email_id,
+                category=category,
+                priority=result['priority'],
+                sentiment=result['sentiment'],
+                urgency=result['urgency'],
+                intent=result['intent'],
+            )
+
+        logger.info(f"Stored enrichment for email {email_id}: {result['category']}, "
+                    f"priority {result['priority']}, {result['sentiment']}")
+
+    @staticmethod
+    def load_for_emails(user, message_ids):
+        """
+        Load the stored annotations of many emails with a single EmailMeta query
+
+        Args:
+            user: User object
+            message_ids: Iterable of Gmail message IDs
+
+        Returns:
+            Dict of message ID -> {'is_important', 'category', 'category_color', 'priority',
+            'sentiment', 'urgency', 'intent', 'has_reminder'}; emails without metadata still get an entry
+        """
+        message_ids = list(dict.fromkeys(message_ids))
+        annotations = {
+            message_id: {
+                'is_important': False,
+                'category': '',
+                'category_color': '',
+                'priority': 0,
+                'sentiment': '',
+                'urgency': '',
+                'intent': '',
+                'has_reminder': False,
+            }
+            for message_id in message_ids
+        }
+        if not message_ids or user is None or not user.is_authenticated:
+            return annotations
+
+        for email_id, meta in EmailMetaService.get_many(user, message_ids).items():
+            annotations[email_id].update(
+                is_important=meta.is_important,
+                category=meta.category.name if meta.category else '',
+                category_color=meta.category.color if meta.category else '',
+                priority=meta.priority,
+                sentiment=meta.sentiment,
+                urgency=meta.urgency,
+                intent=meta.intent,
+                has_reminder=meta.has_reminder,
+            )
+
+        return annotations
+
+    @staticmethod
+    def annotate_emails(user, emails):
+        """
+        Add importance, category, priority and sentiment to email dicts in place
+
+        Args:
+            user: User object
+            emails: List of email dicts with an 'id' key
+
+        Returns:
+            The same list
+        """
+        annotations = EnrichmentService.load_for_emails(user, [email['id'] for email in emails])
+        for email in emails:
+            email.update(annotations.get(email['id'], {}))
+        return emails
+
+
+def enqueue_enrichment(user, email_ids):
+    """
+    Queue background enrichment for emails that have not been categorized and scored yet
+
+    Args:
+        user: User object
+        email_ids: Iterable of Gmail message IDs
+    """
+    email_ids = list(dict.fromkeys(email_ids))
+    if not email_ids or user is None or not user.is_authenticated:
+        return
+    meta = EmailMetaService.get_many(user, email_ids)
+    JobQueue.enqueue_many('enrich_email', [
+        (user, {'email_id': email_id}, f"{user.pk}:{email_id}")
+        for email_id in email_ids
+        if email_id not in meta or not (meta[email_id].category_id and meta[email_id].priority)
+    ])
+
+
+def email_source_text(details):
+    """
+    Text of an email as the compose box shows it (useEmail() in main.js)
+
+    Background enrichment and reply drafting use the same text the user would
+    send, so their results are reused when the user asks for a reply.
+    """
+    return (
+        f"From: {details.get('from') or 'Unknown'}\n"
+        f"Subject: {details.get('subject') or 'No Subject'}\n"
+        f"Date: {details.get('date') or ''}\n"
+        f" {details.get('body_text') or details.get('snippet') or ''}"
+    ).strip()
+
+
+def load_email_details(user, email_id):
+    """
+    Details of an email from the mailbox mirror, downloading the body from Gmail if needed
+
+    Raises:
+        RuntimeError: If the user has no Gmail credentials or the email cannot be fetched
+    """
+    from .gmail import get_gmail_service, get_email_details
+    from .sync import MailboxSyncService
+
+    mirrored = MailboxSyncService.get_message(user, email_id)
+    if mirrored and mirrored.body_fetched:
+        return mirrored.to_details_dict()
+
+    service = get_gmail_service(user=user)
+    if not service:
+        raise RuntimeError("No Gmail credentials")
+    details = get_email_details(service, email_id)
+    if not details:
+        raise RuntimeError(f"Email {email_id} could not be fetched")
+    MailboxSyncService.store_details(user, details)
+    return details
+
+
+def run_enrichment_job(job):
+    """
+    Job handler: enrich one email and store its category, priority and sentiment
+
+    The local classifier is tried first; only emails it is unsure about go to the
+    LLM. Uses the text in the payload if given, otherwise the mirrored body,
+    downloading it from Gmail when it has not been fetched yet. Afterwards replies
+    are drafted ahead of time for the user's highest-priority unread emails.
+    """
+    from .speculative import SpeculativeReplyService
+
+    user = job.user
+    email_id = job.payload['email_id']
+    email_text = job.payload.get('email_text', '')
+
+    if not email_text:
+        meta = EmailMetaService.get_many(user, [email_id]).get(email_id)
+        if meta and meta.category_id and meta.priority:
+            logger.info(f"Email {email_id} already enriched, skipping")
+            return
+
+    email = LocalClassifierService.email_for(user, email_id, email_text)
+    if BatchClassificationService.classify_locally(user, email_id, email):
+        logger.info(f"Email {email_id} classified locally")
+    else:
+        if not email_text:
+            email_text = email_source_text(load_email_details(user, email_id))
+        EnrichmentService.enrich_email(user, email_id, email_text)
+        LocalClassifierService.schedule_training(user)
+    SpeculativeReplyService.schedule(user)
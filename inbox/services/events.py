@@ -0,0 +1,188 @@
+# inbox/services/events.py
+
+import asyncio
+import logging
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from ..models import InboxEvent, InboxEventSequence, MailboxMessage
+from ..signals import reminder_due, scheduled_email_sent
+
+logger = logging.getLogger(__name__)
+
+# Hours events are kept for clients resuming with Last-Event-ID
+INBOX_EVENT_RETENTION_HOURS = getattr(settings, "INBOX_EVENT_RETENTION_HOURS", 24)
+# Seconds between checks for events published by other processes (workers, scheduler)
+INBOX_STREAM_POLL_INTERVAL = getattr(settings, "INBOX_STREAM_POLL_INTERVAL", 5)
+# Seconds a stream stays open before the client is told to reconnect
+INBOX_STREAM_MAX_DURATION = getattr(settings, "INBOX_STREAM_MAX_DURATION", 300)
+# Seconds of silence before a keepalive comment, so proxies keep the connection open
+INBOX_STREAM_KEEPALIVE = 15
+# Most events sent per database read
+INBOX_EVENT_BATCH_SIZE = 100
+
+# Per-user (loop, future) pairs that wake streams in this process as soon as an event
+# is stored; streams in other processes find events produced here on their next poll
+_waiters = {}
+_waiters_lock = threading.Lock()
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _wake(user_id):
+    # Runs in whichever thread committed the event, so hand over to each stream's loop
+    with _waiters_lock:
+        waiters = _waiters.pop(user_id, ())
+    for loop, future in waiters:
+        try:
+            loop.call_soon_threadsafe(_resolve, future)
+        except RuntimeError:
+            # The loop has been closed
+            pass
+
+
+def message_payload(row):
+    """Event payload for a mirrored message: its list entry plus its unread state"""
+    payload = row.to_email_dict()
+    payload.pop('body_text', None)
+    payload['is_unread'] = row.is_unread and not row.is_trashed
+    payload['label_ids'] = row.label_ids
+    return payload
+
+
+class InboxEventService:
+    """
+    Append-only log of inbox changes that the live update stream replays
+
+    Events are numbered per user (seq) while holding the lock on the user's
+    InboxEventSequence row until the inserting transaction commits. A stream that
+    has seen seq N therefore never misses a lower seq committed later, which
+    autoincrement IDs cannot promise once the web process, workers and the
+    scheduler all write events.
+    """
+
+    @staticmethod
+    def _reserve(user, count):
+        """
+        Take the user's next `count` seqs; call inside the transaction that inserts the events
+
+        Returns:
+            int: First seq taken
+        """
+        InboxEventSequence.objects.get_or_create(user=user)
+        sequence = InboxEventSequence.objects.select_for_update().get(user=user)
+        sequence.last_seq += count
+        sequence.save(update_fields=['last_seq'])
+        return sequence.last_seq - count + 1
+
+    @staticmethod
+    def publish(user, kind, payload=None):
+        """
+        Record an event and wake the user's streams once it is committed
+
+        Args:
+            user: User object
+            kind: One of InboxEvent.KIND_CHOICES
+            payload: JSON-serializable dict
+
+        Returns:
+            InboxEvent object, or None for anonymous users
+        """
+        if not user or not user.is_authenticated:
+            return None
+        with transaction.atomic():
+            seq = InboxEventService._reserve(user, 1)
+            event = InboxEvent.objects.create(user=user, seq=seq, kind=kind, payload=payload or {})
+        transaction.on_commit(lambda: _wake(user.pk))
+        return event
+
+    @staticmethod
+    def publish_many(user, kind, payloads):
+        """Record one event per payload with a single insert"""
+        if not user or not user.is_authenticated or not payloads:
+            return
+        with transaction.atomic():
+            first = InboxEventService._reserve(user, len(payloads))
+            InboxEvent.objects.bulk_create([
+                InboxEvent(user=user, seq=first + i, kind=kind, payload=payload)
+                for i, payload in enumerate(payloads)
+            ])
+        transaction.on_commit(lambda: _wake(user.pk))
+
+    @staticmethod
+    def since(user, after_seq, limit=INBOX_EVENT_BATCH_SIZE):
+        """
+        Events of a user after a seq, oldest first
+
+        Args:
+            user: User object
+            after_seq: Last event seq the client has seen
+            limit: Maximum number of events
+
+        Returns:
+            List of InboxEvent objects
+        """
+        return list(InboxEvent.objects.filter(user=user, seq__gt=after_seq).order_by('seq')[:limit])
+
+    @staticmethod
+    def latest_seq(user):
+        """Seq of the user's newest committed event, 0 if there is none"""
+        return InboxEvent.objects.filter(user=user).order_by('-seq').values_list('seq', flat=True).first() or 0
+
+    @staticmethod
+    def can_resume(user, after_seq):
+        """Whether the events after `after_seq` are all still stored (its event was not purged)"""
+        return InboxEvent.objects.filter(user=user, seq=after_seq).exists()
+
+    @staticmethod
+    async def wait(user, timeout):
+        """Wait until an event is published for the user in this process, or the timeout passes"""
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        with _waiters_lock:
+            _waiters.setdefault(user.pk, set()).add(waiter)
+        try:
+            await asyncio.wait([waiter[1]], timeout=timeout)
+        finally:
+            with _waiters_lock:
+                waiters = _waiters.get(user.pk)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del _waiters[user.pk]
+
+    @staticmethod
+    def purge(hours=INBOX_EVENT_RETENTION_HOURS):
+        """Delete events older than `hours`; returns the number deleted"""
+        deleted, _ = InboxEvent.objects.filter(created_at__lt=timezone.now() - timedelta(hours=hours)).delete()
+        return deleted
+
+
+@receiver(reminder_due)
+def publish_reminder_due(sender, reminder, **kwargs):
+    payload = {
+        'reminder_id': reminder.id,
+        'email_id': reminder.email_id,
+        'message': reminder.message or '',
+        'reminder_time': reminder.reminder_time.isoformat(),
+    }
+    row = MailboxMessage.objects.filter(user=reminder.user, message_id=reminder.email_id).first()
+    if row:
+        payload['subject'] = row.subject
+        payload['from'] = row.sender
+    InboxEventService.publish(reminder.user, 'reminder_due', payload)
+
+
+@receiver(scheduled_email_sent)
+def publish_scheduled_email_sent(sender, scheduled_email, **kwargs):
+    InboxEventService.publish(scheduled_email.user, 'scheduled_email_sent', {
+        'scheduled_email_id': scheduled_email.id,
+        'draft_id': scheduled_email.email_id,
+        'message_id': scheduled_email.sent_message_id,
+    })
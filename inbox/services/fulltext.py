@@ -0,0 +1,295 @@
+# inbox/services/fulltext.py
+
+import logging
+import re
+from datetime import datetime, time as dt_time
+from django.db import connection, connections, OperationalError
+from django.db.models import Q
+from django.utils import timezone
+from ..models import MailboxMessage
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_TABLE = 'inbox_mailboxmessage'
+# SQLite: FTS5 table whose rowid is the MailboxMessage primary key, kept current by triggers
+FTS_TABLE = 'inbox_mailbox_fts'
+# Postgres: generated tsvector column on the message table with a GIN index
+SEARCH_VECTOR_COLUMN = 'search_vector'
+
+# bm25 weights of the FTS5 columns (subject, sender, body)
+SQLITE_RANK_WEIGHTS = (10.0, 5.0, 1.0)
+# Text search configuration of the Postgres index and queries
+POSTGRES_CONFIG = 'english'
+
+SQLITE_INDEX_SQL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"subject, sender, body, tokenize='porter unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON {MESSAGE_TABLE} BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, subject, sender, body) "
+    f"VALUES (new.id, new.subject, new.sender, new.snippet || ' ' || new.body_text); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF subject, sender, snippet, body_text "
+    f"ON {MESSAGE_TABLE} BEGIN DELETE FROM {FTS_TABLE} WHERE rowid = old.id; "
+    f"INSERT INTO {FTS_TABLE}(rowid, subject, sender, body) "
+    f"VALUES (new.id, new.subject, new.sender, new.snippet || ' ' || new.body_text); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON {MESSAGE_TABLE} BEGIN "
+    f"DELETE FROM {FTS_TABLE} WHERE rowid = old.id; END",
+]
+SQLITE_REBUILD_SQL = [
+    f"DELETE FROM {FTS_TABLE}",
+    f"INSERT INTO {FTS_TABLE}(rowid, subject, sender, body) "
+    f"SELECT id, subject, sender, snippet || ' ' || body_text FROM {MESSAGE_TABLE}",
+]
+SQLITE_DROP_SQL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_insert",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_update",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_delete",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+POSTGRES_INDEX_SQL = [
+    f"ALTER TABLE {MESSAGE_TABLE} ADD COLUMN IF NOT EXISTS {SEARCH_VECTOR_COLUMN} tsvector GENERATED ALWAYS AS ("
+    f"setweight(to_tsvector('{POSTGRES_CONFIG}', coalesce(subject, '')), 'A') || "
+    f"setweight(to_tsvector('{POSTGRES_CONFIG}', coalesce(sender, '')), 'B') || "
+    f"setweight(to_tsvector('{POSTGRES_CONFIG}', coalesce(snippet, '') || ' ' || coalesce(body_text, '')), 'C')"
+    f") STORED",
+    f"CREATE INDEX IF NOT EXISTS inbox_mbox_search_idx ON {MESSAGE_TABLE} USING GIN ({SEARCH_VECTOR_COLUMN})",
+]
+POSTGRES_DROP_SQL = [
+    "DROP INDEX IF EXISTS inbox_mbox_search_idx",
+    f"ALTER TABLE {MESSAGE_TABLE} DROP COLUMN IF EXISTS {SEARCH_VECTOR_COLUMN}",
+]
+
+QUERY_TOKEN_RE = re.compile(r'(?:(\w+):)?(?:"([^"]*)"|(\S+))')
+
+# Database alias -> whether its index exists
+_available = {}
+
+
+def install_index(db_connection=None):
+    """
+    Create the full-text index of the mailbox mirror if the database supports one
+
+    SQLite gets an FTS5 table maintained by triggers (recreated and refilled if a
+    table rebuild dropped them), Postgres a generated tsvector column with a GIN
+    index. Other databases are searched with a table scan.
+
+    Returns:
+        bool: Whether the index exists
+    """
+    db_connection = db_connection or connection
+    if MESSAGE_TABLE not in db_connection.introspection.table_names():
+        return False
+
+    with db_connection.cursor() as cursor:
+        if db_connection.vendor == 'sqlite':
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s", [f"{FTS_TABLE}_%"]
+            )
+            triggers = cursor.fetchone()[0]
+            try:
+                for statement in SQLITE_INDEX_SQL:
+                    cursor.execute(statement)
+            except OperationalError as e:
+                logger.warning(f"SQLite has no FTS5, mailbox search will scan the table: {str(e)}")
+                return False
+            if triggers < 3:
+                for statement in SQLITE_REBUILD_SQL:
+                    cursor.execute(statement)
+                logger.info("Built the mailbox full-text index")
+        elif db_connection.vendor == 'postgresql':
+            for statement in POSTGRES_INDEX_SQL:
+                cursor.execute(statement)
+        else:
+            return False
+
+    _available.pop(db_connection.alias, None)
+    return True
+
+
+def drop_index(db_connection=None):
+    """Remove the full-text index (reverse of install_index)"""
+    db_connection = db_connection or connection
+    statements = {'sqlite': SQLITE_DROP_SQL, 'postgresql': POSTGRES_DROP_SQL}.get(db_connection.vendor, [])
+    with db_connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+    _available.pop(db_connection.alias, None)
+
+
+def ensure_index(sender, using='default', **kwargs):
+    """post_migrate receiver: migrations that rebuild the message table on SQLite drop its triggers"""
+    db_connection = connections[using]
+    # Only repair an index the migration created (not one it just removed)
+    if db_connection.vendor == 'sqlite' and FTS_TABLE in db_connection.introspection.table_names():
+        install_index(db_connection)
+
+
+def index_available(db_connection=None):
+    """Whether the database has the full-text index (checked once per process)"""
+    db_connection = db_connection or connection
+    if db_connection.alias not in _available:
+        with db_connection.cursor() as cursor:
+            if db_connection.vendor == 'sqlite':
+                cursor.execute("SELECT count(*) FROM sqlite_master WHERE name = %s", [FTS_TABLE])
+                _available[db_connection.alias] = bool(cursor.fetchone()[0])
+            elif db_connection.vendor == 'postgresql':
+                cursor.execute(
+                    "SELECT count(*) FROM information_schema.columns WHERE table_name = %s AND column_name = %s",
+                    [MESSAGE_TABLE, SEARCH_VECTOR_COLUMN]
+                )
+                _available[db_connection.alias] = bool(cursor.fetchone()[0])
+            else:
+                _available[db_connection.alias] = False
+    return _available[db_connection.alias]
+
+
+def _parse_date(value):
+    for fmt in ('%Y-%m-%d', '%Y/%m/%d'):
+        try:
+            return timezone.make_aware(datetime.combine(datetime.strptime(value, fmt).date(), dt_time.min))
+        except ValueError:
+            continue
+    return None
+
+
+def parse_query(query):
+    """
+    Split a search query into text and filters (Gmail-style operators)
+
+    Supports words, "quoted phrases", from:, subject: (a word or a quoted phrase)
+    and after:/before: dates as YYYY-MM-DD or YYYY/MM/DD (before: is exclusive,
+    like Gmail). Unknown operators and invalid dates are searched as text.
+
+    Returns:
+        Dict with 'terms', 'phrases', 'from', 'subject' (lists of strings) and
+        'after', 'before' (aware datetimes or None; before is exclusive)
+    """
+    parsed = {'terms': [], 'phrases': [], 'from': [], 'subject': [], 'after': None, 'before': None}
+    for match in QUERY_TOKEN_RE.finditer(query or ''):
+        operator, quoted, word = match.groups()
+        value = (quoted if quoted is not None else word or '').strip()
+        operator = (operator or '').lower()
+        if not re.search(r'\w', value):
+            continue
+        if operator in ('after', 'before') and _parse_date(value):
+            parsed[operator] = _parse_date(value)
+        elif operator in ('from', 'subject'):
+            parsed[operator].append(value)
+        elif quoted is not None:
+            parsed['phrases'].append(f"{operator}:{value}" if operator else value)
+        else:
+            parsed['terms'].append(match.group(0))
+    return parsed
+
+
+def _fts5_string(value, prefix=False):
+    return '"' + value.replace('"', '""') + '"' + ('*' if prefix else '')
+
+
+class FullTextSearchService:
+    """Ranked full-text search over a user's mirrored messages, without calling Gmail"""
+
+    @staticmethod
+    def search(user, query, limit=20, offset=0):
+        """
+        Mirrored messages matching a query, best match first
+
+        Args:
+            user: User object
+            query: Search string (see parse_query)
+            limit: Maximum number of results
+            offset: Results to skip
+
+        Returns:
+            List of (message ID, score) tuples; higher scores are better matches. Queries
+            without text (only dates) return the newest messages first with score 0.
+        """
+        parsed = parse_query(query)
+        has_text = parsed['terms'] or parsed['phrases'] or parsed['from'] or parsed['subject']
+        if not has_text and not (parsed['after'] or parsed['before']):
+            return []
+        if has_text and index_available():
+            if connection.vendor == 'sqlite':
+                return FullTextSearchService._search_sqlite(user, parsed, limit, offset)
+            if parsed['terms'] or parsed['phrases']:
+                return FullTextSearchService._search_postgres(user, parsed, limit, offset)
+        return FullTextSearchService._search_scan(user, parsed, limit, offset)
+
+    @staticmethod
+    def _date_filters(parsed, column):
+        clauses, params = [], []
+        if parsed['after']:
+            clauses.append(f"{column} >= %s")
+            params.append(connection.ops.adapt_datetimefield_value(parsed['after']))
+        if parsed['before']:
+            clauses.append(f"{column} < %s")
+            params.append(connection.ops.adapt_datetimefield_value(parsed['before']))
+        return clauses, params
+
+    @staticmethod
+    def _search_sqlite(user, parsed, limit, offset):
+        # Free words match as prefixes, so partly typed words already find something
+        match = [_fts5_string(term, prefix=True) for term in parsed['terms']]
+        match += [_fts5_string(phrase) for phrase in parsed['phrases']]
+        match += [f"sender : {_fts5_string(value)}" for value in parsed['from']]
+        match += [f"subject : {_fts5_string(value)}" for value in parsed['subject']]
+
+        clauses, params = FullTextSearchService._date_filters(parsed, 'm.internal_date')
+        sql = (
+            f"SELECT m.message_id, bm25({FTS_TABLE}, {', '.join(str(w) for w in SQLITE_RANK_WEIGHTS)}) AS rank "
+            f"FROM {FTS_TABLE} JOIN {MESSAGE_TABLE} m ON m.id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH %s AND m.user_id = %s AND NOT m.is_trashed "
+            + ''.join(f"AND {clause} " for clause in clauses) +
+            "ORDER BY rank LIMIT %s OFFSET %s"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [' AND '.join(match), user.pk, *params, limit, offset])
+            # bm25 is lower for better matches
+            return [(message_id, -rank) for message_id, rank in cursor.fetchall()]
+
+    @staticmethod
+    def _search_postgres(user, parsed, limit, offset):
+        queries, query_params = [], []
+        if parsed['terms']:
+            queries.append("plainto_tsquery(%s, %s)")
+            query_params += [POSTGRES_CONFIG, ' '.join(parsed['terms'])]
+        for phrase in parsed['phrases']:
+            queries.append("phraseto_tsquery(%s, %s)")
+            query_params += [POSTGRES_CONFIG, phrase]
+
+        clauses, params = FullTextSearchService._date_filters(parsed, 'internal_date')
+        for column, values in (('sender', parsed['from']), ('subject', parsed['subject'])):
+            for value in values:
+                clauses.append(f"{column} ILIKE %s")
+                params.append('%' + re.sub(r'([\\%_])', r'\\\1', value) + '%')
+
+        sql = (
+            f"SELECT message_id, ts_rank_cd({SEARCH_VECTOR_COLUMN}, query) AS rank "
+            f"FROM {MESSAGE_TABLE}, (SELECT {' && '.join(queries)} AS query) q "
+            f"WHERE user_id = %s AND NOT is_trashed AND {SEARCH_VECTOR_COLUMN} @@ query "
+            + ''.join(f"AND {clause} " for clause in clauses) +
+            "ORDER BY rank DESC, internal_date DESC NULLS LAST LIMIT %s OFFSET %s"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [*query_params, user.pk, *params, limit, offset])
+            return [(message_id, float(rank)) for message_id, rank in cursor.fetchall()]
+
+    @staticmethod
+    def _search_scan(user, parsed, limit, offset):
+        """Search without the index: substring matches, newest first"""
+        queryset = MailboxMessage.objects.filter(user=user, is_trashed=False)
+        for value in parsed['terms'] + parsed['phrases']:
+            queryset = queryset.filter(
+                Q(subject__icontains=value) | Q(sender__icontains=value)
+                | Q(snippet__icontains=value) | Q(body_text__icontains=value)
+            )
+        for value in parsed['from']:
+            queryset = queryset.filter(sender__icontains=value)
+        for value in parsed['subject']:
+            queryset = queryset.filter(subject__icontains=value)
+        if parsed['after']:
+            queryset = queryset.filter(internal_date__gte=parsed['after'])
+        if parsed['before']:
+            queryset = queryset.filter(internal_date__lt=parsed['before'])
+        message_ids = queryset.order_by('-internal_date').values_list('message_id', flat=True)[offset:offset + limit]
+        return [(message_id, 0.0) for message_id in message_ids]
@@ -2,8 +2,17 @@ import os
 import logging
 import json
 import time
+import threading
+import functools
+import inspect
+import contextvars
 import google.generativeai as genai
 from django.conf import settings
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from . import aio
+from .llm_cache import response_cache
+from .ratelimit import rate_limiter
 
 # Set up logger
 logger = logging.getLogger(__name__)
@@ -28,60 +37,245 @@ MODEL_NAME = getattr(settings, "GEMINI_MODEL", MODEL_OPTIONS[0])
 # Log the model being used
 logger.info(f"Configured Gemini model: {MODEL_NAME}")
 
+# Model health lives in the Django cache so every worker shares it
+# (with a shared backend such as Redis; LocMemCache keeps it per process)
+GEMINI_MODEL_HEALTH_TTL = getattr(settings, "GEMINI_MODEL_HEALTH_TTL", 1800)
+MODEL_HEALTH_CACHE_KEY = "gemini_model_health"
+MODEL_HEALTH_LOCK_KEY = "gemini_model_health_refreshing"
+
+
+def _is_quota_error(error):
+    return "429" in str(error) or "quota" in str(error).lower()
+
+
+def _is_model_unavailable_error(error):
+    message = str(error).lower()
+    return "404" in message or "not found" in message or "not supported" in message
+
+
+def _candidate_models():
+    """Configured model first, then the other options, without duplicates"""
+    return list(dict.fromkeys([MODEL_NAME] + MODEL_OPTIONS))
+
+
+def get_model_health():
+    """
+    Get the shared model health state
+
+    Returns:
+        Dict with 'selected' (model name), 'checked_at' (timestamp) and
+        'models' (model name -> {'ok', 'error', 'checked_at'}), empty if never checked
+    """
+    return cache.get(MODEL_HEALTH_CACHE_KEY) or {}
+
+
+def get_quota_backoff_until():
+    """Timestamp until which Gemini calls fail fast after repeated quota or server errors (None if not backing off)"""
+    state = rate_limiter.breaker("gemini").state()
+    if state['state'] != 'open':
+        return None
+    return time.time() + state['retry_in']
+
+
 def get_working_model():
-    """Try to find a working model from the available options"""
-    # Check if we've recently hit quota limits
-    if hasattr(get_working_model, '_last_quota_error_time'):
-        # If we hit quota within the last hour, use a fallback
-        if time.time() - get_working_model._last_quota_error_time < 3600:
-            logger.warning("Recently hit quota limit, using fallback model")
-            return MODEL_OPTIONS[-1]  # Use the last option as fallback
-    
-    for model_name in MODEL_OPTIONS:
-        try:
-            model = genai.GenerativeModel(model_name)
-            # Test if the model works with a simple prompt
-            test_response = model.generate_content("Test")
-            logger.info(f"Successfully using model: {model_name}")
-            return model_name
-        except Exception as e:
-            # Check if this is a quota error
-            if "429" in str(e) or "quota" in str(e).lower():
-                # Remember when we hit the quota
-                get_working_model._last_quota_error_time = time.time()
-                logger.warning(f"Hit quota limit with model {model_name}")
-                continue
-            logger.warning(f"Model {model_name} failed: {str(e)}")
-            continue
-    
-    # If none of the preferred models work, try to list available models
+    """
+    Get the model to use, without calling the Gemini API
+
+    Uses the health state shared through the cache and schedules a background
+    refresh when it is missing or older than GEMINI_MODEL_HEALTH_TTL. Until the
+    first refresh finishes the configured MODEL_NAME is used.
+    """
+    health = get_model_health()
+    if time.time() - health.get('checked_at', 0) > GEMINI_MODEL_HEALTH_TTL:
+        refresh_model_health_async()
+    return health.get('selected') or MODEL_NAME
+
+
+def refresh_model_health_async():
+    """Refresh model health in a background thread unless a refresh is already running"""
+    if not GEMINI_API_KEY:
+        return
+    if not cache.add(MODEL_HEALTH_LOCK_KEY, True, 300):
+        return
+    threading.Thread(target=refresh_model_health, name="gemini-model-health", daemon=True).start()
+
+
+def refresh_model_health():
+    """
+    Probe the candidate models and store the result in the shared cache
+
+    Probes use model metadata lookups, so they don't spend generation quota.
+
+    Returns:
+        The model health dict that was stored
+    """
     try:
-        logger.info("Trying to find available models...")
-        models = genai.list_models()
-        for model in models:
-            if "generateContent" in model.supported_generation_methods:
-                logger.info(f"Found available model: {model.name}")
-                # Try this model
+        now = time.time()
+        models = {}
+        for model_name in _candidate_models():
+            try:
+                info = genai.get_model(model_name)
+                if "generateContent" in info.supported_generation_methods:
+                    models[model_name] = {'ok': True, 'error': '', 'checked_at': now}
+                else:
+                    models[model_name] = {'ok': False, 'error': 'generateContent not supported', 'checked_at': now}
+            except Exception as e:
+                logger.warning(f"Model {model_name} failed: {str(e)}")
+                models[model_name] = {'ok': False, 'error': str(e), 'checked_at': now}
+
+        selected = next((name for name, state in models.items() if state['ok']), None)
+
+        # If none of the preferred models work, try to list available models
+        if selected is None:
+            try:
+                logger.info("Trying to find available models...")
+                for model in genai.list_models():
+                    if "generateContent" in model.supported_generation_methods:
+                        logger.info(f"Found available model: {model.name}")
+                        models[model.name] = {'ok': True, 'error': '', 'checked_at': now}
+                        selected = model.name
+                        break
+            except Exception as e:
+                logger.error(f"Failed to list models: {str(e)}")
+
+        if selected is None:
+            # If nothing works, keep the default and let it fail with a clear error
+            logger.error("No working model found")
+
+        health = {'selected': selected or MODEL_NAME, 'checked_at': now, 'models': models}
+        cache.set(MODEL_HEALTH_CACHE_KEY, health, None)
+        logger.info(f"Selected working model: {health['selected']}")
+        return health
+    finally:
+        cache.delete(MODEL_HEALTH_LOCK_KEY)
+
+
+def record_model_error(error, model_name=None):
+    """
+    Feed an error from a real Gemini call back into the shared state
+
+    Quota errors are retried and throttled by the rate limiter, so they leave the
+    selection alone; errors saying the model is gone mark it unhealthy and move the
+    selection to the next healthy candidate.
+
+    Args:
+        error: Exception raised by the Gemini call
+        model_name: Model that was called (defaults to the current selection)
+    """
+    # Keep the failed call's fallback result out of the response cache
+    _call_failed.set(True)
+
+    if _is_quota_error(error):
+        # Don't downgrade the model over a quota error; retries and the circuit breaker handle it
+        logger.warning(f"Gemini quota error after retries: {str(error)[:200]}")
+        return
+
+    if not _is_model_unavailable_error(error):
+        return
+
+    health = get_model_health()
+    model_name = model_name or health.get('selected') or MODEL_NAME
+    models = health.get('models', {})
+    models[model_name] = {'ok': False, 'error': str(error), 'checked_at': time.time()}
+    selected = next(
+        (name for name in _candidate_models() if models.get(name, {}).get('ok', True) and name != model_name),
+        MODEL_NAME
+    )
+    cache.set(MODEL_HEALTH_CACHE_KEY, {**health, 'models': models, 'selected': selected}, None)
+    logger.warning(f"Model {model_name} unavailable, switching to {selected}")
+
+
+def _get_model():
+    """GenerativeModel for the current working model"""
+    return genai.GenerativeModel(get_working_model())
+
+
+def _generate_content(model, prompt, **kwargs):
+    """Call model.generate_content under the shared Gemini rate limit, retry policy and circuit breaker"""
+    return rate_limiter.call("gemini", lambda: model.generate_content(prompt, **kwargs))
+
+
+async def _agenerate_text(prompt):
+    """Async counterpart of _generate_content on the shared HTTP client; returns the response text"""
+    return await aio.generate_text(get_working_model(), prompt, GEMINI_API_KEY)
+
+
+# Set by record_model_error while a cached call runs, so error fallbacks are never cached
+_call_failed = contextvars.ContextVar("gemini_call_failed", default=False)
+
+
+def cached_llm_call(prompt_version=1, content=None, name=None):
+    """
+    Cache a Gemini helper's result in the two-tier LLM response cache
+
+    The key covers the working model, the function name, `prompt_version` (bump it
+    when the prompt changes) and a hash of the input. Calls that fail are not cached.
+    Coroutine functions are supported; their cache reads and writes run off the event loop.
+
+    Args:
+        prompt_version: Version of the function's prompt template
+        content: Optional function mapping the call's arguments to the hashed input
+        name: Function name used in the key (lets an async variant share the sync function's entries)
+    """
+    def decorator(func):
+        function_name = name or func.__name__
+
+        def cache_key(args, kwargs):
+            model_name = get_working_model()
+            key_content = content(*args, **kwargs) if content else [args, kwargs]
+            return model_name, response_cache.make_key(model_name, function_name, prompt_version, key_content)
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not GEMINI_API_KEY:
+                    return await func(*args, **kwargs)
+
+                model_name, key = cache_key(args, kwargs)
+                cached = await sync_to_async(response_cache.get)(key)
+                if cached is not None:
+                    logger.info(f"LLM response cache hit for {function_name}")
+                    return cached
+
+                token = _call_failed.set(False)
                 try:
-                    test_model = genai.GenerativeModel(model.name)
-                    test_response = test_model.generate_content("Test")
-                    logger.info(f"Successfully using fallback model: {model.name}")
-                    return model.name
-                except Exception as e:
-                    # Check if this is a quota error
-                    if "429" in str(e) or "quota" in str(e).lower():
-                        # Remember when we hit the quota
-                        get_working_model._last_quota_error_time = time.time()
-                        logger.warning(f"Hit quota limit with model {model.name}")
-                        continue
-                    logger.warning(f"Fallback model {model.name} failed: {str(e)}")
-    except Exception as e:
-        logger.error(f"Failed to list models: {str(e)}")
-    
-    # If nothing works, return the default and let it fail with a clear error
-    logger.error("No working model found")
-    return MODEL_OPTIONS[0]
+                    result = await func(*args, **kwargs)
+                    if not _call_failed.get() and result:
+                        await sync_to_async(response_cache.set)(
+                            key, result,
+                            model_name=model_name, function=function_name, prompt_version=prompt_version
+                        )
+                    return result
+                finally:
+                    _call_failed.reset(token)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not GEMINI_API_KEY:
+                return func(*args, **kwargs)
+
+            model_name, key = cache_key(args, kwargs)
+            cached = response_cache.get(key)
+            if cached is not None:
+                logger.info(f"LLM response cache hit for {function_name}")
+                return cached
+
+            token = _call_failed.set(False)
+            try:
+                result = func(*args, **kwargs)
+                if not _call_failed.get() and result:
+                    response_cache.set(
+                        key, result,
+                        model_name=model_name, function=function_name, prompt_version=prompt_version
+                    )
+                return result
+            finally:
+                _call_failed.reset(token)
+        return wrapper
+    return decorator
 
+@cached_llm_call()
 def summarize_email(text: str) -> str:
     """
     Produce a brief, helpful summary suitable for a reply assistant.
@@ -95,9 +289,9 @@ def summarize_email(text: str) -> str:
             "including the sender's main request and any deadlines:\n\n"
             f"{text}"
         )
-        model = genai.GenerativeModel(WORKING_MODEL)
-        logger.info(f"Using model for summarization: {WORKING_MODEL}")
-        resp = model.generate_content(prompt)
+        model = _get_model()
+        logger.info(f"Using model for summarization: {model.model_name}")
+        resp = _generate_content(model, prompt)
 
         if hasattr(resp, "text") and resp.text:
             return resp.text.strip()
@@ -108,9 +302,11 @@ def summarize_email(text: str) -> str:
         return "No summary generated."
     except Exception as e:
         logger.error(f"Error in summarize_email: {str(e)}")
+        record_model_error(e)
         return f"[Gemini error: {e}]"
 
 
+@cached_llm_call()
 def generate_reply(email_text: str, summary: str | None = None) -> str:
     """
     Generate a polite, professional reply draft.
@@ -127,9 +323,9 @@ def generate_reply(email_text: str, summary: str | None = None) -> str:
             f"Email:\n{email_text}\n\n"
             "Reply:"
         )
-        model = genai.GenerativeModel(WORKING_MODEL)
-        logger.info(f"Using model for reply generation: {WORKING_MODEL}")
-        resp = model.generate_content(prompt)
+        model = _get_model()
+        logger.info(f"Using model for reply generation: {model.model_name}")
+        resp = _generate_content(model, prompt)
 
         if hasattr(resp, "text") and resp.text:
             return resp.text.strip()
@@ -139,8 +335,10 @@ def generate_reply(email_text: str, summary: str | None = None) -> str:
         return "No reply generated."
     except Exception as e:
         logger.error(f"Error in generate_reply: {str(e)}")
+        record_model_error(e)
         return f"[Gemini error: {e}]"
     
+@cached_llm_call()
 def detect_sentiment(text: str) -> dict:
     """
     Detect sentiment in email text and return detailed analysis
@@ -159,9 +357,9 @@ def detect_sentiment(text: str) -> dict:
             f"Email: {text}\n\n"
             "Analysis (in JSON format):"
         )
-        model = genai.GenerativeModel(WORKING_MODEL)
-        logger.info(f"Using model for sentiment detection: {WORKING_MODEL}")
-        resp = model.generate_content(prompt)
+        model = _get_model()
+        logger.info(f"Using model for sentiment detection: {model.model_name}")
+        resp = _generate_content(model, prompt)
 
         if hasattr(resp, "text") and resp.text:
             # Try to parse as JSON, fallback to text if not valid JSON
@@ -186,13 +384,11 @@ def detect_sentiment(text: str) -> dict:
         return {"error": "No sentiment analysis generated."}
     except Exception as e:
         logger.error(f"Error in detect_sentiment: {str(e)}")
+        record_model_error(e)
         return {"error": f"[Gemini error: {e}]"}
     
-def analyze_email_message(email_text):
-    """
-    Analyze a single email message and return sentiment, key points, and summary.
-    """
-    prompt = f"""
+def _message_analysis_prompt(email_text):
+    return f"""
     Analyze the following email message and provide:
     1. Sentiment (positive, negative, or neutral)
     2. Key points (list of main points, at most 5)
@@ -208,29 +404,55 @@ def analyze_email_message(email_text):
         "summary": "..."
     }}
     """
+
+
+def _message_analysis_result(text):
+    """Parse a message analysis response"""
     try:
-        # FIX: Use the global WORKING_MODEL
-        model = genai.GenerativeModel(WORKING_MODEL)
-        response = model.generate_content(prompt)
-        # Try to parse the response as JSON
-        try:
-            result = json.loads(response.text)
-            return result
-        except json.JSONDecodeError:
-            # If the response is not valid JSON, return a default structure
-            return {
-                "sentiment": "unknown",
-                "key_points": [],
-                "summary": response.text
-            }
-    except Exception as e:
-        logger.error(f"Error in analyze_email_message: {str(e)}")
+        return json.loads(text)
+    except json.JSONDecodeError:
+        # If the response is not valid JSON, return a default structure
         return {
-            "sentiment": "error",
+            "sentiment": "unknown",
             "key_points": [],
-            "summary": f"Error analyzing message: {str(e)}"
+            "summary": text
         }
 
+
+def _message_analysis_error(error):
+    return {
+        "sentiment": "error",
+        "key_points": [],
+        "summary": f"Error analyzing message: {str(error)}"
+    }
+
+
+@cached_llm_call()
+def analyze_email_message(email_text):
+    """
+    Analyze a single email message and return sentiment, key points, and summary.
+    """
+    try:
+        model = _get_model()
+        response = _generate_content(model, _message_analysis_prompt(email_text))
+        return _message_analysis_result(response.text)
+    except Exception as e:
+        logger.error(f"Error in analyze_email_message: {str(e)}")
+        record_model_error(e)
+        return _message_analysis_error(e)
+
+
+@cached_llm_call(name="analyze_email_message")
+async def aanalyze_email_message(email_text):
+    """Async analyze_email_message(), sharing its cache entries"""
+    try:
+        return _message_analysis_result(await _agenerate_text(_message_analysis_prompt(email_text)))
+    except Exception as e:
+        logger.error(f"Error in aanalyze_email_message: {str(e)}")
+        record_model_error(e)
+        return _message_analysis_error(e)
+
+@cached_llm_call()
 def analyze_email_thread(email_text):
     """
     Analyze an entire email thread and provide a comprehensive summary.
@@ -256,9 +478,8 @@ def analyze_email_thread(email_text):
     }}
     """
     try:
-        # FIX: Use the global WORKING_MODEL
-        model = genai.GenerativeModel(WORKING_MODEL)
-        response = model.generate_content(prompt)
+        model = _get_model()
+        response = _generate_content(model, prompt)
         # Try to parse the response as JSON
         try:
             result = json.loads(response.text)
@@ -275,6 +496,7 @@ def analyze_email_thread(email_text):
             }
     except Exception as e:
         logger.error(f"Error in analyze_email_thread: {str(e)}")
+        record_model_error(e)
         return {
             "main_topic": "Error analyzing thread",
             "key_points": [],
@@ -284,6 +506,7 @@ def analyze_email_thread(email_text):
             "error": str(e)
         }
 
+@cached_llm_call(content=lambda template, email_text: [template.subject, template.body, email_text])
 def customize_template_with_content(template, email_text):
     """
     Customize an email template based on the content of the original email.
@@ -306,9 +529,8 @@ def customize_template_with_content(template, email_text):
     }}
     """
     try:
-        # FIX: Use the global WORKING_MODEL
-        model = genai.GenerativeModel(WORKING_MODEL)
-        response = model.generate_content(prompt)
+        model = _get_model()
+        response = _generate_content(model, prompt)
         # Try to parse the response as JSON
         try:
             result = json.loads(response.text)
@@ -331,11 +553,13 @@ def customize_template_with_content(template, email_text):
             }
     except Exception as e:
         logger.error(f"Error in customize_template_with_content: {str(e)}")
+        record_model_error(e)
         return {
             "subject": template.subject,
             "body": f"Error customizing template: {str(e)}"
         }
 
+@cached_llm_call()
 def extract_email_entities(email_text):
     """
     Extract key entities from email text like dates, names, locations, etc.
@@ -361,9 +585,8 @@ def extract_email_entities(email_text):
     }}
     """
     try:
-        # FIX: Use the global WORKING_MODEL
-        model = genai.GenerativeModel(WORKING_MODEL)
-        response = model.generate_content(prompt)
+        model = _get_model()
+        response = _generate_content(model, prompt)
         # Try to parse the response as JSON
         try:
             result = json.loads(response.text)
@@ -380,6 +603,7 @@ def extract_email_entities(email_text):
             }
     except Exception as e:
         logger.error(f"Error in extract_email_entities: {str(e)}")
+        record_model_error(e)
         return {
             "people": [],
             "dates": [],
@@ -389,6 +613,7 @@ def extract_email_entities(email_text):
             "error": str(e)
         }
 
+@cached_llm_call()
 def categorize_email(email_text):
     """
     Categorize an email into predefined categories.
@@ -414,9 +639,8 @@ def categorize_email(email_text):
     }}
     """
     try:
-        # FIX: Use the global WORKING_MODEL
-        model = genai.GenerativeModel(WORKING_MODEL)
-        response = model.generate_content(prompt)
+        model = _get_model()
+        response = _generate_content(model, prompt)
         # Try to parse the response as JSON
         try:
             result = json.loads(response.text)
@@ -430,12 +654,14 @@ def categorize_email(email_text):
             }
     except Exception as e:
         logger.error(f"Error in categorize_email: {str(e)}")
+        record_model_error(e)
         return {
             "category": "Other",
             "confidence": 0.0,
             "reason": f"Error categorizing email: {str(e)}"
         }
 
+@cached_llm_call()
 def generate_smart_reply(email_text, user_context=None):
     """
     Generate a smart reply that considers context and user preferences.
@@ -466,9 +692,8 @@ def generate_smart_reply(email_text, user_context=None):
     }}
     """
     try:
-        # FIX: Use the global WORKING_MODEL
-        model = genai.GenerativeModel(WORKING_MODEL)
-        response = model.generate_content(prompt)
+        model = _get_model()
+        response = _generate_content(model, prompt)
         # Try to parse the response as JSON
         try:
             result = json.loads(response.text)
@@ -492,12 +717,14 @@ def generate_smart_reply(email_text, user_context=None):
             }
     except Exception as e:
         logger.error(f"Error in generate_smart_reply: {str(e)}")
+        record_model_error(e)
         return {
             "subject": "Re: Your email",
             "body": f"Error generating reply: {str(e)}",
             "suggested_actions": []
         }
 
+@cached_llm_call()
 def detect_email_intent(email_text):
     """
     Detect the primary intent of the email (question, request, information, etc.).
@@ -524,9 +751,8 @@ def detect_email_intent(email_text):
     }}
     """
     try:
-        # FIX: Use the global WORKING_MODEL
-        model = genai.GenerativeModel(WORKING_MODEL)
-        response = model.generate_content(prompt)
+        model = _get_model()
+        response = _generate_content(model, prompt)
         # Try to parse the response as JSON
         try:
             result = json.loads(response.text)
@@ -540,12 +766,272 @@ def detect_email_intent(email_text):
             }
     except Exception as e:
         logger.error(f"Error in detect_email_intent: {str(e)}")
+        record_model_error(e)
         return {
             "intent": "Other",
             "confidence": 0.0,
             "details": f"Error detecting intent: {str(e)}"
         }
         
+# Separates the streamed reply from the summary that follows it
+REPLY_SUMMARY_DELIMITER = "=====SUMMARY====="
+
+
+def stream_reply(email_text, tone="professional"):
+    """
+    Stream a reply draft, followed by a summary, as Gemini produces them.
+
+    The reply comes first so the user sees text as soon as possible; the summary
+    is generated in the same call after REPLY_SUMMARY_DELIMITER.
+
+    Yields:
+        ("reply", text) and then ("summary", text) chunks
+
+    Raises:
+        RuntimeError: If the Gemini API key is not configured
+        Exception: Errors from the Gemini API
+    """
+    if not GEMINI_API_KEY:
+        raise RuntimeError("Gemini API key not configured")
+
+    model_name = get_working_model()
+    key = response_cache.make_key(model_name, "stream_reply", 1, [email_text, tone])
+    cached = response_cache.get(key)
+    if cached is not None:
+        logger.info("LLM response cache hit for stream_reply")
+        yield "reply", cached["reply"]
+        yield "summary", cached["summary"]
+        return
+
+    prompt = (
+        f"Write a concise reply to the email below in a {tone} tone. "
+        "Be helpful, keep it under 150 words, and use plain language. "
+        f"After the reply, write a line containing only {REPLY_SUMMARY_DELIMITER} and then "
+        "summarize the email in 3-4 concise bullet points, including the sender's main "
+        "request and any deadlines.\n\n"
+        f"Email:\n{email_text}\n\n"
+        "Reply:"
+    )
+
+    parts = {"reply": [], "summary": []}
+    part = "reply"
+    pending = ""  # Text held back in case it is the start of the delimiter
+    try:
+        model = genai.GenerativeModel(model_name)
+        logger.info(f"Streaming reply with model: {model_name}")
+        for chunk in _generate_content(model, prompt, stream=True):
+            text = getattr(chunk, "text", "")
+            if not text:
+                continue
+            if part == "summary":
+                parts[part].append(text)
+                yield part, text
+                continue
+
+            pending += text
+            if REPLY_SUMMARY_DELIMITER in pending:
+                reply_text, summary_text = pending.split(REPLY_SUMMARY_DELIMITER, 1)
+                if reply_text:
+                    parts["reply"].append(reply_text)
+                    yield "reply", reply_text
+                part, pending = "summary", ""
+                if summary_text.strip():
+                    parts[part].append(summary_text)
+                    yield part, summary_text
+                continue
+
+            # Flush everything that can no longer be the start of the delimiter
+            safe = len(pending) - len(REPLY_SUMMARY_DELIMITER) + 1
+            if safe > 0:
+                parts["reply"].append(pending[:safe])
+                yield "reply", pending[:safe]
+                pending = pending[safe:]
+    except Exception as e:
+        logger.error(f"Error in stream_reply: {str(e)}")
+        record_model_error(e, model_name)
+        raise
+
+    if pending:
+        parts[part].append(pending)
+        yield part, pending
+
+    result = {"reply": "".join(parts["reply"]).strip(), "summary": "".join(parts["summary"]).strip()}
+    if result["reply"]:
+        response_cache.set(key, result, model_name=model_name, function="stream_reply", prompt_version=1)
+
+
+ENRICHMENT_CATEGORIES = ['Work', 'Personal', 'Social', 'Promotions', 'Finance', 'Travel', 'Other']
+ENRICHMENT_INTENTS = ['Request', 'Information', 'Question', 'Complaint', 'Appreciation', 'Meeting', 'Other']
+
+
+def _parse_json_response(text):
+    """Parse a JSON object from a model response, tolerating ```json fences around it"""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rsplit("```", 1)[0]
+    return json.loads(text)
+
+
+def _enrichment_prompt(email_text, tone):
+    return f"""
+    Analyze the email below and answer with a single JSON object, no other text:
+    {{
+        "summary": "3-4 concise bullet points with the sender's main request and any deadlines",
+        "reply": "a reply in a {tone} tone, under 150 words, plain language",
+        "sentiment": "positive | negative | neutral",
+        "confidence": 0-100,
+        "urgency": "low | medium | high",
+        "suggested_tone": "professional | friendly | casual | formal | apologetic",
+        "key_indicators": ["...", "..."],
+        "category": "{' | '.join(ENRICHMENT_CATEGORIES)}",
+        "priority": 1-10 (1-3 low, 4-6 medium, 7-10 needs immediate attention),
+        "intent": "{' | '.join(ENRICHMENT_INTENTS)}",
+        "entities": {{
+            "people": ["..."],
+            "dates": ["..."],
+            "locations": ["..."],
+            "organizations": ["..."],
+            "action_items": ["..."]
+        }}
+    }}
+
+    Email:
+    {email_text}
+    """
+
+
+def _enrichment_result(text):
+    """Parse an enrichment response; parse failures are returned as errors and kept out of the cache"""
+    try:
+        result = _parse_json_response(text)
+    except (json.JSONDecodeError, ValueError):
+        logger.error("Email enrichment response was not valid JSON")
+        _call_failed.set(True)
+        return {"error": "Could not parse enrichment response", "raw_response": text}
+    if not isinstance(result, dict):
+        _call_failed.set(True)
+        return {"error": "Enrichment response was not a JSON object"}
+    return result
+
+
+@cached_llm_call()
+def enrich_email(email_text, tone="professional"):
+    """
+    Summarize, draft a reply and classify an email with a single model call.
+
+    Returns a dict with summary, reply, sentiment, urgency, suggested_tone,
+    confidence, key_indicators, category, priority, intent and entities, or a
+    dict with an "error" key if the call failed.
+    """
+    if not GEMINI_API_KEY:
+        return {"error": "Gemini API key not configured"}
+
+    try:
+        model = _get_model()
+        logger.info(f"Using model for email enrichment: {model.model_name}")
+        response = _generate_content(model, _enrichment_prompt(email_text, tone))
+        return _enrichment_result(response.text)
+    except Exception as e:
+        logger.error(f"Error in enrich_email: {str(e)}")
+        record_model_error(e)
+        return {"error": f"[Gemini error: {e}]"}
+
+
+@cached_llm_call(name="enrich_email")
+async def aenrich_email(email_text, tone="professional"):
+    """Async enrich_email(), sharing its cache entries"""
+    if not GEMINI_API_KEY:
+        return {"error": "Gemini API key not configured"}
+
+    try:
+        return _enrichment_result(await _agenerate_text(_enrichment_prompt(email_text, tone)))
+    except Exception as e:
+        logger.error(f"Error in aenrich_email: {str(e)}")
+        record_model_error(e)
+        return {"error": f"[Gemini error: {e}]"}
+
+# Characters of each email's snippet sent in a batch classification prompt
+CLASSIFY_SNIPPET_CHARS = 500
+
+
+@cached_llm_call()
+def classify_emails(emails):
+    """
+    Categorize and score several emails with a single model call.
+
+    Args:
+        emails: List of dicts with id, from, subject and snippet
+
+    Returns a list of {"id", "category", "priority"} dicts as the model gave
+    them (unvalidated), or a dict with an "error" key if the call failed.
+    "raw_response" is set when the model answered without a usable JSON array.
+    """
+    if not GEMINI_API_KEY:
+        return {"error": "Gemini API key not configured"}
+
+    listing = "\n\n".join(
+        f"id: {email['id']}\n"
+        f"From: {email.get('from', '')}\n"
+        f"Subject: {email.get('subject', '')}\n"
+        f"Snippet: {(email.get('snippet') or '')[:CLASSIFY_SNIPPET_CHARS]}"
+        for email in emails
+    )
+    prompt = f"""
+    Classify each of the {len(emails)} emails below. Answer with a single JSON array, no other text,
+    holding one object per email in the same order:
+    [
+        {{
+            "id": "the email's id, copied exactly",
+            "category": "{' | '.join(ENRICHMENT_CATEGORIES)}",
+            "priority": 1-10 (1-3 low, 4-6 medium, 7-10 needs immediate attention)
+        }}
+    ]
+
+    Emails:
+    {listing}
+    """
+    try:
+        model = _get_model()
+        logger.info(f"Using model to classify {len(emails)} emails: {model.model_name}")
+        response = _generate_content(model, prompt)
+        try:
+            result = _parse_json_response(response.text)
+        except (json.JSONDecodeError, ValueError):
+            logger.error("Batch classification response was not valid JSON")
+            _call_failed.set(True)
+            return {"error": "Could not parse classification response", "raw_response": response.text}
+        if not isinstance(result, list):
+            _call_failed.set(True)
+            return {"error": "Classification response was not a JSON array", "raw_response": response.text}
+        return result
+    except Exception as e:
+        logger.error(f"Error in classify_emails: {str(e)}")
+        record_model_error(e)
+        return {"error": f"[Gemini error: {e}]"}
+
+# Embedding model used for semantic search
+EMBEDDING_MODEL = getattr(settings, "GEMINI_EMBEDDING_MODEL", "models/text-embedding-004")
+
+
+def embed_texts(texts, task_type="retrieval_document"):
+    """
+    Embed texts with the Gemini embedding model under the shared rate limit.
+
+    Args:
+        texts: List of strings (one request, so keep it to about 100)
+        task_type: "retrieval_document" for indexed text, "retrieval_query" for queries
+
+    Returns a list of embedding vectors (lists of floats), one per text.
+    Raises RuntimeError without an API key; API errors are raised as they are.
+    """
+    if not GEMINI_API_KEY:
+        raise RuntimeError("Gemini API key not configured")
+    result = rate_limiter.call(
+        "gemini", lambda: genai.embed_content(model=EMBEDDING_MODEL, content=list(texts), task_type=task_type)
+    )
+    return result["embedding"]
+
 def generate_reply_fallback(email_text: str, summary: str | None = None) -> str:
     """
     Generate a simple reply when Gemini API is unavailable.
@@ -554,10 +1040,3 @@ def generate_reply_fallback(email_text: str, summary: str | None = None) -> str:
         return f"Thank you for your email. {summary}\n\nI'll get back to you soon."
     else:
         return "Thank you for your email. I'll review it and get back to you soon."
-
-# ==============================================================================
-# KEY FIX: Define the global WORKING_MODEL by calling the helper function.
-# This should be at the end of the file so all functions are defined first.
-# ==============================================================================
-WORKING_MODEL = get_working_model()
-logger.info(f"Selected working model: {WORKING_MODEL}")
\ No newline at end of file
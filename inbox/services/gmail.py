@@ -1,14 +1,33 @@
 import base64
+import functools
 import logging
 import json
 import re
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from googleapiclient.errors import HttpError
-from django.core.cache import cache
+from googleapiclient.http import HttpRequest
+from .batch import batch_get_messages, batch_get_drafts
+from .cache import UserCache
+from .pool import service_pool, ThreadLocalHttp
+from .mime import parse_message
+from .ratelimit import rate_limiter, gmail_quota_units, UpstreamUnavailable
 
 logger = logging.getLogger(__name__)
 
+# Headers shown in email lists; bodies are only downloaded when an email is opened
+LIST_METADATA_HEADERS = ['Subject', 'From', 'To', 'Date']
+# Partial-response selectors for list-mode requests
+LIST_MESSAGE_FIELDS = 'id,threadId,labelIds,snippet,internalDate,payload/headers'
+LIST_DRAFT_FIELDS = 'id,message(id,threadId,snippet,payload/headers)'
+
+# UserCache group holding the cached unread lists, so mutations can patch them in place
+UNREAD_CACHE_GROUP = 'gmail_unread'
+# UserCache group holding the cached draft lists
+DRAFTS_CACHE_GROUP = 'gmail_drafts'
+# Characters of a draft's body shown as its snippet, like Gmail's own snippets
+DRAFT_SNIPPET_LENGTH = 200
+
 def build_flow(redirect_uri):
     """Build OAuth flow"""
     from google_auth_oauthlib.flow import Flow
@@ -43,6 +62,29 @@ def build_flow(redirect_uri):
 
     return flow
 
+class RateLimitedHttpRequest(HttpRequest):
+    """HttpRequest whose execute() goes through the shared rate limiter, retry policy and circuit breaker"""
+
+    quota_key = None
+
+    @property
+    def upstream(self):
+        return (self.methodId or 'google').split('.')[0]
+
+    def execute(self, http=None, num_retries=0):
+        return rate_limiter.call(
+            self.upstream,
+            lambda: super(RateLimitedHttpRequest, self).execute(http=http, num_retries=num_retries),
+            key=self.quota_key,
+            cost=gmail_quota_units(self.methodId)
+        )
+
+def _build_request(http, *args, connections=None, quota_key=None, **kwargs):
+    """Run every API request on the calling thread's connection (httplib2.Http is not thread-safe)"""
+    request = RateLimitedHttpRequest(connections.get() if connections else http, *args, **kwargs)
+    request.quota_key = quota_key
+    return request
+
 def get_gmail_service(user=None):
     """Get Gmail service with credentials and improved error handling"""
     from googleapiclient.discovery import build
@@ -50,6 +92,14 @@ def get_gmail_service(user=None):
     from google.auth.transport.requests import Request
     from inbox.models import GmailCredentials
 
+    # Reuse the pooled service while its token is still valid
+    pooled = service_pool.get(user)
+    if pooled:
+        if not pooled.credentials.expired:
+            return pooled.service
+        # The token needs a refresh, rebuild the entry below
+        service_pool.invalidate(user)
+
     try:
         # Get credentials from database
         if user and user.is_authenticated:
@@ -93,10 +143,13 @@ def get_gmail_service(user=None):
             # Update credentials in database
             creds_obj.token = creds.token
             creds_obj.save()
+            service_pool.invalidate(user)
             logger.info("Gmail token refreshed successfully")
 
-        # Build service
-        service = build('gmail', 'v1', credentials=creds)
+        # Build service (discovery is static, so this is only done once per pool entry)
+        connections = ThreadLocalHttp(creds)
+        request_builder = functools.partial(_build_request, connections=connections, quota_key=service_pool.key_for(user))
+        service = build('gmail', 'v1', credentials=creds, requestBuilder=request_builder, cache_discovery=False)
         
         # Test service by fetching user's profile
         try:
@@ -109,20 +162,52 @@ def get_gmail_service(user=None):
                 logger.info(f"Linking Gmail credentials to authenticated user: {user.username}")
                 creds_obj.user = user
                 creds_obj.save()
+                service_pool.invalidate(None)
             
         except Exception as e:
             logger.error(f"Error testing Gmail service: {str(e)}")
             return None
         
+        # Keep the service and the profile probe for the following requests
+        service_pool.put(user, service, creds, profile, http=connections)
         return service
     except Exception as e:
         logger.error(f"Error getting Gmail service: {str(e)}", exc_info=True)
         return None
 
+def get_access_token(user=None):
+    """OAuth access token of the user's Gmail credentials, refreshed if it expired (None if not connected)"""
+    if get_gmail_service(user=user) is None:
+        return None
+    pooled = service_pool.get(user)
+    return pooled.credentials.token if pooled else None
+
+def refresh_access_token(user=None):
+    """Refresh the user's pooled access token after Gmail rejected it; returns the new token or None"""
+    from google.auth.transport.requests import Request
+
+    pooled = service_pool.get(user)
+    if pooled is None or not pooled.credentials.refresh_token:
+        return None
+    pooled.credentials.refresh(Request())
+    # Stores the token and drops the pooled service built with the old one
+    _save_creds_to_db(pooled.credentials, user=user)
+    return pooled.credentials.token
+
+def get_gmail_profile(user=None):
+    """Get the Gmail profile probed when the user's service was built (None if not connected)"""
+    if get_gmail_service(user=user) is None:
+        return None
+    pooled = service_pool.get(user)
+    return pooled.profile if pooled else None
+
 def _save_creds_to_db(credentials, user=None):
     """Save credentials to database with proper scope handling"""
     from inbox.models import GmailCredentials
 
+    # Any pooled service was built from the credentials being replaced
+    service_pool.invalidate(user)
+
     try:
         if credentials:
             # Convert scopes list to a JSON string for proper storage
@@ -263,115 +348,188 @@ def create_gmail_draft(service, to, subject, body):
         logger.error(f"Error creating draft: {str(e)}", exc_info=True)
         raise
 
-def fetch_unread(service, max_results=10):
-    """Fetch unread emails from Gmail"""
+def fetch_unread(service, max_results=10, metadata_only=True, user=None):
+    """
+    Fetch unread emails from Gmail
+
+    In list mode (metadata_only) only the headers shown in the list and the
+    snippet are requested; use get_email_details to load the body when an
+    email is opened. Results are cached in the user's cache namespace.
+    """
+    emails, _, _ = fetch_unread_page(service, max_results, metadata_only=metadata_only, user=user)
+    return emails
+
+def fetch_unread_page(service, page_size=10, page_token=None, metadata_only=True, user=None):
+    """
+    Fetch one page of unread emails from Gmail
+
+    Args:
+        service: Gmail API service
+        page_size: Number of emails on the page
+        page_token: Gmail nextPageToken of the previous page, or None for the first page
+        metadata_only: Only request the headers and snippet shown in the list
+        user: User whose cache namespace is used
+
+    Returns:
+        Tuple of (list of email dicts, nextPageToken or None, Gmail's estimate of the total)
+    """
     try:
-        cache_key = f"gmail_unread_{max_results}"
-        cached_emails = cache.get(cache_key)
+        cache_key = unread_cache_key(page_size, page_token, metadata_only)
+        cached_emails = UserCache.get(user, cache_key)
         if cached_emails:
+            next_page_token, estimate = UserCache.get(user, f"{cache_key}:next") or (None, len(cached_emails))
+            cached_emails = unread_only(cached_emails)
             logger.info(f"Returning cached unread emails: {len(cached_emails)} emails")
-            return cached_emails
+            return cached_emails, next_page_token, estimate
 
-        logger.info(f"Fetching unread emails from Gmail API with max_results={max_results}")
+        logger.info(f"Fetching unread emails from Gmail API with page_size={page_size}")
         
         # Use only UNREAD label instead of multiple labels
+        list_kwargs = {'pageToken': page_token} if page_token else {}
         response = service.users().messages().list(
             userId='me',
             labelIds=['UNREAD'],
-            maxResults=max_results
+            maxResults=page_size,
+            fields='messages/id,nextPageToken,resultSizeEstimate',
+            **list_kwargs
         ).execute()
         
         messages = response.get('messages', [])
+        next_page_token = response.get('nextPageToken')
+        estimate = response.get('resultSizeEstimate', len(messages))
         logger.info(f"Found {len(messages)} unread messages")
         
+        # Get messages in batches instead of one round-trip per message
+        message_ids = [message['id'] for message in messages]
+        if metadata_only:
+            fetched = batch_get_messages(
+                service,
+                message_ids,
+                format='metadata',
+                metadataHeaders=LIST_METADATA_HEADERS,
+                fields=LIST_MESSAGE_FIELDS
+            )
+        else:
+            fetched = batch_get_messages(service, message_ids)
         emails = []
 
         for message in messages:
+            msg = fetched.get(message['id'])
+            if msg is None:
+                continue
             try:
-                # Get full message
-                msg = service.users().messages().get(userId='me', id=message['id']).execute()
-                headers = msg['payload']['headers']
-                
-                # Extract headers with proper processing
-                subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '(no subject)')
-                from_raw = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown')
-                to_raw = next((h['value'] for h in headers if h['name'] == 'To'), '')
-                date = next((h['value'] for h in headers if h['name'] == 'Date'), '')
-                snippet = msg.get('snippet', '')
-                
-                # Extract body text
-                body_text = ''
-                if 'parts' in msg['payload']:
-                    for part in msg['payload']['parts']:
-                        if part['mimeType'] == 'text/plain':
-                            body_data = part['body'].get('data', '')
-                            if body_data:
-                                body_text = base64.urlsafe_b64decode(body_data).decode('utf-8')
-                            break
-                else:
-                    if 'body' in msg['payload'] and 'data' in msg['payload']['body']:
-                        body_data = msg['payload']['body'].get('data', '')
-                        if body_data:
-                            body_text = base64.urlsafe_b64decode(body_data).decode('utf-8')
-
-                emails.append({
-                    'id': message['id'],
-                    'threadId': msg.get('threadId', ''),
-                    'subject': subject,
-                    'from': from_raw,  # Keep raw format for serializer processing
-                    'to': to_raw,      # Keep raw format for serializer processing
-                    'date': date,
-                    'snippet': snippet,
-                    'body_text': body_text
-                })
+                emails.append(_list_email_from_message(message['id'], msg, metadata_only))
             except Exception as e:
                 logger.error(f"Error processing message {message['id']}: {str(e)}", exc_info=True)
                 continue
 
         logger.info(f"Successfully processed {len(emails)} unread emails")
-        cache.set(cache_key, emails, 300)  # Cache for 5 minutes
-        return emails
+        # A page with failed messages is served once but not cached, so the next request retries them
+        if len(emails) == len(messages):
+            UserCache.set_list(user, UNREAD_CACHE_GROUP, cache_key, emails, 300)  # Cache for 5 minutes
+            UserCache.set(user, f"{cache_key}:next", (next_page_token, estimate), 300)
+        return emails, next_page_token, estimate
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error fetching unread emails: {str(e)}", exc_info=True)
-        return []
+        return [], None, 0
+
+def unread_only(emails):
+    """Drop the emails a cached unread list marks as read since it was cached"""
+    return [email for email in emails if email.get('is_unread', True)]
+
+def unread_cache_key(page_size, page_token=None, metadata_only=True):
+    """UserCache name of a page of unread emails"""
+    cache_key = f"gmail_unread_{page_size}" if metadata_only else f"gmail_unread_full_{page_size}"
+    if page_token:
+        cache_key = f"{cache_key}_{page_token}"
+    return cache_key
+
+def _list_email_from_message(message_id, message, metadata_only=True):
+    """Build an email list entry from a Gmail message resource"""
+    # List mode leaves the body to get_email_details
+    parsed = parse_message(message, decode_bodies=not metadata_only)
+
+    return {
+        'id': message_id,
+        'threadId': parsed.thread_id,
+        'subject': parsed.header('Subject', '(no subject)'),
+        'from': parsed.header('From', 'Unknown'),  # Keep raw format for serializer processing
+        'to': parsed.header('To'),                 # Keep raw format for serializer processing
+        'date': parsed.header('Date'),
+        'snippet': parsed.snippet,
+        'body_text': parsed.body_text
+    }
 
-def fetch_drafts(service, max_results=10):
+def fetch_drafts(service, max_results=10, user=None):
     """Fetch draft emails from Gmail with improved error handling"""
+    drafts, _, _ = fetch_drafts_page(service, max_results, user=user)
+    return drafts
+
+def fetch_drafts_page(service, page_size=10, page_token=None, user=None):
+    """
+    Fetch one page of drafts from Gmail
+
+    Args:
+        service: Gmail API service
+        page_size: Number of drafts on the page
+        page_token: Gmail nextPageToken of the previous page, or None for the first page
+        user: User whose cache namespace is used
+
+    Returns:
+        Tuple of (list of draft dicts, nextPageToken or None, Gmail's estimate of the total)
+    """
     try:
-        cache_key = f"gmail_drafts_{max_results}"
-        cached_drafts = cache.get(cache_key)
+        cache_key = f"gmail_drafts_{page_size}"
+        if page_token:
+            cache_key = f"{cache_key}_{page_token}"
+        cached_drafts = UserCache.get(user, cache_key)
         if cached_drafts:
+            next_page_token, estimate = UserCache.get(user, f"{cache_key}:next") or (None, len(cached_drafts))
             logger.info(f"Returning cached drafts: {len(cached_drafts)} drafts")
-            return cached_drafts
+            return cached_drafts, next_page_token, estimate
 
-        logger.info(f"Fetching drafts from Gmail API with max_results={max_results}")
+        logger.info(f"Fetching drafts from Gmail API with page_size={page_size}")
         
         # Get draft list with proper error handling
         try:
-            drafts_response = service.users().drafts().list(userId='me', maxResults=max_results).execute()
+            list_kwargs = {'pageToken': page_token} if page_token else {}
+            drafts_response = service.users().drafts().list(
+                userId='me',
+                maxResults=page_size,
+                fields='drafts/id,nextPageToken,resultSizeEstimate',
+                **list_kwargs
+            ).execute()
             logger.info(f"Raw drafts response: {drafts_response}")
+        except UpstreamUnavailable:
+            raise
         except Exception as api_error:
             logger.error(f"Error fetching drafts list: {str(api_error)}")
-            return []
+            return [], None, 0
         
         draft_ids = [draft['id'] for draft in drafts_response.get('drafts', [])]
+        next_page_token = drafts_response.get('nextPageToken')
+        estimate = drafts_response.get('resultSizeEstimate', len(draft_ids))
         logger.info(f"Found {len(draft_ids)} draft IDs from Gmail API")
 
         if not draft_ids:
             logger.warning("No draft IDs found in API response")
-            return []
+            return [], None, 0
 
+        # Get draft details in batches instead of one round-trip per draft
+        fetched = batch_get_drafts(service, draft_ids, format='metadata', fields=LIST_DRAFT_FIELDS)
         drafts = []
         for i, draft_id in enumerate(draft_ids):
+            draft = fetched.get(draft_id)
+            if draft is None:
+                continue
             try:
-                logger.debug(f"Fetching draft details for ID: {draft_id}")
-                draft = service.users().drafts().get(userId='me', id=draft_id).execute()
-                message = draft['message']
-                headers = message.get('payload', {}).get('headers', [])
-                subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '(no subject)')
-                to_raw = next((h['value'] for h in headers if h['name'] == 'To'), 'Unknown')
-                date = next((h['value'] for h in headers if h['name'] == 'Date'), '')
-                snippet = message.get('snippet', '')
+                parsed = parse_message(draft['message'], decode_bodies=False)
+                subject = parsed.header('Subject', '(no subject)')
+                to_raw = parsed.header('To', 'Unknown')
+                date = parsed.header('Date')
+                snippet = parsed.snippet
 
                 drafts.append({
                     'id': draft_id,
@@ -388,46 +546,32 @@ def fetch_drafts(service, max_results=10):
                 continue
 
         logger.info(f"Successfully processed {len(drafts)}/{len(draft_ids)} drafts")
-        cache.set(cache_key, drafts, 300)  # Cache for 5 minutes
-        return drafts
+        # A page with failed drafts is served once but not cached, so the next request retries them
+        if len(drafts) == len(draft_ids):
+            UserCache.set_list(user, DRAFTS_CACHE_GROUP, cache_key, drafts, 300)  # Cache for 5 minutes
+            UserCache.set(user, f"{cache_key}:next", (next_page_token, estimate), 300)
+        return drafts, next_page_token, estimate
         
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Critical error in fetch_drafts: {str(e)}", exc_info=True)
-        return []
+        return [], None, 0
 
 def get_draft_details(service, draft_id):
     """Get full details of a draft"""
     try:
         draft = service.users().drafts().get(userId='me', id=draft_id).execute()
-        message = draft['message']
-        headers = message.get('payload', {}).get('headers', [])
-        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '(no subject)')
-        to_raw = next((h['value'] for h in headers if h['name'] == 'To'), 'Unknown')
-        from_raw = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown')
-        date = next((h['value'] for h in headers if h['name'] == 'Date'), '')
-
-        body = ''
-        if 'parts' in message['payload']:
-            for part in message['payload']['parts']:
-                if part['mimeType'] == 'text/plain':
-                    body_data = part['body'].get('data', '')
-                    if body_data:
-                        body = base64.urlsafe_b64decode(body_data).decode('utf-8')
-                    break
-        else:
-            if 'body' in message['payload'] and 'data' in message['payload']['body']:
-                body_data = message['payload']['body'].get('data', '')
-                if body_data:
-                    body = base64.urlsafe_b64decode(body_data).decode('utf-8')
+        parsed = parse_message(draft['message'])
 
         return {
             'id': draft_id,
-            'subject': subject,
-            'to': to_raw,  # Keep raw format for serializer processing
-            'from': from_raw,  # Keep raw format for serializer processing
-            'date': date,
-            'body': body,
-            'snippet': message.get('snippet', '')
+            'subject': parsed.header('Subject', '(no subject)'),
+            'to': parsed.header('To', 'Unknown'),  # Keep raw format for serializer processing
+            'from': parsed.header('From', 'Unknown'),  # Keep raw format for serializer processing
+            'date': parsed.header('Date'),
+            'body': parsed.body_text,
+            'snippet': parsed.snippet
         }
     except Exception as e:
         logger.error(f"Error getting draft details: {str(e)}", exc_info=True)
@@ -442,6 +586,13 @@ def delete_draft(service, draft_id):
         logger.error(f"Error deleting draft: {str(e)}", exc_info=True)
         return False
 
+def draft_list_fields(to, subject, body=None):
+    """Fields of a cached draft list entry after the draft was edited (the body only if it changed)"""
+    fields = {'subject': subject, 'from': to}
+    if body is not None:
+        fields['snippet'] = " ".join(body.split())[:DRAFT_SNIPPET_LENGTH]
+    return fields
+
 def update_draft(service, draft_id, to, subject, body):
     """Update an existing draft"""
     try:
@@ -502,52 +653,38 @@ def get_email_details(service, message_id):
     """Get full details of an email"""
     try:
         message = service.users().messages().get(userId='me', id=message_id).execute()
-        headers = message['payload']['headers']
-        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '(no subject)')
-        from_raw = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown')
-        to_raw = next((h['value'] for h in headers if h['name'] == 'To'), '')
-        cc_raw = next((h['value'] for h in headers if h['name'] == 'Cc'), '')
-        date = next((h['value'] for h in headers if h['name'] == 'Date'), '')
-
-        body_text = ''
-        body_html = ''
-
-        if 'parts' in message['payload']:
-            for part in message['payload']['parts']:
-                if part['mimeType'] == 'text/plain':
-                    body_data = part['body'].get('data', '')
-                    if body_data:
-                        body_text = base64.urlsafe_b64decode(body_data).decode('utf-8')
-                elif part['mimeType'] == 'text/html':
-                    body_data = part['body'].get('data', '')
-                    if body_data:
-                        body_html = base64.urlsafe_b64decode(body_data).decode('utf-8')
-        else:
-            if 'body' in message['payload']:
-                if message['payload']['mimeType'] == 'text/plain':
-                    body_data = message['payload']['body'].get('data', '')
-                    if body_data:
-                        body_text = base64.urlsafe_b64decode(body_data).decode('utf-8')
-                elif message['payload']['mimeType'] == 'text/html':
-                    body_data = message['payload']['body'].get('data', '')
-                    if body_data:
-                        body_html = base64.urlsafe_b64decode(body_data).decode('utf-8')
-
-        return {
-            'id': message_id,
-            'subject': subject,
-            'from': from_raw,  # Keep raw format for serializer processing
-            'to': to_raw,      # Keep raw format for serializer processing
-            'cc': cc_raw,      # Keep raw format for serializer processing
-            'date': date,
-            'body_text': body_text,
-            'body_html': body_html,
-            'snippet': message.get('snippet', '')
-        }
+        return _email_details_from_message(message_id, message)
     except Exception as e:
         logger.error(f"Error getting email details: {str(e)}", exc_info=True)
         return None
 
+def get_emails_details(service, message_ids):
+    """Get full details of several emails using Gmail batch requests"""
+    fetched = batch_get_messages(service, message_ids)
+    details = {}
+    for message_id, message in fetched.items():
+        try:
+            details[message_id] = _email_details_from_message(message_id, message)
+        except Exception as e:
+            logger.error(f"Error processing email {message_id}: {str(e)}", exc_info=True)
+    return details
+
+def _email_details_from_message(message_id, message):
+    """Build the email details dict from a full Gmail message resource"""
+    parsed = parse_message(message)
+
+    return {
+        'id': message_id,
+        'subject': parsed.header('Subject', '(no subject)'),
+        'from': parsed.header('From', 'Unknown'),  # Keep raw format for serializer processing
+        'to': parsed.header('To'),      # Keep raw format for serializer processing
+        'cc': parsed.header('Cc'),      # Keep raw format for serializer processing
+        'date': parsed.header('Date'),
+        'body_text': parsed.body_text,
+        'body_html': parsed.body_html,
+        'snippet': parsed.snippet
+    }
+
 # Helper function to extract email address from a string
 def extract_email_address(email_str):
     """Extract email address from a string that might contain 'Name <email>' format"""
@@ -0,0 +1,198 @@
+# inbox/services/jobs.py
+
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from ..models import BackgroundJob
+
+logger = logging.getLogger(__name__)
+
+# Seconds a leased job stays invisible to other workers before it is handed out again
+JOB_VISIBILITY_TIMEOUT = getattr(settings, "JOB_VISIBILITY_TIMEOUT", 300)
+# Attempts per job, and the base of the exponential retry delay in seconds
+JOB_MAX_ATTEMPTS = getattr(settings, "JOB_MAX_ATTEMPTS", 3)
+JOB_RETRY_DELAY = getattr(settings, "JOB_RETRY_DELAY", 30)
+# Days finished jobs are kept
+JOB_RETENTION_DAYS = getattr(settings, "JOB_RETENTION_DAYS", 7)
+
+# Job kind -> dotted path of a function taking the BackgroundJob
+JOB_HANDLERS = {
+    'enrich_email': 'inbox.services.enrichment.run_enrichment_job',
+    'send_scheduled_email': 'inbox.services.workflow.run_scheduled_email_job',
+    'notify_reminder': 'inbox.services.workflow.run_reminder_job',
+    'draft_reply': 'inbox.services.speculative.run_draft_reply_job',
+    'train_classifier': 'inbox.services.classifier.run_train_classifier_job',
+    'index_messages': 'inbox.services.semantic.run_index_messages_job',
+}
+
+
+class JobQueue:
+    """Database-backed job queue with leasing, retries and a visibility timeout"""
+
+    @staticmethod
+    def enqueue(kind, payload=None, user=None, dedupe_key='', run_after=None, max_attempts=JOB_MAX_ATTEMPTS):
+        """
+        Queue a job
+
+        Args:
+            kind: Key of JOB_HANDLERS
+            payload: JSON-serializable dict passed to the handler
+            user: User the job runs for
+            dedupe_key: Skip queueing if a pending or running job of this kind has the same key
+            run_after: Earliest time the job may run (now by default)
+            max_attempts: Attempts before the job is marked failed
+
+        Returns:
+            BackgroundJob object, or None if an identical job is already queued
+        """
+        if kind not in JOB_HANDLERS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        try:
+            with transaction.atomic():
+                return BackgroundJob.objects.create(
+                    user=user,
+                    kind=kind,
+                    payload=payload or {},
+                    dedupe_key=dedupe_key,
+                    run_after=run_after or timezone.now(),
+                    max_attempts=max_attempts,
+                )
+        except IntegrityError:
+            logger.debug(f"{kind} job {dedupe_key} already queued")
+            return None
+
+    @staticmethod
+    def enqueue_many(kind, jobs):
+        """
+        Queue many jobs with one insert; duplicates of queued jobs are skipped
+
+        Args:
+            kind: Key of JOB_HANDLERS
+            jobs: Iterable of (user or user id, payload, dedupe_key) tuples
+        """
+        rows = [
+            BackgroundJob(
+                user_id=getattr(user, 'pk', user), kind=kind, payload=payload,
+                dedupe_key=dedupe_key, max_attempts=JOB_MAX_ATTEMPTS,
+            )
+            for user, payload, dedupe_key in jobs
+        ]
+        if rows:
+            BackgroundJob.objects.bulk_create(rows, batch_size=500, ignore_conflicts=True)
+            logger.info(f"Queued up to {len(rows)} {kind} jobs")
+
+    @staticmethod
+    def _ready(now):
+        """Pending jobs that are due, plus running jobs whose lease expired (their worker died)"""
+        return (
+            Q(status='pending', run_after__lte=now)
+            | Q(status='running', leased_until__lt=now)
+        )
+
+    @staticmethod
+    def lease(worker_id, limit=1, kinds=None):
+        """
+        Claim up to `limit` ready jobs for a worker
+
+        Each job is claimed with a conditional UPDATE, so two workers never get the
+        same job even on databases without SELECT ... FOR UPDATE SKIP LOCKED.
+
+        Args:
+            worker_id: Name of the claiming worker
+            limit: Maximum number of jobs
+            kinds: Only lease these job kinds
+
+        Returns:
+            List of BackgroundJob objects now leased to the worker
+        """
+        now = timezone.now()
+        candidates = BackgroundJob.objects.filter(JobQueue._ready(now))
+        if kinds:
+            candidates = candidates.filter(kind__in=kinds)
+        candidate_ids = list(candidates.order_by('run_after', 'id').values_list('id', flat=True)[:limit * 2])
+
+        leased = []
+        for job_id in candidate_ids:
+            claimed = BackgroundJob.objects.filter(JobQueue._ready(now), id=job_id).update(
+                status='running',
+                leased_until=now + timedelta(seconds=JOB_VISIBILITY_TIMEOUT),
+                locked_by=worker_id,
+                attempts=F('attempts') + 1,
+            )
+            if claimed:
+                leased.append(job_id)
+                if len(leased) >= limit:
+                    break
+
+        return list(BackgroundJob.objects.filter(id__in=leased).select_related('user'))
+
+    @staticmethod
+    def complete(job):
+        """Mark a leased job done"""
+        BackgroundJob.objects.filter(id=job.id, locked_by=job.locked_by).update(
+            status='done', leased_until=None, finished_at=timezone.now(), last_error=''
+        )
+
+    @staticmethod
+    def fail(job, error):
+        """
+        Record a failed attempt; retry with exponential backoff until max_attempts
+
+        Args:
+            job: Leased BackgroundJob
+            error: Exception or message
+        """
+        now = timezone.now()
+        if job.attempts < job.max_attempts:
+            delay = JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+            BackgroundJob.objects.filter(id=job.id, locked_by=job.locked_by).update(
+                status='pending', leased_until=None, run_after=now + timedelta(seconds=delay), last_error=str(error)
+            )
+            logger.warning(f"{job.kind} job {job.id} failed (attempt {job.attempts}/{job.max_attempts}), "
+                           f"retrying in {delay}s: {str(error)}")
+        else:
+            BackgroundJob.objects.filter(id=job.id, locked_by=job.locked_by).update(
+                status='failed', leased_until=None, finished_at=now, last_error=str(error)
+            )
+            logger.error(f"{job.kind} job {job.id} failed permanently: {str(error)}")
+
+    @staticmethod
+    def run(job):
+        """
+        Run a leased job's handler and record the outcome
+
+        Returns:
+            bool: True if the handler succeeded
+        """
+        if job.attempts > job.max_attempts:
+            # Its lease kept expiring, so the worker running it died every time
+            JobQueue.fail(job, job.last_error or "Lease expired on every attempt")
+            return False
+        try:
+            handler = import_string(JOB_HANDLERS[job.kind])
+            handler(job)
+        except Exception as e:
+            logger.error(f"Error running {job.kind} job {job.id}: {str(e)}", exc_info=True)
+            JobQueue.fail(job, e)
+            return False
+        JobQueue.complete(job)
+        return True
+
+    @staticmethod
+    def purge(days=JOB_RETENTION_DAYS):
+        """Delete finished jobs older than `days`; returns the number deleted"""
+        cutoff = timezone.now() - timedelta(days=days)
+        deleted, _ = BackgroundJob.objects.filter(status__in=['done', 'failed'], finished_at__lt=cutoff).delete()
+        return deleted
+
+    @staticmethod
+    def stats():
+        """Number of jobs per status"""
+        counts = {status: 0 for status, _ in BackgroundJob.STATUS_CHOICES}
+        for row in BackgroundJob.objects.values('status').annotate(count=Count('id')):
+            counts[row['status']] = row['count']
+        return counts
@@ -0,0 +1,167 @@
+# inbox/services/llm_cache.py
+
+import hashlib
+import json
+import logging
+import threading
+from datetime import timedelta
+from cachetools import TTLCache
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from ..models import LLMResponseCacheEntry
+
+logger = logging.getLogger(__name__)
+
+# Seconds a cached LLM response stays valid
+LLM_CACHE_TTL = getattr(settings, "LLM_CACHE_TTL", 7 * 24 * 3600)
+# Entries kept in the per-process LRU tier
+LLM_CACHE_MEMORY_SIZE = getattr(settings, "LLM_CACHE_MEMORY_SIZE", 1024)
+# Rows kept in the database tier; the oldest are evicted beyond this
+LLM_CACHE_DB_MAX_ENTRIES = getattr(settings, "LLM_CACHE_DB_MAX_ENTRIES", 10000)
+# Database evictions run once every this many writes
+LLM_CACHE_EVICT_EVERY = 100
+
+_MISSING = object()
+
+
+class LLMResponseCache:
+    """
+    Two-tier cache for LLM responses: a per-process LRU in front of a database table.
+
+    Keys are derived from the model name, the calling function, its prompt
+    template version and a hash of the input, so changing a prompt only needs a
+    version bump. Both tiers expire entries after `ttl` seconds.
+    """
+
+    def __init__(self, memory_size=LLM_CACHE_MEMORY_SIZE, ttl=LLM_CACHE_TTL, max_db_entries=LLM_CACHE_DB_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_db_entries = max_db_entries
+        self._memory = TTLCache(maxsize=memory_size, ttl=ttl)
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+    @staticmethod
+    def make_key(model_name, function, prompt_version, content):
+        """
+        Build the cache key
+
+        Args:
+            model_name: Gemini model the response came from
+            function: Name of the calling function
+            prompt_version: Version of the function's prompt template
+            content: JSON-serializable input the prompt is built from
+
+        Returns:
+            str: sha256 hex digest
+        """
+        content_hash = hashlib.sha256(
+            json.dumps(content, sort_keys=True, default=str).encode('utf-8')
+        ).hexdigest()
+        raw = f"{model_name}|{function}|v{prompt_version}|{content_hash}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def get(self, key, default=None):
+        """Look a response up in memory, then in the database"""
+        with self._lock:
+            value = self._memory.get(key, _MISSING)
+        if value is not _MISSING:
+            self._count('memory_hits')
+            return value
+
+        try:
+            entry = (
+                LLMResponseCacheEntry.objects
+                .filter(cache_key=key, expires_at__gt=timezone.now())
+                .only('response', 'expires_at')
+                .first()
+            )
+        except Exception as e:
+            logger.error(f"Error reading LLM response cache: {str(e)}")
+            entry = None
+
+        if entry is None:
+            self._count('misses')
+            return default
+
+        self._count('db_hits')
+        LLMResponseCacheEntry.objects.filter(pk=entry.pk).update(
+            hit_count=F('hit_count') + 1,
+            last_hit_at=timezone.now()
+        )
+        with self._lock:
+            self._memory[key] = entry.response
+        return entry.response
+
+    def set(self, key, value, model_name='', function='', prompt_version=1):
+        """Store a response in both tiers"""
+        with self._lock:
+            self._memory[key] = value
+
+        try:
+            LLMResponseCacheEntry.objects.update_or_create(
+                cache_key=key,
+                defaults={
+                    'model_name': model_name,
+                    'function': function,
+                    'prompt_version': prompt_version,
+                    'response': value,
+                    'expires_at': timezone.now() + timedelta(seconds=self.ttl),
+                }
+            )
+        except Exception as e:
+            logger.error(f"Error writing LLM response cache: {str(e)}")
+            return
+
+        self._count('writes')
+        if self._counters['writes'] % LLM_CACHE_EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """
+        Drop expired rows and the least recently used rows beyond max_db_entries
+
+        Returns:
+            int: Number of rows deleted
+        """
+        deleted, _ = LLMResponseCacheEntry.objects.filter(expires_at__lte=timezone.now()).delete()
+
+        overflow = LLMResponseCacheEntry.objects.count() - self.max_db_entries
+        if overflow > 0:
+            stale_ids = list(
+                LLMResponseCacheEntry.objects
+                .order_by(F('last_hit_at').asc(nulls_first=True), 'created_at')
+                .values_list('id', flat=True)[:overflow]
+            )
+            deleted += LLMResponseCacheEntry.objects.filter(id__in=stale_ids).delete()[0]
+
+        if deleted:
+            self._count('evictions', deleted)
+            logger.info(f"Evicted {deleted} LLM response cache entries")
+        return deleted
+
+    def clear(self, function=None):
+        """Drop cached responses, optionally only those of one function"""
+        with self._lock:
+            self._memory.clear()
+        queryset = LLMResponseCacheEntry.objects.all()
+        if function:
+            queryset = queryset.filter(function=function)
+        queryset.delete()
+
+    def stats(self):
+        """Hit/miss counters of this process plus the size of both tiers"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['db_hits']) / lookups, 3) if lookups else 0.0
+        stats['db_entries'] = LLMResponseCacheEntry.objects.count()
+        return stats
+
+
+response_cache = LLMResponseCache()
@@ -0,0 +1,96 @@
+# inbox/services/meta.py
+
+import logging
+from ..models import EmailMeta, Reminder
+
+logger = logging.getLogger(__name__)
+
+# Sort orders accepted by EmailMetaService.filter_ids ('priority' = highest first)
+META_SORTS = {
+    'priority': ['-priority', 'email_id'],
+    '-priority': ['priority', 'email_id'],
+}
+
+
+class EmailMetaService:
+    """Service keeping the denormalized EmailMeta rows in sync and querying them"""
+
+    @staticmethod
+    def update(user, email_id, **fields):
+        """
+        Set fields on an email's metadata row, creating it if needed
+
+        Args:
+            user: User object
+            email_id: Gmail message ID
+            **fields: EmailMeta fields to set (e.g. priority=7, category=category_obj)
+
+        Returns:
+            EmailMeta object
+        """
+        meta, _ = EmailMeta.objects.update_or_create(user=user, email_id=email_id, defaults=fields)
+        return meta
+
+    @staticmethod
+    def refresh_reminders(user, email_id):
+        """Recompute has_reminder for an email from its open reminders"""
+        has_reminder = Reminder.objects.filter(user=user, email_id=email_id, completed=False).exists()
+        return EmailMetaService.update(user, email_id, has_reminder=has_reminder)
+
+    @staticmethod
+    def get_many(user, email_ids):
+        """
+        Get metadata rows for many emails with one query
+
+        Args:
+            user: User object
+            email_ids: Iterable of Gmail message IDs
+
+        Returns:
+            Dict of message ID -> EmailMeta object (emails without a row are left out)
+        """
+        rows = (
+            EmailMeta.objects
+            .filter(user=user, email_id__in=list(email_ids))
+            .select_related('category')
+        )
+        return {row.email_id: row for row in rows}
+
+    @staticmethod
+    def filter_ids(user, email_ids, min_priority=None, category=None, important=None, has_reminder=None, sort=None):
+        """
+        Filter (and optionally sort) message IDs by their metadata in the database
+
+        Args:
+            user: User object
+            email_ids: Iterable of Gmail message IDs to choose from
+            min_priority: Keep emails with priority >= this
+            category: Keep emails in the category with this name
+            important: Keep emails whose important flag equals this
+            has_reminder: Keep emails whose has_reminder flag equals this
+            sort: Key of META_SORTS, or None to keep the given order
+
+        Returns:
+            List of message IDs
+        """
+        email_ids = list(email_ids)
+        queryset = EmailMeta.objects.filter(user=user, email_id__in=email_ids)
+        if min_priority is not None:
+            queryset = queryset.filter(priority__gte=min_priority)
+        if category:
+            queryset = queryset.filter(category__name__iexact=category)
+        if important is not None:
+            queryset = queryset.filter(is_important=important)
+        if has_reminder is not None:
+            queryset = queryset.filter(has_reminder=has_reminder)
+
+        if sort in META_SORTS:
+            ordered = list(queryset.order_by(*META_SORTS[sort]).values_list('email_id', flat=True))
+            if min_priority is None and not category and important is None and has_reminder is None:
+                # Nothing filtered out, so emails without metadata go last
+                seen = set(ordered)
+                ordered += [email_id for email_id in email_ids if email_id not in seen]
+            return ordered
+
+        matching = set(queryset.values_list('email_id', flat=True))
+        return [email_id for email_id in email_ids if email_id in matching]
@@ -0,0 +1,148 @@
+# inbox/services/mime.py
+
+import binascii
+import logging
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHARSET = 'utf-8'
+_URLSAFE_TO_STANDARD = bytes.maketrans(b'-_', b'+/')
+
+
+@dataclass(slots=True)
+class ParsedMessage:
+    """A Gmail message (or draft message) reduced to what the app uses"""
+    id: str
+    thread_id: str = ''
+    headers: dict = field(default_factory=dict)
+    snippet: str = ''
+    body_text: str = ''
+    body_html: str = ''
+    attachments: list = field(default_factory=list)
+
+    def header(self, name, default=''):
+        """Value of a header by case-insensitive name"""
+        return self.headers.get(name.lower(), default)
+
+
+def parse_headers(headers):
+    """
+    Index a Gmail header list by lower-cased name in one pass
+
+    Args:
+        headers: List of {'name': ..., 'value': ...} dicts
+
+    Returns:
+        Dict of lower-cased header name -> value of its first occurrence
+    """
+    indexed = {}
+    for header in headers or ():
+        indexed.setdefault(header['name'].lower(), header['value'])
+    return indexed
+
+
+def _content_type_charset(part_headers):
+    """Charset parameter of a part's Content-Type header, if any"""
+    content_type = part_headers.get('content-type', '')
+    for param in content_type.split(';')[1:]:
+        name, _, value = param.partition('=')
+        if name.strip().lower() == 'charset':
+            return value.strip().strip('"\'') or None
+    return None
+
+
+def decode_body(data, charset=None):
+    """
+    Decode a Gmail base64url body to text
+
+    Args:
+        data: base64url string from part['body']['data'] (padding optional)
+        charset: Charset of the part, utf-8 when unknown
+
+    Returns:
+        str: Decoded text ('' for empty or undecodable data)
+    """
+    if not data:
+        return ''
+    try:
+        # Map the alphabet with one bytes.translate and let a2b_base64 skip the surplus
+        # padding, instead of urlsafe_b64decode's extra str -> bytes -> translated copies
+        raw = binascii.a2b_base64(data.encode('ascii').translate(_URLSAFE_TO_STANDARD) + b'==')
+    except (binascii.Error, ValueError) as e:
+        logger.warning(f"Could not decode message part: {str(e)}")
+        return ''
+    try:
+        return raw.decode(charset or DEFAULT_CHARSET, errors='replace')
+    except LookupError:
+        # Unknown charset label
+        return raw.decode(DEFAULT_CHARSET, errors='replace')
+
+
+def walk_parts(payload):
+    """
+    Yield every part of a MIME tree depth-first, in document order
+
+    Args:
+        payload: Gmail message payload (the root part)
+    """
+    stack = [payload] if payload else []
+    while stack:
+        part = stack.pop()
+        yield part
+        children = part.get('parts')
+        if children:
+            stack.extend(reversed(children))
+
+
+def parse_message(message, decode_bodies=True):
+    """
+    Parse a Gmail message resource
+
+    Headers of the root part are indexed once; the MIME tree is walked to any
+    depth and only the first inline text/plain and text/html parts are decoded.
+
+    Args:
+        message: Gmail message resource (any format; metadata has no bodies)
+        decode_bodies: Decode the text bodies (False for list views)
+
+    Returns:
+        ParsedMessage
+    """
+    payload = message.get('payload') or {}
+    parsed = ParsedMessage(
+        id=message.get('id', ''),
+        thread_id=message.get('threadId', ''),
+        headers=parse_headers(payload.get('headers')),
+        snippet=message.get('snippet', ''),
+    )
+
+    for part in walk_parts(payload):
+        mime_type = part.get('mimeType', '').lower()
+        body = part.get('body') or {}
+
+        if part.get('filename'):
+            parsed.attachments.append({
+                'filename': part['filename'],
+                'mime_type': mime_type,
+                'attachment_id': body.get('attachmentId', ''),
+                'size': body.get('size', 0),
+            })
+            continue
+
+        if not decode_bodies or mime_type not in ('text/plain', 'text/html'):
+            continue
+        if mime_type == 'text/plain' and parsed.body_text:
+            continue
+        if mime_type == 'text/html' and parsed.body_html:
+            continue
+
+        # Part headers are only indexed for the few parts that get decoded
+        charset = _content_type_charset(parse_headers(part.get('headers')))
+        text = decode_body(body.get('data', ''), charset)
+        if mime_type == 'text/plain':
+            parsed.body_text = text
+        else:
+            parsed.body_html = text
+
+    return parsed
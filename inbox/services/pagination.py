@@ -0,0 +1,52 @@
+# inbox/services/pagination.py
+
+import base64
+import json
+
+
+def encode_cursor(position):
+    """
+    Encode a list position as an opaque cursor
+
+    Args:
+        position: JSON-serializable dict describing where the next page starts
+
+    Returns:
+        str: URL-safe cursor
+    """
+    raw = json.dumps(position, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, fields=None):
+    """
+    Decode a cursor made by encode_cursor
+
+    Cursors come back from clients, so with `fields` every key of the position
+    must be known and hold a value of the listed types.
+
+    Args:
+        cursor: Cursor string, or empty/None for the first page
+        fields: Optional dict of key -> type or tuple of types
+
+    Returns:
+        dict: The position ({} for the first page)
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    if not cursor:
+        return {}
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {str(e)}")
+    if not isinstance(position, dict):
+        raise ValueError("Invalid cursor")
+    if fields is not None:
+        for key, value in position.items():
+            # JSON true/false would pass as ints
+            if key not in fields or isinstance(value, bool) or not isinstance(value, fields[key]):
+                raise ValueError(f"Invalid cursor field: {key}")
+    return position
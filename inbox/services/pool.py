@@ -0,0 +1,87 @@
+# inbox/services/pool.py
+
+import logging
+import threading
+from dataclasses import dataclass, field
+from cachetools import TTLCache
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+GMAIL_SERVICE_POOL_SIZE = getattr(settings, "GMAIL_SERVICE_POOL_SIZE", 256)
+GMAIL_SERVICE_POOL_TTL = getattr(settings, "GMAIL_SERVICE_POOL_TTL", 1800)
+
+
+class ThreadLocalHttp(threading.local):
+    """
+    One authorized HTTP connection per thread for a set of credentials
+
+    httplib2.Http is not thread-safe, but it keeps its TCP+TLS connection open,
+    so each thread reuses its own connection across requests instead of
+    connecting again for every call.
+    """
+
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self.http = None
+
+    def get(self):
+        if self.http is None:
+            import httplib2
+            import google_auth_httplib2
+
+            self.http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http())
+        return self.http
+
+
+@dataclass
+class PooledService:
+    """An authorized Gmail service together with its credentials, connections and profile probe"""
+    service: object
+    credentials: object
+    profile: dict = field(default_factory=dict)
+    http: ThreadLocalHttp = None
+
+
+class GmailServicePool:
+    """
+    Process-level pool of authorized Gmail service objects keyed by user.
+
+    Entries expire after `ttl` seconds and the least recently used entry is
+    evicted once `maxsize` users are pooled. The pool is per process, so the TTL
+    also bounds how long another worker can keep using replaced credentials.
+    """
+
+    def __init__(self, maxsize=GMAIL_SERVICE_POOL_SIZE, ttl=GMAIL_SERVICE_POOL_TTL):
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(user=None):
+        """Pool key for a user; all anonymous requests share one entry"""
+        if user is not None and user.is_authenticated:
+            return f"user:{user.pk}"
+        return "anonymous"
+
+    def get(self, user=None):
+        with self._lock:
+            return self._entries.get(self.key_for(user))
+
+    def put(self, user, service, credentials, profile=None, http=None):
+        entry = PooledService(service=service, credentials=credentials, profile=profile or {}, http=http)
+        with self._lock:
+            self._entries[self.key_for(user)] = entry
+        return entry
+
+    def invalidate(self, user=None):
+        with self._lock:
+            removed = self._entries.pop(self.key_for(user), None)
+        if removed is not None:
+            logger.info(f"Invalidated pooled Gmail service for {self.key_for(user)}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+service_pool = GmailServicePool()
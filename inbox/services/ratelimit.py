@@ -0,0 +1,481 @@
+# inbox/services/ratelimit.py
+
+import asyncio
+import logging
+import math
+import random
+import re
+import socket
+import threading
+import time
+import httpx
+from cachetools import TTLCache
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Gmail quota units per user per second, and for the whole project (1,200,000 per minute)
+GMAIL_USER_QUOTA_PER_SECOND = getattr(settings, "GMAIL_USER_QUOTA_PER_SECOND", 250)
+GMAIL_GLOBAL_QUOTA_PER_SECOND = getattr(settings, "GMAIL_GLOBAL_QUOTA_PER_SECOND", 20000)
+# Gemini generate_content calls per minute
+GEMINI_REQUESTS_PER_MINUTE = getattr(settings, "GEMINI_REQUESTS_PER_MINUTE", 60)
+# Attempts per call and the backoff bounds (seconds) between them
+API_RETRY_ATTEMPTS = getattr(settings, "API_RETRY_ATTEMPTS", 4)
+API_RETRY_BASE_DELAY = getattr(settings, "API_RETRY_BASE_DELAY", 0.5)
+API_RETRY_MAX_DELAY = getattr(settings, "API_RETRY_MAX_DELAY", 30)
+# Longest a call waits for rate-limit tokens or a Retry-After before giving up
+API_MAX_WAIT = getattr(settings, "API_MAX_WAIT", 10)
+# Consecutive failed calls that open an upstream's circuit, and seconds it stays open
+CIRCUIT_BREAKER_FAILURES = getattr(settings, "CIRCUIT_BREAKER_FAILURES", 5)
+CIRCUIT_BREAKER_COOLDOWN = getattr(settings, "CIRCUIT_BREAKER_COOLDOWN", 30)
+
+# Gmail quota units per API method (https://developers.google.com/gmail/api/reference/quota)
+GMAIL_QUOTA_UNITS = {
+    'gmail.users.getProfile': 1,
+    'gmail.users.history.list': 2,
+    'gmail.users.labels.list': 1,
+    'gmail.users.messages.list': 5,
+    'gmail.users.messages.get': 5,
+    'gmail.users.messages.modify': 5,
+    'gmail.users.messages.trash': 5,
+    'gmail.users.messages.untrash': 5,
+    'gmail.users.messages.delete': 10,
+    'gmail.users.messages.batchModify': 50,
+    'gmail.users.messages.batchDelete': 50,
+    'gmail.users.messages.send': 100,
+    'gmail.users.drafts.list': 5,
+    'gmail.users.drafts.get': 5,
+    'gmail.users.drafts.create': 10,
+    'gmail.users.drafts.update': 15,
+    'gmail.users.drafts.delete': 10,
+    'gmail.users.drafts.send': 100,
+    'gmail.users.threads.list': 10,
+    'gmail.users.threads.get': 10,
+}
+DEFAULT_QUOTA_UNITS = 5
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded', 'quotaExceeded')
+
+
+class UpstreamUnavailable(Exception):
+    """An upstream API is rate limited or its circuit is open; try again after `retry_after` seconds"""
+
+    def __init__(self, upstream, retry_after, message=''):
+        self.upstream = upstream
+        self.retry_after = max(1, int(retry_after + 0.999))
+        super().__init__(message or f"{upstream} is temporarily unavailable, retry in {self.retry_after}s")
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at `rate` tokens per second up to `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount, max_wait):
+        """
+        Take `amount` tokens, borrowing against future refills if needed
+
+        Args:
+            amount: Tokens to take (capped at the capacity)
+            max_wait: Longest acceptable wait in seconds
+
+        Returns:
+            Seconds to wait before using the tokens, or None if that would exceed
+            max_wait (nothing is taken then)
+        """
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (amount - self._tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            self._tokens -= amount
+            return wait
+
+    def refund(self, amount):
+        """Give back tokens taken by reserve"""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + min(amount, self.capacity))
+
+
+class SharedTokenBucket:
+    """
+    Token bucket shared by every process through the Django cache.
+
+    Tokens are counted in fixed windows of capacity / rate seconds with one
+    cache.incr per reservation, so all workers together take at most `capacity`
+    tokens per window (with a shared cache backend such as Redis; LocMemCache
+    keeps the count per process). Reservations that don't fit borrow from the
+    next windows, like TokenBucket.
+    """
+
+    def __init__(self, name, rate, capacity=None):
+        self.name = name
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.period = self.capacity / self.rate
+        self._taken = threading.local()
+
+    def _key(self, window):
+        return f"ratelimit:{self.name}:{window}"
+
+    def _take(self, window, amount):
+        """Add `amount` to a window's count unless that would exceed the capacity"""
+        key = self._key(window)
+        cache.add(key, 0, math.ceil(self.period) + 60)
+        try:
+            used = cache.incr(key, amount)
+        except ValueError:
+            # Culled between add and incr
+            cache.add(key, amount, math.ceil(self.period) + 60)
+            return True
+        if used <= self.capacity:
+            return True
+        cache.decr(key, amount)
+        return False
+
+    def reserve(self, amount, max_wait):
+        """
+        Take `amount` tokens from the first window that has room for them
+
+        Args:
+            amount: Tokens to take (capped at the capacity)
+            max_wait: Longest acceptable wait in seconds
+
+        Returns:
+            Seconds to wait before using the tokens, or None if that would exceed
+            max_wait (nothing is taken then)
+        """
+        amount = math.ceil(min(amount, self.capacity))
+        now = time.time()
+        window = int(now // self.period)
+        while True:
+            wait = max(0.0, window * self.period - now)
+            if wait > max_wait:
+                return None
+            if self._take(window, amount):
+                self._taken.window = window
+                return wait
+            window += 1
+
+    def refund(self, amount):
+        """Give back tokens taken by this thread's last reserve"""
+        window = getattr(self._taken, 'window', None)
+        if window is None:
+            return
+        self._taken.window = None
+        try:
+            cache.decr(self._key(window), math.ceil(min(amount, self.capacity)))
+        except ValueError:
+            pass
+
+
+class CircuitBreaker:
+    """
+    Per-upstream circuit breaker shared by every process through the Django cache.
+
+    After `failures` consecutive failed calls the circuit opens and calls fail fast
+    for `cooldown` seconds in every worker (with a shared cache backend such as
+    Redis; LocMemCache keeps the state per process). Then a single trial call is
+    let through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, name, failures=CIRCUIT_BREAKER_FAILURES, cooldown=CIRCUIT_BREAKER_COOLDOWN):
+        self.name = name
+        self.failures = failures
+        self.cooldown = cooldown
+        self._open_until_key = f"circuit:{name}:open_until"
+        self._failures_key = f"circuit:{name}:failures"
+        self._trial_key = f"circuit:{name}:trial"
+
+    def before_call(self):
+        """Raise UpstreamUnavailable if the circuit is open"""
+        open_until = cache.get(self._open_until_key)
+        if open_until is None:
+            return
+        remaining = open_until - time.time()
+        if remaining > 0:
+            raise UpstreamUnavailable(self.name, remaining, f"{self.name} circuit is open")
+        # Half-open: let one trial call through; the claim expires in case its process dies
+        if not cache.add(self._trial_key, True, self.cooldown):
+            raise UpstreamUnavailable(self.name, 1, f"{self.name} circuit is open")
+
+    def cancel_trial(self):
+        """Give up a trial call that was never made"""
+        cache.delete(self._trial_key)
+
+    def record_success(self):
+        state = cache.get_many([self._open_until_key, self._failures_key])
+        if not state:
+            return
+        if self._open_until_key in state:
+            logger.info(f"{self.name} circuit closed")
+        cache.delete_many([self._open_until_key, self._failures_key, self._trial_key])
+
+    def record_failure(self):
+        cache.add(self._failures_key, 0, None)
+        try:
+            failures = cache.incr(self._failures_key)
+        except ValueError:
+            failures = 1
+        trial_running = cache.get(self._trial_key) is not None
+        if trial_running or failures >= self.failures:
+            if trial_running or cache.get(self._open_until_key) is None:
+                logger.warning(f"{self.name} circuit opened for {self.cooldown}s after {failures} failed calls")
+            cache.set(self._open_until_key, time.time() + self.cooldown, None)
+            cache.delete(self._trial_key)
+
+    def state(self):
+        """'closed', 'open' or 'half-open', plus seconds until the next trial"""
+        state = cache.get_many([self._open_until_key, self._failures_key])
+        failures = state.get(self._failures_key, 0)
+        if self._open_until_key not in state:
+            return {'state': 'closed', 'retry_in': 0, 'failures': failures}
+        remaining = max(0.0, state[self._open_until_key] - time.time())
+        return {
+            'state': 'open' if remaining > 0 else 'half-open',
+            'retry_in': round(remaining, 1),
+            'failures': failures,
+        }
+
+
+def classify_error(error):
+    """
+    Decide whether a failed Google API call is worth retrying
+
+    Args:
+        error: Exception raised by an HttpRequest.execute, generate_content or httpx call
+
+    Returns:
+        Tuple of (retryable, retry_after seconds or None)
+    """
+    status = None
+    retry_after = None
+
+    resp = getattr(error, 'resp', None)
+    if resp is not None:
+        # googleapiclient HttpError
+        status = getattr(resp, 'status', None)
+        header = resp.get('retry-after') if hasattr(resp, 'get') else None
+        if header and str(header).isdigit():
+            retry_after = float(header)
+        if status == 403 and any(reason in str(error) for reason in RATE_LIMIT_REASONS):
+            status = 429
+    elif isinstance(error, httpx.HTTPStatusError):
+        # Async client (services.aio)
+        status = error.response.status_code
+        header = error.response.headers.get('retry-after')
+        if header and header.isdigit():
+            retry_after = float(header)
+        if status == 403 and any(reason in error.response.text for reason in RATE_LIMIT_REASONS):
+            status = 429
+    elif isinstance(getattr(error, 'code', None), int):
+        # google.api_core exceptions raised by the Gemini client
+        status = error.code
+        match = re.search(r'retry_delay\s*\{\s*seconds:\s*(\d+)', str(error))
+        if match:
+            retry_after = float(match.group(1))
+
+    if status is not None:
+        return status in RETRYABLE_STATUSES, retry_after
+    if isinstance(error, (socket.timeout, TimeoutError, ConnectionError, httpx.TransportError)):
+        return True, None
+    return False, None
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Full-jitter exponential backoff for a retry, never shorter than the server's Retry-After"""
+    delay = random.uniform(0, min(API_RETRY_MAX_DELAY, API_RETRY_BASE_DELAY * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class RateLimiter:
+    """
+    Rate limiting, retries and circuit breaking for upstream APIs.
+
+    Each upstream has a global token bucket and optional per-key (per-user)
+    buckets. Calls wait for their tokens (up to API_MAX_WAIT), retry retryable
+    errors with full-jitter exponential backoff that honors Retry-After, and fail
+    fast with UpstreamUnavailable while the upstream's circuit is open. Global
+    buckets and circuit breakers live in the Django cache, so all workers share
+    them; per-key buckets are per process.
+    """
+
+    def __init__(self):
+        self._global = {
+            'gmail': SharedTokenBucket('gmail', GMAIL_GLOBAL_QUOTA_PER_SECOND),
+            'gemini': SharedTokenBucket('gemini', GEMINI_REQUESTS_PER_MINUTE / 60, max(1, GEMINI_REQUESTS_PER_MINUTE / 6)),
+        }
+        self._per_key_rates = {'gmail': GMAIL_USER_QUOTA_PER_SECOND}
+        self._per_key = TTLCache(maxsize=4096, ttl=3600)
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, upstream):
+        with self._lock:
+            if upstream not in self._breakers:
+                self._breakers[upstream] = CircuitBreaker(upstream)
+            return self._breakers[upstream]
+
+    def _buckets(self, upstream, key):
+        with self._lock:
+            # Upstreams without configured limits only get retries and circuit breaking
+            buckets = [self._global[upstream]] if upstream in self._global else []
+            if key is not None and upstream in self._per_key_rates:
+                bucket = self._per_key.get((upstream, key))
+                if bucket is None:
+                    bucket = TokenBucket(self._per_key_rates[upstream])
+                    self._per_key[(upstream, key)] = bucket
+                buckets.append(bucket)
+            return buckets
+
+    def _reserve(self, upstream, key, cost, max_wait):
+        """Take `cost` tokens from every bucket of the upstream; returns the seconds to wait for them"""
+        max_wait = API_MAX_WAIT if max_wait is None else max_wait
+        taken = []
+        wait = 0.0
+        for bucket in self._buckets(upstream, key):
+            bucket_wait = bucket.reserve(cost, max_wait)
+            if bucket_wait is None:
+                for taken_bucket in taken:
+                    taken_bucket.refund(cost)
+                raise UpstreamUnavailable(upstream, cost / bucket.rate, f"{upstream} rate limit reached")
+            taken.append(bucket)
+            wait = max(wait, bucket_wait)
+        return wait
+
+    def acquire(self, upstream, key=None, cost=1, max_wait=None):
+        """
+        Wait until `cost` tokens are available in the upstream's global and per-key buckets
+
+        Raises:
+            UpstreamUnavailable: If the wait would exceed max_wait (API_MAX_WAIT by default)
+        """
+        wait = self._reserve(upstream, key, cost, max_wait)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, upstream, key=None, cost=1, max_wait=None):
+        """acquire() for coroutines: waits without blocking the event loop"""
+        wait = self._reserve(upstream, key, cost, max_wait)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def _retry_delay(self, upstream, error, attempt, attempts):
+        """
+        Record a failed attempt and decide whether to retry
+
+        Returns:
+            Seconds to wait before the next attempt, or None to re-raise the error
+
+        Raises:
+            UpstreamUnavailable: If the upstream asked to wait longer than API_MAX_WAIT
+        """
+        breaker = self.breaker(upstream)
+        retryable, retry_after = classify_error(error)
+        if not retryable:
+            # The upstream answered; the request itself was bad
+            breaker.record_success()
+            return None
+        breaker.record_failure()
+        if attempt == attempts - 1:
+            return None
+
+        delay = backoff_delay(attempt, retry_after)
+        if delay > API_MAX_WAIT:
+            raise UpstreamUnavailable(upstream, delay, f"{upstream} asked to retry in {delay:.0f}s") from error
+        logger.warning(f"{upstream} call failed ({str(error)[:200]}), "
+                       f"retry {attempt + 1}/{attempts - 1} in {delay:.2f}s")
+        return delay
+
+    def call(self, upstream, func, key=None, cost=1, attempts=None):
+        """
+        Run `func()` under the upstream's rate limits, retry policy and circuit breaker
+
+        Args:
+            upstream: Upstream name ('gmail', 'gemini', ...)
+            func: Function making the API call
+            key: Per-user bucket key, or None for the global bucket only
+            cost: Quota units the call uses
+            attempts: Total attempts (API_RETRY_ATTEMPTS by default)
+
+        Returns:
+            Whatever func returns
+
+        Raises:
+            UpstreamUnavailable: If the circuit is open or tokens are not available in time
+            The last error of func if it is not retryable or attempts run out
+        """
+        breaker = self.breaker(upstream)
+        attempts = attempts or API_RETRY_ATTEMPTS
+
+        for attempt in range(attempts):
+            breaker.before_call()
+            try:
+                self.acquire(upstream, key, cost)
+            except UpstreamUnavailable:
+                breaker.cancel_trial()
+                raise
+            try:
+                result = func()
+            except Exception as e:
+                delay = self._retry_delay(upstream, e, attempt, attempts)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+            else:
+                breaker.record_success()
+                return result
+
+    async def acall(self, upstream, func, key=None, cost=1, attempts=None):
+        """
+        call() for coroutines: `func` is an async function making the API call
+
+        Waits for tokens and backoff with asyncio.sleep, so a throttled call only
+        holds its socket, not a thread.
+        """
+        breaker = self.breaker(upstream)
+        attempts = attempts or API_RETRY_ATTEMPTS
+
+        for attempt in range(attempts):
+            breaker.before_call()
+            try:
+                await self.aacquire(upstream, key, cost)
+            except UpstreamUnavailable:
+                breaker.cancel_trial()
+                raise
+            try:
+                result = await func()
+            except Exception as e:
+                delay = self._retry_delay(upstream, e, attempt, attempts)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+            else:
+                breaker.record_success()
+                return result
+
+    def stats(self):
+        """Circuit state of every upstream seen so far"""
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {name: breaker.state() for name, breaker in breakers.items()}
+
+
+rate_limiter = RateLimiter()
+
+
+def gmail_quota_units(method_id):
+    """Quota units a Gmail API method costs"""
+    return GMAIL_QUOTA_UNITS.get(method_id, DEFAULT_QUOTA_UNITS)
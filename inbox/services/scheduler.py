@@ -0,0 +1,182 @@
+# inbox/services/scheduler.py
+
+import heapq
+import logging
+from collections import namedtuple
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from ..models import ScheduledEmail, Reminder
+from .jobs import JobQueue
+
+logger = logging.getLogger(__name__)
+
+# Seconds ahead of now whose due rows are kept in the heap
+SCHEDULER_HORIZON = getattr(settings, "SCHEDULER_HORIZON", 3600)
+# Most heap entries per source; the window shrinks to fit when more rows are due
+SCHEDULER_MAX_LOADED = getattr(settings, "SCHEDULER_MAX_LOADED", 50000)
+# Rows read per query
+SCHEDULER_BATCH_SIZE = 2000
+
+# A table of rows that come due: `pending` selects rows not yet handled, and with
+# `time_field` it must match an index so window loads are range scans
+DueSource = namedtuple('DueSource', 'model time_field pending job_kind payload_key')
+
+DUE_SOURCES = {
+    'scheduled_email': DueSource(
+        ScheduledEmail, 'scheduled_time', Q(sent=False, failed=False), 'send_scheduled_email', 'scheduled_email_id'
+    ),
+    'reminder': DueSource(
+        Reminder, 'reminder_time', Q(completed=False, notified_at__isnull=True), 'notify_reminder', 'reminder_id'
+    ),
+}
+
+
+class DueScheduler:
+    """
+    In-memory min-heap of upcoming due times, fed from the database incrementally
+
+    Each source keeps a (time, id) keyset cursor: everything pending up to it is in
+    the heap or already dispatched. Advancing the window only reads rows past the
+    cursor, and rows created since the last check are found by primary key, so no
+    tick scans the whole table. Due rows are handed to the job queue with a dedupe
+    key per row (its idempotency key) and sent by `manage.py run_workers`.
+    """
+
+    def __init__(self, sources=None, horizon=SCHEDULER_HORIZON, max_loaded=SCHEDULER_MAX_LOADED):
+        self.sources = {name: DUE_SOURCES[name] for name in (sources or DUE_SOURCES)}
+        self.horizon = timedelta(seconds=horizon)
+        self.max_loaded = max_loaded
+        self.reload()
+
+    def reload(self):
+        """Drop the heap and start over from the oldest pending rows"""
+        self.heap = []
+        self.loaded = set()
+        self.counts = {name: 0 for name in self.sources}
+        # source -> (time, id) the window is loaded to; id None means all rows at that time
+        self.cursors = {name: None for name in self.sources}
+        # source -> highest primary key checked for new rows
+        self.max_ids = {}
+        for name, source in self.sources.items():
+            last = source.model.objects.order_by('-pk').values_list('pk', flat=True).first()
+            self.max_ids[name] = last or 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def _push(self, name, pk, due, user_id):
+        if (name, pk) in self.loaded:
+            return
+        self.loaded.add((name, pk))
+        self.counts[name] += 1
+        heapq.heappush(self.heap, (due, name, pk, user_id))
+
+    def advance(self, now=None):
+        """
+        Load pending rows up to now + horizon that are past each source's cursor
+
+        Returns:
+            int: Number of rows loaded
+        """
+        window_end = (now or timezone.now()) + self.horizon
+        count = 0
+        for name, source in self.sources.items():
+            while True:
+                cursor = self.cursors[name]
+                if cursor and cursor[1] is None and cursor[0] >= window_end:
+                    break
+
+                rows = source.model.objects.filter(source.pending, **{f'{source.time_field}__lte': window_end})
+                if cursor:
+                    cursor_time, cursor_id = cursor
+                    after = Q(**{f'{source.time_field}__gt': cursor_time})
+                    if cursor_id is not None:
+                        after |= Q(**{source.time_field: cursor_time, 'pk__gt': cursor_id})
+                    rows = rows.filter(after)
+
+                limit = min(self.max_loaded - self.counts[name], SCHEDULER_BATCH_SIZE)
+                if limit <= 0:
+                    # Heap is full for this source; the window stays at the cursor
+                    break
+                batch = list(
+                    rows.order_by(source.time_field, 'pk')
+                    .values_list('pk', source.time_field, 'user_id')[:limit + 1]
+                )
+                more = len(batch) > limit
+                batch = batch[:limit]
+                for pk, due, user_id in batch:
+                    self._push(name, pk, due, user_id)
+                count += len(batch)
+
+                if not more:
+                    self.cursors[name] = (window_end, None)
+                    break
+                # More rows in the window; continue after the last one read
+                self.cursors[name] = (batch[-1][1], batch[-1][0])
+        return count
+
+    def load_new(self):
+        """
+        Pick up rows created since the last check that fall inside the loaded window
+
+        Rows due later than the cursor are left for `advance`.
+
+        Returns:
+            int: Number of rows loaded
+        """
+        count = 0
+        for name, source in self.sources.items():
+            rows = list(
+                source.model.objects.filter(source.pending, pk__gt=self.max_ids[name])
+                .order_by('pk')
+                .values_list('pk', source.time_field, 'user_id')[:SCHEDULER_BATCH_SIZE]
+            )
+            if not rows:
+                continue
+            self.max_ids[name] = rows[-1][0]
+            cursor = self.cursors[name]
+            for pk, due, user_id in rows:
+                if cursor and due <= cursor[0]:
+                    self._push(name, pk, due, user_id)
+                    count += 1
+        return count
+
+    def next_due(self):
+        """Due time of the earliest heap entry, or None"""
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now=None):
+        """
+        Remove and return the heap entries that are due
+
+        Returns:
+            List of (due, source, id, user_id) tuples in due order
+        """
+        now = now or timezone.now()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)
+            self.loaded.discard((entry[1], entry[2]))
+            self.counts[entry[1]] -= 1
+            due.append(entry)
+        return due
+
+    def dispatch(self, entries):
+        """
+        Queue a job for each due entry
+
+        The dedupe key makes re-dispatching a row that already has a queued or
+        running job a no-op, so reloads and restarts never double-queue.
+        """
+        by_source = {}
+        for _, name, pk, user_id in entries:
+            by_source.setdefault(name, []).append((pk, user_id))
+        for name, rows in by_source.items():
+            source = self.sources[name]
+            JobQueue.enqueue_many(source.job_kind, [
+                (user_id, {source.payload_key: pk}, f'{name}:{pk}')
+                for pk, user_id in rows
+            ])
+            logger.info(f"Dispatched {len(rows)} due {name} rows")
@@ -0,0 +1,432 @@
+# inbox/services/semantic.py
+
+import logging
+import math
+import threading
+import zlib
+import numpy as np
+from cachetools import LRUCache
+from django.conf import settings
+from ..models import MailboxMessage, MessageEmbedding
+from . import gemini
+from .classifier import TOKEN_RE
+from .jobs import JobQueue
+
+logger = logging.getLogger(__name__)
+
+# Embedder used for new indexes: 'gemini' or 'hashing' (offline, no API calls)
+SEMANTIC_SEARCH_EMBEDDER = getattr(settings, "SEMANTIC_SEARCH_EMBEDDER", "hashing")
+# Users whose index a process keeps in memory between searches
+SEMANTIC_INDEX_CACHE_SIZE = getattr(settings, "SEMANTIC_INDEX_CACHE_SIZE", 20)
+# Vectors from which searches only scan the closest clusters instead of the whole index
+SEMANTIC_IVF_MIN_VECTORS = getattr(settings, "SEMANTIC_IVF_MIN_VECTORS", 20000)
+# Clusters scanned per search once the index is clustered
+SEMANTIC_IVF_PROBES = getattr(settings, "SEMANTIC_IVF_PROBES", 8)
+
+# Characters of a message that are embedded
+MAX_EMBED_CHARS = 4000
+# Messages embedded per embedder call
+EMBED_BATCH_SIZE = 100
+# Stored vectors read per query when an index is loaded
+LOAD_BATCH_SIZE = 5000
+# Rows scored per matrix product, bounding the memory of one search
+SEARCH_CHUNK_ROWS = 65536
+# Share of dead rows (removed or re-embedded messages) that triggers a compaction
+COMPACT_DEAD_RATIO = 0.25
+# Share of rows appended since clustering that triggers a new clustering
+RECLUSTER_TAIL_RATIO = 0.1
+# k-means iterations when clustering, and rows it is fitted on
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 50000
+
+# (user ID, embedder name) -> VectorIndex loaded in this process
+_indexes = LRUCache(maxsize=SEMANTIC_INDEX_CACHE_SIZE)
+_indexes_lock = threading.Lock()
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def message_text(row):
+    """Text of a mirrored message that is embedded: subject, snippet and body"""
+    return f"{row.subject}\n{row.snippet}\n{row.body_text}"[:MAX_EMBED_CHARS]
+
+
+class HashingEmbedder:
+    """Signed feature hashing of words and word pairs; needs no model or network"""
+
+    name = 'hashing'
+    dim = 512
+
+    def embed(self, texts, query=False):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = TOKEN_RE.findall(text.lower())
+            for token in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+                digest = zlib.crc32(token.encode('utf-8'))
+                vectors[row, digest % self.dim] += 1.0 if digest & 0x80000000 else -1.0
+        # Dampen repeated words so one long body doesn't dominate
+        return _normalize(np.sign(vectors) * np.log1p(np.abs(vectors)))
+
+
+class GeminiEmbedder:
+    """Gemini text embeddings (gemini.EMBEDDING_MODEL)"""
+
+    name = 'gemini'
+    dim = 768
+
+    def embed(self, texts, query=False):
+        task_type = "retrieval_query" if query else "retrieval_document"
+        vectors = []
+        for start in range(0, len(texts), EMBED_BATCH_SIZE):
+            vectors.extend(gemini.embed_texts(texts[start:start + EMBED_BATCH_SIZE], task_type=task_type))
+        return _normalize(vectors)
+
+
+EMBEDDERS = {
+    'hashing': HashingEmbedder,
+    'gemini': GeminiEmbedder,
+}
+
+
+def get_embedder(name=None):
+    """Embedder instance by name, SEMANTIC_SEARCH_EMBEDDER by default"""
+    return EMBEDDERS[name or SEMANTIC_SEARCH_EMBEDDER]()
+
+
+class VectorIndex:
+    """
+    One user's message vectors as float16 rows in memory
+
+    Rows are only appended: a removed or re-embedded message leaves a dead row
+    (None) until the next compaction. Large indexes get an IVF coarse quantizer:
+    k-means centroids and the cluster of each row, so a search scores only the
+    rows in the SEMANTIC_IVF_PROBES clusters closest to the query.
+    """
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.rows = []  # Row -> [message ID, embedded with body] or None
+        self.ivf_rows = 0  # Rows covered by the clustering; later rows are always scanned
+        self.last_id = 0  # Highest MessageEmbedding ID applied
+        self.loaded = 0  # MessageEmbedding rows applied, to notice when the log was compacted
+        self.lock = threading.Lock()
+        self._live = {}  # Message ID -> row
+        self._buffer = np.empty((0, dim), dtype=np.float16)
+        self._centroids = None
+        self._assignments = None
+
+    @property
+    def _vectors(self):
+        return self._buffer[:len(self.rows)]
+
+    def entries(self):
+        """Message ID -> (row, embedded with body) of the live rows"""
+        return {message_id: (row, self.rows[row][1]) for message_id, row in self._live.items()}
+
+    @property
+    def live_rows(self):
+        return len(self._live)
+
+    @property
+    def dead_rows(self):
+        return len(self.rows) - len(self._live)
+
+    def append(self, entries, vectors):
+        """
+        Add vectors, replacing the rows of messages that are already indexed
+
+        Args:
+            entries: List of (message ID, embedded with body)
+            vectors: Normalized float array, one row per entry
+        """
+        vectors = np.asarray(vectors, dtype=np.float16).reshape(-1, self.dim)
+        size = len(self.rows) + len(vectors)
+        if size > len(self._buffer):
+            # Grow geometrically so appending row by row stays linear
+            buffer = np.empty((max(size, 2 * len(self._buffer), 1024), self.dim), dtype=np.float16)
+            buffer[:len(self.rows)] = self._vectors
+            self._buffer = buffer
+        self._buffer[len(self.rows):size] = vectors
+        for message_id, has_body in entries:
+            if message_id in self._live:
+                self.rows[self._live[message_id]] = None
+            self._live[message_id] = len(self.rows)
+            self.rows.append([message_id, has_body])
+        return self
+
+    def remove(self, message_ids):
+        """Mark the rows of messages as dead"""
+        for message_id in message_ids:
+            row = self._live.pop(message_id, None)
+            if row is not None:
+                self.rows[row] = None
+        return self
+
+    def compact(self):
+        """Drop dead rows, clustering the index if it is large"""
+        live_rows = [row for row, entry in enumerate(self.rows) if entry is not None]
+        self._buffer = self._buffer[live_rows]
+        self.rows = [self.rows[row] for row in live_rows]
+        self._live = {entry[0]: row for row, entry in enumerate(self.rows)}
+        self._centroids = self._assignments = None
+        self.ivf_rows = 0
+        if len(self.rows) >= SEMANTIC_IVF_MIN_VECTORS:
+            self._centroids, self._assignments = _kmeans(self._buffer)
+            self.ivf_rows = len(self.rows)
+        return self
+
+    def needs_compaction(self):
+        if not self.rows:
+            return False
+        if self.dead_rows > COMPACT_DEAD_RATIO * len(self.rows):
+            return True
+        if self.live_rows >= SEMANTIC_IVF_MIN_VECTORS:
+            return not self.ivf_rows or len(self.rows) - self.ivf_rows > RECLUSTER_TAIL_RATIO * len(self.rows)
+        return bool(self.ivf_rows)
+
+    def _candidates(self, query):
+        """Rows to score: all of them, or those in the closest clusters plus the unclustered tail"""
+        if self._centroids is None:
+            return None
+        probes = np.argsort(self._centroids @ query)[::-1][:SEMANTIC_IVF_PROBES]
+        clustered = np.flatnonzero(np.isin(self._assignments, probes))
+        return np.concatenate([clustered, np.arange(self.ivf_rows, len(self.rows))])
+
+    def search(self, query, k):
+        """
+        Rows closest to a query vector by cosine similarity
+
+        Returns:
+            List of (message ID, score), best first
+        """
+        if not self._live or k <= 0:
+            return []
+        query = np.asarray(query, dtype=np.float32)
+        vectors = self._vectors
+        dead = np.fromiter((entry is None for entry in self.rows), dtype=bool, count=len(self.rows))
+        candidates = self._candidates(query)
+        total = len(self.rows) if candidates is None else len(candidates)
+
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, total, SEARCH_CHUNK_ROWS):
+            if candidates is None:
+                rows = np.arange(start, min(start + SEARCH_CHUNK_ROWS, total))
+                scores = vectors[start:start + SEARCH_CHUNK_ROWS].astype(np.float32) @ query
+            else:
+                rows = candidates[start:start + SEARCH_CHUNK_ROWS]
+                scores = vectors[rows].astype(np.float32) @ query
+            scores[dead[rows]] = -np.inf
+            best_rows = np.concatenate([best_rows, rows])
+            best_scores = np.concatenate([best_scores, scores])
+            if len(best_scores) > k:
+                top = np.argpartition(best_scores, -k)[-k:]
+                best_rows, best_scores = best_rows[top], best_scores[top]
+
+        order = np.argsort(best_scores)[::-1]
+        return [
+            (self.rows[best_rows[i]][0], float(best_scores[i]))
+            for i in order if np.isfinite(best_scores[i])
+        ]
+
+
+def _kmeans(vectors):
+    """Spherical k-means over float16 rows; returns (centroids, cluster of every row)"""
+    count = len(vectors)
+    clusters = min(1024, max(16, int(math.sqrt(count))))
+    rng = np.random.default_rng(0)
+    sample = np.asarray(vectors[np.sort(rng.choice(count, min(count, KMEANS_SAMPLE), replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), clusters, replace=False)]
+    for _ in range(KMEANS_ITERATIONS):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        for cluster in range(clusters):
+            members = sample[labels == cluster]
+            if len(members):
+                centroids[cluster] = members.sum(axis=0)
+        centroids = _normalize(centroids)
+
+    assignments = np.empty(count, dtype=np.int32)
+    for start in range(0, count, SEARCH_CHUNK_ROWS):
+        chunk = np.asarray(vectors[start:start + SEARCH_CHUNK_ROWS], dtype=np.float32)
+        assignments[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return centroids, assignments
+
+
+class SemanticSearchService:
+    """
+    Semantic search over a user's mirrored mail
+
+    A background job embeds mirrored messages into MessageEmbedding rows; every
+    process that searches keeps the user's index in memory and applies the rows
+    stored since it last looked, so workers and web servers share the index
+    through the database rather than a local disk.
+    """
+
+    @staticmethod
+    def _stored(user, embedder):
+        return MessageEmbedding.objects.filter(user=user, embedder=embedder.name)
+
+    @staticmethod
+    def _apply(index, rows):
+        """Apply stored rows (ID order) to an index"""
+        entries, vectors = [], []
+        for row_id, message_id, has_body, removed, vector in rows:
+            if removed:
+                if entries:
+                    index.append(entries, vectors)
+                    entries, vectors = [], []
+                index.remove([message_id])
+            else:
+                entries.append((message_id, has_body))
+                vectors.append(np.frombuffer(bytes(vector), dtype=np.float16))
+            index.last_id = row_id
+            index.loaded += 1
+        if entries:
+            index.append(entries, vectors)
+
+    @staticmethod
+    def _load(index, stored):
+        """Apply the stored rows after the last one the index has seen"""
+        while True:
+            rows = list(
+                stored.filter(id__gt=index.last_id).order_by('id')
+                .values_list('id', 'message_id', 'has_body', 'removed', 'vector')[:LOAD_BATCH_SIZE]
+            )
+            SemanticSearchService._apply(index, rows)
+            if len(rows) < LOAD_BATCH_SIZE:
+                return
+
+    @staticmethod
+    def get_index(user, embedder=None):
+        """
+        The user's index for an embedder (SEMANTIC_SEARCH_EMBEDDER by default),
+        brought up to date with the stored vectors
+        """
+        embedder = embedder or get_embedder()
+        key = (user.pk, embedder.name)
+        with _indexes_lock:
+            index = _indexes.get(key)
+            if index is None:
+                index = _indexes[key] = VectorIndex(embedder.dim)
+
+        with index.lock:
+            stored = SemanticSearchService._stored(user, embedder)
+            SemanticSearchService._load(index, stored)
+            if stored.filter(id__lte=index.last_id).count() != index.loaded:
+                # The log was compacted (or rows committed out of ID order): load it again
+                index = VectorIndex(embedder.dim)
+                with _indexes_lock:
+                    _indexes[key] = index
+                SemanticSearchService._load(index, stored)
+            if index.needs_compaction():
+                index.compact()
+        return index
+
+    @staticmethod
+    def update(user, embedder=None):
+        """
+        Embed mirrored messages that are not indexed yet (or got their body since)
+        and drop messages that left the mirror
+
+        Returns:
+            int: Number of messages embedded
+        """
+        embedder = embedder or get_embedder()
+        stored = SemanticSearchService._stored(user, embedder)
+        indexed = {}  # Message ID -> embedded with body, for the live messages
+        log_rows = 0
+        for message_id, has_body, removed in stored.order_by('id').values_list('message_id', 'has_body', 'removed').iterator():
+            log_rows += 1
+            if removed:
+                indexed.pop(message_id, None)
+            else:
+                indexed[message_id] = has_body
+
+        mirrored = dict(
+            MailboxMessage.objects.filter(user=user, is_trashed=False).values_list('message_id', 'body_fetched')
+        )
+        gone = [message_id for message_id in indexed if message_id not in mirrored]
+        MessageEmbedding.objects.bulk_create([
+            MessageEmbedding(user=user, embedder=embedder.name, message_id=message_id, removed=True, vector=b'')
+            for message_id in gone
+        ])
+        pending = [
+            message_id for message_id, body_fetched in mirrored.items()
+            if message_id not in indexed or (body_fetched and not indexed[message_id])
+        ]
+
+        for start in range(0, len(pending), EMBED_BATCH_SIZE):
+            rows = list(MailboxMessage.objects.filter(
+                user=user, message_id__in=pending[start:start + EMBED_BATCH_SIZE]
+            ).only('message_id', 'subject', 'snippet', 'body_text', 'body_fetched'))
+            vectors = np.asarray(embedder.embed([message_text(row) for row in rows]), dtype=np.float16)
+            MessageEmbedding.objects.bulk_create([
+                MessageEmbedding(user=user, embedder=embedder.name, message_id=row.message_id,
+                                 has_body=row.body_fetched, vector=vector.tobytes())
+                for row, vector in zip(rows, vectors)
+            ])
+            for row in rows:
+                indexed[row.message_id] = row.body_fetched
+
+        for message_id in gone:
+            indexed.pop(message_id)
+        log_rows += len(gone) + len(pending)
+        if log_rows - len(indexed) > COMPACT_DEAD_RATIO * log_rows:
+            SemanticSearchService.compact(user, embedder)
+        if pending or gone:
+            logger.info(f"Semantic index for {user.username}: {len(pending)} embedded, {len(gone)} removed, "
+                        f"{len(indexed)} messages")
+        return len(pending)
+
+    @staticmethod
+    def compact(user, embedder=None):
+        """
+        Delete removed and superseded rows from the user's stored vectors
+
+        Returns:
+            int: Number of rows deleted
+        """
+        embedder = embedder or get_embedder()
+        stored = SemanticSearchService._stored(user, embedder)
+        latest = {}  # Message ID -> (ID, removed) of its newest row
+        row_ids = []
+        for row_id, message_id, removed in stored.order_by('id').values_list('id', 'message_id', 'removed').iterator():
+            latest[message_id] = (row_id, removed)
+            row_ids.append(row_id)
+        keep = {row_id for row_id, removed in latest.values() if not removed}
+        dead = [row_id for row_id in row_ids if row_id not in keep]
+        for start in range(0, len(dead), LOAD_BATCH_SIZE):
+            stored.filter(id__in=dead[start:start + LOAD_BATCH_SIZE]).delete()
+        return len(dead)
+
+    @staticmethod
+    def search(user, query, limit=20):
+        """
+        Mirrored messages closest in meaning to a query
+
+        Returns:
+            Tuple of (list of (message ID, score) best first, number of indexed messages)
+        """
+        embedder = get_embedder()
+        index = SemanticSearchService.get_index(user, embedder)
+        if not index.live_rows:
+            return [], 0
+        query_vector = embedder.embed([query], query=True)[0]
+        with index.lock:
+            return index.search(query_vector, limit), index.live_rows
+
+
+def enqueue_indexing(user):
+    """Queue an index update for the user unless one is already queued"""
+    if user is None or not user.is_authenticated:
+        return
+    JobQueue.enqueue('index_messages', user=user, dedupe_key=f"semantic:{user.pk}")
+
+
+def run_index_messages_job(job):
+    """Job handler: bring a user's semantic index up to date with their mailbox mirror"""
+    SemanticSearchService.update(job.user)
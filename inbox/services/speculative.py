@@ -0,0 +1,187 @@
+# inbox/services/speculative.py
+
+import hashlib
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from ..models import SpeculativeReply, SpeculativeReplyUsage, UserSettings, EmailMeta, MailboxMessage
+from .enrichment import EnrichmentService, email_source_text, load_email_details
+from .jobs import JobQueue
+
+logger = logging.getLogger(__name__)
+
+# Unread emails per user with a reply drafted ahead of time, highest priority first
+SPECULATIVE_REPLY_TOP_N = getattr(settings, "SPECULATIVE_REPLY_TOP_N", 5)
+# Lowest priority (1-10) worth drafting a reply for
+SPECULATIVE_REPLY_MIN_PRIORITY = getattr(settings, "SPECULATIVE_REPLY_MIN_PRIORITY", 7)
+# Model calls spent drafting replies per user per day
+SPECULATIVE_REPLY_DAILY_BUDGET = getattr(settings, "SPECULATIVE_REPLY_DAILY_BUDGET", 20)
+# Days drafted replies are kept
+SPECULATIVE_REPLY_RETENTION_DAYS = getattr(settings, "SPECULATIVE_REPLY_RETENTION_DAYS", 7)
+
+
+def content_hash(email_text):
+    """Hash of an email's text, insensitive to whitespace differences"""
+    return hashlib.sha256(" ".join(email_text.split()).encode("utf-8")).hexdigest()
+
+
+class SpeculativeReplyService:
+    """
+    Replies drafted in the background for the emails a user is most likely to answer
+
+    After enrichment scores a user's mail, the top SPECULATIVE_REPLY_TOP_N unread
+    emails by priority get a reply drafted in the user's reply tone (only with
+    auto replies enabled, within a daily budget). When the user asks for a reply
+    to one of them with the same text, the stored draft is returned at once.
+    """
+
+    @staticmethod
+    def preferences(user):
+        """Tuple of (reply tone, auto replies enabled) from the user's settings"""
+        user_settings = UserSettings.objects.filter(user=user).first()
+        if user_settings is None:
+            return settings.DEFAULT_REPLY_TONE, settings.DEFAULT_AUTO_REPLY_ENABLED
+        return user_settings.reply_tone, user_settings.auto_reply_enabled
+
+    @staticmethod
+    def used_today(user):
+        """Number of model calls spent drafting replies for the user today"""
+        return SpeculativeReplyUsage.objects.filter(
+            user=user, day=timezone.localdate()
+        ).values_list('model_calls', flat=True).first() or 0
+
+    @staticmethod
+    def reserve_call(user):
+        """
+        Count one model call against the user's daily budget if any is left
+
+        The check and the increment are one conditional UPDATE, so workers drafting
+        for the same user at once can't overspend the budget between them.
+
+        Returns:
+            bool: True if the call was reserved, False if the budget is spent
+        """
+        usage, _ = SpeculativeReplyUsage.objects.get_or_create(user=user, day=timezone.localdate())
+        return SpeculativeReplyUsage.objects.filter(
+            pk=usage.pk, model_calls__lt=SPECULATIVE_REPLY_DAILY_BUDGET
+        ).update(model_calls=F('model_calls') + 1) == 1
+
+    @staticmethod
+    def candidates(user, tone, limit=SPECULATIVE_REPLY_TOP_N):
+        """
+        IDs of the user's top unread emails by priority that have no reply drafted in `tone`
+
+        Returns:
+            List of Gmail message IDs, highest priority first
+        """
+        unread = MailboxMessage.objects.filter(user=user, is_unread=True, is_trashed=False).values('message_id')
+        top = list(
+            EmailMeta.objects.filter(user=user, priority__gte=SPECULATIVE_REPLY_MIN_PRIORITY, email_id__in=unread)
+            .order_by('-priority', '-updated_at')
+            .values_list('email_id', flat=True)[:limit]
+        )
+        drafted = set(
+            SpeculativeReply.objects.filter(user=user, email_id__in=top, tone=tone)
+            .values_list('email_id', flat=True)
+        )
+        return [email_id for email_id in top if email_id not in drafted]
+
+    @staticmethod
+    def schedule(user):
+        """
+        Queue reply drafting for the user's top unread emails
+
+        Returns:
+            int: Number of emails a draft was requested for (already queued jobs are not queued twice)
+        """
+        if user is None or not user.is_authenticated:
+            return 0
+        tone, enabled = SpeculativeReplyService.preferences(user)
+        if not enabled:
+            return 0
+        remaining = SPECULATIVE_REPLY_DAILY_BUDGET - SpeculativeReplyService.used_today(user)
+        if remaining <= 0:
+            return 0
+
+        email_ids = SpeculativeReplyService.candidates(user, tone)[:remaining]
+        JobQueue.enqueue_many('draft_reply', [
+            (user, {'email_id': email_id}, f"reply:{user.pk}:{email_id}")
+            for email_id in email_ids
+        ])
+        return len(email_ids)
+
+    @staticmethod
+    def draft(user, email_id):
+        """
+        Draft and store a reply to one email unless it is already drafted or the budget is spent
+
+        Returns:
+            SpeculativeReply object, or None if nothing was drafted
+        """
+        tone, enabled = SpeculativeReplyService.preferences(user)
+        if not enabled:
+            return None
+        if SpeculativeReplyService.used_today(user) >= SPECULATIVE_REPLY_DAILY_BUDGET:
+            logger.info(f"Daily reply drafting budget spent for {user.username}")
+            return None
+
+        email_text = email_source_text(load_email_details(user, email_id))
+        text_hash = content_hash(email_text)
+        existing = SpeculativeReply.objects.filter(user=user, email_id=email_id).first()
+        if existing and existing.tone == tone and existing.content_hash == text_hash:
+            return existing
+
+        # Regenerating a stored reply costs a call as well, so every call is counted up front
+        if not SpeculativeReplyService.reserve_call(user):
+            logger.info(f"Daily reply drafting budget spent for {user.username}")
+            return None
+        # Same call as the reply endpoint, so the email's classification is stored as well
+        enrichment = EnrichmentService.enrich_email(user, email_id, email_text, tone=tone)
+        reply, _ = SpeculativeReply.objects.update_or_create(
+            user=user,
+            email_id=email_id,
+            defaults={
+                'content_hash': text_hash,
+                'tone': tone,
+                'summary': enrichment['summary'],
+                'reply_text': enrichment['reply'],
+                'enrichment': enrichment,
+                'generated_at': timezone.now(),
+                'used_at': None,
+            }
+        )
+        logger.info(f"Drafted a reply to {email_id} ahead of time for {user.username}")
+        return reply
+
+    @staticmethod
+    def lookup(user, email_id, email_text, tone):
+        """
+        Drafted reply for an email, if it was drafted from the same text in the same tone
+
+        Returns:
+            SpeculativeReply object (marked used), or None
+        """
+        if not email_id or user is None or not user.is_authenticated:
+            return None
+        reply = SpeculativeReply.objects.filter(
+            user=user, email_id=email_id, tone=tone, content_hash=content_hash(email_text)
+        ).first()
+        if reply and reply.used_at is None:
+            reply.used_at = timezone.now()
+            reply.save(update_fields=['used_at'])
+        return reply
+
+    @staticmethod
+    def purge(days=SPECULATIVE_REPLY_RETENTION_DAYS):
+        """Delete drafted replies and usage counts older than `days`; returns the number of replies deleted"""
+        cutoff = timezone.now() - timedelta(days=days)
+        SpeculativeReplyUsage.objects.filter(day__lt=timezone.localdate(cutoff)).delete()
+        deleted, _ = SpeculativeReply.objects.filter(generated_at__lt=cutoff).delete()
+        return deleted
+
+
+def run_draft_reply_job(job):
+    """Job handler: draft a reply to one of the user's top unread emails"""
+    SpeculativeReplyService.draft(job.user, job.payload['email_id'])
@@ -0,0 +1,465 @@
+# inbox/services/sync.py
+
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from googleapiclient.errors import HttpError
+from ..models import MailboxMessage, MailboxSyncState
+from .batch import batch_get_messages
+from .mime import parse_headers
+from .enrichment import enqueue_enrichment
+from .semantic import enqueue_indexing
+from .events import InboxEventService, message_payload
+
+logger = logging.getLogger(__name__)
+
+# How many unread messages a full resync mirrors
+MAILBOX_FULL_SYNC_LIMIT = getattr(settings, "MAILBOX_FULL_SYNC_LIMIT", 500)
+# Minimum number of seconds between two history syncs for the same user
+MAILBOX_SYNC_INTERVAL = getattr(settings, "MAILBOX_SYNC_INTERVAL", 15)
+# Queue background enrichment (category, priority, sentiment) for newly seen unread messages
+MAILBOX_AUTO_ENRICH = getattr(settings, "MAILBOX_AUTO_ENRICH", True)
+# Queue a semantic index update when new messages are mirrored
+SEMANTIC_SEARCH_ENABLED = getattr(settings, "SEMANTIC_SEARCH_ENABLED", True)
+
+METADATA_HEADERS = ['Subject', 'From', 'To', 'Cc', 'Date']
+MESSAGE_FIELDS = 'id,threadId,labelIds,snippet,internalDate,sizeEstimate,payload/headers'
+HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+TRASH_LABELS = {'TRASH', 'SPAM'}
+
+
+class HistoryExpired(Exception):
+    """The stored historyId is too old for history.list"""
+
+
+class MailboxSyncService:
+    """Service keeping the local mailbox mirror current with Gmail"""
+
+    @staticmethod
+    def sync(user, service, force=False):
+        """
+        Bring the user's mailbox mirror up to date
+
+        Uses history.list from the stored historyId and only falls back to a
+        full resync when there is no history ID yet or it has expired.
+
+        Args:
+            user: User object
+            service: Gmail service object
+            force: Sync even if the last sync was less than MAILBOX_SYNC_INTERVAL ago
+
+        Returns:
+            bool: True if the mirror is usable, False otherwise
+        """
+        state, _ = MailboxSyncState.objects.get_or_create(user=user)
+
+        if (not force and state.history_id and state.last_synced_at
+                and timezone.now() - state.last_synced_at < timedelta(seconds=MAILBOX_SYNC_INTERVAL)):
+            return True
+
+        # Only one request per process syncs a user at a time, the others use the mirror as is
+        lock_key = f"mailbox_sync_lock_{user.pk}"
+        if not cache.add(lock_key, True, 120):
+            return bool(state.history_id)
+
+        try:
+            if state.history_id:
+                try:
+                    MailboxSyncService.incremental_sync(user, service, state)
+                    return True
+                except HistoryExpired:
+                    logger.warning(f"History {state.history_id} expired for {user.username}, running full resync")
+
+            MailboxSyncService.full_sync(user, service, state)
+            return True
+        except Exception as e:
+            logger.error(f"Error syncing mailbox for {user.username}: {str(e)}", exc_info=True)
+            return bool(state.history_id)
+        finally:
+            cache.delete(lock_key)
+
+    @staticmethod
+    def full_sync(user, service, state):
+        """
+        Rebuild the user's mirror from the current unread messages
+
+        Args:
+            user: User object
+            service: Gmail service object
+            state: MailboxSyncState object
+        """
+        # Take the history position first so nothing that happens while listing is lost
+        profile = service.users().getProfile(userId='me').execute()
+        history_id = str(profile.get('historyId', ''))
+
+        message_ids = []
+        page_token = None
+        while len(message_ids) < MAILBOX_FULL_SYNC_LIMIT:
+            response = service.users().messages().list(
+                userId='me',
+                labelIds=['UNREAD'],
+                maxResults=min(500, MAILBOX_FULL_SYNC_LIMIT - len(message_ids)),
+                pageToken=page_token,
+                fields='messages/id,nextPageToken'
+            ).execute()
+            message_ids.extend(m['id'] for m in response.get('messages', []))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+
+        messages = MailboxSyncService._fetch_metadata(service, message_ids)
+
+        with transaction.atomic():
+            MailboxMessage.objects.filter(user=user).exclude(message_id__in=message_ids).delete()
+            MailboxSyncService._upsert_messages(user, messages.values())
+            # Too much may have changed to describe; open tabs reload their lists
+            InboxEventService.publish(user, 'resync')
+            state.history_id = history_id
+            state.unread_page_token = page_token or ''
+            state.last_full_sync = timezone.now()
+            state.last_synced_at = timezone.now()
+            state.save()
+
+        logger.info(f"Full mailbox sync for {user.username}: {len(messages)} messages at history {history_id}")
+
+    @staticmethod
+    def incremental_sync(user, service, state):
+        """
+        Apply Gmail history since the stored historyId to the mirror
+
+        Args:
+            user: User object
+            service: Gmail service object
+            state: MailboxSyncState object
+
+        Raises:
+            HistoryExpired: If Gmail no longer has history for the stored historyId
+        """
+        added = set()
+        deleted = set()
+        labels = {}  # message ID -> latest known label IDs
+        history_id = state.history_id
+        page_token = None
+
+        while True:
+            try:
+                response = service.users().history().list(
+                    userId='me',
+                    startHistoryId=state.history_id,
+                    historyTypes=HISTORY_TYPES,
+                    pageToken=page_token
+                ).execute()
+            except HttpError as e:
+                if e.resp.status == 404:
+                    raise HistoryExpired(state.history_id)
+                raise
+
+            for record in response.get('history', []):
+                for item in record.get('messagesAdded', []):
+                    message = item['message']
+                    added.add(message['id'])
+                    deleted.discard(message['id'])
+                    labels[message['id']] = message.get('labelIds', [])
+                for item in record.get('messagesDeleted', []):
+                    deleted.add(item['message']['id'])
+                    added.discard(item['message']['id'])
+                for item in record.get('labelsAdded', []) + record.get('labelsRemoved', []):
+                    message = item['message']
+                    labels[message['id']] = message.get('labelIds', [])
+
+            history_id = response.get('historyId', history_id)
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+
+        existing = set(
+            MailboxMessage.objects.filter(user=user, message_id__in=list(labels))
+            .values_list('message_id', flat=True)
+        )
+        # New messages, and messages we never mirrored that just became unread
+        to_fetch = {
+            message_id for message_id in labels
+            if message_id not in deleted and message_id not in existing
+            and (message_id in added or 'UNREAD' in labels[message_id])
+        }
+        messages = MailboxSyncService._fetch_metadata(service, to_fetch)
+
+        with transaction.atomic():
+            if deleted:
+                MailboxMessage.objects.filter(user=user, message_id__in=list(deleted)).delete()
+                InboxEventService.publish(user, 'message_removed', {'ids': sorted(deleted)})
+            created = MailboxSyncService._upsert_messages(user, messages.values())
+            InboxEventService.publish_many(user, 'message_added', [message_payload(row) for row in created])
+            MailboxSyncService.apply_labels(user, {
+                message_id: labels[message_id] for message_id in existing - deleted
+            })
+            state.history_id = str(history_id)
+            state.last_synced_at = timezone.now()
+            state.save()
+
+        if added or deleted or labels:
+            logger.info(f"Incremental mailbox sync for {user.username}: {len(added)} added, "
+                        f"{len(deleted)} deleted, {len(labels)} changed, now at history {history_id}")
+
+    @staticmethod
+    def apply_labels(user, labels):
+        """
+        Set the label IDs of mirrored messages
+
+        Messages that end up with the same labels are updated together, and
+        the whole change is announced as one labels_changed event.
+
+        Args:
+            user: User object
+            labels: Dict of Gmail message ID -> full list of label IDs it now has
+        """
+        groups = {}
+        for message_id, label_ids in labels.items():
+            groups.setdefault(tuple(label_ids), []).append(message_id)
+
+        now = timezone.now()
+        changes = []
+        for label_ids, message_ids in groups.items():
+            label_ids = list(label_ids)
+            updated = MailboxMessage.objects.filter(user=user, message_id__in=message_ids).update(
+                label_ids=label_ids,
+                is_unread='UNREAD' in label_ids,
+                is_trashed=bool(TRASH_LABELS & set(label_ids)),
+                synced_at=now
+            )
+            if updated:
+                changes.append({
+                    'ids': sorted(message_ids),
+                    'label_ids': label_ids,
+                    'is_unread': 'UNREAD' in label_ids and not TRASH_LABELS & set(label_ids),
+                })
+        if changes:
+            InboxEventService.publish(user, 'labels_changed', {'changes': changes})
+
+    @staticmethod
+    def modify_labels(user, message_ids, add_labels=(), remove_labels=()):
+        """
+        Mirror a label change we made through the Gmail API
+
+        Args:
+            user: User object
+            message_ids: List of Gmail message IDs
+            add_labels: Label IDs that were added
+            remove_labels: Label IDs that were removed
+        """
+        if not user or not user.is_authenticated:
+            return
+
+        labels = {}
+        rows = MailboxMessage.objects.filter(user=user, message_id__in=list(message_ids))
+        for row in rows.only('id', 'message_id', 'label_ids'):
+            label_ids = [label for label in row.label_ids if label not in remove_labels]
+            label_ids += [label for label in add_labels if label not in label_ids]
+            labels[row.message_id] = label_ids
+        MailboxSyncService.apply_labels(user, labels)
+
+    @staticmethod
+    def get_unread_emails(user, max_results=100):
+        """
+        Get unread emails from the mirror, newest first
+
+        Args:
+            user: User object
+            max_results: Maximum number of emails
+
+        Returns:
+            List of email dicts shaped like services.gmail.fetch_unread
+        """
+        rows = (
+            MailboxMessage.objects
+            .filter(user=user, is_unread=True, is_trashed=False)
+            .order_by('-internal_date')[:max_results]
+        )
+        return [row.to_email_dict() for row in rows]
+
+    @staticmethod
+    def get_unread_page(user, page_size, after=None):
+        """
+        Get one page of unread emails from the mirror using keyset pagination
+
+        Rows are ordered newest first by (internal_date, id), so each page is a
+        single index range scan no matter how deep into the mailbox it is.
+
+        Args:
+            user: User object
+            page_size: Number of emails on the page
+            after: Keyset (internal date in ms or None, row ID) of the last email on the previous page
+
+        Returns:
+            Tuple of (list of email dicts, keyset of the last email or None if this is the last page)
+        """
+        rows = (
+            MailboxMessage.objects
+            .filter(user=user, is_unread=True, is_trashed=False)
+            .order_by(F('internal_date').desc(nulls_last=True), '-id')
+        )
+        if after is not None:
+            after_ms, after_id = after
+            if after_ms is None:
+                rows = rows.filter(internal_date__isnull=True, id__lt=after_id)
+            else:
+                after_date = datetime.fromtimestamp(after_ms / 1000, tz=dt_timezone.utc)
+                rows = rows.filter(
+                    Q(internal_date__lt=after_date)
+                    | Q(internal_date=after_date, id__lt=after_id)
+                    | Q(internal_date__isnull=True)
+                )
+
+        rows = list(rows[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+
+        next_after = None
+        if has_more:
+            last = rows[-1]
+            last_ms = int(last.internal_date.timestamp() * 1000) if last.internal_date else None
+            next_after = (last_ms, last.id)
+        return [row.to_email_dict() for row in rows], next_after
+
+    @staticmethod
+    def count_unread(user):
+        """Number of unread emails in the mirror"""
+        return MailboxMessage.objects.filter(user=user, is_unread=True, is_trashed=False).count()
+
+    @staticmethod
+    def get_unread_page_token(user):
+        """Gmail page token for the unread messages that did not fit in the mirror ('' if none)"""
+        state = MailboxSyncState.objects.filter(user=user).only('unread_page_token').first()
+        return state.unread_page_token if state else ''
+
+    @staticmethod
+    def get_message(user, message_id):
+        """
+        Get a mirrored message
+
+        Args:
+            user: User object
+            message_id: Gmail message ID
+
+        Returns:
+            MailboxMessage object or None
+        """
+        return MailboxMessage.objects.filter(user=user, message_id=message_id).first()
+
+    @staticmethod
+    def get_messages(user, message_ids):
+        """
+        Get mirrored messages keyed by Gmail message ID
+
+        Args:
+            user: User object
+            message_ids: List of Gmail message IDs
+
+        Returns:
+            Dict of message ID -> MailboxMessage object
+        """
+        rows = MailboxMessage.objects.filter(user=user, message_id__in=list(message_ids))
+        return {row.message_id: row for row in rows}
+
+    @staticmethod
+    def store_details(user, details, thread_id=''):
+        """
+        Store a fully fetched email (including bodies) in the mirror
+
+        Args:
+            user: User object
+            details: Email dict from services.gmail.get_email_details
+            thread_id: Gmail thread ID, if known
+
+        Returns:
+            MailboxMessage object
+        """
+        defaults = {
+            'subject': details.get('subject', ''),
+            'sender': details.get('from', ''),
+            'recipients': details.get('to', ''),
+            'cc': details.get('cc', ''),
+            'date': details.get('date', ''),
+            'snippet': details.get('snippet', ''),
+            'body_text': details.get('body_text', ''),
+            'body_html': details.get('body_html', ''),
+            'body_fetched': True,
+        }
+        if thread_id or details.get('threadId'):
+            defaults['thread_id'] = thread_id or details.get('threadId')
+        message, _ = MailboxMessage.objects.update_or_create(
+            user=user,
+            message_id=details['id'],
+            defaults=defaults
+        )
+        return message
+
+    @staticmethod
+    def remove_messages(user, message_ids):
+        """
+        Drop messages from the mirror (e.g. after they were trashed)
+
+        Args:
+            user: User object
+            message_ids: List of Gmail message IDs
+        """
+        if user and user.is_authenticated:
+            deleted, _ = MailboxMessage.objects.filter(user=user, message_id__in=list(message_ids)).delete()
+            if deleted:
+                InboxEventService.publish(user, 'message_removed', {'ids': list(message_ids)})
+
+    @staticmethod
+    def _fetch_metadata(service, message_ids):
+        """Batch-fetch message metadata (headers, labels, snippet) without bodies"""
+        return batch_get_messages(
+            service,
+            list(message_ids),
+            format='metadata',
+            metadataHeaders=METADATA_HEADERS,
+            fields=MESSAGE_FIELDS
+        )
+
+    @staticmethod
+    def _upsert_messages(user, messages):
+        """Create or update mirror rows from Gmail metadata resources; returns the created rows"""
+        created_rows = []
+        new_unread = []
+        for message in messages:
+            headers = parse_headers(message.get('payload', {}).get('headers'))
+            label_ids = message.get('labelIds', [])
+            internal_date = None
+            if message.get('internalDate'):
+                internal_date = datetime.fromtimestamp(int(message['internalDate']) / 1000, tz=dt_timezone.utc)
+
+            row, created = MailboxMessage.objects.update_or_create(
+                user=user,
+                message_id=message['id'],
+                defaults={
+                    'thread_id': message.get('threadId', ''),
+                    'label_ids': label_ids,
+                    'is_unread': 'UNREAD' in label_ids,
+                    'is_trashed': bool(TRASH_LABELS & set(label_ids)),
+                    'subject': headers.get('subject', ''),
+                    'sender': headers.get('from', ''),
+                    'recipients': headers.get('to', ''),
+                    'cc': headers.get('cc', ''),
+                    'date': headers.get('date', ''),
+                    'internal_date': internal_date,
+                    'snippet': message.get('snippet', ''),
+                    'size_estimate': message.get('sizeEstimate', 0),
+                }
+            )
+            if created:
+                created_rows.append(row)
+                if row.is_unread and not row.is_trashed:
+                    new_unread.append(row.message_id)
+
+        if MAILBOX_AUTO_ENRICH and new_unread:
+            enqueue_enrichment(user, new_unread)
+        if SEMANTIC_SEARCH_ENABLED and created_rows:
+            enqueue_indexing(user)
+        return created_rows
@@ -0,0 +1,188 @@
+# inbox/services/threads.py
+
+import logging
+import re
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from ..models import ThreadAnalysis, MessageAnalysis
+from . import aio, gemini
+from .gmail import extract_email_address
+from .mime import parse_message
+
+logger = logging.getLogger(__name__)
+
+# Messages of one thread analyzed at once
+THREAD_ANALYSIS_CONCURRENCY = getattr(settings, "THREAD_ANALYSIS_CONCURRENCY", 4)
+# Key points kept in the thread rollup, taken from the newest messages
+THREAD_ROLLUP_KEY_POINTS = 10
+
+SENTIMENTS = {'positive', 'negative', 'neutral'}
+SUBJECT_PREFIX_RE = re.compile(r'^\s*((re|fwd?|aw|wg)\s*:\s*)+', re.IGNORECASE)
+
+
+def _message_date(message):
+    """Received time of a thread message (Gmail's internalDate, in milliseconds)"""
+    try:
+        return datetime.fromtimestamp(int(message['internalDate']) / 1000, tz=dt_timezone.utc)
+    except (KeyError, TypeError, ValueError):
+        return timezone.now()
+
+
+def _stored_analysis(row):
+    return {'sentiment': row.sentiment, 'key_points': row.key_points, 'summary': row.summary}
+
+
+class ThreadAnalysisService:
+    """
+    Per-message analysis of a thread with the results stored in MessageAnalysis
+
+    Gmail messages never change, so a stored analysis stays valid: analyzing a
+    thread again only sends the messages that arrived since to the model. The
+    thread-level ThreadAnalysis is a rollup of the per-message results.
+    """
+
+    @staticmethod
+    def rollup(thread_messages):
+        """
+        Combine per-message results into a thread summary without another model call
+
+        Args:
+            thread_messages: List of per-message result dicts, oldest first
+
+        Returns:
+            Dict with the ThreadAnalysis fields (main_topic, key_points, decisions,
+            action_items, overall_sentiment, message_count)
+        """
+        # Later messages carry more weight: they reflect where the conversation ended up
+        votes = Counter()
+        for position, item in enumerate(thread_messages, start=1):
+            sentiment = item['analysis'].get('sentiment')
+            if sentiment in SENTIMENTS:
+                votes[sentiment] += position
+        ranked = votes.most_common(2)
+        if not ranked or (len(ranked) > 1 and ranked[0][1] == ranked[1][1]):
+            overall_sentiment = 'neutral'
+        else:
+            overall_sentiment = ranked[0][0]
+
+        key_points, seen = [], set()
+        for item in reversed(thread_messages):
+            for point in reversed(item['analysis'].get('key_points') or []):
+                point = str(point).strip()
+                if point and point.lower() not in seen:
+                    seen.add(point.lower())
+                    key_points.append(point)
+        key_points = list(reversed(key_points[:THREAD_ROLLUP_KEY_POINTS]))
+
+        subject = thread_messages[0]['subject'] if thread_messages else ''
+        return {
+            'main_topic': SUBJECT_PREFIX_RE.sub('', subject).strip() or '(no subject)',
+            'key_points': key_points,
+            'decisions': '',
+            'action_items': '',
+            'overall_sentiment': overall_sentiment,
+            'message_count': len(thread_messages),
+        }
+
+    @staticmethod
+    def load(user, thread_id):
+        """Stored analyses of a thread's messages, by message ID"""
+        if not user:
+            return {}
+        rows = MessageAnalysis.objects.filter(thread_analysis__user=user, thread_analysis__thread_id=thread_id)
+        return {row.message_id: row for row in rows}
+
+    @staticmethod
+    def save(user, thread_id, thread_messages, new_ids, rollup):
+        """
+        Store the rollup and the analyses of newly analyzed messages in one transaction
+
+        Analyses of messages that are no longer in the thread are removed.
+        """
+        with transaction.atomic():
+            thread_analysis, _ = ThreadAnalysis.objects.update_or_create(
+                user=user, thread_id=thread_id, defaults=rollup
+            )
+            thread_analysis.message_analyses.exclude(
+                message_id__in=[item['message_id'] for item in thread_messages]
+            ).delete()
+            # ignore_conflicts: a concurrent request may have stored the same message
+            MessageAnalysis.objects.bulk_create([
+                MessageAnalysis(
+                    thread_analysis=thread_analysis,
+                    message_id=item['message_id'],
+                    from_email=extract_email_address(item['from'])[:254],
+                    date=item['received_at'],
+                    subject=item['subject'][:255],
+                    sentiment=item['analysis']['sentiment'],
+                    key_points=item['analysis']['key_points'],
+                    summary=item['analysis']['summary'],
+                )
+                for item in thread_messages if item['message_id'] in new_ids
+            ], ignore_conflicts=True)
+
+    @staticmethod
+    async def analyze(user, thread_id, thread):
+        """
+        Analyze the messages of a thread, reusing stored analyses
+
+        Args:
+            user: User object, or None (nothing is stored)
+            thread_id: Gmail thread ID
+            thread: Gmail thread resource in full format (its messages are used as is)
+
+        Returns:
+            Tuple of (list of per-message result dicts oldest first, rollup dict,
+            number of messages sent to the model)
+        """
+        thread_messages = []
+        for message in thread.get('messages', []):
+            parsed = parse_message(message)
+            thread_messages.append({
+                'message_id': message['id'],
+                'from': parsed.header('From', 'Unknown'),
+                'date': parsed.header('Date'),
+                'subject': parsed.header('Subject', '(no subject)'),
+                'received_at': _message_date(message),
+                'body_text': parsed.body_text,
+            })
+
+        stored = await sync_to_async(ThreadAnalysisService.load)(user, thread_id)
+        pending = [item for item in thread_messages if item['message_id'] not in stored]
+        results = await aio.gather_limited(
+            (gemini.aanalyze_email_message(item['body_text']) for item in pending),
+            limit=THREAD_ANALYSIS_CONCURRENCY,
+        )
+
+        new_ids = set()
+        for item, result in zip(pending, results):
+            if not isinstance(result, dict):
+                logger.error(f"Error analyzing message {item['message_id']}: {str(result)}")
+                result = {'sentiment': 'error', 'key_points': [], 'summary': f"Error analyzing message: {str(result)}"}
+            elif result.get('sentiment') != 'error':
+                # Store only usable results; failed messages are retried on the next request
+                sentiment = str(result.get('sentiment') or '').strip().lower()
+                result = {
+                    'sentiment': sentiment if sentiment in SENTIMENTS else 'neutral',
+                    'key_points': [str(point) for point in result.get('key_points') or []],
+                    'summary': str(result.get('summary') or ''),
+                }
+                new_ids.add(item['message_id'])
+            item['analysis'] = result
+        for item in thread_messages:
+            if item['message_id'] in stored:
+                item['analysis'] = _stored_analysis(stored[item['message_id']])
+
+        rollup = ThreadAnalysisService.rollup(thread_messages)
+        if user and (new_ids or len(stored) != len(thread_messages)):
+            await sync_to_async(ThreadAnalysisService.save)(user, thread_id, thread_messages, new_ids, rollup)
+
+        for item in thread_messages:
+            del item['body_text']
+            del item['received_at']
+        logger.info(f"Analyzed thread {thread_id}: {len(pending)} new of {len(thread_messages)} messages")
+        return thread_messages, rollup, len(pending)
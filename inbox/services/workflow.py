@@ -1,9 +1,22 @@
 # inbox/services/workflow.py
 
+import logging
 from datetime import datetime, timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
 from ..models import Reminder, ScheduledEmail, EmailCategory, EmailCategorization, EmailPriority
+from ..signals import reminder_due, scheduled_email_sent
 from . import gemini
+from .classifier import LocalClassifierService
+from .meta import EmailMetaService
+
+logger = logging.getLogger(__name__)
+
+# Emails classified per model call by BatchClassificationService
+CLASSIFY_BATCH_SIZE = getattr(settings, "CLASSIFY_BATCH_SIZE", 20)
 
 class ReminderService:
     """Service for managing email reminders"""
@@ -28,6 +41,7 @@ class ReminderService:
             reminder_time=reminder_time,
             message=message
         )
+        EmailMetaService.update(user, email_id, has_reminder=True)
         return reminder
     
     @staticmethod
@@ -55,9 +69,35 @@ class ReminderService:
             reminder = Reminder.objects.get(id=reminder_id)
             reminder.completed = True
             reminder.save()
+            EmailMetaService.refresh_reminders(reminder.user, reminder.email_id)
             return True
         except Reminder.DoesNotExist:
             return False
+    
+    @staticmethod
+    def notify_reminder(reminder_id):
+        """
+        Push a due reminder to the `reminder_due` receivers and mark it notified
+        
+        Receivers run before the reminder is marked, so a crash in between repeats
+        the notification rather than losing it.
+        
+        Args:
+            reminder_id: ID of the reminder
+            
+        Returns:
+            bool: True if the reminder was notified by this call
+        """
+        reminder = Reminder.objects.filter(
+            id=reminder_id, completed=False, notified_at__isnull=True
+        ).select_related('user').first()
+        if not reminder:
+            return False
+        
+        reminder_due.send(sender=Reminder, reminder=reminder)
+        Reminder.objects.filter(id=reminder.id).update(notified_at=timezone.now())
+        logger.info(f"Reminder {reminder.id} for email {reminder.email_id} is due")
+        return True
 
 
 class SchedulingService:
@@ -99,23 +139,88 @@ class SchedulingService:
     @staticmethod
     def send_scheduled_email(scheduled_email_id):
         """
-        Send a scheduled email
+        Send a scheduled email's Gmail draft
+        
+        The scheduler delivers at least once, so this is safe to repeat: sent rows
+        are skipped, and since Gmail deletes a draft when it sends it, a draft that
+        is gone after an earlier attempt reached Gmail is taken as sent.
         
         Args:
             scheduled_email_id: ID of the scheduled email
             
         Returns:
-            bool: True if successful, False otherwise
+            bool: True if the email has been sent (now or before), False if it can't be
+        
+        Raises:
+            Exception: On errors worth retrying (Gmail unavailable, missing credentials)
         """
+        from googleapiclient.errors import HttpError
+        from .gmail import get_gmail_service
+        from .ratelimit import classify_error
+        
         try:
-            scheduled_email = ScheduledEmail.objects.get(id=scheduled_email_id)
-            # Here you would implement the actual email sending logic
-            # For now, we'll just mark it as sent
-            scheduled_email.sent = True
-            scheduled_email.save()
-            return True
+            scheduled_email = ScheduledEmail.objects.select_related('user').get(id=scheduled_email_id)
         except ScheduledEmail.DoesNotExist:
             return False
+        if scheduled_email.sent:
+            return True
+        if scheduled_email.failed:
+            return False
+        
+        previous_attempts = scheduled_email.attempts
+        ScheduledEmail.objects.filter(id=scheduled_email.id).update(attempts=F('attempts') + 1)
+        
+        service = get_gmail_service(user=scheduled_email.user)
+        if not service:
+            raise RuntimeError("No Gmail credentials")
+        
+        try:
+            message = service.users().drafts().send(
+                userId='me', body={'id': scheduled_email.email_id}
+            ).execute()
+        except HttpError as e:
+            if e.resp.status == 404 and previous_attempts:
+                # An earlier attempt sent it but its worker died before recording that
+                logger.warning(f"Draft of scheduled email {scheduled_email.id} is gone, assuming it was sent")
+                message = {}
+            elif classify_error(e)[0]:
+                raise
+            else:
+                SchedulingService._mark_failed(scheduled_email.id, e)
+                return False
+        
+        sent = ScheduledEmail.objects.filter(id=scheduled_email.id, sent=False).update(
+            sent=True, sent_at=timezone.now(), sent_message_id=message.get('id', ''), last_error=''
+        )
+        if sent:
+            scheduled_email.refresh_from_db()
+            logger.info(f"Sent scheduled email {scheduled_email.id} as message {scheduled_email.sent_message_id}")
+            scheduled_email_sent.send(sender=ScheduledEmail, scheduled_email=scheduled_email)
+        return True
+    
+    @staticmethod
+    def _mark_failed(scheduled_email_id, error):
+        """Give up on a scheduled email; the draft stays in Gmail"""
+        ScheduledEmail.objects.filter(id=scheduled_email_id, sent=False).update(failed=True, last_error=str(error))
+        logger.error(f"Scheduled email {scheduled_email_id} failed: {str(error)}")
+
+
+def run_scheduled_email_job(job):
+    """Job handler: send a due scheduled email (queued by `manage.py run_scheduler`)"""
+    scheduled_email_id = job.payload['scheduled_email_id']
+    try:
+        SchedulingService.send_scheduled_email(scheduled_email_id)
+    except Exception as e:
+        if job.attempts >= job.max_attempts:
+            SchedulingService._mark_failed(scheduled_email_id, e)
+        else:
+            ScheduledEmail.objects.filter(id=scheduled_email_id).update(last_error=str(e))
+        raise
+
+
+def run_reminder_job(job):
+    """Job handler: fire a due reminder (queued by `manage.py run_scheduler`)"""
+    ReminderService.notify_reminder(job.payload['reminder_id'])
 
 
 class CategorizationService:
@@ -124,7 +229,7 @@ class CategorizationService:
     VALID_CATEGORIES = ['Work', 'Personal', 'Social', 'Promotions', 'Finance', 'Travel', 'Other']
     
     @staticmethod
-    def categorize_email(user, email_id, category):
+    def categorize_email(user, email_id, category, source='manual', confidence=None):
         """
         Manually categorize an email
         
@@ -132,6 +237,8 @@ class CategorizationService:
             user: User object
             email_id: ID of the email
             category: Category name
+            source: Who chose the category: 'manual', 'llm' or 'local'
+            confidence: Confidence of an automatic category (0-100)
             
         Returns:
             EmailCategorization object
@@ -150,16 +257,16 @@ class CategorizationService:
         )
         
         # Create or update the categorization
-        categorization, created = EmailCategorization.objects.get_or_create(
+        defaults = {'category': category_obj, 'source': source}
+        if confidence is not None:
+            defaults['confidence'] = Decimal(str(round(confidence, 2)))
+        categorization, created = EmailCategorization.objects.update_or_create(
             user=user,
             email_id=email_id,
-            defaults={'category': category_obj}
+            defaults=defaults
         )
         
-        if not created:
-            categorization.category = category_obj
-            categorization.save()
-            
+        EmailMetaService.update(user, email_id, category=category_obj)
         return categorization
     
     @staticmethod
@@ -197,6 +304,15 @@ class CategorizationService:
         Returns:
             EmailCategorization object
         """
+        # The local classifier answers most emails (newsletters, receipts) without the LLM
+        prediction = LocalClassifierService.predict(
+            user, LocalClassifierService.email_for(user, email_id, email_content)
+        )
+        confident = LocalClassifierService.confident(prediction, 'category')
+        if confident:
+            category, confidence = confident
+            return CategorizationService.categorize_email(user, email_id, category, source='local', confidence=confidence * 100)
+        
         # Create a prompt for categorization
         prompt = f"""
         Categorize the following email into one of these categories: {', '.join(CategorizationService.VALID_CATEGORIES)}
@@ -218,14 +334,14 @@ class CategorizationService:
                 break
         
         # Save the category
-        return CategorizationService.categorize_email(user, email_id, category)
+        return CategorizationService.categorize_email(user, email_id, category, source='llm')
 
 
 class PriorityScoringService:
     """Service for scoring email priority"""
     
     @staticmethod
-    def set_priority(user, email_id, priority):
+    def set_priority(user, email_id, priority, source='manual'):
         """
         Manually set the priority of an email
         
@@ -233,6 +349,7 @@ class PriorityScoringService:
             user: User object
             email_id: ID of the email
             priority: Priority score (1-10)
+            source: Who chose the priority: 'manual', 'llm' or 'local'
             
         Returns:
             EmailPriority object
@@ -243,16 +360,13 @@ class PriorityScoringService:
         if not isinstance(priority, int) or priority < 1 or priority > 10:
             raise ValueError("Priority must be an integer between 1 and 10")
         
-        email_priority, created = EmailPriority.objects.get_or_create(
+        email_priority, created = EmailPriority.objects.update_or_create(
             user=user,
             email_id=email_id,
-            defaults={'priority': priority}
+            defaults={'priority': priority, 'source': source}
         )
         
-        if not created:
-            email_priority.priority = priority
-            email_priority.save()
-            
+        EmailMetaService.update(user, email_id, priority=priority)
         return email_priority
     
     @staticmethod
@@ -285,6 +399,13 @@ class PriorityScoringService:
         Returns:
             EmailPriority object
         """
+        prediction = LocalClassifierService.predict(
+            user, LocalClassifierService.email_for(user, email_id, email_content)
+        )
+        confident = LocalClassifierService.confident(prediction, 'priority')
+        if confident:
+            return PriorityScoringService.set_priority(user, email_id, confident[0], source='local')
+        
         # Create a prompt for priority scoring
         prompt = f"""
         Analyze the following email and assign a priority score from 1 to 10, where:
@@ -322,4 +443,146 @@ class PriorityScoringService:
         priority = max(1, min(10, priority))
         
         # Save the priority
-        return PriorityScoringService.set_priority(user, email_id, priority)
\ No newline at end of file
+        return PriorityScoringService.set_priority(user, email_id, priority, source='llm')
+
+
+class BatchClassificationService:
+    """Service for categorizing and scoring many emails with one model call per batch"""
+    
+    @staticmethod
+    def _validate(item, pending_ids):
+        """
+        Check one element of the model's answer
+
+        Returns:
+            Tuple of (email ID, category, priority), or None if the element is unusable
+        """
+        if not isinstance(item, dict) or str(item.get('id')) not in pending_ids:
+            return None
+        category = str(item.get('category') or '').strip().title()
+        if category not in CategorizationService.VALID_CATEGORIES:
+            return None
+        try:
+            priority = int(item.get('priority'))
+        except (TypeError, ValueError):
+            return None
+        if priority < 1 or priority > 10:
+            return None
+        return str(item['id']), category, priority
+    
+    @staticmethod
+    def classify_locally(user, email_id, email):
+        """
+        Store the local classifier's category and priority if it is confident about both
+        
+        Args:
+            user: User object
+            email_id: Gmail message ID
+            email: Dict with any of subject, from, snippet, body_text and label_ids
+            
+        Returns:
+            Tuple of (category, priority), or None if the LLM is needed
+        """
+        prediction = LocalClassifierService.predict(user, email)
+        category = LocalClassifierService.confident(prediction, 'category')
+        priority = LocalClassifierService.confident(prediction, 'priority')
+        if not (category and priority):
+            return None
+        with transaction.atomic():
+            CategorizationService.categorize_email(user, email_id, category[0], source='local', confidence=category[1] * 100)
+            PriorityScoringService.set_priority(user, email_id, priority[0], source='local')
+        return category[0], priority[0]
+    
+    @staticmethod
+    def _classify_batch(emails):
+        """
+        Classify one batch with a single model call
+
+        Returns:
+            Tuple of (dict of email ID -> (category, priority), dict of email ID -> error
+            for the emails the answer did not cover, whether the model answered at all)
+        """
+        pending_ids = {email['id'] for email in emails}
+        answer = gemini.classify_emails(emails)
+        if isinstance(answer, dict):
+            error = answer.get('error', 'Classification failed')
+            return {}, {email['id']: error for email in emails}, 'raw_response' in answer
+        
+        classified = {}
+        for item in answer:
+            validated = BatchClassificationService._validate(item, pending_ids)
+            if validated:
+                classified[validated[0]] = validated[1:]
+        return classified, {
+            email['id']: 'Missing or invalid in the model response'
+            for email in emails if email['id'] not in classified
+        }, True
+    
+    @staticmethod
+    def classify(user, emails, batch_size=CLASSIFY_BATCH_SIZE, force=False):
+        """
+        Categorize and score emails, up to `batch_size` per model call
+        
+        Emails whose batch answer is missing or invalid are retried one at a time
+        (not when the call itself failed: the rate limiter has retried it already).
+        Unless `force` is set, emails that already have a category and priority are
+        returned from their stored metadata without a model call. Emails the local
+        classifier is confident about are not sent to the model either.
+        
+        Args:
+            user: User object
+            emails: List of dicts with id, from, subject and snippet (and label_ids if known)
+            batch_size: Emails per model call
+            force: Classify emails that are already classified again
+            
+        Returns:
+            Dict with 'results' (email ID -> {'category', 'priority', 'stored', 'local'}),
+            'failed' (email ID -> error) and 'model_calls'
+        """
+        emails = list({email['id']: email for email in emails}.values())
+        results, failed, model_calls = {}, {}, 0
+        
+        if not force:
+            meta = EmailMetaService.get_many(user, [email['id'] for email in emails])
+            for email_id, row in meta.items():
+                if row.category_id and row.priority:
+                    results[email_id] = {'category': row.category.name, 'priority': row.priority, 'stored': True, 'local': False}
+            emails = [email for email in emails if email['id'] not in results]
+        
+        local = {}
+        for email in emails:
+            stored = BatchClassificationService.classify_locally(user, email['id'], email)
+            if stored:
+                local[email['id']] = stored
+                results[email['id']] = {'category': stored[0], 'priority': stored[1], 'stored': False, 'local': True}
+        emails = [email for email in emails if email['id'] not in local]
+        
+        classified = {}
+        for start in range(0, len(emails), batch_size):
+            batch = emails[start:start + batch_size]
+            batch_classified, batch_failed, answered = BatchClassificationService._classify_batch(batch)
+            model_calls += 1
+            classified.update(batch_classified)
+            
+            if answered and len(batch) > 1:
+                for email in batch:
+                    if email['id'] not in batch_failed:
+                        continue
+                    retried, retry_failed, _ = BatchClassificationService._classify_batch([email])
+                    model_calls += 1
+                    classified.update(retried)
+                    failed.update(retry_failed)
+            else:
+                failed.update(batch_failed)
+        
+        with transaction.atomic():
+            for email_id, (category, priority) in classified.items():
+                CategorizationService.categorize_email(user, email_id, category, source='llm')
+                PriorityScoringService.set_priority(user, email_id, priority, source='llm')
+                results[email_id] = {'category': category, 'priority': priority, 'stored': False, 'local': False}
+        
+        if classified:
+            LocalClassifierService.schedule_training(user)
+        logger.info(f"Classified {len(local)} emails locally and {len(classified)} with {model_calls} model calls, "
+                    f"{len(failed)} failed")
+        return {'results': results, 'failed': failed, 'model_calls': model_calls}
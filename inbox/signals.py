@@ -0,0 +1,10 @@
+# inbox/signals.py
+
+from django.dispatch import Signal
+
+# Sent by the scheduler when a reminder comes due (kwargs: reminder). Delivery is
+# at least once, so receivers must tolerate the same reminder twice.
+reminder_due = Signal()
+
+# Sent after a scheduled email went out through Gmail (kwargs: scheduled_email)
+scheduled_email_sent = Signal()
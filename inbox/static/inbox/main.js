@@ -25,6 +25,11 @@ let totalPages = 1;
 let perPage = 10;
 let currentDraftsPage = 1;
 let totalDraftsPages = 1;
+// Cursors of the pages seen so far (index 0 is the first page); the API only knows "next"
+let emailCursors = [null];
+let draftCursors = [null];
+let totalEmailsEstimate = null;
+let totalDraftsEstimate = null;
 let editingDraftId = null;
 let currentView = 'emails'; // Track if we're viewing emails or drafts
 
@@ -603,13 +608,13 @@ async function markAllAsRead() {
     }
     
     try {
-        const response = await fetch('/api/bulk-mark-as-read/', {
+        const response = await fetch('/api/emails/bulk/', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
                 'X-CSRFToken': getCSRFToken()
             },
-            body: JSON.stringify({ email_ids: emailIds })
+            body: JSON.stringify({ action: 'mark-read', email_ids: emailIds })
         });
         
         const data = await response.json();
@@ -910,6 +915,7 @@ async function checkAuthStatus() {
             authSection.style.display = 'none';
             // Load emails only if authenticated
             loadEmails(1);
+            connectInboxEvents();
         } else {
             authSection.style.display = 'block';
         }
@@ -975,13 +981,26 @@ async function loadEmails(page = 1) {
     
     try {
         // Use the global perPage variable
-        const response = await fetch(`/api/unread-emails/?page=${page}&per_page=${perPage}`);
+        if (page === 1) emailCursors = [null];
+        const cursor = emailCursors[page - 1];
+        const response = await fetch(`/api/unread-emails/?per_page=${perPage}${cursor ? `&cursor=${encodeURIComponent(cursor)}` : ''}`);
         const data = await response.json();
         
         if (data.ok) {
-            totalPages = data.total_pages || 1;
-            currentPage = data.current_page || currentPage;
+            // Remember where the next page starts and forget cursors beyond it
+            emailCursors.length = page;
+            if (data.next_cursor) emailCursors.push(data.next_cursor);
+            if (data.total_estimate !== null && data.total_estimate !== undefined) {
+                totalEmailsEstimate = data.total_estimate;
+            }
+            totalPages = emailCursors.length;
             perPage = data.per_page || perPage; // Update perPage from response
+            Object.assign(data, {
+                total_pages: totalPages,
+                current_page: page,
+                has_previous: page > 1,
+                total_emails: totalEmailsEstimate
+            });
             
             renderEmails(data.emails);
             renderPagination(data, false); // Pass false to indicate we are rendering emails
@@ -1040,13 +1059,25 @@ async function loadDrafts(page = 1) {
     }
     
     try {
-        const response = await fetch(`/api/drafts/?page=${page}&per_page=${perPage}`);
+        if (page === 1) draftCursors = [null];
+        const cursor = draftCursors[page - 1];
+        const response = await fetch(`/api/drafts/?per_page=${perPage}${cursor ? `&cursor=${encodeURIComponent(cursor)}` : ''}`);
         const data = await response.json();
         
         if (data.ok) {
-            totalDraftsPages = data.total_pages || 1;
-            currentDraftsPage = data.current_page || currentDraftsPage;
+            draftCursors.length = page;
+            if (data.next_cursor) draftCursors.push(data.next_cursor);
+            if (data.total_estimate !== null && data.total_estimate !== undefined) {
+                totalDraftsEstimate = data.total_estimate;
+            }
+            totalDraftsPages = draftCursors.length;
             perPage = data.per_page || perPage;
+            Object.assign(data, {
+                total_pages: totalDraftsPages,
+                current_page: page,
+                has_previous: page > 1,
+                total_drafts: totalDraftsEstimate
+            });
             
             renderDrafts(data.drafts);
             renderPagination(data, true); // Pass true to indicate we are rendering drafts
@@ -1307,6 +1338,105 @@ function renderDrafts(drafts) {
 
 
 // Generate reply function - COMPLETELY REVISED
+// POST a JSON body and call onEvent(event, data) for each Server-Sent Event in the response
+async function streamServerSentEvents(url, body, csrfToken, onEvent) {
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream',
+            'X-CSRFToken': csrfToken
+        },
+        body: JSON.stringify(body)
+    });
+    
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        // Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            
+            let event = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) event = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            });
+            if (data) onEvent(event, JSON.parse(data));
+        }
+    }
+}
+
+// Live inbox updates: the server pushes changes, so the email list is never re-polled
+let inboxEvents = null;
+let inboxReloadTimer = null;
+
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text == null ? '' : String(text);
+    return div.innerHTML;
+}
+
+// Reload the visible email list once a burst of events has settled
+function scheduleInboxReload() {
+    clearTimeout(inboxReloadTimer);
+    inboxReloadTimer = setTimeout(() => {
+        if (currentView === 'emails') loadEmails(currentPage);
+    }, 1000);
+}
+
+function removeEmailItems(ids) {
+    if (currentView !== 'emails') return;
+    ids.forEach(id => {
+        const emailElement = document.querySelector(`.email-item[data-email-id="${CSS.escape(id)}"]`);
+        if (emailElement) emailElement.remove();
+    });
+    if (document.querySelectorAll('.email-item').length === 0) scheduleInboxReload();
+}
+
+function connectInboxEvents() {
+    if (inboxEvents || !window.EventSource) return;
+    // EventSource reconnects by itself and resumes from the Last-Event-ID it saw
+    inboxEvents = new EventSource('/api/events/stream/');
+    
+    inboxEvents.addEventListener('message_added', (e) => {
+        const email = JSON.parse(e.data);
+        if (!email.is_unread) return;
+        showNotification(`New email from ${escapeHtml(email.from)}: ${escapeHtml(email.subject)}`, 'info');
+        if (currentView === 'emails' && currentPage === 1) scheduleInboxReload();
+    });
+    inboxEvents.addEventListener('labels_changed', (e) => {
+        JSON.parse(e.data).changes.forEach(change => {
+            if (!change.is_unread) {
+                removeEmailItems(change.ids);
+            } else if (currentView === 'emails' && currentPage === 1) {
+                scheduleInboxReload();
+            }
+        });
+    });
+    inboxEvents.addEventListener('message_removed', (e) => removeEmailItems(JSON.parse(e.data).ids));
+    inboxEvents.addEventListener('reminder_due', (e) => {
+        const reminder = JSON.parse(e.data);
+        const note = reminder.message ? ` - ${escapeHtml(reminder.message)}` : '';
+        showNotification(`Reminder: ${escapeHtml(reminder.subject || reminder.email_id)}${note}`, 'warning');
+    });
+    inboxEvents.addEventListener('scheduled_email_sent', () => showNotification('Scheduled email sent', 'success'));
+    inboxEvents.addEventListener('resync', scheduleInboxReload);
+}
+
 async function generateReply() {
     console.log('=== GENERATE REPLY FUNCTION STARTED ===');
     
@@ -1350,48 +1480,46 @@ async function generateReply() {
         
         // Prepare request data
         const requestData = {
-            email_text: emailText
+            email_text: emailText,
+            message_id: emailArea.getAttribute('data-message-id') || ''
         };
         console.log('Request data:', requestData);
         
-        // Make the API request
-        console.log('Sending request to /api/generate-reply/');
-        const response = await fetch('/api/generate-reply/', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'X-CSRFToken': csrfToken
-            },
-            body: JSON.stringify(requestData)
+        // Stream the reply (then the summary) so text shows up as soon as the model produces it
+        console.log('Streaming from /api/ai/generate-reply/stream/');
+        let replyText = '';
+        let summaryText = '';
+        let streamError = null;
+        
+        await streamServerSentEvents('/api/ai/generate-reply/stream/', requestData, csrfToken, (event, data) => {
+            if (event === 'reply') {
+                replyText += data.text;
+                replyArea.value = replyText;
+            } else if (event === 'summary') {
+                summaryText += data.text;
+                summaryArea.value = summaryText;
+            } else if (event === 'done') {
+                replyText = data.draft_reply || replyText;
+                summaryText = data.summary || summaryText;
+            } else if (event === 'error') {
+                streamError = data.error || 'Unknown error occurred';
+            }
         });
         
-        console.log('Response status:', response.status);
-        console.log('Response headers:', response.headers);
-        
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        
-        const data = await response.json();
-        console.log('Response data:', data);
-        
-        if (data.ok) {
-            // Update UI with successful response
-            summaryArea.value = data.summary || 'No summary generated';
-            replyArea.value = data.draft_reply || 'No reply generated';
+        if (streamError) {
+            summaryArea.value = `Error: ${streamError}`;
+            replyArea.value = `Error: ${streamError}`;
+            showNotification(`Failed to generate reply: ${streamError}`, 'error');
+        } else {
+            summaryArea.value = summaryText || 'No summary generated';
+            replyArea.value = replyText || 'No reply generated';
             
             // Auto-populate draft message if available
-            if (draftMessageArea && data.draft_reply) {
-                draftMessageArea.value = data.draft_reply;
+            if (draftMessageArea && replyText) {
+                draftMessageArea.value = replyText;
             }
             
             showNotification('Reply generated successfully!', 'success');
-        } else {
-            // Handle API error
-            const errorMessage = data.error || 'Unknown error occurred';
-            summaryArea.value = `Error: ${errorMessage}`;
-            replyArea.value = `Error: ${errorMessage}`;
-            showNotification(`Failed to generate reply: ${errorMessage}`, 'error');
         }
     } catch (error) {
         console.error('Error in generateReply:', error);
@@ -1749,6 +1877,7 @@ async function deleteDraft(draftId) {
 function useDraft(draft) {
     if (emailArea) {
         emailArea.value = draft.body || '';
+        emailArea.removeAttribute('data-message-id');
         emailArea.scrollIntoView({ behavior: 'smooth', block: 'start' });
     }
 }
@@ -1928,11 +2057,14 @@ async function useEmail(email) {
 From: ${fullEmail.from || 'Unknown'}
 Subject: ${fullEmail.subject || 'No Subject'}
 Date: ${fullEmail.date || ''}
- ${fullEmail.body_text || fullEmail.body || ''}
+ ${fullEmail.body_text || fullEmail.body || fullEmail.snippet || ''}
                 `.trim();
                 
                 emailArea.value = emailContent;
                 
+                // Store the message ID so a reply drafted ahead of time can be used
+                emailArea.setAttribute('data-message-id', email.id);
+                
                 // Store thread ID for thread analysis
                 if (fullEmail.threadId) {
                     emailArea.setAttribute('data-thread-id', fullEmail.threadId);
@@ -2185,10 +2317,15 @@ function renderPagination(data, isDrafts = false) {
     const pageInfoDiv = document.createElement('div');
     pageInfoDiv.className = 'text-muted small';
     
+    const itemCount = ((isDrafts ? data.drafts : data.emails) || []).length;
     const startItem = ((isDrafts ? currentDraftsPage : currentPage) - 1) * perPage + 1;
-    const endItem = Math.min((isDrafts ? currentDraftsPage : currentPage) * perPage, data.total_emails || data.total_drafts);
+    const endItem = startItem + itemCount - 1;
+    const total = isDrafts ? data.total_drafts : data.total_emails;
     
-    pageInfoDiv.textContent = `Showing ${startItem}-${endItem} of ${data.total_emails || data.total_drafts} ${isDrafts ? 'drafts' : 'emails'}`;
+    // Gmail only gives an estimate of the total, so show it as approximate
+    pageInfoDiv.textContent = itemCount === 0
+        ? `No ${isDrafts ? 'drafts' : 'emails'}`
+        : `Showing ${startItem}-${endItem}${total ? ` of ~${total}` : ''} ${isDrafts ? 'drafts' : 'emails'}`;
     
     // Add all parts to the container
     container.appendChild(perPageDiv);
@@ -2236,13 +2373,13 @@ async function markSelectedAsRead() {
     }
     
     try {
-        const response = await fetch('/api/bulk-mark-as-read/', {
+        const response = await fetch('/api/emails/bulk/', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
                 'X-CSRFToken': getCSRFToken()
             },
-            body: JSON.stringify({ email_ids: emailIds })
+            body: JSON.stringify({ action: 'mark-read', email_ids: emailIds })
         });
         
         const data = await response.json();
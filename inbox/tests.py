@@ -1,3 +1,1589 @@
-from django.test import TestCase
+import base64
+import copy
+import functools
+import json
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+import numpy as np
+from cachetools import TTLCache
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from googleapiclient.errors import HttpError
+from httplib2 import Response as HttpResponse
+from .models import (
+    GmailCredentials, MailboxMessage, MailboxSyncState, InboxEvent, BackgroundJob, Reminder, EmailMeta, SpeculativeReply,
+    SpeculativeReplyUsage, UserSettings, MessageEmbedding, LLMResponseCacheEntry,
+)
+from .services import batch, classifier, fulltext, gemini, jobs, ratelimit, scheduler, semantic, speculative
+from .services.fulltext import FullTextSearchService, parse_query
+from .services.jobs import JobQueue
+from .services.scheduler import DueScheduler
+from .services.semantic import VectorIndex, SemanticSearchService, HashingEmbedder
+from .services.speculative import SpeculativeReplyService
+from .services.workflow import BatchClassificationService, CategorizationService, PriorityScoringService
+from .services.classifier import LocalClassifierService
+from .services.ratelimit import TokenBucket, SharedTokenBucket, CircuitBreaker, RateLimiter, UpstreamUnavailable
+from .services import bulk
+from .services.bulk import BulkEmailService
+from .services.cache import UserCache
+from .services.llm_cache import LLMResponseCache
+from .services.pagination import encode_cursor, decode_cursor
+from .services import sync
+from .services.events import InboxEventService
+from .services.gmail import UNREAD_CACHE_GROUP, _build_request, _save_creds_to_db, get_gmail_service, refresh_access_token
+from .services.pool import ThreadLocalHttp, service_pool
+from .services.mime import parse_message, decode_body, walk_parts, parse_headers
+from .services.sync import MailboxSyncService
+from .views import _run_bulk_action
 
-# Create your tests here.
+
+def http_error(status, content=b'{}', headers=None):
+    """googleapiclient HttpError with the given status"""
+    return HttpError(HttpResponse({'status': status, **(headers or {})}), content)
+
+
+class _Request:
+    """HttpRequest stand-in: execute() runs the call"""
+
+    def __init__(self, func):
+        self.func = func
+
+    def execute(self, **kwargs):
+        return self.func()
+
+
+class _Batch:
+    """BatchHttpRequest stand-in that runs every added request"""
+
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self, **kwargs):
+        self.service.batch_calls += 1
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.execute(), None)
+            except Exception as e:
+                self.callback(request_id, None, e)
+
+
+class FakeGmail:
+    """
+    In-memory Gmail service covering the calls the mailbox sync makes
+
+    `history_records` holds history records; history.list returns those after the
+    start ID and answers 404 for start IDs below `oldest_history_id`.
+    """
+
+    def __init__(self):
+        self.mailbox = {}  # Message ID -> message resource
+        self.history_records = []
+        self.history_id = 100
+        self.oldest_history_id = 50
+        self.batch_calls = 0
+
+    def add(self, message_id, labels=('UNREAD', 'INBOX'), subject='Subject', internal_date=1700000000000):
+        self.mailbox[message_id] = {
+            'id': message_id,
+            'threadId': f"t-{message_id}",
+            'labelIds': list(labels),
+            'snippet': f"snippet {message_id}",
+            'internalDate': str(internal_date),
+            'sizeEstimate': 100,
+            'payload': {'headers': [
+                {'name': 'Subject', 'value': subject},
+                {'name': 'From', 'value': 'Sender <sender@example.com>'},
+                {'name': 'To', 'value': 'me@example.com'},
+                {'name': 'Date', 'value': 'Mon, 1 Jan 2024 10:00:00 +0000'},
+            ]},
+        }
+
+    def new_batch_http_request(self, callback=None):
+        return _Batch(self, callback)
+
+    # users().getProfile / messages() / history() chain
+    def users(self):
+        return self
+
+    def getProfile(self, userId):
+        return _Request(lambda: {'emailAddress': 'me@example.com', 'historyId': str(self.history_id)})
+
+    def messages(self):
+        return _FakeMessages(self)
+
+    def history(self):
+        return _FakeHistory(self)
+
+
+class _FakeMessages:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, userId, labelIds=None, maxResults=100, pageToken=None, **kwargs):
+        def call():
+            ids = [
+                message_id for message_id, message in self.service.mailbox.items()
+                if all(label in message['labelIds'] for label in labelIds or [])
+            ]
+            start = int(pageToken or 0)
+            response = {'messages': [{'id': message_id} for message_id in ids[start:start + maxResults]]}
+            if start + maxResults < len(ids):
+                response['nextPageToken'] = str(start + maxResults)
+            return response
+        return _Request(call)
+
+    def get(self, userId, id, **kwargs):
+        def call():
+            if id not in self.service.mailbox:
+                raise http_error(404)
+            return copy.deepcopy(self.service.mailbox[id])
+        return _Request(call)
+
+
+class _FakeHistory:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, userId, startHistoryId, historyTypes=None, pageToken=None):
+        def call():
+            if int(startHistoryId) < self.service.oldest_history_id:
+                raise http_error(404)
+            records = [record for record in self.service.history_records if record['id'] > int(startHistoryId)]
+            return {'history': records, 'historyId': str(self.service.history_id)}
+        return _Request(call)
+
+
+class MailboxSyncServiceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('sync-user')
+        self.gmail = FakeGmail()
+        for i in range(3):
+            self.gmail.add(f"m{i}", internal_date=1700000000000 + i)
+        MailboxSyncService.sync(self.user, self.gmail, force=True)
+
+    def unread_ids(self):
+        return sorted(email['id'] for email in MailboxSyncService.get_unread_emails(self.user))
+
+    def test_full_sync_mirrors_unread_messages(self):
+        self.assertEqual(self.unread_ids(), ['m0', 'm1', 'm2'])
+        self.assertEqual(MailboxSyncState.objects.get(user=self.user).history_id, '100')
+
+    def test_incremental_sync_applies_history(self):
+        self.gmail.add('m9')
+        self.gmail.mailbox['m1']['labelIds'].remove('UNREAD')
+        self.gmail.history_records = [
+            {'id': 101, 'messagesAdded': [{'message': {'id': 'm9', 'labelIds': ['UNREAD', 'INBOX']}}]},
+            {'id': 102, 'labelsRemoved': [{'message': {'id': 'm1', 'labelIds': ['INBOX']}, 'labelIds': ['UNREAD']}]},
+            {'id': 103, 'messagesDeleted': [{'message': {'id': 'm2'}}]},
+        ]
+        self.gmail.history_id = 103
+        batch_calls = self.gmail.batch_calls
+
+        self.assertTrue(MailboxSyncService.sync(self.user, self.gmail, force=True))
+
+        self.assertEqual(self.unread_ids(), ['m0', 'm9'])
+        self.assertFalse(MailboxMessage.objects.filter(user=self.user, message_id='m2').exists())
+        self.assertEqual(MailboxMessage.objects.get(user=self.user, message_id='m1').label_ids, ['INBOX'])
+        self.assertEqual(MailboxSyncState.objects.get(user=self.user).history_id, '103')
+        # Only the new message is fetched
+        self.assertEqual(self.gmail.batch_calls, batch_calls + 1)
+
+    def test_incremental_sync_groups_label_changes(self):
+        self.gmail.history_records = [
+            {'id': 101, 'labelsRemoved': [{'message': {'id': 'm0', 'labelIds': ['INBOX']}}]},
+            {'id': 102, 'labelsRemoved': [{'message': {'id': 'm1', 'labelIds': ['INBOX']}}]},
+            {'id': 103, 'labelsAdded': [{'message': {'id': 'm2', 'labelIds': ['UNREAD', 'INBOX', 'STARRED']}}]},
+        ]
+        self.gmail.history_id = 103
+
+        MailboxSyncService.sync(self.user, self.gmail, force=True)
+
+        events = InboxEvent.objects.filter(user=self.user, kind='labels_changed')
+        self.assertEqual(events.count(), 1)
+        changes = sorted(events.get().payload['changes'], key=lambda change: change['ids'])
+        self.assertEqual(changes, [
+            {'ids': ['m0', 'm1'], 'label_ids': ['INBOX'], 'is_unread': False},
+            {'ids': ['m2'], 'label_ids': ['UNREAD', 'INBOX', 'STARRED'], 'is_unread': True},
+        ])
+        self.assertEqual(self.unread_ids(), ['m2'])
+
+    def test_expired_history_falls_back_to_full_resync(self):
+        MailboxSyncState.objects.filter(user=self.user).update(history_id='10')
+        del self.gmail.mailbox['m0']
+        self.gmail.add('m5')
+        self.gmail.history_id = 120
+
+        self.assertTrue(MailboxSyncService.sync(self.user, self.gmail, force=True))
+
+        self.assertEqual(self.unread_ids(), ['m1', 'm2', 'm5'])
+        state = MailboxSyncState.objects.get(user=self.user)
+        self.assertEqual(state.history_id, '120')
+        self.assertTrue(InboxEvent.objects.filter(user=self.user, kind='resync').exists())
+
+    def test_sync_is_throttled(self):
+        self.gmail.history_records = [{'id': 101, 'messagesDeleted': [{'message': {'id': 'm0'}}]}]
+        self.gmail.history_id = 101
+
+        self.assertTrue(MailboxSyncService.sync(self.user, self.gmail))
+
+        self.assertEqual(self.unread_ids(), ['m0', 'm1', 'm2'])
+
+
+
+class CursorTests(TestCase):
+    def test_round_trip(self):
+        position = {'k': 'mirror', 'd': 1700000000000, 'i': 42}
+        cursor = encode_cursor(position)
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor), position)
+        self.assertEqual(decode_cursor(None), {})
+        self.assertEqual(decode_cursor(''), {})
+
+    def test_malformed_cursors_raise_value_error(self):
+        for cursor in ("%%%", "é", encode_cursor([1, 2]), "bm90IGpzb24", "a"):
+            with self.assertRaises(ValueError, msg=cursor):
+                decode_cursor(cursor)
+
+    def test_fields_are_checked(self):
+        fields = {'k': str, 'd': (int, type(None)), 'i': int}
+        self.assertEqual(decode_cursor(encode_cursor({'k': 'mirror', 'd': None, 'i': 1}), fields), {'k': 'mirror', 'd': None, 'i': 1})
+        for position in ({'i': "1"}, {'i': True}, {'d': 1.5}, {'x': 1}):
+            with self.assertRaises(ValueError, msg=position):
+                decode_cursor(encode_cursor(position), fields)
+
+
+class UnreadCursorPageTests(TransactionTestCase):
+    # The async view runs its database work on other threads, which must see committed rows
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('pager')
+        self.client.force_login(self.user)
+        self.gmail = FakeGmail()
+        for i in range(5):
+            self.gmail.add(f"m{i}", internal_date=1700000000000 + i)
+        patcher = mock.patch('inbox.views.get_gmail_service', return_value=self.gmail)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def page(self, cursor=None, per_page=2):
+        params = {'per_page': per_page}
+        if cursor:
+            params['cursor'] = cursor
+        return self.client.get(reverse('api:unread-emails-list'), params)
+
+    def test_pages_through_the_mirror_newest_first(self):
+        seen, cursor = [], None
+        while True:
+            response = self.page(cursor).json()
+            seen.extend(email['id'] for email in response['emails'])
+            cursor = response['next_cursor']
+            if not cursor:
+                break
+            self.assertEqual(decode_cursor(cursor)['k'], 'mirror')
+        self.assertEqual(seen, ['m4', 'm3', 'm2', 'm1', 'm0'])
+
+    def test_mirror_hands_over_to_the_gmail_page_token(self):
+        # The full sync mirrors 3 of 5 unread messages and keeps Gmail's page token for the rest
+        with mock.patch.object(sync, 'MAILBOX_FULL_SYNC_LIMIT', 3):
+            first = self.page(per_page=3).json()
+        self.assertEqual(len(first['emails']), 3)
+        self.assertEqual(decode_cursor(first['next_cursor']), {'k': 'gmail', 't': '3'})
+
+        gmail_page = ([{'id': "m3", 'threadId': "t-m3", 'snippet': "", 'subject': "", 'from': "", 'to': "", 'date': ""}], None, 5)
+        with mock.patch('inbox.views.aio.fetch_unread_page', new=mock.AsyncMock(return_value=gmail_page)) as fetch:
+            second = self.page(first['next_cursor'], per_page=3).json()
+        fetch.assert_awaited_once_with(self.user, 3, page_token='3')
+        self.assertEqual([email['id'] for email in second['emails']], ["m3"])
+        self.assertIsNone(second['next_cursor'])
+
+    def test_invalid_cursors_are_rejected(self):
+        for cursor in ("not-a-cursor!", encode_cursor({'k': 'mirror', 'd': "yesterday", 'i': 1}),
+                       encode_cursor({'k': 'mirror', 'd': 1}), encode_cursor({'k': 'other'}),
+                       encode_cursor({'k': 'gmail', 't': 7})):
+            response = self.page(cursor)
+            self.assertEqual(response.status_code, 400, cursor)
+            self.assertEqual(response.json(), {'ok': False, 'error': 'Invalid cursor'})
+
+
+class TokenBucketTests(TestCase):
+    def test_reserve_borrows_against_refills(self):
+        bucket = TokenBucket(rate=10, capacity=10)
+        self.assertEqual(bucket.reserve(10, max_wait=0), 0)
+        wait = bucket.reserve(5, max_wait=1)
+        self.assertAlmostEqual(wait, 0.5, delta=0.05)
+
+    def test_reserve_takes_nothing_beyond_max_wait(self):
+        bucket = TokenBucket(rate=10, capacity=10)
+        bucket.reserve(10, max_wait=0)
+        self.assertIsNone(bucket.reserve(10, max_wait=0.5))
+        # The rejected reservation did not take tokens
+        self.assertAlmostEqual(bucket.reserve(5, max_wait=1), 0.5, delta=0.05)
+
+    def test_refund(self):
+        bucket = TokenBucket(rate=1, capacity=4)
+        bucket.reserve(4, max_wait=0)
+        bucket.refund(4)
+        self.assertEqual(bucket.reserve(4, max_wait=0), 0)
+
+
+class SharedTokenBucketTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_buckets_with_one_name_share_the_count(self):
+        first = SharedTokenBucket('test', rate=10, capacity=10)
+        second = SharedTokenBucket('test', rate=10, capacity=10)
+        self.assertEqual(first.reserve(6, max_wait=0), 0)
+        # The current window is full for the other process, so it waits for the next one
+        self.assertIsNone(second.reserve(6, max_wait=0))
+        self.assertGreater(second.reserve(6, max_wait=2), 0)
+
+    def test_refund_returns_the_reserved_window(self):
+        bucket = SharedTokenBucket('test', rate=10, capacity=10)
+        bucket.reserve(10, max_wait=0)
+        bucket.refund(10)
+        self.assertEqual(bucket.reserve(10, max_wait=0), 0)
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker('test', failures=2, cooldown=30)
+        breaker.record_failure()
+        breaker.before_call()
+        breaker.record_failure()
+        with self.assertRaises(UpstreamUnavailable) as raised:
+            breaker.before_call()
+        self.assertEqual(raised.exception.retry_after, 30)
+        self.assertEqual(breaker.state()['state'], 'open')
+
+    def test_success_resets_the_failure_count(self):
+        breaker = CircuitBreaker('test', failures=2, cooldown=30)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.before_call()
+        self.assertEqual(breaker.state(), {'state': 'closed', 'retry_in': 0, 'failures': 1})
+
+    def test_state_is_shared_between_processes(self):
+        # Two instances with one name stand for the same breaker in two workers
+        worker = CircuitBreaker('test', failures=1, cooldown=30)
+        web = CircuitBreaker('test', failures=1, cooldown=30)
+        worker.record_failure()
+        with self.assertRaises(UpstreamUnavailable):
+            web.before_call()
+
+    def test_half_open_lets_one_trial_through(self):
+        breaker = CircuitBreaker('test', failures=1, cooldown=0.05)
+        breaker.record_failure()
+        time.sleep(0.06)
+        breaker.before_call()
+        self.assertEqual(breaker.state()['state'], 'half-open')
+        with self.assertRaises(UpstreamUnavailable):
+            CircuitBreaker('test', failures=1, cooldown=0.05).before_call()
+
+        # A failed trial opens the circuit again, a successful one closes it
+        breaker.record_failure()
+        self.assertEqual(breaker.state()['state'], 'open')
+        time.sleep(0.06)
+        breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.state()['state'], 'closed')
+
+    def test_rate_limiter_fails_fast_while_open(self):
+        limiter = RateLimiter()
+        limiter._breakers['test'] = CircuitBreaker('test', failures=2, cooldown=30)
+        calls = []
+
+        def unavailable():
+            calls.append(1)
+            raise http_error(503)
+
+        with mock.patch.object(ratelimit, 'API_RETRY_BASE_DELAY', 0):
+            with self.assertRaises(UpstreamUnavailable):
+                limiter.call('test', unavailable, attempts=3)
+        self.assertEqual(len(calls), 2)
+
+    def test_rate_limiter_does_not_retry_client_errors(self):
+        limiter = RateLimiter()
+        calls = []
+
+        def not_found():
+            calls.append(1)
+            raise http_error(404)
+
+        with self.assertRaises(HttpError):
+            limiter.call('test', not_found)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(limiter.breaker('test').state()['state'], 'closed')
+
+
+class _FailingBatch:
+    def __init__(self, service):
+        self.service = service
+
+    def add(self, request, request_id):
+        pass
+
+    def execute(self, **kwargs):
+        self.service.batch_calls += 1
+        raise self.service.error
+
+
+class ExecuteBatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.gmail = FakeGmail()
+        for i in range(4):
+            self.gmail.add(f"m{i}")
+
+    def failing_service(self, error):
+        service = mock.Mock(batch_calls=0, error=error)
+        service.new_batch_http_request.side_effect = lambda callback: _FailingBatch(service)
+        return service
+
+    def test_item_errors_do_not_fail_the_batch(self):
+        messages = self.gmail.messages()
+        requests = [(message_id, messages.get(userId='me', id=message_id)) for message_id in ['m0', 'gone', 'm1']]
+        results, errors = batch.execute_batch(self.gmail, requests)
+        self.assertEqual(sorted(results), ['m0', 'm1'])
+        self.assertEqual(list(errors), ['gone'])
+
+    def test_non_retryable_batch_error_is_raised(self):
+        service = self.failing_service(http_error(401))
+        with self.assertRaises(HttpError):
+            batch.execute_batch(service, [('m0', object()), ('m1', object())])
+        self.assertEqual(service.batch_calls, 1)
+
+    def test_retryable_batch_error_is_raised_after_the_last_attempt(self):
+        service = self.failing_service(ConnectionError('connection reset'))
+        with mock.patch.object(ratelimit, 'API_RETRY_BASE_DELAY', 0), mock.patch.object(batch, 'backoff_delay', lambda attempt, retry_after=None: 0):
+            with self.assertRaises(ConnectionError):
+                batch.execute_batch(service, [('m0', object())])
+        self.assertEqual(service.batch_calls, batch.API_RETRY_ATTEMPTS)
+
+    def test_upstream_unavailable_is_raised(self):
+        service = self.failing_service(UpstreamUnavailable('gmail', 5))
+        with self.assertRaises(UpstreamUnavailable):
+            batch.execute_batch(service, [('m0', object())])
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="jobs@example.com")
+
+    def enqueue(self, **kwargs):
+        return JobQueue.enqueue('index_messages', {'message_ids': []}, user=self.user, **kwargs)
+
+    def test_a_job_is_leased_to_one_worker(self):
+        job = self.enqueue()
+        self.assertEqual([j.id for j in JobQueue.lease('worker-1')], [job.id])
+        self.assertEqual(JobQueue.lease('worker-2'), [])
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by, job.attempts), ('running', 'worker-1', 1))
+
+    def test_lease_respects_limit_and_run_after(self):
+        for _ in range(3):
+            self.enqueue()
+        self.enqueue(run_after=timezone.now() + timedelta(hours=1))
+        self.assertEqual(len(JobQueue.lease('worker-1', limit=2)), 2)
+        self.assertEqual(len(JobQueue.lease('worker-2', limit=5)), 1)
+
+    def test_lease_filters_kinds(self):
+        self.enqueue()
+        self.assertEqual(JobQueue.lease('worker-1', kinds=['train_classifier']), [])
+        self.assertEqual(len(JobQueue.lease('worker-1', kinds=['index_messages'])), 1)
+
+    def test_expired_lease_is_handed_out_again(self):
+        job = self.enqueue()
+        [stale] = JobQueue.lease('worker-1')
+        BackgroundJob.objects.filter(id=job.id).update(leased_until=timezone.now() - timedelta(seconds=1))
+
+        [released] = JobQueue.lease('worker-2')
+        self.assertEqual((released.id, released.locked_by, released.attempts), (job.id, 'worker-2', 2))
+        # The first worker lost the job, so it can no longer complete it
+        JobQueue.complete(stale)
+        self.assertEqual(BackgroundJob.objects.get(id=job.id).status, 'running')
+
+    def test_failed_attempts_back_off_then_fail(self):
+        job = self.enqueue(max_attempts=2)
+        [leased] = JobQueue.lease('worker-1')
+        before = timezone.now()
+        JobQueue.fail(leased, "boom")
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.last_error), ('pending', 'boom'))
+        self.assertGreaterEqual(job.run_after, before + timedelta(seconds=jobs.JOB_RETRY_DELAY))
+        self.assertEqual(JobQueue.lease('worker-1'), [])
+
+        BackgroundJob.objects.filter(id=job.id).update(run_after=timezone.now())
+        [leased] = JobQueue.lease('worker-1')
+        self.assertEqual(leased.attempts, 2)
+        JobQueue.fail(leased, "boom again")
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIsNotNone(job.finished_at)
+
+    def test_retry_delay_doubles_per_attempt(self):
+        job = self.enqueue(max_attempts=5)
+        BackgroundJob.objects.filter(id=job.id).update(attempts=2, status='running', locked_by='worker-1')
+        job.refresh_from_db()
+        before = timezone.now()
+        JobQueue.fail(job, "boom")
+        job.refresh_from_db()
+        delay = (job.run_after - before).total_seconds()
+        self.assertAlmostEqual(delay, jobs.JOB_RETRY_DELAY * 2, delta=1)
+
+    def test_dedupe_key_skips_queued_duplicates(self):
+        self.assertIsNotNone(self.enqueue(dedupe_key='same'))
+        self.assertIsNone(self.enqueue(dedupe_key='same'))
+
+
+class DueSchedulerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="due@example.com")
+        self.now = timezone.now()
+
+    def remind(self, minutes, **kwargs):
+        return Reminder.objects.create(
+            user=self.user, email_id="m1", reminder_time=self.now + timedelta(minutes=minutes), **kwargs
+        )
+
+    def popped_ids(self, scheduler, minutes):
+        return [pk for _, _, pk, _ in scheduler.pop_due(self.now + timedelta(minutes=minutes))]
+
+    def test_advance_loads_the_window_once(self):
+        due = [self.remind(-5), self.remind(10)]
+        self.remind(120)
+        self.remind(-1, completed=True)
+        due_scheduler = DueScheduler(sources=['reminder'], horizon=3600)
+
+        self.assertEqual(due_scheduler.advance(self.now), 2)
+        self.assertEqual(due_scheduler.advance(self.now), 0)
+        self.assertEqual(self.popped_ids(due_scheduler, 60), [r.id for r in due])
+
+    def test_advance_reads_only_past_the_cursor(self):
+        first = self.remind(10)
+        later = self.remind(90)
+        due_scheduler = DueScheduler(sources=['reminder'], horizon=3600)
+        due_scheduler.advance(self.now)
+        self.assertEqual(self.popped_ids(due_scheduler, 30), [first.id])
+
+        # Moving the window forward picks up the later row but not the dispatched one
+        self.assertEqual(due_scheduler.advance(self.now + timedelta(minutes=60)), 1)
+        self.assertEqual(self.popped_ids(due_scheduler, 120), [later.id])
+
+    def test_advance_pages_through_rows_sharing_a_due_time(self):
+        reminders = [self.remind(5) for _ in range(5)]
+        due_scheduler = DueScheduler(sources=['reminder'], horizon=3600)
+        with mock.patch.object(scheduler, 'SCHEDULER_BATCH_SIZE', 2):
+            self.assertEqual(due_scheduler.advance(self.now), 5)
+        self.assertEqual(sorted(self.popped_ids(due_scheduler, 10)), [r.id for r in reminders])
+
+    def test_full_heap_holds_the_cursor(self):
+        reminders = [self.remind(minutes) for minutes in (5, 10, 15)]
+        due_scheduler = DueScheduler(sources=['reminder'], horizon=3600, max_loaded=2)
+        self.assertEqual(due_scheduler.advance(self.now), 2)
+        self.assertEqual(self.popped_ids(due_scheduler, 12), [r.id for r in reminders[:2]])
+
+        # The third row is read once there is room again
+        self.assertEqual(due_scheduler.advance(self.now), 1)
+        self.assertEqual(self.popped_ids(due_scheduler, 20), [reminders[2].id])
+
+    def test_load_new_picks_up_rows_inside_the_window(self):
+        due_scheduler = DueScheduler(sources=['reminder'], horizon=3600)
+        due_scheduler.advance(self.now)
+        inside = self.remind(30)
+        outside = self.remind(120)
+
+        self.assertEqual(due_scheduler.load_new(), 1)
+        self.assertEqual(due_scheduler.load_new(), 0)
+        self.assertEqual(due_scheduler.advance(self.now + timedelta(minutes=90)), 1)
+        self.assertEqual(self.popped_ids(due_scheduler, 180), [inside.id, outside.id])
+
+    def test_dispatch_queues_each_row_once(self):
+        reminder = self.remind(-1)
+        due_scheduler = DueScheduler(sources=['reminder'])
+        due_scheduler.advance(self.now)
+        entries = due_scheduler.pop_due(self.now)
+        due_scheduler.dispatch(entries)
+
+        # A restarted scheduler loads the row again; its queued job is not duplicated
+        restarted = DueScheduler(sources=['reminder'])
+        restarted.advance(self.now)
+        restarted.dispatch(restarted.pop_due(self.now))
+
+        job = BackgroundJob.objects.get()
+        self.assertEqual((job.kind, job.payload, job.dedupe_key),
+                         ('notify_reminder', {'reminder_id': reminder.id}, f'reminder:{reminder.id}'))
+
+
+class SpeculativeReplyBudgetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="reply@example.com")
+        self.email_text = "Can we meet on Friday?"
+        self.enrich = mock.patch.object(
+            speculative.EnrichmentService, 'enrich_email',
+            return_value={'summary': "Meeting request", 'reply': "Friday works."},
+        ).start()
+        mock.patch.object(speculative, 'load_email_details', return_value={}).start()
+        mock.patch.object(speculative, 'email_source_text', side_effect=lambda details: self.email_text).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_each_model_call_is_counted(self):
+        SpeculativeReplyService.draft(self.user, "m1")
+        SpeculativeReplyService.draft(self.user, "m2")
+        self.assertEqual(SpeculativeReplyService.used_today(self.user), 2)
+        self.assertEqual(SpeculativeReplyUsage.objects.get(user=self.user).model_calls, 2)
+
+    def test_unchanged_email_is_not_drafted_again(self):
+        first = SpeculativeReplyService.draft(self.user, "m1")
+        self.assertEqual(SpeculativeReplyService.draft(self.user, "m1"), first)
+        self.assertEqual(self.enrich.call_count, 1)
+        self.assertEqual(SpeculativeReplyService.used_today(self.user), 1)
+
+    def test_regenerating_a_reply_spends_budget(self):
+        # Redrafting overwrites the stored reply, so counting replies would miss the second call
+        SpeculativeReplyService.draft(self.user, "m1")
+        self.email_text = "Can we meet on Monday instead?"
+        SpeculativeReplyService.draft(self.user, "m1")
+        self.assertEqual(SpeculativeReply.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(SpeculativeReplyService.used_today(self.user), 2)
+
+    def test_spent_budget_stops_drafting_and_scheduling(self):
+        SpeculativeReplyUsage.objects.create(
+            user=self.user, day=timezone.localdate(), model_calls=speculative.SPECULATIVE_REPLY_DAILY_BUDGET
+        )
+        MailboxMessage.objects.create(user=self.user, message_id="m1", is_unread=True)
+        EmailMeta.objects.create(user=self.user, email_id="m1", priority=9)
+
+        self.assertIsNone(SpeculativeReplyService.draft(self.user, "m1"))
+        self.assertEqual(SpeculativeReplyService.schedule(self.user), 0)
+        self.enrich.assert_not_called()
+
+    def test_reservations_stop_at_the_budget(self):
+        budget = speculative.SPECULATIVE_REPLY_DAILY_BUDGET
+        self.assertEqual(
+            [SpeculativeReplyService.reserve_call(self.user) for _ in range(budget + 2)],
+            [True] * budget + [False, False]
+        )
+        self.assertEqual(SpeculativeReplyService.used_today(self.user), budget)
+
+    def test_budget_spent_after_the_early_check_skips_the_draft(self):
+        # Another worker took the last call between this worker's read and its reservation
+        SpeculativeReplyUsage.objects.create(
+            user=self.user, day=timezone.localdate(), model_calls=speculative.SPECULATIVE_REPLY_DAILY_BUDGET
+        )
+        with mock.patch.object(SpeculativeReplyService, 'used_today', return_value=0):
+            self.assertIsNone(SpeculativeReplyService.draft(self.user, "m1"))
+        self.enrich.assert_not_called()
+        self.assertFalse(SpeculativeReply.objects.exists())
+        self.assertEqual(SpeculativeReplyService.used_today(self.user), speculative.SPECULATIVE_REPLY_DAILY_BUDGET)
+
+    def test_schedule_is_capped_by_the_remaining_budget(self):
+        for i in range(3):
+            MailboxMessage.objects.create(user=self.user, message_id=f"m{i}", is_unread=True)
+            EmailMeta.objects.create(user=self.user, email_id=f"m{i}", priority=9 - i)
+        SpeculativeReplyUsage.objects.create(
+            user=self.user, day=timezone.localdate(), model_calls=speculative.SPECULATIVE_REPLY_DAILY_BUDGET - 2
+        )
+
+        self.assertEqual(SpeculativeReplyService.schedule(self.user), 2)
+        self.assertEqual(
+            sorted(BackgroundJob.objects.values_list('payload__email_id', flat=True)), ["m0", "m1"]
+        )
+
+    def test_disabled_auto_replies_draft_nothing(self):
+        UserSettings.objects.create(user=self.user, auto_reply_enabled=False)
+        self.assertIsNone(SpeculativeReplyService.draft(self.user, "m1"))
+        self.assertEqual(SpeculativeReplyService.used_today(self.user), 0)
+
+
+def unit_vectors(count, dim=8, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(count, dim))
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class VectorIndexTests(TestCase):
+    def setUp(self):
+        self.vectors = unit_vectors(6)
+        self.index = VectorIndex(8).append([(f"m{i}", False) for i in range(6)], self.vectors)
+
+    def test_search_ranks_the_closest_rows_first(self):
+        hits = self.index.search(self.vectors[3], 3)
+        self.assertEqual(len(hits), 3)
+        self.assertEqual(hits[0][0], "m3")
+        self.assertAlmostEqual(hits[0][1], 1.0, places=2)
+        self.assertEqual([score for _, score in hits], sorted((score for _, score in hits), reverse=True))
+
+    def test_reappended_message_replaces_its_row(self):
+        self.index.append([("m3", True)], self.vectors[:1])
+        self.assertEqual((self.index.live_rows, self.index.dead_rows), (6, 1))
+        self.assertEqual(self.index.entries()["m3"], (6, True))
+        self.assertEqual({message_id for message_id, _ in self.index.search(self.vectors[0], 2)}, {"m0", "m3"})
+        self.assertNotEqual(self.index.search(self.vectors[3], 1)[0][0], "m3")
+
+    def test_removed_rows_are_not_returned(self):
+        self.index.remove(["m3", "unknown"])
+        self.assertEqual((self.index.live_rows, self.index.dead_rows), (5, 1))
+        self.assertNotIn("m3", [message_id for message_id, _ in self.index.search(self.vectors[3], 6)])
+
+    def test_compact_drops_dead_rows(self):
+        self.index.remove(["m0", "m1"])
+        self.assertTrue(self.index.needs_compaction())
+        self.index.compact()
+        self.assertEqual((len(self.index.rows), self.index.dead_rows), (4, 0))
+        self.assertFalse(self.index.needs_compaction())
+        self.assertEqual(self.index.search(self.vectors[5], 1)[0][0], "m5")
+
+    def test_appends_grow_the_buffer(self):
+        index = VectorIndex(8)
+        vectors = unit_vectors(1500, seed=1)
+        for i in range(0, 1500, 100):
+            index.append([(f"n{j}", False) for j in range(i, i + 100)], vectors[i:i + 100])
+        self.assertEqual(index.live_rows, 1500)
+        self.assertEqual(index.search(vectors[1234], 1)[0][0], "n1234")
+
+    def test_large_index_is_clustered(self):
+        vectors = unit_vectors(200, seed=2)
+        index = VectorIndex(8).append([(f"n{i}", False) for i in range(200)], vectors)
+        with mock.patch.object(semantic, 'SEMANTIC_IVF_MIN_VECTORS', 100):
+            self.assertTrue(index.needs_compaction())
+            index.compact()
+            self.assertEqual(index.ivf_rows, 200)
+            self.assertFalse(index.needs_compaction())
+        for i in (0, 57, 199):
+            self.assertEqual(index.search(vectors[i], 1)[0][0], f"n{i}")
+
+
+class SemanticSearchServiceTests(TestCase):
+    def setUp(self):
+        semantic._indexes.clear()
+        self.user = User.objects.create(username="semantic@example.com")
+        self.embedder = HashingEmbedder()
+        for message_id, subject in [("m1", "Quarterly invoice overdue"), ("m2", "Team lunch on Friday"),
+                                    ("m3", "Invoice payment reminder")]:
+            MailboxMessage.objects.create(user=self.user, message_id=message_id, subject=subject, snippet=subject)
+
+    def test_update_embeds_only_new_messages(self):
+        self.assertEqual(SemanticSearchService.update(self.user, self.embedder), 3)
+        self.assertEqual(SemanticSearchService.update(self.user, self.embedder), 0)
+        MailboxMessage.objects.filter(message_id="m2").update(body_text="Pizza at noon", body_fetched=True)
+        self.assertEqual(SemanticSearchService.update(self.user, self.embedder), 1)
+
+    def test_index_follows_the_stored_rows(self):
+        SemanticSearchService.update(self.user, self.embedder)
+        index = SemanticSearchService.get_index(self.user, self.embedder)
+        self.assertEqual(index.live_rows, 3)
+
+        # Another process indexes a new message; this one picks it up without reloading
+        MailboxMessage.objects.create(user=self.user, message_id="m4", subject="Invoice attached")
+        SemanticSearchService.update(self.user, self.embedder)
+        self.assertIs(SemanticSearchService.get_index(self.user, self.embedder), index)
+        self.assertEqual(index.live_rows, 4)
+
+        query = self.embedder.embed(["invoice"], query=True)[0]
+        hits = [message_id for message_id, _ in index.search(query, 4)]
+        self.assertEqual(set(hits[:3]), {"m1", "m3", "m4"})
+
+    def test_messages_leaving_the_mirror_are_removed(self):
+        SemanticSearchService.update(self.user, self.embedder)
+        SemanticSearchService.get_index(self.user, self.embedder)
+        MailboxMessage.objects.filter(message_id="m1").update(is_trashed=True)
+        SemanticSearchService.update(self.user, self.embedder)
+
+        index = SemanticSearchService.get_index(self.user, self.embedder)
+        self.assertEqual(set(index.entries()), {"m2", "m3"})
+
+    def test_compaction_rewrites_the_log_and_reloads_the_index(self):
+        SemanticSearchService.update(self.user, self.embedder)
+        SemanticSearchService.get_index(self.user, self.embedder)
+        MailboxMessage.objects.filter(message_id__in=["m1", "m2"]).update(is_trashed=True)
+        SemanticSearchService.update(self.user, self.embedder)
+
+        # Two of five log rows are tombstones, so update compacted the stored rows
+        stored = MessageEmbedding.objects.filter(user=self.user, embedder=self.embedder.name)
+        self.assertEqual(list(stored.values_list('message_id', 'removed')), [("m3", False)])
+        index = SemanticSearchService.get_index(self.user, self.embedder)
+        self.assertEqual(set(index.entries()), {"m3"})
+        self.assertEqual(index.loaded, 1)
+
+
+class ParseQueryTests(TestCase):
+    def test_words_phrases_and_operators(self):
+        parsed = parse_query('budget "quarterly report" from:alice@example.com subject:"Q3 plan" Subject:draft')
+        self.assertEqual(parsed['terms'], ['budget'])
+        self.assertEqual(parsed['phrases'], ['quarterly report'])
+        self.assertEqual(parsed['from'], ['alice@example.com'])
+        self.assertEqual(parsed['subject'], ['Q3 plan', 'draft'])
+
+    def test_dates(self):
+        parsed = parse_query('after:2024-01-31 before:2024/02/15')
+        self.assertEqual(parsed['after'], timezone.make_aware(datetime(2024, 1, 31)))
+        self.assertEqual(parsed['before'], timezone.make_aware(datetime(2024, 2, 15)))
+
+    def test_unknown_operators_and_bad_dates_are_text(self):
+        parsed = parse_query('label:work after:yesterday in:"sent mail"')
+        self.assertEqual(parsed['terms'], ['label:work', 'after:yesterday'])
+        self.assertEqual(parsed['phrases'], ['in:sent mail'])
+        self.assertIsNone(parsed['after'])
+
+    def test_punctuation_only_tokens_are_dropped(self):
+        parsed = parse_query(' - "" ... ')
+        self.assertEqual(parsed, parse_query(''))
+
+
+class FullTextSearchServiceTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="search@example.com")
+        self.other = User.objects.create(username="other@example.com")
+        self.message("m1", "Quarterly budget review", "Alice <alice@example.com>", "Numbers for the budget", days_ago=10)
+        self.message("m2", "Lunch", "Bob <bob@example.com>", "The budget for lunch is small", days_ago=5)
+        self.message("m3", "Holiday plans", "Alice <alice@example.com>", "Running late for the trip", days_ago=1)
+        self.message("m4", "Budget approved", "Carol <carol@example.com>", "Done", days_ago=2, is_trashed=True)
+        self.message("o1", "Budget", "Alice <alice@example.com>", "Budget", user=self.other)
+
+    def message(self, message_id, subject, sender, body, days_ago=0, user=None, **kwargs):
+        return MailboxMessage.objects.create(
+            user=user or self.user, message_id=message_id, subject=subject, sender=sender, body_text=body,
+            internal_date=timezone.now() - timedelta(days=days_ago), **kwargs
+        )
+
+    def ids(self, query, **kwargs):
+        return [message_id for message_id, _ in FullTextSearchService.search(self.user, query, **kwargs)]
+
+    def test_index_is_installed(self):
+        self.assertTrue(fulltext.index_available())
+
+    def test_subject_matches_rank_above_body_matches(self):
+        results = FullTextSearchService.search(self.user, "budget")
+        self.assertEqual([message_id for message_id, _ in results], ["m1", "m2"])
+        self.assertGreater(results[0][1], results[1][1])
+
+    def test_words_match_as_prefixes_and_stems(self):
+        self.assertEqual(self.ids("quart"), ["m1"])
+        self.assertEqual(self.ids("run"), ["m3"])
+
+    def test_phrases_and_operators(self):
+        self.assertEqual(self.ids('"budget for lunch"'), ["m2"])
+        self.assertCountEqual(self.ids("from:alice"), ["m1", "m3"])
+        self.assertEqual(self.ids("budget from:alice"), ["m1"])
+        self.assertEqual(self.ids('subject:"holiday plans"'), ["m3"])
+
+    def test_date_filters(self):
+        after = (timezone.now() - timedelta(days=7)).strftime('%Y-%m-%d')
+        self.assertEqual(self.ids(f"budget after:{after}"), ["m2"])
+        self.assertEqual(self.ids(f"after:{after}"), ["m3", "m2"])
+
+    def test_limit_and_offset(self):
+        self.assertEqual(self.ids("budget", limit=1), ["m1"])
+        self.assertEqual(self.ids("budget", limit=1, offset=1), ["m2"])
+
+    def test_index_follows_updates_and_deletes(self):
+        MailboxMessage.objects.filter(message_id="m3").update(body_text="Budget for the trip")
+        self.assertIn("m3", self.ids("budget"))
+        MailboxMessage.objects.filter(message_id="m1").delete()
+        self.assertNotIn("m1", self.ids("budget"))
+
+    def test_empty_and_unsafe_queries(self):
+        self.assertEqual(self.ids(""), [])
+        self.assertEqual(self.ids('budget" OR "x'), [])
+        self.assertEqual(self.ids("NEAR(budget"), [])
+
+    def test_scan_without_the_index(self):
+        with mock.patch.object(fulltext, 'index_available', return_value=False):
+            self.assertEqual(self.ids("budget"), ["m2", "m1"])
+            self.assertEqual(self.ids("from:alice"), ["m3", "m1"])
+
+
+class UserCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username="cache@example.com")
+
+    def test_invalidate_moves_to_a_new_namespace(self):
+        UserCache.set(self.user, "page", [1])
+        UserCache.invalidate(self.user)
+        self.assertIsNone(UserCache.get(self.user, "page"))
+
+    def test_culled_version_never_revives_old_entries(self):
+        for _ in range(3):
+            UserCache.invalidate(self.user)
+        UserCache.set(self.user, "page", ["old"])
+        old_version = UserCache.version(self.user)
+
+        # The version counter is evicted before its entries, then the user is invalidated
+        cache.delete(UserCache._version_key(self.user))
+        UserCache.invalidate(self.user)
+        self.assertGreater(UserCache.version(self.user), old_version)
+        self.assertIsNone(UserCache.get(self.user, "page"))
+
+        cache.delete(UserCache._version_key(self.user))
+        self.assertGreater(UserCache.version(self.user), old_version)
+        self.assertIsNone(UserCache.get(self.user, "page"))
+
+    def test_update_in_lists_patches_every_list_in_the_group(self):
+        UserCache.set_list(self.user, "unread", "page1", [{'id': "a", 'is_unread': True}])
+        UserCache.set_list(self.user, "unread", "page2", [{'id': "a", 'is_unread': True}, {'id': "b", 'is_unread': True}])
+        UserCache.set(self.user, "other", [{'id': "a", 'is_unread': True}])
+
+        self.assertEqual(UserCache.update_in_lists(self.user, "unread", ["a"], is_unread=False), 2)
+        self.assertEqual(UserCache.get(self.user, "page2"), [{'id': "a", 'is_unread': False}, {'id': "b", 'is_unread': True}])
+        self.assertEqual(UserCache.get(self.user, "other"), [{'id': "a", 'is_unread': True}])
+
+    def test_remove_from_lists_keeps_the_rest_of_the_namespace(self):
+        UserCache.set_list(self.user, "unread", "page1", [{'id': "a"}, {'id': "b"}])
+        UserCache.set_list(self.user, "drafts", "drafts1", [{'id': "a"}])
+        UserCache.remove_from_lists(self.user, "unread", ["a", "missing"])
+        self.assertEqual(UserCache.get(self.user, "page1"), [{'id': "b"}])
+        self.assertEqual(UserCache.get(self.user, "drafts1"), [{'id': "a"}])
+
+    def test_concurrent_patches_are_not_lost(self):
+        items = [{'id': str(i), 'is_unread': True} for i in range(20)]
+        UserCache.set_list(self.user, "unread", "page1", items)
+        get = LocMemCache.get
+
+        def slow_get(backend, *args, **kwargs):
+            # Widen the read-modify-write window so unserialized patches would overwrite each other
+            value = get(backend, *args, **kwargs)
+            time.sleep(0.001)
+            return value
+
+        # Each thread has its own cache connection, so the backend class is patched
+        with mock.patch.object(LocMemCache, 'get', autospec=True, side_effect=slow_get):
+            threads = [
+                threading.Thread(target=UserCache.update_in_lists, args=(self.user, "unread", [str(i)]),
+                                 kwargs={'is_unread': False})
+                for i in range(20)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertFalse(any(item['is_unread'] for item in UserCache.get(self.user, "page1")))
+
+    def test_list_that_stays_locked_is_dropped(self):
+        UserCache.set_list(self.user, "unread", "page1", [{'id': "a"}])
+        cache.add(f"{UserCache.key(self.user, 'page1')}:__lock__", "other", 60)
+        with mock.patch('inbox.services.cache.LIST_LOCK_WAIT', 0):
+            UserCache.update_in_lists(self.user, "unread", ["a"], is_unread=False)
+        self.assertIsNone(UserCache.get(self.user, "page1"))
+
+
+def b64url(data, padding=False):
+    encoded = base64.urlsafe_b64encode(data).decode('ascii')
+    return encoded if padding else encoded.rstrip('=')
+
+
+def mime_part(mime_type, text=None, charset=None, filename='', headers=(), parts=None, **body):
+    content_type = mime_type + (f'; charset="{charset}"' if charset else '')
+    part = {
+        'mimeType': mime_type,
+        'filename': filename,
+        'headers': [{'name': 'Content-Type', 'value': content_type}, *headers],
+        'body': dict(body),
+    }
+    if text is not None:
+        part['body']['data'] = b64url(text.encode(charset or 'utf-8'))
+    if parts is not None:
+        part['parts'] = parts
+    return part
+
+
+class MimeParsingTests(TestCase):
+    def test_alternative_nested_in_mixed(self):
+        payload = mime_part('multipart/mixed', parts=[
+            mime_part('multipart/alternative', parts=[
+                mime_part('text/plain', "Plain body"),
+                mime_part('text/html', "<p>HTML body</p>"),
+            ]),
+            mime_part('application/pdf', filename="report.pdf", attachmentId="att1", size=1234),
+        ])
+        parsed = parse_message({'id': "m1", 'threadId': "t1", 'payload': payload})
+        self.assertEqual(parsed.body_text, "Plain body")
+        self.assertEqual(parsed.body_html, "<p>HTML body</p>")
+        self.assertEqual(parsed.attachments, [
+            {'filename': "report.pdf", 'mime_type': 'application/pdf', 'attachment_id': "att1", 'size': 1234}
+        ])
+
+    def test_related_inside_alternative_inside_mixed(self):
+        payload = mime_part('multipart/mixed', parts=[
+            mime_part('multipart/alternative', parts=[
+                mime_part('text/plain', "Deep plain"),
+                mime_part('multipart/related', parts=[
+                    mime_part('text/html', "<p>Deep html</p>"),
+                    mime_part('image/png', filename="logo.png", attachmentId="att2"),
+                ]),
+            ]),
+        ])
+        parsed = parse_message({'id': "m1", 'payload': payload})
+        self.assertEqual((parsed.body_text, parsed.body_html), ("Deep plain", "<p>Deep html</p>"))
+        self.assertEqual([a['filename'] for a in parsed.attachments], ["logo.png"])
+
+    def test_text_attachment_is_not_the_body(self):
+        payload = mime_part('multipart/mixed', parts=[
+            mime_part('text/plain', "Attached notes", filename="notes.txt"),
+            mime_part('text/plain', "The real body"),
+        ])
+        parsed = parse_message({'id': "m1", 'payload': payload})
+        self.assertEqual(parsed.body_text, "The real body")
+        self.assertEqual([a['filename'] for a in parsed.attachments], ["notes.txt"])
+
+    def test_non_utf8_charset(self):
+        payload = mime_part('text/plain', "Grüße aus Köln", charset='iso-8859-1')
+        self.assertEqual(parse_message({'id': "m1", 'payload': payload}).body_text, "Grüße aus Köln")
+
+        unknown = mime_part('text/plain', "plain ascii")
+        unknown['headers'] = [{'name': 'content-type', 'value': 'text/plain; charset=x-unknown'}]
+        self.assertEqual(parse_message({'id': "m1", 'payload': unknown}).body_text, "plain ascii")
+
+    def test_metadata_only_skips_bodies(self):
+        payload = mime_part('text/plain', "Body")
+        parsed = parse_message({'id': "m1", 'snippet': "Snip", 'payload': payload}, decode_bodies=False)
+        self.assertEqual((parsed.body_text, parsed.snippet), ('', "Snip"))
+
+    def test_decode_body_padding_and_alphabet(self):
+        data = "subjects?>>~ é".encode('utf-8')
+        for length in range(1, len(data) + 1):
+            chunk = data[:length]
+            self.assertEqual(decode_body(b64url(chunk)), chunk.decode('utf-8', errors='replace'))
+            self.assertEqual(decode_body(b64url(chunk, padding=True)), chunk.decode('utf-8', errors='replace'))
+        # Bytes whose base64url form uses '-' and '_' instead of '+' and '/'
+        self.assertEqual(b64url(b'\xfb\xff'), '-_8')
+        self.assertEqual(decode_body('-_8', 'latin-1'), '\xfb\xff')
+        self.assertEqual(decode_body(''), '')
+        self.assertEqual(decode_body('not base64 ***'), '')
+
+    def test_walk_parts_is_depth_first_in_document_order(self):
+        payload = {'mimeType': 'a', 'parts': [
+            {'mimeType': 'b', 'parts': [{'mimeType': 'c'}, {'mimeType': 'd'}]},
+            {'mimeType': 'e'},
+        ]}
+        self.assertEqual([part['mimeType'] for part in walk_parts(payload)], ['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(list(walk_parts(None)), [])
+
+    def test_header_lookup_is_case_insensitive(self):
+        headers = parse_headers([
+            {'name': 'Subject', 'value': "Hello"},
+            {'name': 'FROM', 'value': "alice@example.com"},
+            {'name': 'subject', 'value': "Duplicate"},
+        ])
+        self.assertEqual(headers, {'subject': "Hello", 'from': "alice@example.com"})
+        parsed = parse_message({'id': "m1", 'payload': {'headers': [{'name': 'Reply-To', 'value': "bob@example.com"}]}})
+        self.assertEqual(parsed.header('reply-to'), "bob@example.com")
+        self.assertEqual(parsed.header('REPLY-TO'), "bob@example.com")
+        self.assertEqual(parsed.header('Cc', 'none'), 'none')
+
+
+class GmailConnectionTests(TestCase):
+    def build_service(self, connections):
+        from googleapiclient.discovery import build
+        return build('gmail', 'v1', credentials=connections.credentials, cache_discovery=False,
+                     requestBuilder=functools.partial(_build_request, connections=connections))
+
+    def test_requests_reuse_the_thread_connection(self):
+        from google.oauth2.credentials import Credentials
+
+        connections = ThreadLocalHttp(Credentials(token="token"))
+        service = self.build_service(connections)
+        first = service.users().getProfile(userId='me')
+        second = service.users().messages().list(userId='me')
+        self.assertIs(first.http, second.http)
+        self.assertIs(first.http.credentials, connections.credentials)
+
+        other_thread = []
+        thread = threading.Thread(target=lambda: other_thread.append(service.users().getProfile(userId='me').http))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other_thread[0], first.http)
+
+
+class GmailServicePoolTests(TestCase):
+    def setUp(self):
+        service_pool.clear()
+        self.addCleanup(service_pool.clear)
+        self.user = User.objects.create(username="pool@example.com")
+
+    def credentials(self, token="token"):
+        from google.oauth2.credentials import Credentials
+        return Credentials(
+            token=token, refresh_token="refresh", token_uri="https://oauth2.googleapis.com/token",
+            client_id="client", client_secret="secret", scopes=['https://www.googleapis.com/auth/gmail.modify'],
+        )
+
+    def test_pooled_service_is_reused(self):
+        service = object()
+        service_pool.put(self.user, service, self.credentials())
+        self.assertIs(get_gmail_service(self.user), service)
+
+    def test_saving_credentials_drops_the_pooled_service(self):
+        service_pool.put(self.user, object(), self.credentials())
+        service_pool.put(None, object(), self.credentials())
+        _save_creds_to_db(self.credentials("new token"), user=self.user)
+
+        self.assertIsNone(service_pool.get(self.user))
+        self.assertIsNotNone(service_pool.get(None))
+        self.assertEqual(GmailCredentials.objects.get(user=self.user).token, "new token")
+
+    def test_refreshing_the_token_drops_the_pooled_service(self):
+        from google.oauth2.credentials import Credentials
+
+        credentials = self.credentials("old token")
+        service_pool.put(self.user, object(), credentials)
+
+        def refresh(creds, request):
+            creds.token = "refreshed token"
+
+        with mock.patch.object(Credentials, 'refresh', autospec=True, side_effect=refresh):
+            self.assertEqual(refresh_access_token(self.user), "refreshed token")
+        self.assertIsNone(service_pool.get(self.user))
+        self.assertEqual(GmailCredentials.objects.get(user=self.user).token, "refreshed token")
+
+    def test_expired_pooled_token_rebuilds_the_service(self):
+        expired = mock.Mock(expired=True)
+        service_pool.put(self.user, object(), expired)
+        rebuilt = mock.Mock()
+        rebuilt.users.return_value.getProfile.return_value.execute.return_value = {'emailAddress': "pool@example.com"}
+        GmailCredentials.objects.create(
+            user=self.user, token="stored token", refresh_token="refresh", token_uri="https://oauth2.googleapis.com/token",
+            client_id="client", client_secret="secret", scopes='["https://www.googleapis.com/auth/gmail.modify"]',
+        )
+
+        with mock.patch('googleapiclient.discovery.build', return_value=rebuilt) as build:
+            self.assertIs(get_gmail_service(self.user), rebuilt)
+        build.assert_called_once()
+        pooled = service_pool.get(self.user)
+        self.assertIs(pooled.service, rebuilt)
+        self.assertEqual(pooled.credentials.token, "stored token")
+        self.assertIsInstance(pooled.http, ThreadLocalHttp)
+
+
+class InboxEventServiceTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="events@example.com")
+        self.other = User.objects.create(username="other-events@example.com")
+
+    def test_events_are_numbered_per_user(self):
+        InboxEventService.publish(self.user, 'resync')
+        InboxEventService.publish(self.other, 'resync')
+        InboxEventService.publish_many(self.user, 'message_added', [{'id': "m1"}, {'id': "m2"}])
+        InboxEventService.publish(self.user, 'message_removed', {'id': "m1"})
+
+        self.assertEqual(
+            [(event.seq, event.kind) for event in InboxEventService.since(self.user, 0)],
+            [(1, 'resync'), (2, 'message_added'), (3, 'message_added'), (4, 'message_removed')]
+        )
+        self.assertEqual([event.seq for event in InboxEventService.since(self.other, 0)], [1])
+        self.assertEqual(InboxEventService.latest_seq(self.user), 4)
+
+    def test_resume_after_a_seq(self):
+        for i in range(5):
+            InboxEventService.publish(self.user, 'message_added', {'id': f"m{i}"})
+        self.assertEqual([event.payload['id'] for event in InboxEventService.since(self.user, 3)], ["m3", "m4"])
+        self.assertEqual(len(InboxEventService.since(self.user, 0, limit=2)), 2)
+        self.assertTrue(InboxEventService.can_resume(self.user, 3))
+
+        InboxEvent.objects.filter(user=self.user, seq__lte=3).delete()
+        self.assertFalse(InboxEventService.can_resume(self.user, 3))
+
+    def test_rolled_back_events_do_not_take_seqs_from_later_ones(self):
+        InboxEventService.publish(self.user, 'resync')
+        try:
+            with transaction.atomic():
+                InboxEventService.publish(self.user, 'message_added', {'id': "m1"})
+                raise RuntimeError("rolled back")
+        except RuntimeError:
+            pass
+        InboxEventService.publish(self.user, 'message_added', {'id': "m2"})
+        self.assertEqual([event.seq for event in InboxEventService.since(self.user, 0)], [1, 2])
+
+    def test_anonymous_users_publish_nothing(self):
+        self.assertIsNone(InboxEventService.publish(AnonymousUser(), 'resync'))
+        self.assertFalse(InboxEvent.objects.exists())
+
+
+class FakeModel:
+    """Model stand-in: answers each prompt with the text `respond` returns for the email IDs in it"""
+
+    model_name = 'fake-model'
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.calls = []
+
+    def generate(self, model, prompt, **kwargs):
+        ids = re.findall(r'^\s*id: (\S+)$', prompt, re.MULTILINE)
+        self.calls.append(ids)
+        answer = self.respond(ids)
+        if isinstance(answer, Exception):
+            raise answer
+        return mock.Mock(text=answer)
+
+
+def classification(email_id, category='Work', priority=5):
+    return {'id': email_id, 'category': category, 'priority': priority}
+
+
+class BatchClassificationServiceTests(TestCase):
+    def setUp(self):
+        gemini.response_cache.clear()
+        self.user = User.objects.create(username="classify@example.com")
+        self.emails = [
+            {'id': f"m{i}", 'from': "sender@example.com", 'subject': f"Subject {i}", 'snippet': "Snippet"}
+            for i in range(3)
+        ]
+
+    def classify(self, respond, **kwargs):
+        model = FakeModel(respond)
+        with mock.patch.object(gemini, 'GEMINI_API_KEY', 'key'), \
+                mock.patch.object(gemini, '_get_model', return_value=model), \
+                mock.patch.object(gemini, '_generate_content', side_effect=model.generate):
+            return BatchClassificationService.classify(self.user, self.emails, **kwargs), model.calls
+
+    def test_one_call_classifies_the_batch(self):
+        result, calls = self.classify(lambda ids: json.dumps([classification(i, 'Finance', 8) for i in ids]))
+        self.assertEqual(calls, [["m0", "m1", "m2"]])
+        self.assertEqual((result['model_calls'], result['failed']), (1, {}))
+        self.assertEqual(EmailMeta.objects.get(user=self.user, email_id="m1").priority, 8)
+        self.assertEqual(EmailMeta.objects.get(user=self.user, email_id="m1").category.name, 'Finance')
+
+    def test_fenced_json_and_loose_values_are_accepted(self):
+        answer = [{'id': "m0", 'category': " work ", 'priority': "7"}, classification("m1"), classification("m2")]
+        result, _ = self.classify(lambda ids: "```json\n" + json.dumps(answer) + "\n```")
+        self.assertEqual(result['results']["m0"]['category'], 'Work')
+        self.assertEqual(result['results']["m0"]['priority'], 7)
+
+    def test_only_invalid_or_missing_items_are_retried(self):
+        def respond(ids):
+            if len(ids) > 1:
+                # m1 has an unknown category, m2 an out-of-range priority, and an unknown ID is added
+                return json.dumps([classification("m0"), classification("m1", 'Spam'),
+                                   classification("m2", priority=15), classification("m9")])
+            if ids == ["m1"]:
+                return json.dumps([classification("m1", 'Personal', 3)])
+            return "Sorry, I cannot help with that."
+
+        result, calls = self.classify(respond)
+        self.assertEqual(calls, [["m0", "m1", "m2"], ["m1"], ["m2"]])
+        self.assertEqual(result['model_calls'], 3)
+        self.assertEqual(sorted(result['results']), ["m0", "m1"])
+        self.assertEqual(result['results']["m1"]['category'], 'Personal')
+        self.assertEqual(result['failed'], {"m2": "Could not parse classification response"})
+        self.assertFalse(EmailMeta.objects.filter(user=self.user, email_id="m9").exists())
+
+    def test_malformed_batch_answer_is_retried_per_email(self):
+        def respond(ids):
+            if len(ids) > 1:
+                return '[{"id": "m0", "category": "Work", "priority": 5}, {"id": '
+            return json.dumps([classification(ids[0])])
+
+        result, calls = self.classify(respond)
+        self.assertEqual(calls, [["m0", "m1", "m2"], ["m0"], ["m1"], ["m2"]])
+        self.assertEqual(result['failed'], {})
+
+    def test_non_array_answer_is_a_failed_answer(self):
+        result, calls = self.classify(lambda ids: json.dumps(classification(ids[0])), batch_size=1)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(set(result['failed'].values()), {"Classification response was not a JSON array"})
+
+    def test_failed_call_is_not_retried(self):
+        with mock.patch.object(gemini, 'record_model_error'):
+            result, calls = self.classify(lambda ids: RuntimeError("model unavailable"))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(result['failed']), ["m0", "m1", "m2"])
+        self.assertFalse(EmailMeta.objects.filter(user=self.user).exists())
+
+    def test_classified_emails_are_served_from_metadata(self):
+        self.classify(lambda ids: json.dumps([classification(i) for i in ids]))
+        result, calls = self.classify(lambda ids: json.dumps([classification(i) for i in ids]))
+        self.assertEqual(calls, [])
+        self.assertTrue(all(item['stored'] for item in result['results'].values()))
+
+
+class LocalClassifierTests(TestCase):
+    def setUp(self):
+        classifier._models.clear()
+        self.addCleanup(classifier._models.clear)
+        self.user = User.objects.create(username="local@example.com")
+
+    def label(self, message_id, sender, subject, body, category, priority, source='llm'):
+        MailboxMessage.objects.create(
+            user=self.user, message_id=message_id, sender=sender, subject=subject, body_text=body, label_ids=['INBOX']
+        )
+        CategorizationService.categorize_email(self.user, message_id, category, source=source)
+        PriorityScoringService.set_priority(self.user, message_id, priority, source=source)
+
+    def label_mailbox(self, count=20, start=0):
+        for i in range(start, start + count):
+            self.label(f"bank{i}", "Bank <alerts@bank.example>", f"Invoice {i} payment due",
+                       "Your invoice payment is due. Pay your statement balance.", 'Finance', 8)
+            self.label(f"friend{i}", "Sam <sam@friends.example>", f"Party this weekend {i}",
+                       "Come to the party this weekend, bring snacks and friends.", 'Social', 2)
+
+    def test_too_few_labels_train_nothing(self):
+        self.label_mailbox(count=5)
+        self.assertIsNone(LocalClassifierService.train(self.user))
+        self.assertIsNone(LocalClassifierService.get_model(self.user))
+
+    def test_trained_model_predicts_category_and_priority(self):
+        self.label_mailbox()
+        trained = LocalClassifierService.train(self.user)
+        self.assertEqual((trained.categories, trained.category_samples), (['Finance', 'Social'], 40))
+
+        prediction = LocalClassifierService.predict(self.user, {
+            'from': "alerts@bank.example", 'subject': "Invoice payment", 'body_text': "Your statement balance is due",
+        })
+        self.assertEqual(prediction['category'][0], 'Finance')
+        self.assertGreaterEqual(prediction['category'][1], classifier.LOCAL_CLASSIFIER_THRESHOLD)
+        self.assertEqual(prediction['priority'][0], 8)
+
+        social = LocalClassifierService.predict(self.user, {'from': "sam@friends.example", 'subject': "Weekend party"})
+        self.assertEqual((social['category'][0], social['priority'][0]), ('Social', 2))
+
+    def test_local_predictions_do_not_train_the_model(self):
+        self.label_mailbox(count=10)
+        for i in range(20):
+            self.label(f"local{i}", "x@y.example", "Local", "Local guess", 'Work', 5, source='local')
+        self.assertEqual(LocalClassifierService.labeled_count(self.user), 20)
+        self.assertIsNone(LocalClassifierService.train(self.user))
+
+    def test_threshold_decides_between_local_and_llm(self):
+        self.label_mailbox()
+        LocalClassifierService.train(self.user)
+        email = {'from': "alerts@bank.example", 'subject': "Invoice payment", 'body_text': "Statement balance due"}
+
+        with mock.patch.object(classifier, 'LOCAL_CLASSIFIER_THRESHOLD', 1.01):
+            self.assertIsNone(BatchClassificationService.classify_locally(self.user, "new1", email))
+        self.assertFalse(EmailMeta.objects.filter(user=self.user, email_id="new1").exists())
+
+        self.assertEqual(BatchClassificationService.classify_locally(self.user, "new1", email), ('Finance', 8))
+        meta = EmailMeta.objects.get(user=self.user, email_id="new1")
+        self.assertEqual((meta.category.name, meta.priority), ('Finance', 8))
+
+        # Words the model never saw leave the email to the LLM
+        self.assertIsNone(BatchClassificationService.classify_locally(self.user, "new2", {'subject': "zzz qqq"}))
+
+    def test_gmail_tab_hints_stand_in_for_a_missing_model(self):
+        prediction = LocalClassifierService.predict(self.user, {'subject': "Sale", 'label_ids': ['INBOX', 'CATEGORY_PROMOTIONS']})
+        self.assertEqual(prediction, {
+            'category': ('Promotions', classifier.GMAIL_HINT_CONFIDENCE),
+            'priority': (2, classifier.GMAIL_HINT_CONFIDENCE),
+        })
+        self.assertEqual(
+            BatchClassificationService.classify_locally(self.user, "promo", {'label_ids': ['CATEGORY_SOCIAL']}),
+            ('Social', 3)
+        )
+        self.assertEqual(LocalClassifierService.predict(self.user, {'label_ids': ['INBOX']}),
+                         {'category': None, 'priority': None})
+
+    def test_schedule_training_waits_for_enough_new_labels(self):
+        self.label_mailbox(count=10)
+        LocalClassifierService.schedule_training(self.user)
+        self.assertFalse(BackgroundJob.objects.filter(kind='train_classifier').exists())
+        self.label_mailbox(count=10, start=10)
+        LocalClassifierService.schedule_training(self.user)
+        self.assertTrue(BackgroundJob.objects.filter(kind='train_classifier').exists())
+
+
+class LLMResponseCacheTests(TestCase):
+    def setUp(self):
+        self.clock = [1000.0]
+        self.cache = LLMResponseCache(ttl=60)
+        self.cache._memory = TTLCache(maxsize=8, ttl=60, timer=lambda: self.clock[0])
+        self.key = LLMResponseCache.make_key("model", "summarize_email", 1, ["hello"])
+
+    def test_key_covers_model_function_version_and_input(self):
+        self.assertEqual(self.key, LLMResponseCache.make_key("model", "summarize_email", 1, ["hello"]))
+        for other in [("other", "summarize_email", 1, ["hello"]), ("model", "generate_reply", 1, ["hello"]),
+                      ("model", "summarize_email", 2, ["hello"]), ("model", "summarize_email", 1, ["bye"])]:
+            self.assertNotEqual(self.key, LLMResponseCache.make_key(*other))
+
+    def test_memory_miss_falls_through_to_the_database(self):
+        self.cache.set(self.key, {"summary": "hi"}, model_name="model", function="summarize_email")
+        self.assertEqual(self.cache.get(self.key), {"summary": "hi"})
+
+        # Another process has an empty LRU but shares the table
+        self.cache._memory.clear()
+        self.assertEqual(self.cache.get(self.key), {"summary": "hi"})
+        self.assertEqual(LLMResponseCacheEntry.objects.get(cache_key=self.key).hit_count, 1)
+        # The database hit refilled the LRU
+        self.assertEqual(self.cache.get(self.key), {"summary": "hi"})
+        self.assertEqual(LLMResponseCacheEntry.objects.get(cache_key=self.key).hit_count, 1)
+
+        stats = self.cache.stats()
+        self.assertEqual((stats['memory_hits'], stats['db_hits'], stats['misses']), (2, 1, 0))
+        self.assertIsNone(self.cache.get("missing"))
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_entries_expire_after_ttl_in_both_tiers(self):
+        self.cache.set(self.key, "summary")
+        self.clock[0] += 61
+        self.assertIsNone(self.cache._memory.get(self.key))
+
+        later = timezone.now() + timedelta(seconds=61)
+        with mock.patch('inbox.services.llm_cache.timezone.now', return_value=later):
+            self.assertIsNone(self.cache.get(self.key))
+            self.assertEqual(self.cache.evict(), 1)
+        self.assertFalse(LLMResponseCacheEntry.objects.exists())
+
+    def test_evict_drops_least_recently_used_rows_beyond_the_limit(self):
+        self.cache.max_db_entries = 2
+        keys = [LLMResponseCache.make_key("model", "f", 1, [i]) for i in range(3)]
+        for key in keys:
+            self.cache.set(key, "value")
+        self.cache._memory.clear()
+        self.cache.get(keys[0])
+        self.assertEqual(self.cache.evict(), 1)
+        self.assertEqual(set(LLMResponseCacheEntry.objects.values_list('cache_key', flat=True)), {keys[0], keys[2]})
+
+
+class CachedLLMCallTests(TestCase):
+    def setUp(self):
+        gemini.response_cache.clear()
+        for target, value in [('GEMINI_API_KEY', "key"), ('get_working_model', mock.Mock(return_value="model"))]:
+            patcher = mock.patch.object(gemini, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def summarize(self, text, response=None, error=None):
+        generate = mock.Mock(return_value=response, side_effect=error)
+        with mock.patch.object(gemini, '_get_model', return_value=mock.Mock(model_name="model")), \
+                mock.patch.object(gemini, '_generate_content', generate):
+            return gemini.summarize_email(text), generate.call_count
+
+    def test_successful_calls_are_cached(self):
+        self.assertEqual(self.summarize("email", mock.Mock(text=" - point ")), ("- point", 1))
+        self.assertEqual(self.summarize("email", mock.Mock(text="other")), ("- point", 0))
+        gemini.response_cache._memory.clear()
+        self.assertEqual(self.summarize("email", mock.Mock(text="other")), ("- point", 0))
+        self.assertEqual(self.summarize("another email", mock.Mock(text="other")), ("other", 1))
+
+    def test_failed_calls_are_not_cached(self):
+        result, calls = self.summarize("email", error=RuntimeError("boom"))
+        self.assertEqual((result, calls), ("[Gemini error: boom]", 1))
+        self.assertFalse(LLMResponseCacheEntry.objects.exists())
+        self.assertIs(gemini._call_failed.get(), False)
+
+        self.assertEqual(self.summarize("email", mock.Mock(text="summary")), ("summary", 1))
+        self.assertEqual(LLMResponseCacheEntry.objects.get().response, "summary")
+
+    def test_empty_results_and_error_fallbacks_are_not_cached(self):
+        calls = []
+
+        @gemini.cached_llm_call()
+        def answer(text):
+            calls.append(text)
+            if text == "fails":
+                gemini.record_model_error(RuntimeError("boom"))
+                return "fallback"
+            return "" if text == "empty" else text.upper()
+
+        for text in ["empty", "empty", "fails", "fails", "ok", "ok"]:
+            answer(text)
+        self.assertEqual(calls, ["empty", "empty", "fails", "fails", "ok"])
+        self.assertEqual(list(LLMResponseCacheEntry.objects.values_list('function', 'response')), [("answer", "OK")])
+
+
+class BulkActionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username="bulk@example.com")
+        self.service = mock.MagicMock()
+        self.calls = []
+        # Two IDs per Gmail call, so one failing call leaves the other chunks applied
+        patcher = mock.patch.object(bulk, 'MAX_BULK_IDS', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fail_chunks_with(self, failing_id, method='batchModify'):
+        def call(userId, body):
+            self.calls.append(body)
+            request = mock.Mock()
+            if failing_id in body['ids']:
+                request.execute.side_effect = HttpError(HttpResponse({'status': 500}), b'backend error')
+            return request
+        getattr(self.service.users.return_value.messages.return_value, method).side_effect = call
+
+    def mirror(self, *message_ids):
+        for message_id in message_ids:
+            MailboxMessage.objects.create(user=self.user, message_id=message_id, label_ids=['INBOX', 'UNREAD'])
+        UserCache.set_list(self.user, UNREAD_CACHE_GROUP, "page1",
+                           [{'id': message_id, 'is_unread': True} for message_id in message_ids])
+
+    def labels(self):
+        return dict(MailboxMessage.objects.filter(user=self.user).values_list('message_id', 'label_ids'))
+
+    def test_batch_modify_reports_each_id_of_a_failed_chunk(self):
+        self.fail_chunks_with("c")
+        outcomes = BulkEmailService.batch_modify(self.service, ["a", "b", "a", "c", "d", "e"], remove_labels=['UNREAD'])
+        self.assertEqual([body['ids'] for body in self.calls], [["a", "b"], ["c", "d"], ["e"]])
+        self.assertEqual(self.calls[0]['removeLabelIds'], ['UNREAD'])
+        self.assertNotIn('addLabelIds', self.calls[0])
+        self.assertEqual({message_id for message_id, error in outcomes.items() if error is None}, {"a", "b", "e"})
+        self.assertIn("backend error", outcomes["c"])
+        self.assertIn("backend error", outcomes["d"])
+
+    def test_unknown_action_and_empty_label_change_are_rejected(self):
+        with self.assertRaises(ValueError):
+            BulkEmailService.apply(self.service, 'star', ["a"])
+        with self.assertRaises(ValueError):
+            BulkEmailService.apply(self.service, 'label', ["a"])
+
+    def test_mark_read_updates_only_the_emails_that_succeeded(self):
+        self.mirror("a", "b", "c", "d")
+        self.fail_chunks_with("c")
+        result = _run_bulk_action(self.user, self.service, 'mark-read', ["a", "b", "c", "d"])
+
+        self.assertEqual((result['success_count'], result['total_count']), (2, 4))
+        self.assertEqual(result['results']["a"], {'ok': True})
+        self.assertFalse(result['results']["c"]['ok'])
+        self.assertIn("backend error", result['results']["d"]['error'])
+        self.assertEqual(self.labels(), {"a": ['INBOX'], "b": ['INBOX'], "c": ['INBOX', 'UNREAD'], "d": ['INBOX', 'UNREAD']})
+        self.assertEqual(
+            [item['is_unread'] for item in UserCache.get(self.user, "page1")], [False, False, True, True]
+        )
+
+    def test_archive_removes_only_the_emails_that_succeeded(self):
+        self.mirror("a", "b", "c")
+        self.fail_chunks_with("a")
+        result = _run_bulk_action(self.user, self.service, 'archive', ["a", "b", "c"])
+
+        self.assertEqual(result['success_count'], 1)
+        self.assertEqual(self.labels(), {"a": ['INBOX', 'UNREAD'], "b": ['INBOX', 'UNREAD'], "c": ['UNREAD']})
+        self.assertEqual([item['id'] for item in UserCache.get(self.user, "page1")], ["a", "b"])
+
+    def test_delete_drops_only_the_emails_that_succeeded(self):
+        self.mirror("a", "b", "c")
+        self.fail_chunks_with("c", method='batchDelete')
+        result = _run_bulk_action(self.user, self.service, 'delete', ["a", "b", "c"])
+
+        self.assertEqual(result['success_count'], 2)
+        self.assertEqual(set(self.labels()), {"c"})
+        self.assertEqual([item['id'] for item in UserCache.get(self.user, "page1")], ["c"])
+
+    def test_nothing_changes_when_every_call_fails(self):
+        self.mirror("a", "b")
+        self.fail_chunks_with("a")
+        version = UserCache.version(self.user)
+        result = _run_bulk_action(self.user, self.service, 'mark-unread', ["a", "b"])
+
+        self.assertEqual(result['success_count'], 0)
+        self.assertEqual(UserCache.version(self.user), version)
+        self.assertEqual(len(UserCache.get(self.user, "page1")), 2)
@@ -23,10 +23,14 @@ api_urlpatterns = [
     path('email/<str:message_id>/delete/', views.delete_email_view, name='delete-email'),
     path('email/<str:message_id>/toggle-important/', views.toggle_important_view, name='toggle-important'),
     path('emails/important/', views.important_emails_view, name='important-emails'),
+    path('events/stream/', views.inbox_events_view, name='inbox-events'),
+    path('search/', views.search_emails_view, name='search-emails'),
+    path('search/semantic/', views.semantic_search_view, name='semantic-search'),
 
     # --- Bulk actions ---
     path('emails/bulk-mark-read/', views.bulk_mark_as_read_view, name='bulk-mark-as-read'),
     path('emails/bulk-archive/', views.bulk_archive_emails_view, name='bulk-archive-emails'),
+    path('emails/bulk/', views.bulk_emails_view, name='bulk-emails'),
 
     # ==========================================
     # == Draft Management (Gmail)
@@ -44,12 +48,14 @@ api_urlpatterns = [
     # --- CRITICAL FIX: Added old 'generate-reply' path for your frontend ---
     path('generate-reply/', views.generate_reply_view, name='generate-reply'),
     path('ai/generate-reply/', views.generate_reply_view, name='ai-generate-reply'),
+    path('ai/generate-reply/stream/', views.generate_reply_stream_view, name='ai-generate-reply-stream'),
     path('ai/generate-tone-reply/', views.generate_tone_reply_view, name='generate-tone-reply'),
     path('ai/thread/<str:thread_id>/analyze/', views.email_thread_analysis_view, name='email-thread-analysis'),
     path('ai/thread/analyze-from-text/', views.email_thread_analysis_from_text_view, name='email-thread-analysis-from-text'),
     # --- COMPATIBILITY FIX: Added for frontend that calls the old path ---
     path('email-thread-analysis-from-text/', views.email_thread_analysis_from_text_view, name='email-thread-analysis-from-text-legacy'),
     path('ai/sentiment-analysis/', views.sentiment_analysis_view, name='sentiment-analysis'),
+    path('ai/enrich/', views.enrich_email_view, name='enrich-email'),
 
     # ==========================================
     # == Workflow Automation
@@ -66,6 +72,8 @@ api_urlpatterns = [
     # Priority Scoring
     path('workflow/priority/', views.set_priority_view, name='set-priority'),
     path('workflow/priority/auto/', views.auto_score_priority_view, name='auto-score-priority'),
+    # Batch classification (category and priority)
+    path('workflow/classify/batch/', views.classify_batch_view, name='classify-batch'),
 
     # ==========================================
     # == Email Templates
@@ -3,8 +3,8 @@
 import os
 import json
 import logging
-import base64
-from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest
+import time
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import redirect, render
 from django.views.decorators.http import require_GET, require_POST
 from django.views.decorators.csrf import csrf_exempt
@@ -14,22 +14,40 @@ from django.contrib.auth.models import User
 from django.contrib.auth import login
 from django.urls import resolve, reverse
 from django.contrib import messages
-from django.core.cache import cache
+from asgiref.sync import sync_to_async
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
 from django.core.paginator import Paginator, EmptyPage
 from .serializers import EmailSerializer, EmailTemplateSerializer, ReminderSerializer, ScheduledEmailSerializer
-from .services import gemini
+from .services import gemini, aio
 from .services.gmail import (
     build_flow, get_gmail_service, create_gmail_draft,
     _save_creds_to_db, _load_creds_from_db, fetch_unread, mark_as_read,
-    fetch_drafts, get_draft_details, delete_draft, update_draft, get_email_details
+    fetch_drafts, get_draft_details, fetch_unread_page, fetch_drafts_page, delete_draft, update_draft, get_email_details,
+    get_emails_details, get_gmail_profile, draft_list_fields, UNREAD_CACHE_GROUP, DRAFTS_CACHE_GROUP
 )
 from .services.workflow import (
     ReminderService, SchedulingService, 
-    CategorizationService, PriorityScoringService
+    CategorizationService, PriorityScoringService, BatchClassificationService
 )
+from .services.sync import MailboxSyncService
+from .services.cache import UserCache
+from .services.bulk import BulkEmailService, BULK_ACTIONS
+from .services.enrichment import EnrichmentService
+from .services.threads import ThreadAnalysisService
+from .services.semantic import SemanticSearchService, enqueue_indexing
+from .services.fulltext import FullTextSearchService
+from .services.speculative import SpeculativeReplyService
+from .services.jobs import JobQueue
+from .services.meta import EmailMetaService
+from .services.pagination import encode_cursor, decode_cursor
+from .services.mime import parse_message
+from .services.ratelimit import rate_limiter, UpstreamUnavailable
+from .services.events import (
+    InboxEventService, INBOX_STREAM_POLL_INTERVAL, INBOX_STREAM_MAX_DURATION, INBOX_STREAM_KEEPALIVE
+)
+from .services.sync import MAILBOX_SYNC_INTERVAL
 from .models import GeneratedDraft, ImportantEmail, UserSettings, EmailTemplate, Reminder, ScheduledEmail, EmailCategory, EmailPriority
 
 # Logging
@@ -49,6 +67,46 @@ def credentials_to_dict(credentials):
         'scopes': credentials.scopes,
     }
 
+def sse_event(event, data, event_id=None):
+    """Format one Server-Sent Events message with a JSON payload"""
+    id_line = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{id_line}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def upstream_unavailable_response(error):
+    """503 response telling the client when to retry a rate-limited or circuit-broken upstream"""
+    response = JsonResponse({
+        'ok': False,
+        'error': f"{error.upstream.capitalize()} is busy right now. Please try again in {error.retry_after} seconds.",
+        'retry_after': error.retry_after,
+    }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    response['Retry-After'] = str(error.retry_after)
+    return response
+
+def filter_emails_by_meta(request, user, emails):
+    """Apply the optional min_priority/category/important/sort query params using stored email metadata"""
+    meta_filters = {
+        'min_priority': request.GET.get('min_priority'),
+        'category': request.GET.get('category'),
+        'important': request.GET.get('important'),
+        'sort': request.GET.get('sort'),
+    }
+    if not user or not any(meta_filters.values()):
+        return emails
+
+    try:
+        min_priority = int(meta_filters['min_priority']) if meta_filters['min_priority'] else None
+    except ValueError:
+        min_priority = None
+    important = meta_filters['important'].lower() == 'true' if meta_filters['important'] else None
+    by_id = {email['id']: email for email in emails}
+    return [by_id[email_id] for email_id in EmailMetaService.filter_ids(
+        user, by_id,
+        min_priority=min_priority,
+        category=meta_filters['category'],
+        important=important,
+        sort=meta_filters['sort']
+    )]
+
 def is_authenticated(user=None):
     """Check if user has valid Gmail credentials"""
     try:
@@ -122,20 +180,11 @@ def home_view(request):
 # OAuth status
 ########################################
 def auth_status(request):
-    service = get_gmail_service(user=request.user if request.user.is_authenticated else None)
-    
-    # Test the service by trying to fetch the user's profile
-    profile = None
-    if service:
-        try:
-            profile = service.users().getProfile(userId="me").execute()
-            logger.info(f"Successfully fetched Gmail profile: {profile.get('emailAddress')}")
-        except Exception as e:
-            logger.error(f"Error fetching Gmail profile: {str(e)}", exc_info=True)
-            service = None
+    # The profile is probed once when the pooled service is built
+    profile = get_gmail_profile(user=request.user if request.user.is_authenticated else None)
     
     return JsonResponse({
-        "authenticated": service is not None,
+        "authenticated": profile is not None,
         "django_authenticated": request.user.is_authenticated,
         "email": request.user.email if request.user.is_authenticated else None,
         "username": request.user.username if request.user.is_authenticated else None,
@@ -281,8 +330,15 @@ def oauth_callback(request):
 ########################################
 # API: unread emails with pagination
 ########################################
-@api_view(['GET'])
-def unread_emails_view(request):
+@require_GET
+async def unread_emails_view(request):
+    """
+    List unread emails
+
+    Without a `page` param the list is cursor-paginated: pass the returned
+    `next_cursor` as `cursor` to get the next page. Only `per_page` emails are
+    loaded per request. `page` keeps the older numbered pagination.
+    """
     page_number = request.GET.get('page', 1)
     per_page = request.GET.get('per_page', 10)  # Allow configurable items per page
     
@@ -303,12 +359,13 @@ def unread_emails_view(request):
         per_page = 10
         
     try:
-        user = request.user if request.user.is_authenticated else None
-        service = get_gmail_service(user=user)
+        user = await request.auser()
+        user = user if user.is_authenticated else None
+        service = await aio.run_blocking(get_gmail_service, user=user)
         
         if not service:
             logger.warning("Failed to get Gmail service - user not authenticated or no valid credentials")
-            return Response({
+            return JsonResponse({
                 'ok': False, 
                 'error': 'Authentication required. Please connect your Gmail account.',
                 'auth_required': True
@@ -316,56 +373,14 @@ def unread_emails_view(request):
         
         logger.info(f"Fetching unread emails for user: {user if user else 'anonymous'}")
         
-        # Use the fetch_unread from services.gmail
-        emails = fetch_unread(service, max_results=100)  # Fetch more emails for pagination
-        
-        if not emails:
-            logger.warning("No unread emails found")
-            return Response({'ok': True, 'emails': [], 'total_pages': 0, 'current_page': 1})
-        
-        # Add important status to each email
-        if user and user.is_authenticated:
-            # FIXED: Use email_id instead of message_id
-            important_email_ids = ImportantEmail.objects.filter(user=user).values_list('email_id', flat=True)
-            for email in emails:
-                email['is_important'] = email['id'] in important_email_ids                
-                # Add category and priority information
-                try:
-                    category = CategorizationService.get_email_category(user, email['id'])
-                    if category:
-                        email['category'] = category.name  # FIXED: Use .name instead of .category
-                except Exception as e:
-                    logger.warning(f"Error getting category for email {email['id']}: {str(e)}")
-                
-                try:
-                    priority = PriorityScoringService.get_email_priority(user, email['id'])
-                    if priority:
-                        email['priority'] = priority.priority
-                except Exception as e:
-                    # Check if the error is due to missing table
-                    if "does not exist" in str(e):
-                        logger.warning(f"EmailPriority table does not exist. Skipping priority for email {email['id']}")
-                    else:
-                        logger.warning(f"Error getting priority for email {email['id']}: {str(e)}")
-        
-        paginator = Paginator(emails, per_page)
-        try:
-            page_obj = paginator.page(page_number)
-        except EmptyPage:
-            logger.warning(f"Requested page {page_number} out of range. Returning last page.")
-            page_obj = paginator.page(paginator.num_pages)
+        if 'page' not in request.GET:
+            return await _unread_emails_cursor_page(request, user, service, per_page)
         
-        serializer = EmailSerializer(page_obj.object_list, many=True, context={'user': user})
-        return Response({
-            'ok': True,
-            'emails': serializer.data,
-            'total_pages': paginator.num_pages,
-            'current_page': page_obj.number,
-            'per_page': per_page,
-            'total_emails': len(emails),
-            'has_next': page_obj.has_next(),
-            'has_previous': page_obj.has_previous(),
-        })
+        # The numbered pages load up to 100 emails through the sync client; kept for old clients
+        return await aio.run_blocking(_unread_emails_numbered_page, request, user, service, page_number, per_page)
+    except UpstreamUnavailable as e:
+        logger.warning(f"Gmail unavailable in unread_emails_view: {str(e)}")
+        return upstream_unavailable_response(e)
     except Exception as e:
         logger.error(f"Error in unread_emails_view: {str(e)}", exc_info=True)
         error_msg = "Failed to fetch emails"
@@ -378,18 +393,128 @@ def unread_emails_view(request):
         elif "does not exist" in str(e):
             error_msg = "Database tables not created. Please run migrations."
         
-        return Response({
+        return JsonResponse({
             'ok': False, 
             'error': error_msg,
             'auth_required': "invalid_grant" in str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def _unread_emails_numbered_page(request, user, service, page_number, per_page):
+    """One numbered page of unread emails (sync; run off the event loop)"""
+    # Serve signed-in users from the local mailbox mirror, kept current through Gmail history
+    emails = None
+    if user and MailboxSyncService.sync(user, service):
+        emails = MailboxSyncService.get_unread_emails(user, max_results=100)
+    
+    if emails is None:
+        # Use the fetch_unread from services.gmail
+        emails = fetch_unread(service, max_results=100, user=user)  # Fetch more emails for pagination
+    
+    if not emails:
+        logger.warning("No unread emails found")
+        return JsonResponse({'ok': True, 'emails': [], 'total_pages': 0, 'current_page': 1})
+    
+    # Optional server-side filtering and sorting by stored email metadata
+    emails = filter_emails_by_meta(request, user, emails)
+    
+    paginator = Paginator(emails, per_page)
+    try:
+        page_obj = paginator.page(page_number)
+    except EmptyPage:
+        logger.warning(f"Requested page {page_number} out of range. Returning last page.")
+        page_obj = paginator.page(paginator.num_pages)
+    
+    # Add important status, category, priority and sentiment for the page in one indexed query
+    EnrichmentService.annotate_emails(user, page_obj.object_list)
+    
+    serializer = EmailSerializer(page_obj.object_list, many=True, context={'user': user})
+    return JsonResponse({
+        'ok': True,
+        'emails': serializer.data,
+        'total_pages': paginator.num_pages,
+        'current_page': page_obj.number,
+        'per_page': per_page,
+        'total_emails': len(emails),
+        'has_next': page_obj.has_next(),
+        'has_previous': page_obj.has_previous(),
+    })
+
+def _serialize_email_page(request, user, emails):
+    """Filter a page by stored metadata, annotate it and serialize it"""
+    emails = filter_emails_by_meta(request, user, emails)
+    EnrichmentService.annotate_emails(user, emails)
+    return EmailSerializer(emails, many=True, context={'user': user}).data
+
+# Cursor positions: k is 'mirror' (keyset d = internal date in ms, i = row ID) or
+# 'gmail' (t = Gmail page token); draft cursors only carry t
+UNREAD_CURSOR_FIELDS = {'k': str, 'd': (int, type(None)), 'i': int, 't': str}
+DRAFTS_CURSOR_FIELDS = {'t': str}
+
+async def _unread_emails_cursor_page(request, user, service, per_page):
+    """
+    One cursor page of unread emails
+
+    Signed-in users page through the mailbox mirror by (internal_date, id)
+    keyset; once the mirror is exhausted the cursor carries on with the Gmail
+    nextPageToken left by the last full sync. Without a mirror the cursor wraps
+    Gmail's nextPageToken directly, fetched on the async client. Metadata
+    filters apply within the page.
+    """
+    try:
+        position = decode_cursor(request.GET.get('cursor'), fields=UNREAD_CURSOR_FIELDS)
+        if position and position.get('k') not in ('mirror', 'gmail'):
+            raise ValueError("Unknown cursor kind")
+        if position.get('k') == 'mirror' and 'i' not in position:
+            raise ValueError("Mirror cursor without a row ID")
+    except ValueError:
+        return JsonResponse({'ok': False, 'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+
+    kind = position.get('k')
+    use_mirror = False
+    if user and kind != 'gmail':
+        # Sync on every page is cheap: it is throttled to MAILBOX_SYNC_INTERVAL
+        use_mirror = await aio.run_blocking(MailboxSyncService.sync, user, service) or kind == 'mirror'
+
+    def mirror_page():
+        after = (position.get('d'), position.get('i')) if kind == 'mirror' else None
+        emails, next_after = MailboxSyncService.get_unread_page(user, per_page, after=after)
+        if next_after:
+            next_position = {'k': 'mirror', 'd': next_after[0], 'i': next_after[1]}
+        else:
+            page_token = MailboxSyncService.get_unread_page_token(user)
+            next_position = {'k': 'gmail', 't': page_token} if page_token else None
+        total_estimate = None if position else MailboxSyncService.count_unread(user)
+        return emails, next_position, total_estimate
+
+    if use_mirror:
+        emails, next_position, total_estimate = await sync_to_async(mirror_page)()
+    else:
+        emails, page_token, estimate = await aio.fetch_unread_page(user, per_page, page_token=position.get('t'))
+        next_position = {'k': 'gmail', 't': page_token} if page_token else None
+        total_estimate = None if position else estimate
+
+    return JsonResponse({
+        'ok': True,
+        'emails': await sync_to_async(_serialize_email_page)(request, user, emails),
+        'per_page': per_page,
+        'next_cursor': encode_cursor(next_position) if next_position else None,
+        'has_next': next_position is not None,
+        'total_estimate': total_estimate,
+    })
+
 ########################################
 # API: drafts with pagination
 ########################################
 
 @api_view(['GET'])
 def drafts_view(request):
+    """
+    List drafts
+
+    Without a `page` param the list is cursor-paginated on Gmail's
+    nextPageToken: pass the returned `next_cursor` as `cursor` for the next
+    page. `page` keeps the older numbered pagination.
+    """
     page_number = request.GET.get('page', 1)
     per_page = request.GET.get('per_page', 10)
     refresh = request.GET.get('refresh', 'false').lower() == 'true'  # New refresh parameter
@@ -422,22 +547,38 @@ def drafts_view(request):
             }, status=status.HTTP_401_UNAUTHORIZED)
         
         # Get authenticated email for verification
-        try:
-            profile = service.users().getProfile(userId='me').execute()
-            authenticated_email = profile.get('emailAddress')
-            logger.info(f"Fetching drafts for authenticated Gmail account: {authenticated_email}")
-        except Exception as e:
-            logger.error(f"Error getting Gmail profile: {str(e)}")
-            authenticated_email = "Unknown"
+        profile = get_gmail_profile(user=user) or {}
+        authenticated_email = profile.get('emailAddress', 'Unknown')
+        logger.info(f"Fetching drafts for authenticated Gmail account: {authenticated_email}")
         
         # Clear cache if refresh requested
         if refresh:
-            cache_key = f"gmail_drafts_{per_page}"
-            cache.delete(cache_key)
+            UserCache.invalidate(user)
             logger.info(f"Cleared drafts cache on refresh request")
         
+        if 'page' not in request.GET:
+            try:
+                position = decode_cursor(request.GET.get('cursor'), fields=DRAFTS_CURSOR_FIELDS)
+            except ValueError:
+                return Response({'ok': False, 'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+            
+            drafts, page_token, estimate = fetch_drafts_page(
+                service, per_page, page_token=position.get('t'), user=user
+            )
+            from .serializers import DraftSerializer
+            serializer = DraftSerializer(drafts, many=True)
+            return Response({
+                'ok': True,
+                'drafts': serializer.data,
+                'per_page': per_page,
+                'next_cursor': encode_cursor({'t': page_token}) if page_token else None,
+                'has_next': bool(page_token),
+                'total_estimate': None if position else estimate,
+                'authenticated_email': authenticated_email,
+            })
+        
         # Fetch drafts from Gmail
-        drafts = fetch_drafts(service, max_results=100)
+        drafts = fetch_drafts(service, max_results=100, user=user)
         
         if not drafts:
             logger.warning("No drafts returned from fetch_drafts")
@@ -471,6 +612,9 @@ def drafts_view(request):
             'has_previous': page_obj.has_previous(),
             'authenticated_email': authenticated_email
         })
+    except UpstreamUnavailable as e:
+        logger.warning(f"Gmail unavailable in drafts_view: {str(e)}")
+        return upstream_unavailable_response(e)
     except Exception as e:
         logger.error(f"Error in drafts_view: {str(e)}", exc_info=True)
         error_msg = "Failed to fetch drafts"
@@ -498,7 +642,7 @@ def debug_drafts_view(request):
         
         # Test 1: Get profile
         try:
-            profile = service.users().getProfile(userId='me').execute()
+            profile = get_gmail_profile(user=user) or {}
             profile_info = {
                 'emailAddress': profile.get('emailAddress'),
                 'historyId': profile.get('historyId'),
@@ -711,7 +855,8 @@ def toggle_important_view(request, message_id):
             is_important = False
         else:
             is_important = True
-            
+        
+        EmailMetaService.update(request.user, message_id, is_important=is_important)
         return Response({'ok': True, 'is_important': is_important})
     except Exception as e:
         logger.error(f"Error toggling important status: {str(e)}", exc_info=True)
@@ -738,43 +883,25 @@ def important_emails_view(request):
         if not service:
             return Response({'ok': False, 'error': 'Gmail not connected'}, status=status.HTTP_401_UNAUTHORIZED)
         
-        # Fetch email details for each important message
-        emails = []
-        for message_id in important_email_ids:
-            try:
-                email_details = get_email_details(service, message_id)
-                if email_details:
-                    # Mark as important
-                    email_details['is_important'] = True
-                    
-                    # Add category information with error handling
-                    try:
-                        category = CategorizationService.get_email_category(request.user, message_id)
-                        if category:
-                            email_details['category'] = category.name  # FIXED: Use .name instead of .category
-                    except Exception as e:
-                        # Check if the error is due to missing table
-                        if "does not exist" in str(e):
-                            logger.warning(f"EmailCategory table does not exist. Skipping category for email {message_id}")
-                        else:
-                            logger.warning(f"Error getting category for email {message_id}: {str(e)}")
-                    
-                    # Add priority information with error handling
-                    try:
-                        priority = PriorityScoringService.get_email_priority(request.user, message_id)
-                        if priority:
-                            email_details['priority'] = priority.priority
-                    except Exception as e:
-                        # Check if the error is due to missing table
-                        if "does not exist" in str(e):
-                            logger.warning(f"EmailPriority table does not exist. Skipping priority for email {message_id}")
-                        else:
-                            logger.warning(f"Error getting priority for email {message_id}: {str(e)}")
-                    
-                    emails.append(email_details)
-            except Exception as e:
-                logger.error(f"Error fetching email {message_id}: {str(e)}")
-                continue
+        # Serve important messages from the local mailbox mirror
+        important_email_ids = list(important_email_ids)
+        fetched_details = {}
+        if MailboxSyncService.sync(request.user, service):
+            mirrored = MailboxSyncService.get_messages(request.user, important_email_ids)
+            fetched_details = {message_id: row.to_details_dict() for message_id, row in mirrored.items()}
+        
+        # Fetch the ones we have not mirrored yet in batches
+        missing_ids = [message_id for message_id in important_email_ids if message_id not in fetched_details]
+        if missing_ids:
+            live_details = get_emails_details(service, missing_ids)
+            for details in live_details.values():
+                MailboxSyncService.store_details(request.user, details)
+            fetched_details.update(live_details)
+        
+        emails = [fetched_details[message_id] for message_id in important_email_ids if message_id in fetched_details]
+        
+        # Add category, priority and sentiment in a few bulk queries
+        EnrichmentService.annotate_emails(request.user, emails)
         
         # Sort by date
         emails.sort(key=lambda x: x.get('date', ''), reverse=True)
@@ -904,7 +1031,7 @@ def settings_view(request):
 ########################################
 @csrf_exempt
 @require_POST
-def generate_reply_view(request):
+async def generate_reply_view(request):
     try:
         # FIX: Manually parse the JSON body from the request
         payload = json.loads(request.body.decode("utf-8"))
@@ -917,50 +1044,48 @@ def generate_reply_view(request):
             return HttpResponseBadRequest("email_text is required")
         
         # Get user settings for reply tone
+        user = await request.auser()
         reply_tone = 'professional'  # Default
-        if request.user.is_authenticated:
-            try:
-                user_settings = UserSettings.objects.get(user=request.user)
+        if user.is_authenticated:
+            user_settings = await UserSettings.objects.filter(user=user).afirst()
+            if user_settings:
                 reply_tone = user_settings.reply_tone
-            except UserSettings.DoesNotExist:
-                pass
         
+        # A reply drafted ahead of time from the same text is returned without a model call
+        precomputed = await sync_to_async(SpeculativeReplyService.lookup)(user, message_id, email_text, reply_tone)
         try:
-            summary = gemini.summarize_email(email_text)
-            
-            # Use the existing generate_reply function with tone-specific prompt
-            tone_prompt = f"""
-            Generate a reply to the following email in a {reply_tone} tone.
-            The tone should be {reply_tone} throughout the entire response.
-            
-            Email Summary: {summary}
-            
-            Original Email: {email_text}
-            
-            Reply:
-            """
-            
-            draft = gemini.generate_reply(tone_prompt)
+            if precomputed:
+                enrichment = precomputed.enrichment
+            else:
+                # One model call for summary, reply and classification (stored for the email)
+                enrichment = await EnrichmentService.aenrich_email(user, message_id, email_text, tone=reply_tone)
+            summary = enrichment['summary']
+            draft = enrichment['reply']
         except Exception as e:
             # Check if this is a quota error
             if "429" in str(e) or "quota" in str(e).lower():
                 logger.warning(f"Gemini quota exceeded, using fallback: {str(e)}")
-                draft = gemini.generate_reply_fallback(email_text, summary)
+                enrichment = None
+                summary = ''
+                draft = gemini.generate_reply_fallback(email_text)
             else:
                 logger.error(f"Generate reply error: {str(e)}")
                 return JsonResponse({"ok": False, "error": str(e)}, status=500)
         
         # Save as draft if user is authenticated
-        if request.user.is_authenticated and message_id and subject and from_email:
-            GeneratedDraft.objects.create(
-                user=request.user,
+        if user.is_authenticated and message_id and subject and from_email:
+            await GeneratedDraft.objects.acreate(
+                user=user,
                 original_email_id=message_id,
                 subject=f"Re: {subject}",
                 recipient=from_email,
                 reply_text=draft
             )
         
-        return JsonResponse({"ok": True, "summary": summary, "draft_reply": draft})
+        return JsonResponse({
+            "ok": True, "summary": summary, "draft_reply": draft, "enrichment": enrichment,
+            "precomputed": precomputed is not None
+        })
     except Exception as e:
         logger.error(f"Generate reply error: {str(e)}")
         return JsonResponse({"ok": False, "error": str(e)}, status=500)
@@ -983,23 +1108,12 @@ def generate_tone_reply_view(request):
         if not email_text:
             return HttpResponseBadRequest("email_text is required")
         
-        # FIXED: Remove the model parameter since the function doesn't accept it
-        summary = gemini.summarize_email(email_text)
-        
-        # Create a tone-specific prompt
-        tone_prompt = f"""
-        Generate a reply to the following email in a {tone} tone.
-        The tone should be {tone} throughout the entire response.
-        
-        Email Summary: {summary}
-        
-        Original Email: {email_text}
-        
-        Reply:
-        """
+        summary = ''
         
-        # FIXED: Remove the model parameter since the function doesn't accept it
-        draft = gemini.generate_reply(tone_prompt)
+        # One model call for summary, reply and classification (stored for the email)
+        enrichment = EnrichmentService.enrich_email(request.user, message_id, email_text, tone=tone)
+        summary = enrichment['summary']
+        draft = enrichment['reply']
         
         # Save as draft if user is authenticated and we have the required information
         if request.user.is_authenticated and message_id and subject and from_email:
@@ -1017,7 +1131,7 @@ def generate_tone_reply_view(request):
                 # Don't fail the whole request if saving the draft fails
                 pass
         
-        return JsonResponse({"ok": True, "summary": summary, "draft_reply": draft})
+        return JsonResponse({"ok": True, "summary": summary, "draft_reply": draft, "enrichment": enrichment})
     except Exception as e:
         logger.error(f"Generate tone reply error: {str(e)}")
         
@@ -1042,6 +1156,189 @@ def generate_tone_reply_view(request):
                 }, status=503)  # Service Unavailable
         
         return JsonResponse({"ok": False, "error": str(e)}, status=500)
+
+########################################
+# API: stream a generated reply (Server-Sent Events)
+########################################
+@csrf_exempt
+@require_POST
+async def generate_reply_stream_view(request):
+    """
+    Stream a reply and then a summary as Server-Sent Events
+
+    Events: "reply" and "summary" ({"text": chunk}) as the model produces them,
+    then "done" ({"draft_reply", "summary", "draft_id"}) or "error" ({"error"}).
+    """
+    try:
+        payload = json.loads(request.body.decode("utf-8"))
+    except (ValueError, UnicodeDecodeError):
+        return HttpResponseBadRequest("Invalid JSON body")
+    
+    email_text = payload.get("email_text", "")
+    message_id = payload.get("message_id", "")
+    subject = payload.get("subject", "")
+    from_email = payload.get("from_email", "")
+    tone = payload.get("tone")
+    
+    if not email_text:
+        return HttpResponseBadRequest("email_text is required")
+    
+    # Use the requested tone, else the user's reply tone setting
+    user = await request.auser()
+    user = user if user.is_authenticated else None
+    if not tone:
+        tone = 'professional'
+        if user:
+            user_settings = await UserSettings.objects.filter(user=user).afirst()
+            if user_settings:
+                tone = user_settings.reply_tone
+    
+    # A reply drafted ahead of time from the same text is sent in one piece
+    precomputed = await sync_to_async(SpeculativeReplyService.lookup)(user, message_id, email_text, tone)
+    
+    async def event_stream():
+        parts = {'reply': [], 'summary': []}
+        # The Gemini SDK streams synchronously; each chunk is awaited in a worker thread
+        if precomputed:
+            chunks = iter([('reply', precomputed.reply_text), ('summary', precomputed.summary)])
+        else:
+            chunks = gemini.stream_reply(email_text, tone=tone)
+        try:
+            while True:
+                chunk = await aio.run_blocking(next, chunks, None)
+                if chunk is None:
+                    break
+                part, text = chunk
+                parts[part].append(text)
+                yield sse_event(part, {'text': text})
+        except Exception as e:
+            logger.error(f"Generate reply stream error: {str(e)}")
+            yield sse_event('error', {'error': str(e)})
+            return
+        
+        draft = ''.join(parts['reply']).strip()
+        summary = ''.join(parts['summary']).strip()
+        
+        # Save the finished reply as a draft if we know which email it answers
+        draft_id = None
+        if user and message_id and subject and from_email and draft:
+            try:
+                draft_id = (await GeneratedDraft.objects.acreate(
+                    user=user,
+                    original_email_id=message_id,
+                    subject=f"Re: {subject}",
+                    recipient=from_email,
+                    reply_text=draft
+                )).id
+                logger.info(f"Saved streamed draft for email {message_id}")
+            except Exception as e:
+                logger.error(f"Error saving generated draft: {str(e)}")
+        
+        yield sse_event('done', {'draft_reply': draft, 'summary': summary, 'draft_id': draft_id})
+    
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    return response
+
+########################################
+# API: live inbox updates (Server-Sent Events)
+########################################
+@require_GET
+async def inbox_events_view(request):
+    """
+    Stream inbox changes as Server-Sent Events
+
+    Events (each with its per-user seq as the event ID): message_added, message_removed, labels_changed,
+    reminder_due, scheduled_email_sent, and resync when the client should reload.
+    A reconnecting client sends Last-Event-ID (EventSource does so by itself, or
+    ?last_event_id=) and gets the events it missed. While the stream is open the
+    mailbox is synced from Gmail history, so clients don't poll the email list.
+    The stream ends after INBOX_STREAM_MAX_DURATION seconds and the client reconnects.
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'ok': False, 'error': 'Authentication required'}, status=401)
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    resync = False
+    if last_event_id:
+        try:
+            after_seq = int(last_event_id)
+        except ValueError:
+            return HttpResponseBadRequest("Invalid Last-Event-ID")
+        if after_seq and not await sync_to_async(InboxEventService.can_resume)(user, after_seq):
+            # What was missed has been purged
+            resync = True
+            after_seq = await sync_to_async(InboxEventService.latest_seq)(user)
+    else:
+        after_seq = await sync_to_async(InboxEventService.latest_seq)(user)
+    
+    def sync_mailbox():
+        # Cheap when nothing changed: one history.list, shared by all of the user's tabs
+        try:
+            service = get_gmail_service(user=user)
+            if service:
+                MailboxSyncService.sync(user, service)
+        except Exception as e:
+            logger.error(f"Error syncing mailbox for event stream: {str(e)}")
+    
+    async def event_stream():
+        nonlocal after_seq
+        yield f"retry: 3000\nid: {after_seq}\n\n"
+        if resync:
+            yield sse_event('resync', {}, event_id=after_seq)
+        
+        now = time.monotonic()
+        deadline = now + INBOX_STREAM_MAX_DURATION
+        next_sync = now
+        last_write = now
+        while now < deadline:
+            if now >= next_sync:
+                await aio.run_blocking(sync_mailbox)
+                next_sync = time.monotonic() + MAILBOX_SYNC_INTERVAL
+            
+            events = await sync_to_async(InboxEventService.since)(user, after_seq)
+            for event in events:
+                yield sse_event(event.kind, event.payload, event_id=event.seq)
+                after_seq = event.seq
+            now = time.monotonic()
+            if events:
+                last_write = now
+                continue
+            if now - last_write >= INBOX_STREAM_KEEPALIVE:
+                yield ": keepalive\n\n"
+                last_write = now
+            
+            await InboxEventService.wait(user, max(0.1, min(INBOX_STREAM_POLL_INTERVAL, next_sync - now, deadline - now)))
+            now = time.monotonic()
+    
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    return response
+
+########################################
+# API: enrich email (summary, reply and classification in one call)
+########################################
+@api_view(['POST'])
+@csrf_exempt
+def enrich_email_view(request):
+    """Summarize, draft a reply, and classify an email with one model call"""
+    try:
+        email_text = request.data.get("email_text", "")
+        message_id = request.data.get("message_id", "")
+        tone = request.data.get("tone", "professional")
+        
+        if not email_text:
+            return Response({'ok': False, 'error': 'email_text is required'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        enrichment = EnrichmentService.enrich_email(request.user, message_id, email_text, tone=tone)
+        return Response({'ok': True, 'enrichment': enrichment})
+    except Exception as e:
+        logger.error(f"Error in enrich_email_view: {str(e)}", exc_info=True)
+        return Response({'ok': False, 'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 ########################################
 # API: save draft to Gmail (FIXED)
 @api_view(['POST', 'PUT'])
@@ -1074,6 +1371,7 @@ def save_draft_view(request, draft_id=None):
             draft_id = create_gmail_draft(service, to, subject, body)
             
             if draft_id:
+                UserCache.invalidate(request.user)
                 return Response({
                     'ok': True,
                     'draft_id': draft_id,
@@ -1115,6 +1413,7 @@ def save_draft_view(request, draft_id=None):
             updated_draft_id = update_draft(service, draft_id, to, subject, body)
             
             if updated_draft_id:
+                UserCache.update_in_lists(request.user, DRAFTS_CACHE_GROUP, [draft_id], **draft_list_fields(to, subject, body))
                 return Response({
                     'ok': True,
                     'draft_id': updated_draft_id,
@@ -1135,56 +1434,39 @@ def save_draft_view(request, draft_id=None):
 ########################################
 # API: email details
 ########################################
-@api_view(['GET'])
-def email_detail_view(request, message_id):
+@require_GET
+async def email_detail_view(request, message_id):
     try:
-        service = get_gmail_service(user=request.user if request.user.is_authenticated else None)
+        user = await request.auser()
+        user = user if user.is_authenticated else None
+        service = await aio.run_blocking(get_gmail_service, user=user)
         if not service:
-            return Response({'ok': False, 'error': 'Failed to authenticate'}, status=status.HTTP_401_UNAUTHORIZED)
-        
-        # First check if the email is available
-        from .services.gmail import is_email_available
-        
-        if not is_email_available(service, message_id):
-            return Response({'ok': False, 'error': 'Email not found or may have been deleted'}, status=status.HTTP_404_NOT_FOUND)
-        
-        email_details = get_email_details(service, message_id)
-        if not email_details:
-            return Response({'ok': False, 'error': 'Email not found or may have been deleted'}, status=status.HTTP_404_NOT_FOUND)
-        
-        # Add important status if user is authenticated
-        if request.user.is_authenticated:
-            # FIXED: Use email_id instead of message_id
-            email_details['is_important'] = ImportantEmail.objects.filter(
-                user=request.user, 
-                email_id=message_id
-            ).exists()
+            return JsonResponse({'ok': False, 'error': 'Failed to authenticate'}, status=status.HTTP_401_UNAUTHORIZED)
+        
+        # Serve the email from the local mailbox mirror once its body has been downloaded
+        email_details = None
+        if user:
+            mirrored = await sync_to_async(MailboxSyncService.get_message)(user, message_id)
+            if mirrored and mirrored.body_fetched:
+                email_details = mirrored.to_details_dict()
+        
+        if email_details is None:
+            email_details = await aio.get_email_details(user, message_id)
+            if not email_details:
+                return JsonResponse({'ok': False, 'error': 'Email not found or may have been deleted'}, status=status.HTTP_404_NOT_FOUND)
             
-            # Add category information with error handling
-            try:
-                category = CategorizationService.get_email_category(request.user, message_id)
-                if category:
-                    email_details['category'] = category.name  # FIXED: Use .name instead of .category
-            except Exception as e:
-                # Check if the error is due to missing table
-                if "does not exist" in str(e):
-                    logger.warning(f"EmailCategory table does not exist. Skipping category for email {message_id}")
-                else:
-                    logger.warning(f"Error getting category for email {message_id}: {str(e)}")
-            
-            # Add priority information with error handling
-            try:
-                priority = PriorityScoringService.get_email_priority(request.user, message_id)
-                if priority:
-                    email_details['priority'] = priority.priority
-            except Exception as e:
-                # Check if the error is due to missing table
-                if "does not exist" in str(e):
-                    logger.warning(f"EmailPriority table does not exist. Skipping priority for email {message_id}")
-                else:
-                    logger.warning(f"Error getting priority for email {message_id}: {str(e)}")
-        
-        return Response({'ok': True, 'email': email_details})
+            if user:
+                await sync_to_async(MailboxSyncService.store_details)(user, email_details)
+        
+        # Add important status, category, priority and sentiment if user is authenticated
+        if user:
+            email_details['id'] = message_id
+            await sync_to_async(EnrichmentService.annotate_emails)(user, [email_details])
+        
+        return JsonResponse({'ok': True, 'email': email_details})
+    except UpstreamUnavailable as e:
+        logger.warning(f"Gmail unavailable in email_detail_view: {str(e)}")
+        return upstream_unavailable_response(e)
     except Exception as e:
         logger.error(f"Error fetching email details: {str(e)}", exc_info=True)
         
@@ -1193,7 +1475,7 @@ def email_detail_view(request, message_id):
         if "does not exist" in str(e):
             error_msg = "Database tables not created. Please run migrations."
         
-        return Response({'ok': False, 'error': error_msg}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return JsonResponse({'ok': False, 'error': error_msg}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 ########################################
 # API: draft details
@@ -1230,13 +1512,10 @@ def mark_as_read_view(request, message_id):
         
         success = mark_as_read(service, message_id)
         if success:
-            # Clear the cache for unread emails to ensure fresh data
-            try:
-                # Try to clear by pattern if supported
-                cache.delete_many([key for key in cache.keys('*gmail_unread_*')])
-            except (AttributeError, NotImplementedError):
-                # Fallback: clear entire cache if pattern deletion not supported
-                cache.clear()
+            MailboxSyncService.modify_labels(request.user, [message_id], remove_labels=['UNREAD'])
+            
+            # Flip the email to read in this user's cached unread lists, keep everything else
+            UserCache.update_in_lists(request.user, UNREAD_CACHE_GROUP, [message_id], is_unread=False)
             
             logger.info(f"Successfully marked email {message_id} as read")
             return Response({'ok': True})
@@ -1264,24 +1543,7 @@ def bulk_mark_as_read_view(request):
         if not service:
             return Response({'ok': False, 'error': 'Failed to authenticate. Please reconnect your Gmail account.'}, status=status.HTTP_401_UNAUTHORIZED)
         
-        success_count = 0
-        for email_id in email_ids:
-            if mark_as_read(service, email_id):
-                success_count += 1
-        
-        # Clear the cache for unread emails to ensure fresh data
-        try:
-            # Try to clear by pattern if supported
-            cache.delete_many([key for key in cache.keys('*gmail_unread_*')])
-        except (AttributeError, NotImplementedError):
-            # Fallback: clear entire cache if pattern deletion not supported
-            cache.clear()
-        
-        return Response({
-            'ok': True, 
-            'success_count': success_count,
-            'total_count': len(email_ids)
-        })
+        return Response(_run_bulk_action(request.user, service, 'mark-read', email_ids))
     except Exception as e:
         logger.error(f"Error in bulk_mark_as_read_view: {str(e)}", exc_info=True)
         return Response({'ok': False, 'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -1299,6 +1561,7 @@ def delete_draft_view(request, draft_id):
         
         success = delete_draft(service, draft_id)
         if success:
+            UserCache.remove_from_lists(request.user, DRAFTS_CACHE_GROUP, [draft_id])
             return Response({'ok': True})
         else:
             return Response({'ok': False, 'error': 'Failed to delete draft'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -1326,6 +1589,7 @@ def update_draft_view(request, draft_id):
             return HttpResponseBadRequest("to, subject, body are required")
         
         draft_id = update_draft(service, draft_id, to_email, subject, body)
+        UserCache.update_in_lists(request.user, DRAFTS_CACHE_GROUP, [draft_id], **draft_list_fields(to_email, subject, body))
         return JsonResponse({"ok": True, "draft_id": draft_id})
     except Exception as e:
         logger.error(f"Update draft error: {str(e)}")
@@ -1350,13 +1614,10 @@ def archive_email_view(request, message_id):
         # Archive by removing INBOX label
         success = archive_email(service, message_id)
         if success:
-            # Clear the cache for unread emails to ensure fresh data
-            try:
-                # Try to clear by pattern if supported
-                cache.delete_many([key for key in cache.keys('*gmail_unread_*')])
-            except (AttributeError, NotImplementedError):
-                # Fallback: clear entire cache if pattern deletion not supported
-                cache.clear()
+            MailboxSyncService.modify_labels(request.user, [message_id], remove_labels=['INBOX'])
+            
+            # The email leaves this user's cached unread lists
+            UserCache.remove_from_lists(request.user, UNREAD_CACHE_GROUP, [message_id])
             
             logger.info(f"Successfully archived email {message_id}")
             return Response({'ok': True})
@@ -1388,28 +1649,85 @@ def bulk_archive_emails_view(request):
             return Response({'ok': False, 'error': 'Failed to authenticate. Please reconnect your Gmail account.'}, 
                           status=status.HTTP_401_UNAUTHORIZED)
         
-        success_count = 0
-        for email_id in email_ids:
-            if archive_email(service, email_id):
-                success_count += 1
+        return Response(_run_bulk_action(request.user, service, 'archive', email_ids))
+    except Exception as e:
+        logger.error(f"Error in bulk_archive_emails_view: {str(e)}", exc_info=True)
+        return Response({'ok': False, 'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+########################################
+# API: Bulk actions (batchModify / batchDelete)
+########################################
+@api_view(['POST'])
+@csrf_exempt
+def bulk_emails_view(request):
+    """
+    Apply one action to many emails
+
+    Body: {"action": "mark-read" | "mark-unread" | "archive" | "trash" | "label" | "delete",
+           "email_ids": [...], "add_labels": [...], "remove_labels": [...]}
+    "delete" is permanent and needs the full https://mail.google.com/ scope.
+    """
+    try:
+        payload = json.loads(request.body.decode("utf-8"))
+        action = payload.get("action")
+        email_ids = payload.get("email_ids", [])
+        
+        if action not in BULK_ACTIONS:
+            return Response({'ok': False, 'error': f"action must be one of: {', '.join(BULK_ACTIONS)}"},
+                          status=status.HTTP_400_BAD_REQUEST)
+        if not email_ids:
+            return Response({'ok': False, 'error': 'No email IDs provided'}, 
+                          status=status.HTTP_400_BAD_REQUEST)
+        if action == 'label' and not (payload.get("add_labels") or payload.get("remove_labels")):
+            return Response({'ok': False, 'error': 'add_labels or remove_labels is required for the label action'},
+                          status=status.HTTP_400_BAD_REQUEST)
         
-        # Clear the cache for unread emails to ensure fresh data
-        try:
-            # Try to clear by pattern if supported
-            cache.delete_many([key for key in cache.keys('*gmail_unread_*')])
-        except (AttributeError, NotImplementedError):
-            # Fallback: clear entire cache if pattern deletion not supported
-            cache.clear()
+        service = get_gmail_service(user=request.user if request.user.is_authenticated else None)
+        if not service:
+            return Response({'ok': False, 'error': 'Failed to authenticate. Please reconnect your Gmail account.'}, 
+                          status=status.HTTP_401_UNAUTHORIZED)
         
-        return Response({
-            'ok': True, 
-            'success_count': success_count,
-            'total_count': len(email_ids)
-        })
+        return Response(_run_bulk_action(
+            request.user, service, action, email_ids,
+            add_labels=payload.get("add_labels", []),
+            remove_labels=payload.get("remove_labels", [])
+        ))
     except Exception as e:
-        logger.error(f"Error in bulk_archive_emails_view: {str(e)}", exc_info=True)
+        logger.error(f"Error in bulk_emails_view: {str(e)}", exc_info=True)
         return Response({'ok': False, 'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def _run_bulk_action(user, service, action, email_ids, add_labels=(), remove_labels=()):
+    """Run a bulk action and bring the mailbox mirror and cached lists in line with what succeeded"""
+    changes, outcomes = BulkEmailService.apply(
+        service, action, email_ids, add_labels=add_labels, remove_labels=remove_labels
+    )
+    succeeded_ids = [email_id for email_id, error in outcomes.items() if error is None]
+    
+    if succeeded_ids and action == 'delete':
+        MailboxSyncService.remove_messages(user, succeeded_ids)
+        UserCache.remove_from_lists(user, UNREAD_CACHE_GROUP, succeeded_ids)
+    elif succeeded_ids:
+        MailboxSyncService.modify_labels(user, succeeded_ids, add_labels=changes['add'], remove_labels=changes['remove'])
+        if 'UNREAD' in changes['add']:
+            # Emails join the cached unread lists, which only Gmail can order
+            UserCache.invalidate(user)
+        elif 'INBOX' in changes['remove'] or {'TRASH', 'SPAM'} & set(changes['add']):
+            # Emails leave the cached unread lists
+            UserCache.remove_from_lists(user, UNREAD_CACHE_GROUP, succeeded_ids)
+        elif 'UNREAD' in changes['remove']:
+            UserCache.update_in_lists(user, UNREAD_CACHE_GROUP, succeeded_ids, is_unread=False)
+    
+    return {
+        'ok': True,
+        'action': action,
+        'success_count': len(succeeded_ids),
+        'total_count': len(outcomes),
+        'results': {
+            email_id: {'ok': error is None, **({'error': error} if error else {})}
+            for email_id, error in outcomes.items()
+        }
+    }
+
 ########################################
 # Helper function: Archive email
 ########################################
@@ -2017,7 +2335,7 @@ from django.http import JsonResponse, HttpResponseBadRequest
 from django.views.decorators.csrf import csrf_exempt
 import json
 import logging
-from .services.gmail import get_gmail_service, get_draft_details, create_message
+from .services.gmail import get_gmail_service, get_gmail_profile, get_draft_details, create_message
 
 logger = logging.getLogger(__name__)
 
@@ -2032,8 +2350,9 @@ def test_gmail_drafts_view(request):
             return Response({'error': 'No Gmail service available'}, status=400)
         
         # Get profile
+        profile = {}
         try:
-            profile = service.users().getProfile(userId='me').execute()
+            profile = get_gmail_profile(user=user) or {}
             profile_info = {
                 'emailAddress': profile.get('emailAddress'),
                 'historyId': profile.get('historyId'),
@@ -2103,6 +2422,7 @@ def update_draft_view(request, draft_id):
         updated_draft_id = update_draft(service, draft_id, to, subject, body)
         
         if updated_draft_id:
+            UserCache.update_in_lists(request.user, DRAFTS_CACHE_GROUP, [draft_id], **draft_list_fields(to, subject, body))
             return Response({
                 'ok': True,
                 'draft_id': updated_draft_id,
@@ -2161,6 +2481,7 @@ def edit_gmail_draft_view(request, draft_id):
         ).execute()
         
         logger.info(f"Draft {draft_id} updated successfully")
+        UserCache.update_in_lists(request.user, DRAFTS_CACHE_GROUP, [draft_id], **draft_list_fields(new_to, new_subject))
         return Response({
             "ok": True,
             "draft_id": updated_draft.get('id'),
@@ -2206,6 +2527,7 @@ def save_generated_draft_view(request):
         draft_id = create_gmail_draft(service, to, subject, body)
         
         if draft_id:
+            UserCache.invalidate(request.user)
             return Response({
                 'ok': True,
                 'draft_id': draft_id,
@@ -2250,7 +2572,12 @@ def list_gemini_models(request):
         
         return Response({
             'all_models': model_names,
-            'supported_models': supported_models
+            'supported_models': supported_models,
+            'working_model': gemini.get_working_model(),
+            'model_health': gemini.get_model_health(),
+            'quota_backoff_until': gemini.get_quota_backoff_until(),
+            'circuit_breakers': rate_limiter.stats(),
+            'response_cache': gemini.response_cache.stats()
         })
     except Exception as e:
         return Response({'error': str(e)}, status=500)
@@ -2259,65 +2586,39 @@ def list_gemini_models(request):
 # NEW: Email Thread Analysis Views
 ########################################
 
-@api_view(['GET'])
-def email_thread_analysis_view(request, thread_id):
+@require_GET
+async def email_thread_analysis_view(request, thread_id):
     """Analyze an entire email thread and provide per-message analysis"""
     try:
-        service = get_gmail_service(user=request.user if request.user.is_authenticated else None)
-        if not service:
-            return Response({'ok': False, 'error': 'Authentication required'}, status=status.HTTP_401_UNAUTHORIZED)
-        
-        # Get thread details
-        thread = service.users().threads().get(userId='me', id=thread_id).execute()
-        messages = thread.get('messages', [])
+        user = await request.auser()
+        user = user if user.is_authenticated else None
+        try:
+            # Get thread details
+            thread = await aio.get_thread(user, thread_id)
+        except PermissionError:
+            return JsonResponse({'ok': False, 'error': 'Authentication required'}, status=status.HTTP_401_UNAUTHORIZED)
+        messages = (thread or {}).get('messages', [])
         
         if not messages:
-            return Response({'ok': False, 'error': 'Thread not found'}, status=status.HTTP_404_NOT_FOUND)
-        
-        # Process each message individually
-        message_analyses = []
-        for msg in messages:
-            msg_data = service.users().messages().get(userId='me', id=msg['id'], format='full').execute()
-            headers = msg_data['payload']['headers']
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '(no subject)')
-            from_email = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown')
-            date = next((h['value'] for h in headers if h['name'] == 'Date'), '')
-            
-            # Extract body
-            body = ''
-            if 'parts' in msg_data['payload']:
-                for part in msg_data['payload']['parts']:
-                    if part['mimeType'] == 'text/plain':
-                        body_data = part['body'].get('data', '')
-                        if body_data:
-                            body = base64.urlsafe_b64decode(body_data).decode('utf-8')
-                        break
-            else:
-                if 'body' in msg_data['payload'] and 'data' in msg_data['payload']['body']:
-                    body_data = msg_data['payload']['body'].get('data', '')
-                    if body_data:
-                        body = base64.urlsafe_b64decode(body_data).decode('utf-8')
-            
-            # Analyze this specific message
-            message_analysis = gemini.analyze_email_message(body)
-            
-            message_analyses.append({
-                "message_id": msg['id'],
-                "from": from_email,
-                "date": date,
-                "subject": subject,
-                "analysis": message_analysis
-            })
+            return JsonResponse({'ok': False, 'error': 'Thread not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        return Response({
+        # Messages come with the thread; only those without a stored analysis go to the model
+        message_analyses, rollup, analyzed_count = await ThreadAnalysisService.analyze(user, thread_id, thread)
+        
+        return JsonResponse({
             'ok': True,
             'thread_id': thread_id,
             'message_analyses': message_analyses,
-            'message_count': len(messages)
+            'message_count': len(messages),
+            'thread_analysis': rollup,
+            'analyzed_count': analyzed_count
         })
+    except UpstreamUnavailable as e:
+        logger.warning(f"Upstream unavailable in email_thread_analysis_view: {str(e)}")
+        return upstream_unavailable_response(e)
     except Exception as e:
         logger.error(f"Error in email_thread_analysis_view: {str(e)}", exc_info=True)
-        return Response({'ok': False, 'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return JsonResponse({'ok': False, 'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 ########################################
 # NEW: Email Thread Analysis Views
@@ -2494,13 +2795,10 @@ def delete_email_view(request, message_id):
         # Delete by moving to trash
         success = delete_email(service, message_id)
         if success:
-            # Clear the cache for unread emails to ensure fresh data
-            try:
-                # Try to clear by pattern if supported
-                cache.delete_many([key for key in cache.keys('*gmail_unread_*')])
-            except (AttributeError, NotImplementedError):
-                # Fallback: clear entire cache if pattern deletion not supported
-                cache.clear()
+            MailboxSyncService.modify_labels(request.user, [message_id], add_labels=['TRASH'])
+            
+            # The email leaves this user's cached unread lists
+            UserCache.remove_from_lists(request.user, UNREAD_CACHE_GROUP, [message_id])
             
             logger.info(f"Successfully deleted email {message_id}")
             return Response({'ok': True})
@@ -2719,6 +3017,16 @@ def auto_categorize_email_view(request):
     if not email_id or not email_content:
         return Response({'ok': False, 'error': 'email_id and email_content are required'}, status=status.HTTP_400_BAD_REQUEST)
     
+    # Hand the LLM call to the background workers; the result shows up in the email's metadata
+    if request.data.get('background'):
+        job = JobQueue.enqueue(
+            'enrich_email',
+            {'email_id': email_id, 'email_text': email_content},
+            user=request.user,
+            dedupe_key=f"{request.user.pk}:{email_id}"
+        )
+        return Response({'ok': True, 'queued': True, 'job_id': job.id if job else None}, status=status.HTTP_202_ACCEPTED)
+    
     try:
         email_categorization = CategorizationService.auto_categorize_email(request.user, email_id, email_content)
         return Response({'ok': True, 'category': email_categorization.category.name})  # FIXED: Use .name
@@ -2780,6 +3088,16 @@ def auto_score_priority_view(request):
     if not email_id or not email_content:
         return Response({'ok': False, 'error': 'email_id and email_content are required'}, status=status.HTTP_400_BAD_REQUEST)
     
+    # Hand the LLM call to the background workers; the result shows up in the email's metadata
+    if request.data.get('background'):
+        job = JobQueue.enqueue(
+            'enrich_email',
+            {'email_id': email_id, 'email_text': email_content},
+            user=request.user,
+            dedupe_key=f"{request.user.pk}:{email_id}"
+        )
+        return Response({'ok': True, 'queued': True, 'job_id': job.id if job else None}, status=status.HTTP_202_ACCEPTED)
+    
     try:
         email_priority = PriorityScoringService.auto_score_priority(request.user, email_id, email_content)
         return Response({'ok': True, 'priority': email_priority.priority})
@@ -2796,12 +3114,154 @@ def auto_score_priority_view(request):
         
         return Response({'ok': False, 'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@api_view(['POST'])
+def classify_batch_view(request):
+    """
+    Categorize and score up to 100 emails with one model call per batch
+
+    Body: {"emails": [...], "force": false}. Each email is a Gmail message ID or a
+    dict with id, from, subject and snippet; missing fields come from the mailbox mirror.
+    """
+    if not request.user.is_authenticated:
+        return Response({'ok': False, 'error': 'Authentication required'}, status=status.HTTP_401_UNAUTHORIZED)
+    
+    emails = request.data.get('emails')
+    if not isinstance(emails, list) or not emails:
+        return Response({'ok': False, 'error': 'emails must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(emails) > 100:
+        return Response({'ok': False, 'error': 'At most 100 emails per request'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    emails = [email if isinstance(email, dict) else {'id': email} for email in emails]
+    if not all(email.get('id') for email in emails):
+        return Response({'ok': False, 'error': 'Every email needs an id'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        mirrored = MailboxSyncService.get_messages(request.user, [str(email['id']) for email in emails])
+        batch = []
+        for email in emails:
+            email_id = str(email['id'])
+            row = mirrored.get(email_id)
+            batch.append({
+                'id': email_id,
+                'from': email.get('from') or (row.sender if row else ''),
+                'subject': email.get('subject') or (row.subject if row else ''),
+                'snippet': email.get('snippet') or (row.snippet if row else ''),
+                'label_ids': row.label_ids if row else [],
+            })
+        
+        outcome = BatchClassificationService.classify(request.user, batch, force=bool(request.data.get('force')))
+        return Response({
+            'ok': True,
+            'results': [{'id': email_id, **result} for email_id, result in outcome['results'].items()],
+            'failed': [{'id': email_id, 'error': error} for email_id, error in outcome['failed'].items()],
+            'model_calls': outcome['model_calls'],
+        })
+    except UpstreamUnavailable as e:
+        logger.warning(f"Gemini unavailable in classify_batch_view: {str(e)}")
+        return upstream_unavailable_response(e)
+    except Exception as e:
+        logger.error(f"Error classifying emails: {str(e)}", exc_info=True)
+        return Response({'ok': False, 'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+########################################
+# API: full-text search
+########################################
+@api_view(['GET'])
+def search_emails_view(request):
+    """
+    Mirrored emails matching ?q=, best match first, without calling Gmail
+
+    Supports words, "quoted phrases", from:, subject: and after:/before: (YYYY-MM-DD).
+    Paged with ?limit= (default 20, at most 100) and ?offset=.
+    """
+    if not request.user.is_authenticated:
+        return Response({'ok': False, 'error': 'Authentication required'}, status=status.HTTP_401_UNAUTHORIZED)
+    
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return Response({'ok': False, 'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limit = max(1, min(100, int(request.GET.get('limit', 20))))
+        offset = max(0, int(request.GET.get('offset', 0)))
+    except ValueError:
+        return Response({'ok': False, 'error': 'limit and offset must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        # One extra row tells whether there is a next page
+        hits = FullTextSearchService.search(request.user, query, limit + 1, offset)
+        rows = MailboxSyncService.get_messages(request.user, [message_id for message_id, _ in hits[:limit]])
+        results = []
+        for message_id, score in hits[:limit]:
+            # Deleted from the mirror since the index was queried
+            if message_id not in rows:
+                continue
+            email = rows[message_id].to_email_dict()
+            email.pop('body_text', None)
+            email['score'] = round(score, 4)
+            results.append(email)
+        EnrichmentService.annotate_emails(request.user, results)
+        
+        return Response({
+            'ok': True,
+            'query': query,
+            'results': results,
+            'has_more': len(hits) > limit,
+            'next_offset': offset + limit if len(hits) > limit else None,
+        })
+    except Exception as e:
+        logger.error(f"Error in full-text search: {str(e)}", exc_info=True)
+        return Response({'ok': False, 'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+########################################
+# API: semantic search
+########################################
+@api_view(['GET'])
+def semantic_search_view(request):
+    """
+    Mirrored emails closest in meaning to ?q=, best first (at most ?limit=, default 20)
+
+    The index is updated in the background as mail syncs; messages not embedded yet don't show up.
+    """
+    if not request.user.is_authenticated:
+        return Response({'ok': False, 'error': 'Authentication required'}, status=status.HTTP_401_UNAUTHORIZED)
+    
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return Response({'ok': False, 'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limit = max(1, min(50, int(request.GET.get('limit', 20))))
+    except ValueError:
+        return Response({'ok': False, 'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        hits, indexed = SemanticSearchService.search(request.user, query, limit)
+        if not indexed:
+            enqueue_indexing(request.user)
+        
+        rows = MailboxSyncService.get_messages(request.user, [message_id for message_id, _ in hits])
+        results = []
+        for message_id, score in hits:
+            # Messages that left the mirror stay in the index until its next update
+            if message_id in rows and not rows[message_id].is_trashed:
+                email = rows[message_id].to_email_dict()
+                email.pop('body_text', None)
+                email['score'] = round(score, 4)
+                results.append(email)
+        EnrichmentService.annotate_emails(request.user, results)
+        
+        return Response({'ok': True, 'query': query, 'results': results, 'indexed': indexed})
+    except UpstreamUnavailable as e:
+        logger.warning(f"Gemini unavailable in semantic_search_view: {str(e)}")
+        return upstream_unavailable_response(e)
+    except Exception as e:
+        logger.error(f"Error in semantic search: {str(e)}", exc_info=True)
+        return Response({'ok': False, 'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 # Add to your views
 def debug_gmail_auth(request):
     try:
-        service = get_gmail_service(user=request.user)
-        if service:
-            profile = service.users().getProfile(userId='me').execute()
+        profile = get_gmail_profile(user=request.user)
+        if profile is not None:
             return JsonResponse({"status": "authenticated", "email": profile.get('emailAddress')})
         else:
             return JsonResponse({"status": "not_authenticated"})
@@ -2875,6 +3335,7 @@ def create_sample_data_view(request):
                 defaults=reminder_data
             )
             if created:
+                EmailMetaService.refresh_reminders(user, reminder.email_id)
                 created_reminders.append(reminder.message)
         
         return JsonResponse({